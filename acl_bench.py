@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+#
+###############################################################################
+#   Copyright (C) 2020-2021 Eric, KF7EEL, <kf7eel@qsl.net>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+Compares acl_check (hblink.py) on a compiled ACL with the linear scan it
+replaced, for ACLs of 10, 1,000 and 100,000 entries. Each ACL is a mix of
+single IDs and ranges, in no order. Lookups are timed for IDs that haven't
+been seen before, and for a few IDs heard over and over (a busy talkgroup),
+which the verdict cache answers. Every verdict must match the linear scan's.
+
+The string column is the old cost of an ACL that was never compiled, which
+acl_check rebuilt on every call.
+
+    python3 acl_bench.py -s 10 1000 100000
+'''
+
+import sys
+import random
+import argparse
+from time import perf_counter
+
+import const
+from config import acl_build
+from hblink import acl_check
+from dmr_utils3.utils import bytes_3
+
+__author__     = 'Eric Craw, KF7EEL'
+__copyright__  = 'Copyright (c) 2020-2021, Eric Craw, KF7EEL'
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Eric Craw, KF7EEL'
+__email__      = 'kf7eel@qsl.net'
+
+# Seconds to spend timing each case
+TIME = 1
+# IDs checked against every ACL for matching verdicts
+CHECKS = 10000
+# IDs in the hot set
+HOT = 20
+
+
+# The linear scan acl_check used to do, on the (action, ranges) tuple
+def linear_check(_id, _acl):
+    _id = int.from_bytes(_id, 'big')
+    for entry in _acl[1]:
+        if entry[0] <= _id <= entry[1]:
+            return _acl[0]
+    return not _acl[0]
+
+
+# An ACL string of _size entries, about one in five a range
+def acl_string(_size):
+    _entries = []
+    for _n in range(_size):
+        _start = random.randint(const.ID_MIN, 9999999)
+        if random.random() < 0.2:
+            _entries.append('{}-{}'.format(_start, _start + random.randint(1, 500)))
+        else:
+            _entries.append(str(_start))
+    return 'DENY:' + ','.join(_entries)
+
+
+# Microseconds per call of _check(id, _acl), going round _ids for about TIME seconds
+def per_call(_check, _ids, _acl):
+    _calls = 0
+    _start = perf_counter()
+    while perf_counter() - _start < TIME:
+        for _id in _ids:
+            _check(_id, _acl)
+        _calls += len(_ids)
+    return (perf_counter() - _start) / _calls * 1000000
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--sizes', action='store', dest='SIZES', type=int, nargs='+', default=[10, 1000, 100000], help='ACL sizes to try.')
+    cli_args = parser.parse_args()
+
+    random.seed(1)
+    failed = False
+    print('entries   linear scan   string   compiled   compiled, hot IDs   (us per check)')
+    for size in cli_args.SIZES:
+        string = acl_string(size)
+        plain = (False, [tuple(int(i) for i in e.split('-')) if '-' in e else (int(e), int(e)) for e in string[5:].split(',')])
+        acl = acl_build(string, const.ID_MAX)
+
+        # Half the IDs are in the ACL, so both verdicts are checked
+        ids = [bytes_3(random.randint(const.ID_MIN, 9999999)) for _n in range(CHECKS // 2)]
+        ids += [bytes_3(random.randint(*random.choice(plain[1]))) for _n in range(CHECKS // 2)]
+        wrong = [i for i in ids if acl_check(i, acl) != linear_check(i, plain)]
+        if wrong:
+            failed = True
+
+        # Going round more IDs than the verdict cache holds, so every check misses it
+        linear = per_call(linear_check, ids[:200] if size > 1000 else ids, plain)
+        built = per_call(lambda _id, _acl: acl_check(_id, acl_build(_acl, const.ID_MAX)), ids[:20] if size > 1000 else ids[:1000], string)
+        compiled = per_call(acl_check, ids, acl_build(string, const.ID_MAX))
+        hot = per_call(acl_check, ids[:HOT], acl)
+        print('{:7}   {:11.2f}   {:6.0f}   {:8.2f}   {:17.2f}   {}'.format(size, linear, built, compiled, hot, 'ok' if not wrong else '{} WRONG'.format(len(wrong))))
+    if failed:
+        sys.exit('Compiled ACL verdicts differ from the linear scan')
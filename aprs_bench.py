@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+#
+###############################################################################
+#   Copyright (C) 2020-2021 Eric, KF7EEL, <kf7eel@qsl.net>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+Packets per second through aprs_process (data_gateway.py) with USERS users
+in the settings file. The stream is PACKETS packets in the mix an APRS-IS
+feed has: mostly positions, some weather, status and telemetry, messages,
+and a few that don't parse. A file of packets, one per line as aprslib.IS
+hands them over, can be used instead with -f. A quarter of the messages are
+for users with APRS turned on, some with the wrong SSID or in lower case.
+
+mailbox_write, send_sms and aprs_send go to the web service and the network,
+so they are replaced by counters here. Each message must be delivered to
+exactly the users whose callsign and SSID match, and nothing else.
+
+    python3 aprs_bench.py -u 10000 -n 100000
+'''
+
+import sys
+import shutil
+import random
+import argparse
+import tempfile
+from time import perf_counter
+
+import data_gateway
+from user_settings import UserSettings
+from dmr_utils3.utils import bytes_3
+
+__author__     = 'Eric Craw, KF7EEL'
+__copyright__  = 'Copyright (c) 2020-2021, Eric Craw, KF7EEL'
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Eric Craw, KF7EEL'
+__email__      = 'kf7eel@qsl.net'
+
+# SSID of users who haven't set one
+USER_SSID = '15'
+FIRST_ID = 3120000
+
+
+def callsign(_n):
+    return 'KB{:04d}'.format(_n)
+
+
+# Settings for _users users, every other one with an SSID of their own, one in ten with APRS off
+def user_settings(_users):
+    _settings = {}
+    for _n in range(_users):
+        _settings[FIRST_ID + _n] = [{'call': callsign(_n)}, {'ssid': str(_n % 10) if _n % 2 else ''}, {'icon': ''}, {'comment': ''}, {'pin': ''}, {'APRS': _n % 10 != 3}]
+    return _settings
+
+
+# An APRS-IS stream of _count packets, and the DMR IDs each message should reach
+def stream(_count, _settings):
+    _packets = []
+    _expect = {}
+    for _n in range(_count):
+        _src = 'N{}XYZ-{}'.format(random.randint(0, 9), random.randint(1, 15))
+        _path = _src + '>APRS,TCPIP*,qAC,T2TEST:'
+        _kind = random.random()
+        if _kind < 0.6:
+            _packets.append(_path + '!49{:02d}.{:02d}N/072{:02d}.{:02d}W-PHG2360 test'.format(random.randint(0, 59), random.randint(0, 99), random.randint(0, 59), random.randint(0, 99)))
+        elif _kind < 0.7:
+            _packets.append(_path + '@092345z4903.50N/07201.75W_220/004g005t077r000p000P000h50b09900wRSW')
+        elif _kind < 0.75:
+            _packets.append(_path + '>Net Control Center')
+        elif _kind < 0.8:
+            _packets.append(_path + 'T#{:03d},199,000,255,073,123,01101001'.format(random.randint(0, 999)))
+        elif _kind < 0.97:
+            _user = random.randrange(len(_settings) * 4)
+            _ssid = str(random.randint(0, 15))
+            if _user < len(_settings):
+                _ssid = _settings[FIRST_ID + _user][1]['ssid'] or USER_SSID
+                # Sometimes the wrong SSID, or in lower case which should still match
+                if random.random() < 0.2:
+                    _ssid = str(int(_ssid) + 1)
+            _call = callsign(_user)
+            if random.random() < 0.1:
+                _call = _call.lower()
+            _msg_no = '{' + str(_n % 1000) if random.random() < 0.5 else ''
+            _packets.append(_path + ':{:9}:Hello {}{}'.format(_call + '-' + _ssid, _n, _msg_no))
+            if _user < len(_settings):
+                _user_settings = _settings[FIRST_ID + _user]
+                if _user_settings[5]['APRS'] and (_user_settings[1]['ssid'] or USER_SSID) == _ssid:
+                    _expect[len(_packets) - 1] = [FIRST_ID + _user]
+        else:
+            _packets.append(_src + 'not an APRS packet')
+    return _packets, _expect
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-u', '--users', action='store', dest='USERS', type=int, default=10000, help='Users in the settings file.')
+    parser.add_argument('-n', '--packets', action='store', dest='PACKETS', type=int, default=100000, help='Packets in the made up stream.')
+    parser.add_argument('-f', '--file', action='store', dest='FILE', help='Recorded APRS-IS packets to use instead, deliveries are only counted.')
+    cli_args = parser.parse_args()
+
+    random.seed(1)
+    settings = user_settings(cli_args.USERS)
+    if cli_args.FILE:
+        with open(cli_args.FILE, 'r', errors = 'ignore') as f:
+            packets, expect = [line.rstrip('\r\n') for line in f if line.strip()], None
+    else:
+        packets, expect = stream(cli_args.PACKETS, settings)
+
+    tmp_dir = tempfile.mkdtemp(prefix = 'hbnet_aprs_bench_')
+    try:
+        with open(tmp_dir + '/user_settings.txt', 'w') as f:
+            f.write(str(settings))
+        data_gateway.USER_SETTINGS = UserSettings(tmp_dir + '/user_settings.txt')
+        data_gateway.user_ssid = USER_SSID
+        # Half the users have been heard, so their messages are ACKed
+        data_gateway.UNIT_MAP = {bytes_3(dmr_id): ('MASTER-1', 0) for dmr_id in list(settings)[::2]}
+
+        delivered = {}
+        acks = []
+        current = [None]
+        data_gateway.mailbox_write = lambda *_args: None
+        data_gateway.send_sms = lambda _csbk, _to_id, *_args: delivered.setdefault(current[0], []).append(_to_id)
+        data_gateway.aprs_send = acks.append
+
+        # The settings file is read, and the index built, on the first message. Time those separately.
+        start = perf_counter()
+        data_gateway.USER_SETTINGS.all()
+        load_time = perf_counter() - start
+        start = perf_counter()
+        data_gateway.aprs_index()
+        index_time = perf_counter() - start
+
+        start = perf_counter()
+        for current[0], packet in enumerate(packets):
+            data_gateway.aprs_process(packet)
+        took = perf_counter() - start
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    print('{} users, settings read in {:.0f} ms, index built in {:.1f} ms'.format(cli_args.USERS, load_time * 1000, index_time * 1000))
+    print('{} packets: {:.0f} packets/sec, {} messages delivered, {} ACKs'.format(len(packets), len(packets) / took, sum(len(to) for to in delivered.values()), len(acks)))
+    if expect != None:
+        if delivered != expect:
+            wrong = set(delivered) ^ set(expect) | set(n for n in set(delivered) & set(expect) if delivered[n] != expect[n])
+            print('{} messages delivered to the wrong users, e.g. {}'.format(len(wrong), packets[min(wrong)]))
+            sys.exit('Messages were not delivered to exactly the matching users')
+        print('every message delivered to exactly the matching users')
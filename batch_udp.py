@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+#
+###############################################################################
+#   Copyright (C) 2020-2021 Eric, KF7EEL, <kf7eel@qsl.net>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+Batched UDP for systems with a lot of peers. Rather than one sendto() per peer
+per frame, datagrams written during a reactor turn are queued and sent together
+with a single sendmmsg() call once the turn is over. If the socket buffer fills
+up, what is left waits until the socket can take more. Reads are drained with
+recvmmsg(). Both are Linux calls, listenUDP() here falls back to the normal
+Twisted UDP port anywhere they aren't available.
+'''
+
+import sys
+import socket
+import errno
+import ctypes
+import ctypes.util
+from errno import EAGAIN, EWOULDBLOCK, EINTR, ECONNREFUSED
+
+from twisted.internet import reactor, udp, abstract
+
+# The module needs logging, but handlers, etc. are controlled by the parent
+import logging
+logger = logging.getLogger(__name__)
+
+__author__     = 'Eric Craw, KF7EEL'
+__copyright__  = 'Copyright (c) 2020-2021, Eric Craw, KF7EEL'
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Eric Craw, KF7EEL'
+__email__      = 'kf7eel@qsl.net'
+
+# Most datagrams handed to the kernel, or read from it, in one call
+BATCH_SIZE = 64
+# Most datagrams kept waiting for room in the socket buffer, past this the oldest are dropped.
+# A single reactor turn can queue any number, this only applies while the socket is full.
+QUEUE_SIZE = 4096
+MSG_DONTWAIT = 0x40
+
+
+class iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+class msghdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_name', ctypes.c_void_p),
+        ('msg_namelen', ctypes.c_uint32),
+        ('msg_iov', ctypes.POINTER(iovec)),
+        ('msg_iovlen', ctypes.c_size_t),
+        ('msg_control', ctypes.c_void_p),
+        ('msg_controllen', ctypes.c_size_t),
+        ('msg_flags', ctypes.c_int)
+        ]
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', msghdr), ('msg_len', ctypes.c_uint)]
+
+class sockaddr_in(ctypes.Structure):
+    _fields_ = [
+        ('sin_family', ctypes.c_ushort),
+        ('sin_port', ctypes.c_ubyte * 2),
+        ('sin_addr', ctypes.c_ubyte * 4),
+        ('sin_zero', ctypes.c_ubyte * 8)
+        ]
+
+_SOCKADDR_LEN = ctypes.sizeof(sockaddr_in)
+
+# Find sendmmsg/recvmmsg, HAVE_MMSG is False if we can't use them
+_libc = None
+if sys.platform.startswith('linux'):
+    try:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno = True)
+        _libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int]
+        _libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    except (OSError, AttributeError):
+        _libc = None
+HAVE_MMSG = _libc != None
+
+
+class BatchPort(udp.Port):
+    def __init__(self, *args, **kwargs):
+        udp.Port.__init__(self, *args, **kwargs)
+        # Datagrams waiting for the end of the reactor turn, format: [(datagram, (sockaddr_in, address of it)), ...]
+        self._queue = []
+        self._flush_call = None
+        # True while waiting for the socket buffer to have room
+        self._blocked = False
+        # Datagrams dropped because the queue was full, in all and since the last log message
+        self.dropped = 0
+        self._dropped_log = 0
+        # Packed addresses of the hosts we send to, format: (ip, port): (sockaddr_in, address of it)
+        self._sockaddrs = {}
+
+        # Send headers are set up once too, each message points at its own iovec
+        self._tx_iovs = (iovec * BATCH_SIZE)()
+        self._tx_msgs = (mmsghdr * BATCH_SIZE)()
+        for _i in range(BATCH_SIZE):
+            self._tx_msgs[_i].msg_hdr.msg_namelen = _SOCKADDR_LEN
+            self._tx_msgs[_i].msg_hdr.msg_iov = ctypes.pointer(self._tx_iovs[_i])
+            self._tx_msgs[_i].msg_hdr.msg_iovlen = 1
+        self._tx_iov_list = [self._tx_iovs[_i] for _i in range(BATCH_SIZE)]
+        self._tx_hdr_list = [self._tx_msgs[_i].msg_hdr for _i in range(BATCH_SIZE)]
+
+        # Receive buffers are set up once and re-used for every read
+        self._rx_bufs = [ctypes.create_string_buffer(self.maxPacketSize) for _ in range(BATCH_SIZE)]
+        self._rx_names = (sockaddr_in * BATCH_SIZE)()
+        self._rx_iovs = (iovec * BATCH_SIZE)()
+        self._rx_msgs = (mmsghdr * BATCH_SIZE)()
+        for _i in range(BATCH_SIZE):
+            self._rx_iovs[_i].iov_base = ctypes.addressof(self._rx_bufs[_i])
+            self._rx_iovs[_i].iov_len = self.maxPacketSize
+            self._rx_msgs[_i].msg_hdr.msg_name = ctypes.addressof(self._rx_names[_i])
+            self._rx_msgs[_i].msg_hdr.msg_iov = ctypes.pointer(self._rx_iovs[_i])
+            self._rx_msgs[_i].msg_hdr.msg_iovlen = 1
+
+    def _sockaddr(self, _addr):
+        try:
+            return self._sockaddrs[_addr]
+        except KeyError:
+            _name = sockaddr_in()
+            _name.sin_family = socket.AF_INET
+            _name.sin_port[:] = _addr[1].to_bytes(2, 'big')
+            _name.sin_addr[:] = socket.inet_aton(_addr[0])
+            # Peers come and go, don't keep every address we have ever seen
+            if len(self._sockaddrs) >= 4096:
+                self._sockaddrs.clear()
+            self._sockaddrs[_addr] = (_name, ctypes.addressof(_name))
+            return self._sockaddrs[_addr]
+
+    def write(self, datagram, addr = None):
+        if addr == None or self._connectedAddr or self.addressFamily != socket.AF_INET:
+            return udp.Port.write(self, datagram, addr)
+        try:
+            _name = self._sockaddr(addr)
+        except (OSError, TypeError, ValueError, OverflowError):
+            # Not an IPv4 address, let Twisted raise the usual error
+            return udp.Port.write(self, datagram, addr)
+
+        self._queue.append((datagram, _name))
+        if self._blocked and len(self._queue) > QUEUE_SIZE:
+            del self._queue[0]
+            self.dropped += 1
+            self._dropped_log += 1
+        # When blocked, doWrite() sends the queue as soon as there is room
+        if self._flush_call == None and not self._blocked:
+            self._flush_call = reactor.callLater(0, self._flush)
+
+    def _flush(self):
+        self._flush_call = None
+        _queue, self._queue = self._queue, []
+        if not self.socket:
+            return
+
+        while _queue:
+            _batch = _queue[:BATCH_SIZE]
+            _count = len(_batch)
+            # Asking ctypes for the address of a bytes object is slow, so the batch is joined
+            # into one and each iovec points at its part of it
+            _data = b''.join([_datagram for _datagram, _name in _batch])
+            _offset = ctypes.cast(_data, ctypes.c_void_p).value
+            for _i in range(_count):
+                _datagram, _name = _batch[_i]
+                _iov = self._tx_iov_list[_i]
+                _iov.iov_base = _offset
+                _iov.iov_len = len(_datagram)
+                self._tx_hdr_list[_i].msg_name = _name[1]
+                _offset += len(_datagram)
+
+            _sent = _libc.sendmmsg(self.socket.fileno(), self._tx_msgs, _count, 0)
+            if _sent < 0:
+                _errno = ctypes.get_errno()
+                if _errno == EINTR:
+                    continue
+                # The socket buffer is full, keep what is left (anything written meanwhile
+                # goes after it) and send it when the socket can take more
+                if _errno in (EAGAIN, EWOULDBLOCK):
+                    self._queue = _queue
+                    self._blocked = True
+                    self.startWriting()
+                    return
+                # Anything else is a problem with the first datagram, drop it and carry on
+                if _errno != ECONNREFUSED:
+                    logger.error('(BATCH UDP) sendmmsg failed on port %s: %s', self._realPortNumber, errno.errorcode.get(_errno, _errno))
+                _sent = 1
+            # The kernel can take fewer than we gave it, the rest go next time around the loop
+            del _queue[:_sent]
+
+    # The socket buffer has room again
+    def doWrite(self):
+        self.stopWriting()
+        self._blocked = False
+        if self._dropped_log:
+            logger.warning('(BATCH UDP) Socket buffer full on port %s, dropped %s datagrams (%s in all)', self._realPortNumber, self._dropped_log, self.dropped)
+            self._dropped_log = 0
+        self._flush()
+
+    def doRead(self):
+        # The receive buffers only hold IPv4 addresses
+        if self.addressFamily != socket.AF_INET:
+            return udp.Port.doRead(self)
+        _read = 0
+        _fd = self.socket.fileno()
+        while _read < self.maxThroughput:
+            for _i in range(BATCH_SIZE):
+                self._rx_msgs[_i].msg_hdr.msg_namelen = _SOCKADDR_LEN
+            _count = _libc.recvmmsg(_fd, self._rx_msgs, BATCH_SIZE, MSG_DONTWAIT, None)
+            if _count < 0:
+                _errno = ctypes.get_errno()
+                if _errno not in (EAGAIN, EWOULDBLOCK, EINTR, ECONNREFUSED):
+                    # Like udp.Port, an error reading is logged and the port keeps going
+                    logger.error('(BATCH UDP) recvmmsg failed on port %s: %s', self._realPortNumber, errno.errorcode.get(_errno, _errno))
+                return
+
+            for _i in range(_count):
+                _length = self._rx_msgs[_i].msg_len
+                _data = ctypes.string_at(self._rx_bufs[_i], _length)
+                _name = self._rx_names[_i]
+                _addr = (socket.inet_ntoa(bytes(_name.sin_addr)), int.from_bytes(bytes(_name.sin_port), 'big'))
+                _read += _length
+                try:
+                    self.protocol.datagramReceived(_data, _addr)
+                except BaseException:
+                    logger.exception('(BATCH UDP) Unhandled error in datagramReceived')
+
+            # A short read means the socket is empty
+            if _count < BATCH_SIZE:
+                return
+
+    def connectionLost(self, reason = None):
+        if self._flush_call != None and self._flush_call.active():
+            self._flush_call.cancel()
+        self._flush_call = None
+        self._queue = []
+        self._blocked = False
+        udp.Port.connectionLost(self, reason)
+
+
+# Drop-in for reactor.listenUDP() that uses a BatchPort when the platform supports it. BatchPort
+# only reads IPv4 addresses, IPv6 interfaces get a normal port.
+def listenUDP(port, protocol, interface = '', maxPacketSize = 8192):
+    if not HAVE_MMSG or abstract.isIPv6Address(interface):
+        return reactor.listenUDP(port, protocol, interface = interface, maxPacketSize = maxPacketSize)
+    _port = BatchPort(port, protocol, interface, maxPacketSize, reactor)
+    _port.startListening()
+    return _port
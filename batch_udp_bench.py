@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+#
+###############################################################################
+#   Copyright (C) 2020-2021 Eric, KF7EEL, <kf7eel@qsl.net>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+Loopback fan-out through a normal Twisted UDP port and a BatchPort
+(batch_udp.py), the way a master repeats each frame to all of its peers. Every
+time round the reactor one DMRD sized frame is written to each of PEERS ports
+opened by another process, for SECONDS seconds. The datagrams written and
+received per second are counted, with any the BatchPort had to drop because
+the socket buffer stayed full.
+
+On loopback the kernel drops datagrams the receiving process hasn't room for
+rather than making the sender wait, so "lost" is the receiver not keeping up.
+
+    python3 batch_udp_bench.py -p 1000 -s 5
+'''
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+from time import time
+
+from twisted.internet import reactor
+from twisted.internet.protocol import DatagramProtocol
+
+import batch_udp
+
+__author__     = 'Eric Craw, KF7EEL'
+__copyright__  = 'Copyright (c) 2020-2021, Eric Craw, KF7EEL'
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Eric Craw, KF7EEL'
+__email__      = 'kf7eel@qsl.net'
+
+# Seconds the receiver waits for stragglers after the sender has finished
+DRAIN = 2
+
+
+class Counter(DatagramProtocol):
+    def __init__(self, _stats):
+        self._stats = _stats
+
+    def datagramReceived(self, _data, _addr):
+        self._stats['RECEIVED'] += 1
+
+
+# The peers: _peers ports in this process, their numbers are printed for the sender
+def receive(_peers, _seconds):
+    _stats = {'RECEIVED': 0}
+    _ports = [batch_udp.listenUDP(0, Counter(_stats), interface = '127.0.0.1') for _n in range(_peers)]
+    print(json.dumps([_port.getHost().port for _port in _ports]))
+    sys.stdout.flush()
+
+    def finish():
+        print(json.dumps(_stats))
+        sys.stdout.flush()
+        reactor.stop()
+
+    reactor.callLater(_seconds + DRAIN, finish)
+    reactor.run()
+
+
+def send(_mode, _peers, _seconds):
+    _receiver = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--receive', '-p', str(_peers), '-s', str(_seconds)], stdout = subprocess.PIPE)
+    _addrs = [('127.0.0.1', _port) for _port in json.loads(_receiver.stdout.readline())]
+    if _mode == 'batch':
+        _port = batch_udp.listenUDP(0, DatagramProtocol(), interface = '127.0.0.1')
+    else:
+        _port = reactor.listenUDP(0, DatagramProtocol(), interface = '127.0.0.1')
+    _frame = b'DMRD' + bytes(51)
+    _stats = {'WRITTEN': 0}
+
+    def fan_out(_stop):
+        for _addr in _addrs:
+            _port.write(_frame, _addr)
+        _stats['WRITTEN'] += len(_addrs)
+        if time() < _stop:
+            reactor.callLater(0, fan_out, _stop)
+        else:
+            reactor.callLater(DRAIN, reactor.stop)
+
+    reactor.callWhenRunning(fan_out, time() + _seconds)
+    reactor.run()
+    _stats['DROPPED'] = getattr(_port, 'dropped', 0)
+    _stats.update(json.loads(_receiver.communicate()[0]))
+    return _stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-p', '--peers', action='store', dest='PEERS', type=int, default=1000, help='Peers every frame is sent to.')
+    parser.add_argument('-s', '--seconds', action='store', dest='SECONDS', type=int, default=5, help='Seconds to send for.')
+    parser.add_argument('--mode', action='store', dest='MODE', choices=['twisted', 'batch'], help='Only run one of the two.')
+    parser.add_argument('--receive', action='store_true', dest='RECEIVE', help=argparse.SUPPRESS)
+    cli_args = parser.parse_args()
+
+    if cli_args.RECEIVE:
+        receive(cli_args.PEERS, cli_args.SECONDS)
+        sys.exit(0)
+
+    if not batch_udp.HAVE_MMSG:
+        sys.exit('sendmmsg/recvmmsg are not available here, BatchPort would be a normal port')
+
+    # A reactor can only be run once, so each mode has its own process
+    if not cli_args.MODE:
+        print('port      written/sec  received/sec  lost  dropped')
+        for mode in ['twisted', 'batch']:
+            subprocess.call([sys.executable, os.path.abspath(__file__), '-p', str(cli_args.PEERS), '-s', str(cli_args.SECONDS), '--mode', mode])
+        sys.exit(0)
+
+    stats = send(cli_args.MODE, cli_args.PEERS, cli_args.SECONDS)
+    print('{:8}  {:11.0f}  {:12.0f}  {:4.1%}  {:7}'.format(cli_args.MODE, stats['WRITTEN'] / cli_args.SECONDS, stats['RECEIVED'] / cli_args.SECONDS, 1 - stats['RECEIVED'] / stats['WRITTEN'], stats['DROPPED']))
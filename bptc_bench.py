@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+#
+###############################################################################
+#   Copyright (C) 2020-2021 Eric, KF7EEL, <kf7eel@qsl.net>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+Checks bptc_decode (data_gateway.py, the BPTC_TABLE built by mk_bptc_table)
+against the bit by bit decode it replaced: dmr_utils3 decode.to_bits, Slot
+Type and EMB Sync removed, then decode_full. The corpus is CORPUS bursts,
+half of them random payloads and half 12 byte blocks encoded by dmr_utils3
+(bptc.encode_19696, interleave_19696) into MMDVM packets the way data_gateway
+sends them. Every burst must decode to the same 96 bits both ways, the
+encoded ones must give back the block they were made from, and the first 72
+bits must match dmr_utils3 bptc.decode_full_lc.
+
+dmr_encode (BPTC_ENCODE_TABLE) must also encode every block to the same
+burst dmr_utils3 does. Then both ways of decoding and encoding are timed.
+
+    python3 bptc_bench.py -n 10000
+'''
+
+import sys
+import random
+import argparse
+from time import perf_counter
+
+from bitarray import bitarray
+from binascii import b2a_hex as ahex
+from dmr_utils3 import decode, bptc
+
+from data_gateway import bptc_decode, decode_full, dmr_encode, mmdvm_encapsulate
+
+__author__     = 'Eric Craw, KF7EEL'
+__copyright__  = 'Copyright (c) 2020-2021, Eric Craw, KF7EEL'
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Eric Craw, KF7EEL'
+__email__      = 'kf7eel@qsl.net'
+
+
+# The decode bptc_decode replaced
+def bit_decode(_data):
+    _bits = bitarray(decode.to_bits(_data[20:]))
+    del _bits[98:166]
+    return decode_full(_bits)
+
+
+# The encode dmr_encode replaced, for one block
+def bit_encode(_block):
+    _bits = bptc.interleave_19696(bptc.encode_19696(_block))
+    return ahex(_bits[:98] + bitarray('0111011100') + bitarray('110101011101011111110111011111111101011101010111') + bitarray('1101110001') + _bits[98:])
+
+
+# Seconds per call of _decode, over the whole corpus
+def per_call(_decode, _corpus):
+    _start = perf_counter()
+    for _data in _corpus:
+        _decode(_data)
+    return (perf_counter() - _start) / len(_corpus)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--corpus', action='store', dest='CORPUS', type=int, default=10000, help='Bursts to decode.')
+    cli_args = parser.parse_args()
+
+    random.seed(1)
+    corpus = []
+    blocks = []
+    for n in range(cli_args.CORPUS // 2):
+        corpus.append(b'DMRD' + bytes(random.getrandbits(8) for _n in range(51)))
+    for n in range(cli_args.CORPUS - len(corpus)):
+        blocks.append(bytes(random.getrandbits(8) for _n in range(12)))
+        corpus.append(mmdvm_encapsulate('002383', '2f9c70', '002f9c70', n % 256, 1, 1, 7, n, bit_encode(blocks[-1])))
+
+    wrong = 0
+    for n, data in enumerate(corpus):
+        table, bits = bptc_decode(data), bit_decode(data)
+        ok = table.tobytes() == bits.tobytes()
+        # The first 72 bits are the full LC dmr_utils3 decodes
+        full = bitarray(decode.to_bits(data[20:]))
+        del full[98:166]
+        ok = ok and table[:72] == bptc.decode_full_lc(full)
+        if n >= len(corpus) - len(blocks):
+            ok = ok and table.tobytes() == blocks[n - len(corpus) + len(blocks)]
+        wrong += not ok
+
+    wrong_encode = sum(dmr_encode([block], 0)[0] != bit_encode(block) for block in blocks)
+
+    bit_time = per_call(bit_decode, corpus)
+    table_time = per_call(bptc_decode, corpus)
+    bit_encode_time = per_call(bit_encode, blocks)
+    table_encode_time = per_call(lambda _block: dmr_encode([_block], 0), blocks)
+    print('{} bursts, {} decoded differently, {} blocks, {} encoded differently'.format(len(corpus), wrong, len(blocks), wrong_encode))
+    print('decode bit by bit (dmr_utils3):  {:7.2f} us per burst'.format(bit_time * 1000000))
+    print('decode BPTC_TABLE:               {:7.2f} us per burst, {:.1f}x'.format(table_time * 1000000, bit_time / table_time))
+    print('encode bit by bit (dmr_utils3):  {:7.2f} us per block'.format(bit_encode_time * 1000000))
+    print('encode BPTC_ENCODE_TABLE:        {:7.2f} us per block, {:.1f}x'.format(table_encode_time * 1000000, bit_encode_time / table_encode_time))
+    if wrong or wrong_encode:
+        sys.exit('BPTC_TABLE or BPTC_ENCODE_TABLE does not match dmr_utils3')
@@ -33,7 +33,6 @@ This program currently only works with group voice calls.
 
 # Python modules we need
 import sys
-from bitarray import bitarray
 from time import time
 import importlib.util
 
@@ -64,7 +63,15 @@ import json, requests
 import threading
 
 # Hotspot Proxy stuff
-from hotspot_proxy_v2 import Proxy
+from hotspot_proxy_v2 import Proxy, IsIPv4Address
+
+# Multi-process workers
+from shard import supervise, ShardLink, ShardReport
+from web_client import get_client
+from functools import partial
+
+# sendmmsg/recvmmsg UDP ports
+import batch_udp
 
 # Used for converting time
 from datetime import datetime
@@ -115,23 +122,39 @@ def update_tg(CONFIG, mode, dmr_id, data):
 ##        return config.build_config(cli_file)
 
 
+# Send the web service the units added, heard again or expired since the last time. The whole
+# table goes the first time, or after a failed send, so the web service can't drift from UNIT_MAP.
 def send_unit_table(CONFIG, _data):
+    global UNIT_SENT
+    _full = UNIT_SENT == None
+    _sent = UNIT_SENT or {}
+    _update = [[int_id(_unit), str(_data[_unit][0]), _data[_unit][1]] for _unit in _data if _sent.get(_unit) != _data[_unit]]
+    _remove = [int_id(_unit) for _unit in _sent if _unit not in _data]
+    if not _full and not _update and not _remove:
+        return
     user_man_url = CONFIG['WEB_SERVICE']['URL']
     shared_secret = str(sha256(CONFIG['WEB_SERVICE']['SHARED_SECRET'].encode()).hexdigest())
     sms_data = {
     'unit_table': CONFIG['WEB_SERVICE']['THIS_SERVER_NAME'],
     'secret':shared_secret,
-    'data': str(_data),
+    'full': _full,
+    'update': _update,
+    'remove': _remove
 
     }
     json_object = json.dumps(sms_data, indent = 4)
     
     try:
         req = requests.post(user_man_url, data=json_object, headers={'Content-Type': 'application/json'})
+        if req.ok:
+            UNIT_SENT = dict(_data)
+        else:
+            UNIT_SENT = None
 ##        resp = json.loads(req.text)
 ##        print(resp)
 ##        return resp['rules']
     except requests.ConnectionError:
+        UNIT_SENT = None
         logger.error('Config server unreachable')
 
 def ping(CONFIG):
@@ -155,22 +178,64 @@ def ping(CONFIG):
 ##        return config.build_config(cli_file)
 
 
-# Function to download rules
-def download_rules(L_CONFIG_FILE, cli_file):
-    user_man_url = L_CONFIG_FILE['WEB_SERVICE']['URL']
+# Ask for the config or rules (_kind), with the ETag of the copy we already have so the web
+# service answers with nothing or only what changed
+def snapshot_request(L_CONFIG_FILE, _kind):
     shared_secret = str(sha256(L_CONFIG_FILE['WEB_SERVICE']['SHARED_SECRET'].encode()).hexdigest())
-    rules_check = {
-    'get_rules':L_CONFIG_FILE['WEB_SERVICE']['THIS_SERVER_NAME'],
+    snapshot_check = {
+    'get_' + _kind:L_CONFIG_FILE['WEB_SERVICE']['THIS_SERVER_NAME'],
     'secret':shared_secret
     }
-##    print(rules_check)
-    json_object = json.dumps(rules_check, indent = 4)
-    
+    if _kind in REMOTE_SNAPSHOTS:
+        snapshot_check['etag'] = REMOTE_SNAPSHOTS[_kind]['ETAG']
+    return snapshot_check
+
+# Work out all of the config or rules from the answer to snapshot_request(). Returns a copy of it
+# and whether it changed, or None if the changes sent didn't give what the web service has.
+def snapshot_reply(_kind, resp):
+    last = REMOTE_SNAPSHOTS.get(_kind)
+    if last and resp.get('not_modified'):
+        return copy.deepcopy(last['DATA']), False
+    if last and 'diff' in resp:
+        data = copy.deepcopy(last['DATA'])
+        for s in resp['diff']['CHANGED']:
+            if isinstance(data.get(s), dict):
+                data[s].update(resp['diff']['CHANGED'][s])
+            else:
+                data[s] = resp['diff']['CHANGED'][s]
+        for s in resp['diff']['REMOVED']:
+            for k in resp['diff']['REMOVED'][s]:
+                data[s].pop(k, None)
+        # All of it is asked for next time
+        if sha256(json.dumps(data, sort_keys = True).encode()).hexdigest() != resp['etag']:
+            del REMOTE_SNAPSHOTS[_kind]
+            return None
+    elif _kind == 'rules':
+        data = {'UNIT': resp['rules'][0], 'BRIDGES': resp['rules'][1]}
+    else:
+        data = {'config': resp['config'], 'peers': resp['peers'], 'masters': resp['masters']}
+    # An older web service doesn't send an ETag
+    if 'etag' in resp:
+        REMOTE_SNAPSHOTS[_kind] = {'ETAG': resp['etag'], 'DATA': data}
+    return copy.deepcopy(data), True
+
+# Download the config or rules (_kind), see snapshot_request()
+def download_snapshot(L_CONFIG_FILE, _kind):
+    user_man_url = L_CONFIG_FILE['WEB_SERVICE']['URL']
+    json_object = json.dumps(snapshot_request(L_CONFIG_FILE, _kind), indent = 4)
+
+    req = requests.post(user_man_url, data=json_object, headers={'Content-Type': 'application/json'})
+    snapshot = snapshot_reply(_kind, json.loads(req.text))
+    if snapshot == None:
+        logger.warning('(ROUTER) Downloaded %s changes did not match, downloading all of it', _kind)
+        return download_snapshot(L_CONFIG_FILE, _kind)
+    return snapshot
+
+# Function to download rules
+def download_rules(L_CONFIG_FILE, cli_file):
     try:
-        req = requests.post(user_man_url, data=json_object, headers={'Content-Type': 'application/json'})
-        resp = json.loads(req.text)
-##        print(resp)
-        return resp['rules']
+        rules, changed = download_snapshot(L_CONFIG_FILE, 'rules')
+        return [rules['UNIT'], rules['BRIDGES']]
     except requests.ConnectionError:
         logger.error('Config server unreachable, defaulting to local config')
         return config.build_config(cli_file)
@@ -178,17 +243,8 @@ def download_rules(L_CONFIG_FILE, cli_file):
 
 # Function to download config
 def download_config(L_CONFIG_FILE, cli_file):
-    user_man_url = L_CONFIG_FILE['WEB_SERVICE']['URL']
-    shared_secret = str(sha256(L_CONFIG_FILE['WEB_SERVICE']['SHARED_SECRET'].encode()).hexdigest())
-    config_check = {
-    'get_config':L_CONFIG_FILE['WEB_SERVICE']['THIS_SERVER_NAME'],
-    'secret':shared_secret
-    }
-    json_object = json.dumps(config_check, indent = 4)
-    
     try:
-        req = requests.post(user_man_url, data=json_object, headers={'Content-Type': 'application/json'})
-        resp = json.loads(req.text)
+        resp, changed = download_snapshot(L_CONFIG_FILE, 'config')
         iterate_config = resp['peers'].copy()
         corrected_config = resp['config'].copy()
         corrected_config['SYSTEMS'] = {}
@@ -217,6 +273,8 @@ def download_config(L_CONFIG_FILE, cli_file):
                 corrected_config['SYSTEMS'][i]['TG1_ACL'] = config.acl_build(iterate_config[i]['TG1_ACL'], 4294967295)
                 corrected_config['SYSTEMS'][i]['TG2_ACL'] = config.acl_build(iterate_config[i]['TG2_ACL'], 4294967295)
                 corrected_config['SYSTEMS'][i]['PASSPHRASE'] = bytes(iterate_config[i]['PASSPHRASE'], 'utf-8')
+                if iterate_config[i]['MODE'] == 'MASTER' or iterate_config[i]['MODE'] == 'PROXY':
+                    corrected_config['SYSTEMS'][i]['REG_ACL'] = config.acl_build(iterate_config[i]['REG_ACL'], 4294967295)
                 if iterate_config[i]['MODE'] == 'OPENBRIDGE':
 ##                    corrected_config['SYSTEMS'][i]['NETWORK_ID'] = int(iterate_config[i]['NETWORK_ID']).to_bytes(4, 'big')
                     corrected_config['SYSTEMS'][i]['NETWORK_ID'] = int(iterate_config[i]['NETWORK_ID']).to_bytes(4, 'big')
@@ -345,10 +403,6 @@ def hotspot_proxy(listen_port, port_start, port_stop):
     
 #*******************
     
-    
-    #Set process title early
-    setproctitle(__file__)
-    
     #If IPv6 is enabled by enivornment variable...
     if ListenIP == '' and 'FDPROXY_IPV6' in os.environ and bool(os.environ['FDPROXY_IPV6']):
         ListenIP = '::'
@@ -374,23 +428,19 @@ def hotspot_proxy(listen_port, port_start, port_stop):
     if ListenIP == '::' and IsIPv4Address(Master):
         Master = '::ffff:' + Master
 
-    reactor.listenUDP(ListenPort,Proxy(Master,ListenPort,CONNTRACK,BlackList,Timeout,Debug,ClientInfo,DestportStart,DestPortEnd),interface=ListenIP)
+    proxy = Proxy(Master,ListenPort,CONNTRACK,BlackList,Timeout,Debug,ClientInfo,DestportStart,DestPortEnd)
+    reactor.listenUDP(int(ListenPort),proxy,interface=ListenIP)
 
     def loopingErrHandle(failure):
-        print('(GLOBAL) STOPPING REACTOR TO AVOID MEMORY LEAK: Unhandled error innowtimed loop.\n {}'.format(failure))
+        logger.error('(GLOBAL) STOPPING REACTOR TO AVOID MEMORY LEAK: Unhandled error in timed loop.\n {}'.format(failure))
         reactor.stop()
         
     def stats():        
-        count = 0
-        nowtime = time()
-        for port in CONNTRACK:
-            if CONNTRACK[port]:
-                count = count+1
-                
         totalPorts = DestPortEnd - DestportStart
-        freePorts = totalPorts - count
+        freePorts = len(proxy.freePorts)
+        count = len(CONNTRACK) - freePorts
         
-        print("{} ports out of {} in use ({} free)".format(count,totalPorts,freePorts))
+        logger.info("{} ports out of {} in use ({} free)".format(count,totalPorts,freePorts))
 
 
         
@@ -398,6 +448,8 @@ def hotspot_proxy(listen_port, port_start, port_stop):
         stats_task = task.LoopingCall(stats)
         statsa = stats_task.start(30)
         statsa.addErrback(loopingErrHandle)
+
+    return proxy
     
 
 # Used to track if we have downloaded user custon rules
@@ -407,9 +459,40 @@ user_rules = {}
 # This is for pruning unit-to-uint calls to not broadcast once the
 # target system for a unit is identified
 # format 'unit_id': ('SYSTEM', time)
-UNIT_MAP = {} 
+UNIT_MAP = {}
+# UNIT_MAP as last sent to the web service, None to send all of it next time
+UNIT_SENT = None
+# Config and rules as last downloaded from the web service, see download_snapshot()
+# format: 'config' or 'rules': {'ETAG': , 'DATA': }
+REMOTE_SNAPSHOTS = {}
 BRIDGES = {}
 
+# Seconds between checks for new rules, in the rules file or from the web service
+RULES_CHECK_INTERVAL = 30
+# Settings each bridge's rules were loaded with, see rule_settings()
+# format: bridge: [settings of each rule in BRIDGES[bridge], ...]
+RULES_LOADED = {}
+# Rules as they were in the rules file or from the web service, before make_bridges()
+RULES_SOURCE = {}
+# Modification time of the rules file when it was read
+RULES_MTIME = None
+
+# Routing index built from BRIDGES, see index_bridge()
+# ROUTE_KEYS tracks which index keys each bridge contributed to
+ROUTES = {}
+ROUTE_KEYS = {}
+
+# This worker's link to the others when running with --workers, see shard.py.
+# None when running as a single process.
+SHARD = None
+# Last time UNIT_MAP was sent to the other workers
+SHARD_SYNC = 0
+
+# Subscribers waiting to be announced over SVRD, format: rf_src: None (a dict, to keep order)
+SVRD_UNITS = {}
+# Seconds between SVRD subscriber announcements
+SVRD_UNIT_INTERVAL = 2
+
 # Timed loop used for reporting HBP status
 #
 # REPORT BASED ON THE TYPE SELECTED IN THE MAIN CONFIG FILE
@@ -439,6 +522,17 @@ def svrd_send_all(_svrd_data):
                 if CONFIG['SYSTEMS'][system]['MODE'] == 'OPENBRIDGE':
                     if CONFIG['SYSTEMS'][system]['ENCRYPTION_KEY'] != b'':
                         systems[system].send_system(_svrd_packet + _svrd_data)
+
+# Queue a subscriber to be announced to other HBNet servers. Subscribers heard during
+# the same SVRD_UNIT_INTERVAL are announced once, by svrd_unit_loop
+def svrd_send_unit(_rf_src):
+    SVRD_UNITS[_rf_src] = None
+
+def svrd_unit_loop():
+    if SVRD_UNITS:
+        for _rf_src in SVRD_UNITS:
+            svrd_send_all(b'UNIT' + _rf_src)
+        SVRD_UNITS.clear()
                         
 # Send any data packets to connections with ALL_DATA specified in other options
 def mirror_traffic(_data):
@@ -515,6 +609,198 @@ def make_bridges(_rules, _web_serv_status):
                 _system['TIMER']  = time()
     return _new_rules
 
+# Routing index so group_received doesn't have to walk every rule for every packet.
+# format (SYSTEM, TS, TGID): ((bridge, source rule, (active target rules)), ...)
+# Only ACTIVE source rules are indexed, and the target tuple only holds ACTIVE rules,
+# so the index MUST be updated any time a rule's ACTIVE state changes.
+def index_bridge(_bridge):
+    # Drop whatever this bridge contributed before
+    for _key in ROUTE_KEYS.pop(_bridge, ()):
+        _routes = tuple(_route for _route in ROUTES[_key] if _route[0] != _bridge)
+        if _routes:
+            ROUTES[_key] = _routes
+        else:
+            del ROUTES[_key]
+
+    if _bridge not in BRIDGES:
+        return
+
+    _keys = set()
+    for _system in BRIDGES[_bridge]:
+        if _system['ACTIVE'] == True:
+            _key = (_system['SYSTEM'], _system['TS'], _system['TGID'])
+            _targets = tuple(_target for _target in BRIDGES[_bridge] if _target['ACTIVE'] and (_target['SYSTEM'] != _system['SYSTEM'] or _target['TS'] != _system['TS']))
+            ROUTES[_key] = ROUTES.get(_key, ()) + ((_bridge, _system, _targets),)
+            _keys.add(_key)
+    if _keys:
+        ROUTE_KEYS[_bridge] = _keys
+
+def build_routes():
+    ROUTES.clear()
+    ROUTE_KEYS.clear()
+    for _bridge in BRIDGES:
+        index_bridge(_bridge)
+    logger.debug('(ROUTER) Routing index built: %s routes from %s bridges', len(ROUTES), len(BRIDGES))
+
+# A rule as it was loaded, before traffic or timers changed its ACTIVE state and TIMER
+def rule_settings(_system):
+    return (_system['SYSTEM'], _system['TS'], _system['TGID'], _system['ACTIVE'], _system['TIMEOUT'], _system['TO_TYPE'], tuple(_system['ON']), tuple(_system['OFF']), tuple(_system['RESET']))
+
+def rules_loaded(_rules):
+    RULES_SOURCE.clear()
+    RULES_SOURCE.update(_rules)
+    RULES_LOADED.clear()
+    for _bridge in BRIDGES:
+        RULES_LOADED[_bridge] = [rule_settings(_system) for _system in BRIDGES[_bridge]]
+
+# Apply bridges fresh from make_bridges() to the live BRIDGES, _bridges is the name of every
+# bridge there should be. Bridges loaded with the same rules are left alone. In a bridge that
+# changed, rules that are still set the same are kept, with their ACTIVE state and TIMER, and
+# only that bridge is re-indexed. Calls in progress carry on, every packet is routed with
+# whatever is in ROUTES when it arrives.
+def update_bridges(_new_bridges, _bridges):
+    _added = []
+    _changed = []
+    _removed = []
+    for _bridge in list(BRIDGES):
+        if _bridge not in _bridges:
+            del BRIDGES[_bridge]
+            RULES_LOADED.pop(_bridge, None)
+            index_bridge(_bridge)
+            _removed.append(_bridge)
+
+    for _bridge in _new_bridges:
+        _settings = [rule_settings(_system) for _system in _new_bridges[_bridge]]
+        if _bridge in BRIDGES and RULES_LOADED.get(_bridge) == _settings:
+            continue
+        # Live rules by the settings they were loaded with, format: settings: [rule, ...]
+        _live = {}
+        for _system, _loaded in zip(BRIDGES.get(_bridge, ()), RULES_LOADED.get(_bridge, ())):
+            _live.setdefault(_loaded, []).append(_system)
+        _rules = []
+        for _system, _setting in zip(_new_bridges[_bridge], _settings):
+            if _live.get(_setting):
+                _rules.append(_live[_setting].pop(0))
+            else:
+                _rules.append(_system)
+        if _bridge in BRIDGES:
+            _changed.append(_bridge)
+        else:
+            _added.append(_bridge)
+        BRIDGES[_bridge] = _rules
+        RULES_LOADED[_bridge] = _settings
+        index_bridge(_bridge)
+    return _added, _changed, _removed
+
+# Put new rules (as in the rules file or from the web service) in place without a restart
+def reload_rules(_rules, _unit, _web_serv_status):
+    global UNIT
+    # Only bridges that aren't the same as last time need making
+    _rules_changed = {_bridge: _rules[_bridge] for _bridge in _rules if RULES_SOURCE.get(_bridge) != _rules[_bridge]}
+    try:
+        _new_bridges = make_bridges(_rules_changed, _web_serv_status)
+    # make_bridges() exits on a rule for a system that isn't configured
+    except (SystemExit, Exception) as e:
+        logger.error('(ROUTER) New rules not used: %s', e)
+        return
+    _added, _changed, _removed = update_bridges(_new_bridges, _rules)
+    RULES_SOURCE.clear()
+    RULES_SOURCE.update(_rules)
+    UNIT = _unit
+    logger.info('(ROUTER) Rules reloaded, bridges added: %s, changed: %s, removed: %s', len(_added), len(_changed), len(_removed))
+    if (_added or _changed or _removed) and CONFIG['REPORTS']['REPORT']:
+        report_server.send_clients(b'bridge updated')
+
+def load_rules_file(_rules_file):
+    global RULES_MTIME
+    RULES_MTIME = os.stat(_rules_file).st_mtime
+    spec = importlib.util.spec_from_file_location("module.name", _rules_file)
+    rules_module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(rules_module)
+    return rules_module
+
+def rules_file_check(_rules_file):
+    try:
+        if os.stat(_rules_file).st_mtime == RULES_MTIME:
+            return
+        rules_module = load_rules_file(_rules_file)
+    except Exception as e:
+        logger.error('(ROUTER) Could not read changed rules file %s: %s', _rules_file, e)
+        return
+    logger.info('(ROUTER) Rules file changed: %s', _rules_file)
+    reload_rules(rules_module.BRIDGES, gen_proxy_unit(rules_module.UNIT), False)
+
+def rules_downloaded(_resp):
+    try:
+        _snapshot = snapshot_reply('rules', _resp)
+    except Exception as e:
+        logger.error('(ROUTER) Bad rules from web service: %s', e)
+        return
+    if _snapshot == None:
+        logger.warning('(ROUTER) Downloaded rules changes did not match, downloading all of them next time')
+        return
+    _rules, _changed = _snapshot
+    if _changed:
+        reload_rules(_rules['BRIDGES'], _rules['UNIT'], True)
+
+def rules_download_failed(_failure):
+    logger.error('(ROUTER) Could not check web service for new rules: %s', _failure.getErrorMessage())
+
+# Look for new rules wherever the ones in use came from. The web service only answers with
+# something when the rules have changed since we last asked.
+def rules_loop(_rules_file, _remote):
+    if _remote:
+        _d = get_client(LOCAL_CONFIG['WEB_SERVICE']['URL']).post(snapshot_request(LOCAL_CONFIG, 'rules'))
+        _d.addCallbacks(rules_downloaded, rules_download_failed)
+    else:
+        rules_file_check(_rules_file)
+
+# Jobs that talk to the web service or the report clients only need doing once, by worker 0
+def lead_worker():
+    return SHARD == None or SHARD.worker == 0
+
+# Send the ACTIVE state and timer of rules to the other workers. Only the worker that owns a
+# rule's system changes it. format: [(bridge, rule), ...]
+def share_rules(_rules):
+    if SHARD and _rules:
+        SHARD.broadcast('RULES', [(_bridge, _system['SYSTEM'], _system['TS'], _system['TGID'], _system['ACTIVE'], _system['TIMER']) for _bridge, _system in _rules])
+
+def rules_received(_rules):
+    _changed = set()
+    for _bridge, _sys_name, _ts, _tgid, _active, _timer in _rules:
+        for _system in BRIDGES.get(_bridge, ()):
+            if _system['SYSTEM'] == _sys_name and _system['TS'] == _ts and _system['TGID'] == _tgid:
+                if _system['ACTIVE'] != _active:
+                    _system['ACTIVE'] = _active
+                    _changed.add(_bridge)
+                _system['TIMER'] = _timer
+    for _bridge in _changed:
+        index_bridge(_bridge)
+
+# Send the UNIT_MAP entries this worker learned since the last run to the others, and log
+# any voice frames the other workers couldn't take
+def shard_loop():
+    global SHARD_SYNC
+    _now = time()
+    _units = [(_unit, UNIT_MAP[_unit][0], UNIT_MAP[_unit][1]) for _unit in UNIT_MAP if UNIT_MAP[_unit][1] >= SHARD_SYNC and SHARD.owns(UNIT_MAP[_unit][0])]
+    if _units:
+        SHARD.broadcast('UNITS', _units)
+    SHARD_SYNC = _now
+    SHARD.log_dropped()
+
+def units_received(_units):
+    for _unit, _system, _time in _units:
+        if _unit not in UNIT_MAP or UNIT_MAP[_unit][1] < _time:
+            UNIT_MAP[_unit] = (_system, _time)
+
+# A packet another worker routed to one of our systems
+def packet_received(_system, _packet):
+    systems[_system].send_system(_packet)
+
+def report_received(_data):
+    if report_server:
+        report_server.send_bridgeEvent(_data)
+
 def ten_loop_func():
     logger.info('10 minute function loop')
     # Download burn list
@@ -528,14 +814,21 @@ def rule_timer_loop(unit_flood_time):
     global UNIT_MAP
     logger.debug('(ROUTER) routerHBP Rule timer loop started')
     _now = time()
+    _changed = set()
+    _shared = []
     #This is a good place to get and modify rules for users
 ##    print(BRIDGES)
     for _bridge in BRIDGES:
         for _system in BRIDGES[_bridge]:
+            # The worker that owns the system looks after its rules
+            if SHARD and not SHARD.owns(_system['SYSTEM']):
+                continue
             if _system['TO_TYPE'] == 'ON':
                 if _system['ACTIVE'] == True:
                     if _system['TIMER'] < _now:
                         _system['ACTIVE'] = False
+                        _changed.add(_bridge)
+                        _shared.append((_bridge, _system))
                         logger.info('(ROUTER) Conference Bridge TIMEOUT: DEACTIVATE System: %s, Bridge: %s, TS: %s, TGID: %s', _system['SYSTEM'], _bridge, _system['TS'], int_id(_system['TGID']))
                         # Send not active POST
                         #update_tg(CONFIG, 'off', 0, [{'SYSTEM':_system['SYSTEM']}, {'ts':_system['TS']}, {'tg': int_id(_system['TGID'])}])
@@ -550,6 +843,8 @@ def rule_timer_loop(unit_flood_time):
                 if _system['ACTIVE'] == False:
                     if _system['TIMER'] < _now:
                         _system['ACTIVE'] = True
+                        _changed.add(_bridge)
+                        _shared.append((_bridge, _system))
                         logger.info('(ROUTER) Conference Bridge TIMEOUT: ACTIVATE System: %s, Bridge: %s, TS: %s, TGID: %s', _system['SYSTEM'], _bridge, _system['TS'], int_id(_system['TGID']))
                         # POST ON
 ##                        update_tg(CONFIG, 'on', 0, [{'SYSTEM':_system['SYSTEM']}, {'ts':_system['TS']}, {'tg': int_id(_system['TGID'])}])
@@ -564,6 +859,11 @@ def rule_timer_loop(unit_flood_time):
             else:
                 logger.debug('(ROUTER) Conference Bridge NO ACTION: System: %s, Bridge: %s, TS: %s, TGID: %s', _system['SYSTEM'], _bridge, _system['TS'], int_id(_system['TGID']))
 
+    # Re-index only the bridges that had a rule change state
+    for _bridge in _changed:
+        index_bridge(_bridge)
+    share_rules(_shared)
+
 ##    for unit in UNIT_MAP:
 ##        svrd_send_all(b'UNIT' + unit)
     _then = _now - unit_flood_time
@@ -574,7 +874,8 @@ def rule_timer_loop(unit_flood_time):
 
     for unit in remove_list:
         del UNIT_MAP[unit]
-    send_unit_table(CONFIG, UNIT_MAP)
+    if lead_worker():
+        send_unit_table(CONFIG, UNIT_MAP)
 
     logger.debug('Removed unit(s) %s from UNIT_MAP', remove_list)
 
@@ -586,7 +887,8 @@ def rule_timer_loop(unit_flood_time):
 # run this every 10 seconds to trim orphaned stream ids
 def stream_trimmer_loop():
     print(UNIT_MAP)
-    ping(CONFIG)
+    if lead_worker():
+        ping(CONFIG)
     logger.debug('(ROUTER) Trimming inactive stream IDs from system lists')
     _now = time()
        
@@ -635,6 +937,197 @@ def stream_trimmer_loop():
                 else:
                     logger.error('(%s) Attemped to remove OpenBridge Stream ID %s not in the Stream ID list: %s', system, int_id(stream_id), [id for id in systems[system].STATUS])
 
+# LC re-write templates. Rather than unpacking every 33 byte burst into a bitarray for every
+# target, the burst is treated as a single 264 bit integer (burst bit 0 is the MSB) and the LC
+# is merged in with a mask. Each template is (bits to keep from the burst, LC bits to merge in).
+# format: {'H_LC': template, 'T_LC': template, 'EMB_LC': {1: template ... 4: template}}
+_LC_KEEP_FULL = ((1 << 68) - 1) << 98                       # Keep burst bits 98:166 (sync or slot type)
+_LC_KEEP_EMB = ((1 << 264) - 1) ^ (((1 << 32) - 1) << 116)  # Keep all but burst bits 116:148 (EMB LC)
+_LC_LOW_98 = (1 << 98) - 1
+
+# Templates only depend on the destination LC, so calls fanned out to many systems on the same
+# TGID share them. Cleared when it gets too big, there are only as many entries as active calls.
+LC_TEMPLATES = {}
+
+def mk_lc_templates(_dst_lc):
+    if _dst_lc in LC_TEMPLATES:
+        return LC_TEMPLATES[_dst_lc]
+    if len(LC_TEMPLATES) >= 1024:
+        LC_TEMPLATES.clear()
+
+    _h_lc = int(bptc.encode_header_lc(_dst_lc).to01(), 2)
+    _t_lc = int(bptc.encode_terminator_lc(_dst_lc).to01(), 2)
+    _emb_lc = bptc.encode_emblc(_dst_lc)
+    # Full LC is split around the sync: LC bits 0:98 -> burst 0:98, LC bits 98:196 -> burst 166:264
+    _templates = {
+        'H_LC': (_LC_KEEP_FULL, ((_h_lc >> 98) << 166) | (_h_lc & _LC_LOW_98)),
+        'T_LC': (_LC_KEEP_FULL, ((_t_lc >> 98) << 166) | (_t_lc & _LC_LOW_98)),
+        'EMB_LC': {}
+    }
+    for _vseq in range(1, 5):
+        _templates['EMB_LC'][_vseq] = (_LC_KEEP_EMB, int(_emb_lc[_vseq].to01(), 2) << 116)
+    LC_TEMPLATES[_dst_lc] = _templates
+    return _templates
+
+# Apply an LC template to a burst that has already been converted with int.from_bytes
+def lc_rewrite(_burst, _template):
+    return ((_burst & _template[0]) | _template[1]).to_bytes(33, 'big')
+
+# Route one frame of a group call to a target system: contention handling, the target's TX
+# state and LC re-writes, then the packet. Only the worker that owns a system has its RX state
+# and TX state, so it has to be the one to decide whether a call gets the target's slot, route()
+# passes frames for other workers' systems to their owner. _src_lc is the LC of the source
+# stream and _end is True for the terminator that ends it.
+def route_group(_target_sys, _target_ts, _target_tgid, _source, _bridge, _src_ts, _src_lc, _end, _peer_id, _rf_src, _stream_id, _frame_type, _dtype_vseq, _data):
+    pkt_time = time()
+    dmrpkt = _data[20:53]
+    _bits = _data[15]
+    # Burst as an integer for LC re-writes, see lc_rewrite()
+    _burst = int.from_bytes(dmrpkt, 'big')
+    _target_status = systems[_target_sys].STATUS
+    _target_system = CONFIG['SYSTEMS'][_target_sys]
+
+    if _target_system['MODE'] == 'OPENBRIDGE':
+        # Is this a new call stream on the target?
+        if (_stream_id not in _target_status):
+            # This is a new call stream on the target
+            _target_status[_stream_id] = {
+                'START':     pkt_time,
+                'CONTENTION':False,
+                'RFS':       _rf_src,
+                'TYPE':     'GROUP',
+                'DST':      _target_tgid,
+                'ACTIVE':   True,
+            }
+            # Get the LC (full and EMB) re-write templates for the TX stream
+            dst_lc = b''.join([_src_lc[0:3], _target_tgid, _rf_src])
+            _target_status[_stream_id]['TX_LC'] = mk_lc_templates(dst_lc)
+
+            logger.info('(%s) Conference Bridge: %s, Call Bridged to OBP System: %s TS: %s, TGID: %s', _source, _bridge, _target_sys, _target_ts, int_id(_target_tgid))
+            if CONFIG['REPORTS']['REPORT']:
+                systems[_target_sys]._report.send_bridgeEvent('GROUP VOICE,START,TX,{},{},{},{},{},{}'.format(_target_sys, int_id(_stream_id), int_id(_peer_id), int_id(_rf_src), _target_ts, int_id(_target_tgid)).encode(encoding='utf-8', errors='ignore'))
+
+        # Record the time of this packet so we can later identify a stale stream
+        _target_status[_stream_id]['LAST'] = pkt_time
+        # Clear the TS bit -- all OpenBridge streams are effectively on TS1
+        _tmp_bits = _bits & ~(1 << 7)
+
+        # Assemble transmit HBP packet header
+        _tmp_data = b''.join([_data[:8], _target_tgid, _data[11:15], _tmp_bits.to_bytes(1, 'big'), _data[16:20]])
+
+        _lc = _target_status[_stream_id]['TX_LC']
+        # Create a voice header packet (FULL LC)
+        if _frame_type == HBPF_DATA_SYNC and _dtype_vseq == HBPF_SLT_VHEAD:
+            _tx_pkt = lc_rewrite(_burst, _lc['H_LC'])
+        # Create a voice terminator packet (FULL LC)
+        elif _frame_type == HBPF_DATA_SYNC and _dtype_vseq == HBPF_SLT_VTERM:
+            _tx_pkt = lc_rewrite(_burst, _lc['T_LC'])
+            if CONFIG['REPORTS']['REPORT']:
+                call_duration = pkt_time - _target_status[_stream_id]['START']
+                _target_status[_stream_id]['ACTIVE'] = False
+                systems[_target_sys]._report.send_bridgeEvent('GROUP VOICE,END,TX,{},{},{},{},{},{},{:.2f}'.format(_target_sys, int_id(_stream_id), int_id(_peer_id), int_id(_rf_src), _target_ts, int_id(_target_tgid), call_duration).encode(encoding='utf-8', errors='ignore'))
+        # Create a Burst B-E packet (Embedded LC)
+        elif _dtype_vseq in [1,2,3,4]:
+            _tx_pkt = lc_rewrite(_burst, _lc['EMB_LC'][_dtype_vseq])
+        # Anything else is passed through untouched
+        else:
+            _tx_pkt = dmrpkt
+        _tmp_data = b''.join([_tmp_data, _tx_pkt])
+
+    else:
+        _slot = _target_status[_target_ts]
+        # BEGIN STANDARD CONTENTION HANDLING
+        #
+        # The rules for each of the 4 "ifs" below are listed here for readability. The Frame To Send is:
+        #   From a different group than last RX from this HBSystem, but it has been less than Group Hangtime
+        #   From a different group than last TX to this HBSystem, but it has been less than Group Hangtime
+        #   From the same group as the last RX from this HBSystem, but from a different subscriber, and it has been less than stream timeout
+        #   From the same group as the last TX to this HBSystem, but from a different subscriber, and it has been less than stream timeout
+        # The "return" at the end of each means the frame is not sent. Each call that is refused is logged once.
+        #
+        if ((_target_tgid != _slot['RX_TGID']) and ((pkt_time - _slot['RX_TIME']) < _target_system['GROUP_HANGTIME'])):
+            if _slot['TX_REFUSED'] != _stream_id:
+                _slot['TX_REFUSED'] = _stream_id
+                logger.info('(%s) Call not routed to TGID %s, target active or in group hangtime: HBSystem: %s, TS: %s, TGID: %s', _source, int_id(_target_tgid), _target_sys, _target_ts, int_id(_slot['RX_TGID']))
+            return
+        if ((_target_tgid != _slot['TX_TGID']) and ((pkt_time - _slot['TX_TIME']) < _target_system['GROUP_HANGTIME'])):
+            if _slot['TX_REFUSED'] != _stream_id:
+                _slot['TX_REFUSED'] = _stream_id
+                logger.info('(%s) Call not routed to TGID%s, target in group hangtime: HBSystem: %s, TS: %s, TGID: %s', _source, int_id(_target_tgid), _target_sys, _target_ts, int_id(_slot['TX_TGID']))
+            return
+        if (_target_tgid == _slot['RX_TGID']) and ((pkt_time - _slot['RX_TIME']) < STREAM_TO):
+            if _slot['TX_REFUSED'] != _stream_id:
+                _slot['TX_REFUSED'] = _stream_id
+                logger.info('(%s) Call not routed to TGID%s, matching call already active on target: HBSystem: %s, TS: %s, TGID: %s', _source, int_id(_target_tgid), _target_sys, _target_ts, int_id(_slot['RX_TGID']))
+            return
+        if (_target_tgid == _slot['TX_TGID']) and (_rf_src != _slot['TX_RFS']) and ((pkt_time - _slot['TX_TIME']) < STREAM_TO):
+            if _slot['TX_REFUSED'] != _stream_id:
+                _slot['TX_REFUSED'] = _stream_id
+                logger.info('(%s) Call not routed for subscriber %s, call route in progress on target: HBSystem: %s, TS: %s, TGID: %s, SUB: %s', _source, int_id(_rf_src), _target_sys, _target_ts, int_id(_slot['TX_TGID']), int_id(_slot['TX_RFS']))
+            return
+
+        # Is this a new call stream on the target?
+        if (_slot['TX_STREAM_ID'] != _stream_id):
+            # Record the DST TGID and Stream ID
+            _slot['TX_START'] = pkt_time
+            _slot['TX_TGID'] = _target_tgid
+            _slot['TX_STREAM_ID'] = _stream_id
+            _slot['TX_RFS'] = _rf_src
+            _slot['TX_PEER'] = _peer_id
+            # Get the LC (full and EMB) re-write templates for the TX stream
+            dst_lc = _src_lc[0:3] + _target_tgid + _rf_src
+            _slot['TX_LC'] = mk_lc_templates(dst_lc)
+            logger.debug('(%s) Generating TX FULL and EMB LCs for HomeBrew destination: System: %s, TS: %s, TGID: %s', _source, _target_sys, _target_ts, int_id(_target_tgid))
+            logger.info('(%s) Conference Bridge: %s, Call Bridged to HBP System: %s TS: %s, TGID: %s', _source, _bridge, _target_sys, _target_ts, int_id(_target_tgid))
+            if CONFIG['REPORTS']['REPORT']:
+                systems[_target_sys]._report.send_bridgeEvent('GROUP VOICE,START,TX,{},{},{},{},{},{}'.format(_target_sys, int_id(_stream_id), int_id(_peer_id), int_id(_rf_src), _target_ts, int_id(_target_tgid)).encode(encoding='utf-8', errors='ignore'))
+
+        # Set other values for the contention handler to test next time there is a frame to forward
+        _slot['TX_TIME'] = pkt_time
+        _slot['TX_TYPE'] = _dtype_vseq
+
+        # Handle any necessary re-writes for the destination
+        if _src_ts != _target_ts:
+            _tmp_bits = _bits ^ 1 << 7
+        else:
+            _tmp_bits = _bits
+
+        # Assemble transmit HBP packet header
+        _tmp_data = b''.join([_data[:8], _target_tgid, _data[11:15], _tmp_bits.to_bytes(1, 'big'), _data[16:20]])
+
+        _lc = _slot['TX_LC']
+        # Create a voice header packet (FULL LC)
+        if _frame_type == HBPF_DATA_SYNC and _dtype_vseq == HBPF_SLT_VHEAD:
+            _tx_pkt = lc_rewrite(_burst, _lc['H_LC'])
+        # Create a voice terminator packet (FULL LC)
+        elif _frame_type == HBPF_DATA_SYNC and _dtype_vseq == HBPF_SLT_VTERM:
+            _tx_pkt = lc_rewrite(_burst, _lc['T_LC'])
+            if CONFIG['REPORTS']['REPORT']:
+                call_duration = pkt_time - _slot['TX_START']
+                systems[_target_sys]._report.send_bridgeEvent('GROUP VOICE,END,TX,{},{},{},{},{},{},{:.2f}'.format(_target_sys, int_id(_stream_id), int_id(_peer_id), int_id(_rf_src), _target_ts, int_id(_target_tgid), call_duration).encode(encoding='utf-8', errors='ignore'))
+        # Create a Burst B-E packet (Embedded LC)
+        elif _dtype_vseq in [1,2,3,4]:
+            _tx_pkt = lc_rewrite(_burst, _lc['EMB_LC'][_dtype_vseq])
+        # Anything else is passed through untouched
+        else:
+            _tx_pkt = dmrpkt
+        # OBP doesn't include the BER & RSSI bytes, send two bytes of nothing for those
+        _tmp_data = b''.join([_tmp_data, _tx_pkt, _data[53:55] or b'\x00\x00'])
+
+    # Transmit the packet to the destination system
+    systems[_target_sys].send_system(_tmp_data)
+
+    if _target_system['MODE'] == 'OPENBRIDGE' and _end:
+        if (_stream_id in _target_status):
+            _target_status.pop(_stream_id)
+
+# Route a group call frame here if this worker owns the target system, or by the worker that does
+def route(_target_sys, *_args):
+    if SHARD and not SHARD.owns(_target_sys):
+        SHARD.send(SHARD.owner(_target_sys), 'ROUTE', _target_sys, *_args)
+    else:
+        route_group(_target_sys, *_args)
+
 class routerOBP(OPENBRIDGE):
 
     def __init__(self, _name, _config, _report):
@@ -654,7 +1147,6 @@ class routerOBP(OPENBRIDGE):
     def group_received(self, _peer_id, _rf_src, _dst_id, _seq, _slot, _frame_type, _dtype_vseq, _stream_id, _data):
         pkt_time = time()
         dmrpkt = _data[20:53]
-        _bits = _data[15]
         
         # Is this a new call stream?
         if (_stream_id not in self.STATUS):
@@ -686,153 +1178,11 @@ class routerOBP(OPENBRIDGE):
 
         self.STATUS[_stream_id]['LAST'] = pkt_time
 
-
-        for _bridge in BRIDGES:
-            for _system in BRIDGES[_bridge]:
-
-                if (_system['SYSTEM'] == self._system and _system['TGID'] == _dst_id and _system['TS'] == _slot and _system['ACTIVE'] == True):
-
-                    for _target in BRIDGES[_bridge]:
-                        if (_target['SYSTEM'] != self._system) and (_target['ACTIVE']):
-                            _target_status = systems[_target['SYSTEM']].STATUS
-                            _target_system = self._CONFIG['SYSTEMS'][_target['SYSTEM']]
-                            if _target_system['MODE'] == 'OPENBRIDGE':
-                                # Is this a new call stream on the target?
-                                if (_stream_id not in _target_status):
-                                    # This is a new call stream on the target
-                                    _target_status[_stream_id] = {
-                                        'START':     pkt_time,
-                                        'CONTENTION':False,
-                                        'RFS':       _rf_src,
-                                        'TYPE':      'GROUP',
-                                        'DST':       _dst_id,
-                                        'ACTIVE':    True
-                                    }
-                                    # Generate LCs (full and EMB) for the TX stream
-                                    dst_lc = b''.join([self.STATUS[_stream_id]['LC'][0:3], _target['TGID'], _rf_src])
-                                    _target_status[_stream_id]['H_LC'] = bptc.encode_header_lc(dst_lc)
-                                    _target_status[_stream_id]['T_LC'] = bptc.encode_terminator_lc(dst_lc)
-                                    _target_status[_stream_id]['EMB_LC'] = bptc.encode_emblc(dst_lc)
-
-                                    logger.info('(%s) Conference Bridge: %s, Call Bridged to OBP System: %s TS: %s, TGID: %s', self._system, _bridge, _target['SYSTEM'], _target['TS'], int_id(_target['TGID']))
-                                    if CONFIG['REPORTS']['REPORT']:
-                                        systems[_target['SYSTEM']]._report.send_bridgeEvent('GROUP VOICE,START,TX,{},{},{},{},{},{}'.format(_target['SYSTEM'], int_id(_stream_id), int_id(_peer_id), int_id(_rf_src), _target['TS'], int_id(_target['TGID'])).encode(encoding='utf-8', errors='ignore'))
-
-                                # Record the time of this packet so we can later identify a stale stream
-                                _target_status[_stream_id]['LAST'] = pkt_time
-                                # Clear the TS bit -- all OpenBridge streams are effectively on TS1
-                                _tmp_bits = _bits & ~(1 << 7)
-
-                                # Assemble transmit HBP packet header
-                                _tmp_data = b''.join([_data[:8], _target['TGID'], _data[11:15], _tmp_bits.to_bytes(1, 'big'), _data[16:20]])
-
-                                # MUST TEST FOR NEW STREAM AND IF SO, RE-WRITE THE LC FOR THE TARGET
-                                # MUST RE-WRITE DESTINATION TGID IF DIFFERENT
-                                # if _dst_id != rule['DST_GROUP']:
-                                dmrbits = bitarray(endian='big')
-                                dmrbits.frombytes(dmrpkt)
-                                # Create a voice header packet (FULL LC)
-                                if _frame_type == HBPF_DATA_SYNC and _dtype_vseq == HBPF_SLT_VHEAD:
-                                    dmrbits = _target_status[_stream_id]['H_LC'][0:98] + dmrbits[98:166] + _target_status[_stream_id]['H_LC'][98:197]
-                                # Create a voice terminator packet (FULL LC)
-                                elif _frame_type == HBPF_DATA_SYNC and _dtype_vseq == HBPF_SLT_VTERM:
-                                    dmrbits = _target_status[_stream_id]['T_LC'][0:98] + dmrbits[98:166] + _target_status[_stream_id]['T_LC'][98:197]
-                                    if CONFIG['REPORTS']['REPORT']:
-                                        call_duration = pkt_time - _target_status[_stream_id]['START']
-                                        _target_status[_stream_id]['ACTIVE'] = False
-                                        systems[_target['SYSTEM']]._report.send_bridgeEvent('GROUP VOICE,END,TX,{},{},{},{},{},{},{:.2f}'.format(_target['SYSTEM'], int_id(_stream_id), int_id(_peer_id), int_id(_rf_src), _target['TS'], int_id(_target['TGID']), call_duration).encode(encoding='utf-8', errors='ignore'))              
-                                # Create a Burst B-E packet (Embedded LC)
-                                elif _dtype_vseq in [1,2,3,4]:
-                                    dmrbits = dmrbits[0:116] + _target_status[_stream_id]['EMB_LC'][_dtype_vseq] + dmrbits[148:264]
-                                dmrpkt = dmrbits.tobytes()
-                                _tmp_data = b''.join([_tmp_data, dmrpkt])
-
-                            else:
-                                # BEGIN CONTENTION HANDLING
-                                #
-                                # The rules for each of the 4 "ifs" below are listed here for readability. The Frame To Send is:
-                                #   From a different group than last RX from this HBSystem, but it has been less than Group Hangtime
-                                #   From a different group than last TX to this HBSystem, but it has been less than Group Hangtime
-                                #   From the same group as the last RX from this HBSystem, but from a different subscriber, and it has been less than stream timeout
-                                #   From the same group as the last TX to this HBSystem, but from a different subscriber, and it has been less than stream timeout
-                                # The "continue" at the end of each means the next iteration of the for loop that tests for matching rules
-                                #
-                                if ((_target['TGID'] != _target_status[_target['TS']]['RX_TGID']) and ((pkt_time - _target_status[_target['TS']]['RX_TIME']) < _target_system['GROUP_HANGTIME'])):
-                                    if self.STATUS[_stream_id]['CONTENTION'] == False:
-                                        self.STATUS[_stream_id]['CONTENTION'] = True
-                                        logger.info('(%s) Call not routed to TGID %s, target active or in group hangtime: HBSystem: %s, TS: %s, TGID: %s', self._system, int_id(_target['TGID']), _target['SYSTEM'], _target['TS'], int_id(_target_status[_target['TS']]['RX_TGID']))
-                                    continue
-                                if ((_target['TGID'] != _target_status[_target['TS']]['TX_TGID']) and ((pkt_time - _target_status[_target['TS']]['TX_TIME']) < _target_system['GROUP_HANGTIME'])):
-                                    if self.STATUS[_stream_id]['CONTENTION'] == False:
-                                        self.STATUS[_stream_id]['CONTENTION'] = True
-                                        logger.info('(%s) Call not routed to TGID%s, target in group hangtime: HBSystem: %s, TS: %s, TGID: %s', self._system, int_id(_target['TGID']), _target['SYSTEM'], _target['TS'], int_id(_target_status[_target['TS']]['TX_TGID']))
-                                    continue
-                                if (_target['TGID'] == _target_status[_target['TS']]['RX_TGID']) and ((pkt_time - _target_status[_target['TS']]['RX_TIME']) < STREAM_TO):
-                                    if self.STATUS[_stream_id]['CONTENTION'] == False:
-                                        self.STATUS[_stream_id]['CONTENTION'] = True
-                                        logger.info('(%s) Call not routed to TGID%s, matching call already active on target: HBSystem: %s, TS: %s, TGID: %s', self._system, int_id(_target['TGID']), _target['SYSTEM'], _target['TS'], int_id(_target_status[_target['TS']]['RX_TGID']))
-                                    continue
-                                if (_target['TGID'] == _target_status[_target['TS']]['TX_TGID']) and (_rf_src != _target_status[_target['TS']]['TX_RFS']) and ((pkt_time - _target_status[_target['TS']]['TX_TIME']) < STREAM_TO):
-                                    if self.STATUS[_stream_id]['CONTENTION'] == False:
-                                        self.STATUS[_stream_id]['CONTENTION'] = True
-                                        logger.info('(%s) Call not routed for subscriber %s, call route in progress on target: HBSystem: %s, TS: %s, TGID: %s, SUB: %s', self._system, int_id(_rf_src), _target['SYSTEM'], _target['TS'], int_id(_target_status[_target['TS']]['TX_TGID']), int_id(_target_status[_target['TS']]['TX_RFS']))
-                                    continue
-
-                                # Is this a new call stream?
-                                if (_target_status[_target['TS']]['TX_STREAM_ID'] != _stream_id):
-                                    # Record the DST TGID and Stream ID
-                                    _target_status[_target['TS']]['TX_START'] = pkt_time
-                                    _target_status[_target['TS']]['TX_TGID'] = _target['TGID']
-                                    _target_status[_target['TS']]['TX_STREAM_ID'] = _stream_id
-                                    _target_status[_target['TS']]['TX_RFS'] = _rf_src
-                                    _target_status[_target['TS']]['TX_PEER'] = _peer_id
-                                    # Generate LCs (full and EMB) for the TX stream
-                                    dst_lc = b''.join([self.STATUS[_stream_id]['LC'][0:3], _target['TGID'], _rf_src])
-                                    _target_status[_target['TS']]['TX_H_LC'] = bptc.encode_header_lc(dst_lc)
-                                    _target_status[_target['TS']]['TX_T_LC'] = bptc.encode_terminator_lc(dst_lc)
-                                    _target_status[_target['TS']]['TX_EMB_LC'] = bptc.encode_emblc(dst_lc)
-                                    logger.debug('(%s) Generating TX FULL and EMB LCs for HomeBrew destination: System: %s, TS: %s, TGID: %s', self._system, _target['SYSTEM'], _target['TS'], int_id(_target['TGID']))
-                                    logger.info('(%s) Conference Bridge: %s, Call Bridged to HBP System: %s TS: %s, TGID: %s', self._system, _bridge, _target['SYSTEM'], _target['TS'], int_id(_target['TGID']))
-                                    if CONFIG['REPORTS']['REPORT']:
-                                       systems[_target['SYSTEM']]._report.send_bridgeEvent('GROUP VOICE,START,TX,{},{},{},{},{},{}'.format(_target['SYSTEM'], int_id(_stream_id), int_id(_peer_id), int_id(_rf_src), _target['TS'], int_id(_target['TGID'])).encode(encoding='utf-8', errors='ignore'))
-
-                                # Set other values for the contention handler to test next time there is a frame to forward
-                                _target_status[_target['TS']]['TX_TIME'] = pkt_time
-                                _target_status[_target['TS']]['TX_TYPE'] = _dtype_vseq
-
-                                # Handle any necessary re-writes for the destination
-                                if _system['TS'] != _target['TS']:
-                                    _tmp_bits = _bits ^ 1 << 7
-                                else:
-                                    _tmp_bits = _bits
-
-                                # Assemble transmit HBP packet header
-                                _tmp_data = b''.join([_data[:8], _target['TGID'], _data[11:15], _tmp_bits.to_bytes(1, 'big'), _data[16:20]])
-
-                                # MUST TEST FOR NEW STREAM AND IF SO, RE-WRITE THE LC FOR THE TARGET
-                                # MUST RE-WRITE DESTINATION TGID IF DIFFERENT
-                                # if _dst_id != rule['DST_GROUP']:
-                                dmrbits = bitarray(endian='big')
-                                dmrbits.frombytes(dmrpkt)
-                                # Create a voice header packet (FULL LC)
-                                if _frame_type == HBPF_DATA_SYNC and _dtype_vseq == HBPF_SLT_VHEAD:
-                                    dmrbits = _target_status[_target['TS']]['TX_H_LC'][0:98] + dmrbits[98:166] + _target_status[_target['TS']]['TX_H_LC'][98:197]
-                                # Create a voice terminator packet (FULL LC)
-                                elif _frame_type == HBPF_DATA_SYNC and _dtype_vseq == HBPF_SLT_VTERM:
-                                    dmrbits = _target_status[_target['TS']]['TX_T_LC'][0:98] + dmrbits[98:166] + _target_status[_target['TS']]['TX_T_LC'][98:197]
-                                    if CONFIG['REPORTS']['REPORT']:
-                                        call_duration = pkt_time - _target_status[_target['TS']]['TX_START']
-                                        systems[_target['SYSTEM']]._report.send_bridgeEvent('GROUP VOICE,END,TX,{},{},{},{},{},{},{:.2f}'.format(_target['SYSTEM'], int_id(_stream_id), int_id(_peer_id), int_id(_rf_src), _target['TS'], int_id(_target['TGID']), call_duration).encode(encoding='utf-8', errors='ignore'))
-                                # Create a Burst B-E packet (Embedded LC)
-                                elif _dtype_vseq in [1,2,3,4]:
-                                    dmrbits = dmrbits[0:116] + _target_status[_target['TS']]['TX_EMB_LC'][_dtype_vseq] + dmrbits[148:264]
-                                dmrpkt = dmrbits.tobytes()
-                                _tmp_data = b''.join([_tmp_data, dmrpkt, b'\x00\x00']) # Add two bytes of nothing since OBP doesn't include BER & RSSI bytes #_data[53:55]
-
-                            # Transmit the packet to the destination system
-                            systems[_target['SYSTEM']].send_system(_tmp_data)
-                            #logger.debug('(%s) Packet routed by bridge: %s to system: %s TS: %s, TGID: %s', self._system, _bridge, _target['SYSTEM'], _target['TS'], int_id(_target['TGID']))
-
+        # Look up the rules this packet matches in the routing index
+        for _bridge, _system, _targets in ROUTES.get((self._system, _slot, _dst_id), ()):
+            for _target in _targets:
+                if _target['SYSTEM'] != self._system:
+                    route(_target['SYSTEM'], _target['TS'], _target['TGID'], self._system, _bridge, _system['TS'], self.STATUS[_stream_id]['LC'], False, _peer_id, _rf_src, _stream_id, _frame_type, _dtype_vseq, _data)
 
         # Final actions - Is this a voice terminator?
         if (_frame_type == HBPF_DATA_SYNC) and (_dtype_vseq == HBPF_SLT_VTERM):
@@ -1023,7 +1373,7 @@ class routerHBP(HBSYSTEM):
 
         # Status information for the system, TS1 & TS2
         # 1 & 2 are "timeslot"
-        # In TX_EMB_LC, 2-5 are burst B-E
+        # TX_LC holds the LC re-write templates for the stream, see mk_lc_templates()
         self.STATUS = {
             1: {
                 'RX_START':     time(),
@@ -1042,14 +1392,8 @@ class routerHBP(HBSYSTEM):
                 'RX_TYPE':      HBPF_SLT_VTERM,
                 'TX_TYPE':      HBPF_SLT_VTERM,
                 'RX_LC':        b'\x00',
-                'TX_H_LC':      b'\x00',
-                'TX_T_LC':      b'\x00',
-                'TX_EMB_LC': {
-                    1: b'\x00',
-                    2: b'\x00',
-                    3: b'\x00',
-                    4: b'\x00',
-                    }
+                'TX_LC':        None,
+                'TX_REFUSED':   b'\x00',
                 },
             2: {
                 'RX_START':     time(),
@@ -1068,21 +1412,14 @@ class routerHBP(HBSYSTEM):
                 'RX_TYPE':      HBPF_SLT_VTERM,
                 'TX_TYPE':      HBPF_SLT_VTERM,
                 'RX_LC':        b'\x00',
-                'TX_H_LC':      b'\x00',
-                'TX_T_LC':      b'\x00',
-                'TX_EMB_LC': {
-                    1: b'\x00',
-                    2: b'\x00',
-                    3: b'\x00',
-                    4: b'\x00',
-                    }
+                'TX_LC':        None,
+                'TX_REFUSED':   b'\x00',
                 }
             }
     def group_received(self, _peer_id, _rf_src, _dst_id, _seq, _slot, _frame_type, _dtype_vseq, _stream_id, _data):
         global UNIT_MAP
         pkt_time = time()
         dmrpkt = _data[20:53]
-        _bits = _data[15]
 
         # Make/update an entry in the UNIT_MAP for this subscriber
         UNIT_MAP[_rf_src] = (self.name, pkt_time)
@@ -1099,7 +1436,7 @@ class routerHBP(HBSYSTEM):
             # This is a new call stream
 
             # Send subscriber ID over OBP
-            svrd_send_all(b'UNIT' + _rf_src)
+            svrd_send_unit(_rf_src)
             
             self.STATUS[_slot]['RX_START'] = pkt_time
             logger.info('(%s) *GROUP CALL START* STREAM ID: %s SUB: %s (%s) PEER: %s (%s) TGID %s (%s), TS %s', \
@@ -1125,156 +1462,11 @@ class routerHBP(HBSYSTEM):
 ##                user_rules[_rf_src] = self.name
 ####                print('updated')
 ####        print(user_rules)
-        for _bridge in BRIDGES:
-##            print(BRIDGES)
-##            print(_bridge)
-            # Match bridge name here
-            for _system in BRIDGES[_bridge]:
-##                print(_system)
-                # Modify rule here for indiv system
-                if (_system['SYSTEM'] == self._system and _system['TGID'] == _dst_id and _system['TS'] == _slot and _system['ACTIVE'] == True):
-
-                    for _target in BRIDGES[_bridge]:
-                        if _target['SYSTEM'] != self._system or (_target['SYSTEM'] == self._system and _target['TS'] != _slot):
-                            if _target['ACTIVE']:
-                                _target_status = systems[_target['SYSTEM']].STATUS
-                                _target_system = self._CONFIG['SYSTEMS'][_target['SYSTEM']]
-
-                                if _target_system['MODE'] == 'OPENBRIDGE':
-                                    # Is this a new call stream on the target?
-                                    if (_stream_id not in _target_status):
-                                        # This is a new call stream on the target
-                                        _target_status[_stream_id] = {
-                                            'START':     pkt_time,
-                                            'CONTENTION':False,
-                                            'RFS':       _rf_src,
-                                            'TYPE':     'GROUP',
-                                            'DST':      _dst_id,
-                                            'ACTIVE':   True,
-                                        }
-                                        # Generate LCs (full and EMB) for the TX stream
-                                        dst_lc = b''.join([self.STATUS[_slot]['RX_LC'][0:3], _target['TGID'], _rf_src])
-                                        _target_status[_stream_id]['H_LC'] = bptc.encode_header_lc(dst_lc)
-                                        _target_status[_stream_id]['T_LC'] = bptc.encode_terminator_lc(dst_lc)
-                                        _target_status[_stream_id]['EMB_LC'] = bptc.encode_emblc(dst_lc)
-
-                                        logger.info('(%s) Conference Bridge: %s, Call Bridged to OBP System: %s TS: %s, TGID: %s', self._system, _bridge, _target['SYSTEM'], _target['TS'], int_id(_target['TGID']))
-                                        if CONFIG['REPORTS']['REPORT']:
-                                            systems[_target['SYSTEM']]._report.send_bridgeEvent('GROUP VOICE,START,TX,{},{},{},{},{},{}'.format(_target['SYSTEM'], int_id(_stream_id), int_id(_peer_id), int_id(_rf_src), _target['TS'], int_id(_target['TGID'])).encode(encoding='utf-8', errors='ignore'))
-
-                                    # Record the time of this packet so we can later identify a stale stream
-                                    _target_status[_stream_id]['LAST'] = pkt_time
-                                    # Clear the TS bit -- all OpenBridge streams are effectively on TS1
-                                    _tmp_bits = _bits & ~(1 << 7)
-
-                                    # Assemble transmit HBP packet header
-                                    _tmp_data = b''.join([_data[:8], _target['TGID'], _data[11:15], _tmp_bits.to_bytes(1, 'big'), _data[16:20]])
-
-                                    # MUST TEST FOR NEW STREAM AND IF SO, RE-WRITE THE LC FOR THE TARGET
-                                    # MUST RE-WRITE DESTINATION TGID IF DIFFERENT
-                                    # if _dst_id != rule['DST_GROUP']:
-                                    dmrbits = bitarray(endian='big')
-                                    dmrbits.frombytes(dmrpkt)
-                                    # Create a voice header packet (FULL LC)
-                                    if _frame_type == HBPF_DATA_SYNC and _dtype_vseq == HBPF_SLT_VHEAD:
-                                        dmrbits = _target_status[_stream_id]['H_LC'][0:98] + dmrbits[98:166] + _target_status[_stream_id]['H_LC'][98:197]
-                                    # Create a voice terminator packet (FULL LC)
-                                    elif _frame_type == HBPF_DATA_SYNC and _dtype_vseq == HBPF_SLT_VTERM:
-                                        dmrbits = _target_status[_stream_id]['T_LC'][0:98] + dmrbits[98:166] + _target_status[_stream_id]['T_LC'][98:197]
-                                        if CONFIG['REPORTS']['REPORT']:
-                                            call_duration = pkt_time - _target_status[_stream_id]['START']
-                                            _target_status[_stream_id]['ACTIVE'] = False
-                                            systems[_target['SYSTEM']]._report.send_bridgeEvent('GROUP VOICE,END,TX,{},{},{},{},{},{},{:.2f}'.format(_target['SYSTEM'], int_id(_stream_id), int_id(_peer_id), int_id(_rf_src), _target['TS'], int_id(_target['TGID']), call_duration).encode(encoding='utf-8', errors='ignore'))
-                                    # Create a Burst B-E packet (Embedded LC)
-                                    elif _dtype_vseq in [1,2,3,4]:
-                                        dmrbits = dmrbits[0:116] + _target_status[_stream_id]['EMB_LC'][_dtype_vseq] + dmrbits[148:264]
-                                    dmrpkt = dmrbits.tobytes()
-                                    _tmp_data = b''.join([_tmp_data, dmrpkt])
-
-                                else:
-                                    # BEGIN STANDARD CONTENTION HANDLING
-                                    #
-                                    # The rules for each of the 4 "ifs" below are listed here for readability. The Frame To Send is:
-                                    #   From a different group than last RX from this HBSystem, but it has been less than Group Hangtime
-                                    #   From a different group than last TX to this HBSystem, but it has been less than Group Hangtime
-                                    #   From the same group as the last RX from this HBSystem, but from a different subscriber, and it has been less than stream timeout
-                                    #   From the same group as the last TX to this HBSystem, but from a different subscriber, and it has been less than stream timeout
-                                    # The "continue" at the end of each means the next iteration of the for loop that tests for matching rules
-                                    #
-                                    if ((_target['TGID'] != _target_status[_target['TS']]['RX_TGID']) and ((pkt_time - _target_status[_target['TS']]['RX_TIME']) < _target_system['GROUP_HANGTIME'])):
-                                        if _frame_type == HBPF_DATA_SYNC and _dtype_vseq == HBPF_SLT_VHEAD and self.STATUS[_slot]['RX_STREAM_ID'] != _stream_id:
-                                            logger.info('(%s) Call not routed to TGID %s, target active or in group hangtime: HBSystem: %s, TS: %s, TGID: %s', self._system, int_id(_target['TGID']), _target['SYSTEM'], _target['TS'], int_id(_target_status[_target['TS']]['RX_TGID']))
-                                        continue
-                                    if ((_target['TGID'] != _target_status[_target['TS']]['TX_TGID']) and ((pkt_time - _target_status[_target['TS']]['TX_TIME']) < _target_system['GROUP_HANGTIME'])):
-                                        if _frame_type == HBPF_DATA_SYNC and _dtype_vseq == HBPF_SLT_VHEAD and self.STATUS[_slot]['RX_STREAM_ID'] != _stream_id:
-                                            logger.info('(%s) Call not routed to TGID%s, target in group hangtime: HBSystem: %s, TS: %s, TGID: %s', self._system, int_id(_target['TGID']), _target['SYSTEM'], _target['TS'], int_id(_target_status[_target['TS']]['TX_TGID']))
-                                        continue
-                                    if (_target['TGID'] == _target_status[_target['TS']]['RX_TGID']) and ((pkt_time - _target_status[_target['TS']]['RX_TIME']) < STREAM_TO):
-                                        if _frame_type == HBPF_DATA_SYNC and _dtype_vseq == HBPF_SLT_VHEAD and self.STATUS[_slot]['RX_STREAM_ID'] != _stream_id:
-                                            logger.info('(%s) Call not routed to TGID%s, matching call already active on target: HBSystem: %s, TS: %s, TGID: %s', self._system, int_id(_target['TGID']), _target['SYSTEM'], _target['TS'], int_id(_target_status[_target['TS']]['RX_TGID']))
-                                        continue
-                                    if (_target['TGID'] == _target_status[_target['TS']]['TX_TGID']) and (_rf_src != _target_status[_target['TS']]['TX_RFS']) and ((pkt_time - _target_status[_target['TS']]['TX_TIME']) < STREAM_TO):
-                                        if _frame_type == HBPF_DATA_SYNC and _dtype_vseq == HBPF_SLT_VHEAD and self.STATUS[_slot]['RX_STREAM_ID'] != _stream_id:
-                                            logger.info('(%s) Call not routed for subscriber %s, call route in progress on target: HBSystem: %s, TS: %s, TGID: %s, SUB: %s', self._system, int_id(_rf_src), _target['SYSTEM'], _target['TS'], int_id(_target_status[_target['TS']]['TX_TGID']), int_id(_target_status[_target['TS']]['TX_RFS']))
-                                        continue
-
-                                    # Is this a new call stream?
-                                    if (_stream_id != self.STATUS[_slot]['RX_STREAM_ID']):
-                                        # Record the DST TGID and Stream ID
-                                        _target_status[_target['TS']]['TX_START'] = pkt_time
-                                        _target_status[_target['TS']]['TX_TGID'] = _target['TGID']
-                                        _target_status[_target['TS']]['TX_STREAM_ID'] = _stream_id
-                                        _target_status[_target['TS']]['TX_RFS'] = _rf_src
-                                        _target_status[_target['TS']]['TX_PEER'] = _peer_id
-                                        # Generate LCs (full and EMB) for the TX stream
-                                        dst_lc = self.STATUS[_slot]['RX_LC'][0:3] + _target['TGID'] + _rf_src
-                                        _target_status[_target['TS']]['TX_H_LC'] = bptc.encode_header_lc(dst_lc)
-                                        _target_status[_target['TS']]['TX_T_LC'] = bptc.encode_terminator_lc(dst_lc)
-                                        _target_status[_target['TS']]['TX_EMB_LC'] = bptc.encode_emblc(dst_lc)
-                                        logger.debug('(%s) Generating TX FULL and EMB LCs for HomeBrew destination: System: %s, TS: %s, TGID: %s', self._system, _target['SYSTEM'], _target['TS'], int_id(_target['TGID']))
-                                        logger.info('(%s) Conference Bridge: %s, Call Bridged to HBP System: %s TS: %s, TGID: %s', self._system, _bridge, _target['SYSTEM'], _target['TS'], int_id(_target['TGID']))
-                                        if CONFIG['REPORTS']['REPORT']:
-                                            systems[_target['SYSTEM']]._report.send_bridgeEvent('GROUP VOICE,START,TX,{},{},{},{},{},{}'.format(_target['SYSTEM'], int_id(_stream_id), int_id(_peer_id), int_id(_rf_src), _target['TS'], int_id(_target['TGID'])).encode(encoding='utf-8', errors='ignore'))
-
-                                    # Set other values for the contention handler to test next time there is a frame to forward
-                                    _target_status[_target['TS']]['TX_TIME'] = pkt_time
-                                    _target_status[_target['TS']]['TX_TYPE'] = _dtype_vseq
-
-                                    # Handle any necessary re-writes for the destination
-                                    if _system['TS'] != _target['TS']:
-                                        _tmp_bits = _bits ^ 1 << 7
-                                    else:
-                                        _tmp_bits = _bits
-
-                                    # Assemble transmit HBP packet header
-                                    _tmp_data = b''.join([_data[:8], _target['TGID'], _data[11:15], _tmp_bits.to_bytes(1, 'big'), _data[16:20]])
-
-                                    dmrbits = bitarray(endian='big')
-                                    dmrbits.frombytes(dmrpkt)
-                                    # Create a voice header packet (FULL LC)
-                                    if _frame_type == HBPF_DATA_SYNC and _dtype_vseq == HBPF_SLT_VHEAD:
-                                        dmrbits = _target_status[_target['TS']]['TX_H_LC'][0:98] + dmrbits[98:166] + _target_status[_target['TS']]['TX_H_LC'][98:197]
-                                    # Create a voice terminator packet (FULL LC)
-                                    elif _frame_type == HBPF_DATA_SYNC and _dtype_vseq == HBPF_SLT_VTERM:
-                                        dmrbits = _target_status[_target['TS']]['TX_T_LC'][0:98] + dmrbits[98:166] + _target_status[_target['TS']]['TX_T_LC'][98:197]
-                                        if CONFIG['REPORTS']['REPORT']:
-                                            call_duration = pkt_time - _target_status[_target['TS']]['TX_START']
-                                            systems[_target['SYSTEM']]._report.send_bridgeEvent('GROUP VOICE,END,TX,{},{},{},{},{},{},{:.2f}'.format(_target['SYSTEM'], int_id(_stream_id), int_id(_peer_id), int_id(_rf_src), _target['TS'], int_id(_target['TGID']), call_duration).encode(encoding='utf-8', errors='ignore'))
-                                    # Create a Burst B-E packet (Embedded LC)
-                                    elif _dtype_vseq in [1,2,3,4]:
-                                        dmrbits = dmrbits[0:116] + _target_status[_target['TS']]['TX_EMB_LC'][_dtype_vseq] + dmrbits[148:264]
-                                    dmrpkt = dmrbits.tobytes()
-                                    _tmp_data = b''.join([_tmp_data, dmrpkt, _data[53:55]])
-
-                                # Transmit the packet to the destination system
-                                systems[_target['SYSTEM']].send_system(_tmp_data)
-                                #logger.debug('(%s) Packet routed by bridge: %s to system: %s TS: %s, TGID: %s', self._system, _bridge, _target['SYSTEM'], _target['TS'], int_id(_target['TGID']))
-                                
-                                if _target_system['MODE'] == 'OPENBRIDGE':
-                                    if (_frame_type == HBPF_DATA_SYNC) and (_dtype_vseq == HBPF_SLT_VTERM) and (self.STATUS[_slot]['RX_TYPE'] != HBPF_SLT_VTERM):
-                                        if (_stream_id in _target_status):
-                                            _target_status.pop(_stream_id)
-
+        # Look up the rules this packet matches in the routing index
+        _end = (_frame_type == HBPF_DATA_SYNC) and (_dtype_vseq == HBPF_SLT_VTERM) and (self.STATUS[_slot]['RX_TYPE'] != HBPF_SLT_VTERM)
+        for _bridge, _system, _targets in ROUTES.get((self._system, _slot, _dst_id), ()):
+            for _target in _targets:
+                route(_target['SYSTEM'], _target['TS'], _target['TGID'], self._system, _bridge, _system['TS'], self.STATUS[_slot]['RX_LC'], _end, _peer_id, _rf_src, _stream_id, _frame_type, _dtype_vseq, _data)
 
         # Final actions - Is this a voice terminator?
         if (_frame_type == HBPF_DATA_SYNC) and (_dtype_vseq == HBPF_SLT_VTERM) and (self.STATUS[_slot]['RX_TYPE'] != HBPF_SLT_VTERM):
@@ -1289,10 +1481,12 @@ class routerHBP(HBSYSTEM):
             #
 
             # Iterate the rules dictionary
-
+            _changed = set()
+            _shared = []
             for _bridge in BRIDGES:
                 for _system in BRIDGES[_bridge]:
                     if _system['SYSTEM'] == self._system:
+                        _before = (_system['ACTIVE'], _system['TIMER'])
 ##                        # Insert POST for TG timer update?
 ##                        print(_system)
 ##                        print()
@@ -1315,6 +1509,7 @@ class routerHBP(HBSYSTEM):
                                 if _system['ACTIVE'] == False:
                                     _system['ACTIVE'] = True
                                     _system['TIMER'] = pkt_time + _system['TIMEOUT']
+                                    _changed.add(_bridge)
 
                                     logger.info('(%s) Bridge: %s, connection changed to state: %s', self._system, _bridge, _system['ACTIVE'])
                                     # Cancel the timer if we've enabled an "OFF" type timeout
@@ -1332,6 +1527,7 @@ class routerHBP(HBSYSTEM):
                             if _dst_id in _system['OFF']:
                                 if _system['ACTIVE'] == True:
                                     _system['ACTIVE'] = False
+                                    _changed.add(_bridge)
                                     logger.info('(%s) Bridge: %s, connection changed to state: %s', self._system, _bridge, _system['ACTIVE'])
                                     # POST off
                                     #update_tg(CONFIG, 'off', 0, [{'SYSTEM':_system['SYSTEM']}, {'ts':_system['TS']}, {'tg': int_id(_system['TGID'])}])
@@ -1349,6 +1545,15 @@ class routerHBP(HBSYSTEM):
                                 _system['TIMER'] = pkt_time
                                 logger.info('(%s) Bridge: %s set to ON with and "OFF" timer rule: timeout timer cancelled', self._system, _bridge)
 
+                        # Only rules this call changed go to the other workers
+                        if (_system['ACTIVE'], _system['TIMER']) != _before:
+                            _shared.append((_bridge, _system))
+
+            # Keep the routing index in step with any ON/OFF changes
+            for _bridge in _changed:
+                index_bridge(_bridge)
+            share_rules(_shared)
+
         #
         # END IN-BAND SIGNALLING
         #
@@ -1376,7 +1581,7 @@ class routerHBP(HBSYSTEM):
         
         
         # Is this a new call stream?
-        svrd_send_all(b'UNIT' + _rf_src)
+        svrd_send_unit(_rf_src)
         
         if (_stream_id != self.STATUS[_slot]['RX_STREAM_ID']):
             
@@ -1397,7 +1602,7 @@ class routerHBP(HBSYSTEM):
                 self._targets.remove(self._system)
             
             # This is a new call stream, so log & report
-            svrd_send_all(b'UNIT' + _rf_src)
+            svrd_send_unit(_rf_src)
             self.STATUS[_slot]['RX_START'] = pkt_time
             logger.info('(%s) *UNIT CALL START* STREAM ID: %s SUB: %s (%s) PEER: %s (%s) UNIT: %s (%s), TS: %s, FORWARD: %s', \
                     self._system, int_id(_stream_id), get_alias(_rf_src, subscriber_ids), int_id(_rf_src), get_alias(_peer_id, peer_ids), int_id(_peer_id), get_alias(_dst_id, talkgroup_ids), int_id(_dst_id), _slot, self._targets)
@@ -1562,6 +1767,10 @@ if __name__ == '__main__':
     parser.add_argument('-c', '--config', action='store', dest='CONFIG_FILE', help='/full/path/to/config.file (usually hbnet.cfg)')
     parser.add_argument('-r', '--rules', action='store', dest='RULES_FILE', help='/full/path/to/rules.file (usually rules.py)')
     parser.add_argument('-l', '--logging', action='store', dest='LOG_LEVEL', help='Override config file logging level.')
+    parser.add_argument('-w', '--workers', action='store', dest='WORKERS', type=int, default=1, help='Number of worker processes to share the systems between.')
+    parser.add_argument('--worker', action='store', dest='WORKER', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('-b', '--batch-udp', action='store_true', dest='BATCH_UDP', help='Send and receive DMRD in batches with sendmmsg/recvmmsg where available.')
+    parser.add_argument('-i', '--rules-interval', action='store', dest='RULES_INTERVAL', type=float, default=RULES_CHECK_INTERVAL, help='Seconds between checks for new rules.')
     cli_args = parser.parse_args()
 
     # Ensure we have a path for the config file, if one wasn't specified, then use the default (top of file)
@@ -1589,6 +1798,23 @@ if __name__ == '__main__':
     logger.info('\n\nCopyright (c) 2013, 2014, 2015, 2016, 2018, 2019, 2020\n\tThe Regents of the K0USY Group. All rights reserved.\n')
     logger.debug('(GLOBAL) Logging system started, anything from here on gets logged')
 
+    # With more than one worker, this process only looks after the workers
+    if cli_args.WORKERS > 1 and cli_args.WORKER == None:
+        supervise(cli_args.WORKERS)
+        sys.exit(0)
+
+    # Set up the link to the other workers, systems are assigned once proxies are expanded
+    if cli_args.WORKER != None:
+        SHARD = ShardLink(cli_args.WORKER, cli_args.WORKERS, {
+            'PACKET': packet_received,
+            'ROUTE': route_group,
+            'RULES': rules_received,
+            'UNITS': units_received,
+            'REPORT': report_received
+            })
+        SHARD.listen()
+        logger.info('(SHARD) Running as worker %s of %s', cli_args.WORKER, cli_args.WORKERS)
+
     # Set up the signal handler
     def sig_handler(_signal, _frame):
         logger.info('(GLOBAL) SHUTDOWN: CONFBRIDGE IS TERMINATING WITH SIGNAL %s', str(_signal))
@@ -1606,7 +1832,10 @@ if __name__ == '__main__':
 
     # INITIALIZE THE REPORTING LOOP
     if CONFIG['REPORTS']['REPORT']:
-        report_server = config_reports(CONFIG, bridgeReportFactory)
+        if lead_worker():
+            report_server = config_reports(CONFIG, bridgeReportFactory)
+        else:
+            report_server = ShardReport(SHARD)
     else:
         report_server = None
         logger.info('(REPORT) TCP Socket reporting not configured')
@@ -1620,13 +1849,11 @@ if __name__ == '__main__':
         if CONFIG['SYSTEMS'][i]['ENABLED'] == True:
             if CONFIG['SYSTEMS'][i]['MODE'] == 'PROXY':
                 proxy_master_list.append(i)
-    # Start proxy as a thread (if enabled in config) for each set of MASTERs
+    # Start proxy (if enabled in config) for each set of MASTERs
     for m in proxy_master_list:
-        if CONFIG['SYSTEMS'][m]['EXTERNAL_PROXY_SCRIPT'] == False:
-            proxy_thread = threading.Thread(target=hotspot_proxy, args=(CONFIG['SYSTEMS'][m]['EXTERNAL_PORT'],CONFIG['SYSTEMS'][m]['INTERNAL_PORT_START'],CONFIG['SYSTEMS'][m]['INTERNAL_PORT_STOP'],))
-            proxy_thread.daemon = True
-            proxy_thread.start()
-            logger.info('Started thread for PROXY for MASTER set: ' + m)
+        if CONFIG['SYSTEMS'][m]['EXTERNAL_PROXY_SCRIPT'] == False and lead_worker():
+            hotspot_proxy(CONFIG['SYSTEMS'][m]['EXTERNAL_PORT'],CONFIG['SYSTEMS'][m]['INTERNAL_PORT_START'],CONFIG['SYSTEMS'][m]['INTERNAL_PORT_STOP'])
+            logger.info('Started PROXY for MASTER set: ' + m)
                 
     #Build Master configs from list
     for i in proxy_master_list:
@@ -1663,30 +1890,31 @@ if __name__ == '__main__':
             remote_config = download_rules(LOCAL_CONFIG, cli_args.CONFIG_FILE)
             # Build the routing rules file
             BRIDGES = make_bridges(remote_config[1], True) #make_bridges(rules_module.BRIDGES)
+            rules_source = remote_config[1]
             # Get rule parameter for private calls
             UNIT = remote_config[0]
             unit_flood_time = CONFIG['OTHER']['UNIT_TIME']
+            remote_rules = True
         except Exception as e:
             logger.error('Control server unreachable or other error. Using local config.')
             logger.error(e)
-            spec = importlib.util.spec_from_file_location("module.name", cli_args.RULES_FILE)
-            rules_module = importlib.util.module_from_spec(spec)
+            remote_rules = False
             try:
-                spec.loader.exec_module(rules_module)
+                rules_module = load_rules_file(cli_args.RULES_FILE)
                 logger.info('(ROUTER) Routing bridges file found and bridges imported: %s', cli_args.RULES_FILE)
             except (ImportError, FileNotFoundError):
                 sys.exit('(ROUTER) TERMINATING: Routing bridges file not found or invalid: {}'.format(cli_args.RULES_FILE))
             # Build the routing rules file
             BRIDGES = make_bridges(rules_module.BRIDGES, False)
+            rules_source = rules_module.BRIDGES
             # Get rule parameter for private calls
             UNIT = gen_proxy_unit(rules_module.UNIT)
             unit_flood_time = rules_module.FLOOD_TIMEOUT
 
     else:
-        spec = importlib.util.spec_from_file_location("module.name", cli_args.RULES_FILE)
-        rules_module = importlib.util.module_from_spec(spec)
+        remote_rules = False
         try:
-            spec.loader.exec_module(rules_module)
+            rules_module = load_rules_file(cli_args.RULES_FILE)
             logger.info('(ROUTER) Routing bridges file found and bridges imported: %s', cli_args.RULES_FILE)
         except (ImportError, FileNotFoundError):
             sys.exit('(ROUTER) TERMINATING: Routing bridges file not found or invalid: {}'.format(cli_args.RULES_FILE))
@@ -1695,17 +1923,39 @@ if __name__ == '__main__':
 ##        print(rules_module.BRIDGES)
         # Build the routing rules file
         BRIDGES = make_bridges(rules_module.BRIDGES, False)
+        rules_source = rules_module.BRIDGES
         # Get rule parameter for private calls
         UNIT = gen_proxy_unit(rules_module.UNIT)
         unit_flood_time = rules_module.FLOOD_TIMEOUT
 
+    # Build the routing index from the rules we ended up with
+    build_routes()
+    rules_loaded(rules_source)
+
+    if SHARD:
+        SHARD.assign(CONFIG['SYSTEMS'])
+
+    # UDP ports for the systems, batched if asked for and the platform can do it
+    if cli_args.BATCH_UDP and batch_udp.HAVE_MMSG:
+        listenUDP = batch_udp.listenUDP
+        logger.info('(GLOBAL) Using sendmmsg/recvmmsg for system UDP ports')
+    else:
+        listenUDP = reactor.listenUDP
+        if cli_args.BATCH_UDP:
+            logger.warning('(GLOBAL) sendmmsg/recvmmsg not available on this platform, using normal UDP ports')
+
     for system in CONFIG['SYSTEMS']:
         if CONFIG['SYSTEMS'][system]['ENABLED']:
             if CONFIG['SYSTEMS'][system]['MODE'] == 'OPENBRIDGE':
                 systems[system] = routerOBP(system, CONFIG, report_server)
             else:
                 systems[system] = routerHBP(system, CONFIG, report_server)
-            reactor.listenUDP(CONFIG['SYSTEMS'][system]['PORT'], systems[system], interface=CONFIG['SYSTEMS'][system]['IP'])
+            # Systems owned by other workers are kept to route to, but anything sent to them
+            # goes to the worker that owns them
+            if SHARD and not SHARD.owns(system):
+                systems[system].send_system = partial(SHARD.forward, system)
+                continue
+            listenUDP(CONFIG['SYSTEMS'][system]['PORT'], systems[system], interface=CONFIG['SYSTEMS'][system]['IP'])
             logger.debug('(GLOBAL) %s instance created: %s, %s', CONFIG['SYSTEMS'][system]['MODE'], system, systems[system])
 
     def loopingErrHandle(failure):
@@ -1718,15 +1968,33 @@ if __name__ == '__main__':
     rule_timer = rule_timer_task.start(60)
     rule_timer.addErrback(loopingErrHandle)
 
+    # Pick up changed rules without a restart. Each worker checks for itself, rules that are
+    # kept keep their state, so the workers still agree.
+    rules_task = task.LoopingCall(rules_loop, cli_args.RULES_FILE, remote_rules)
+    rules_check = rules_task.start(cli_args.RULES_INTERVAL, now=False)
+    rules_check.addErrback(loopingErrHandle)
+
     # Initialize the stream trimmer
     stream_trimmer_task = task.LoopingCall(stream_trimmer_loop)
     stream_trimmer = stream_trimmer_task.start(5)
     stream_trimmer.addErrback(loopingErrHandle)
 
+    # Announce subscribers heard since the last run to other HBNet servers
+    svrd_unit_task = task.LoopingCall(svrd_unit_loop)
+    svrd_unit = svrd_unit_task.start(SVRD_UNIT_INTERVAL)
+    svrd_unit.addErrback(loopingErrHandle)
+
     # Used for misc timing events
-    ten_loop_task = task.LoopingCall(ten_loop_func)
-    ten_loop = ten_loop_task.start(600)
-    ten_loop.addErrback(loopingErrHandle)
+    if lead_worker():
+        ten_loop_task = task.LoopingCall(ten_loop_func)
+        ten_loop = ten_loop_task.start(600)
+        ten_loop.addErrback(loopingErrHandle)
+
+    # Keep the other workers up to date with the subscribers we've heard
+    if SHARD:
+        shard_task = task.LoopingCall(shard_loop)
+        shard = shard_task.start(1)
+        shard.addErrback(loopingErrHandle)
 
     logger.info('UNIT calls will be bridged to: ' + str(UNIT))
 ##    print(CONFIG)
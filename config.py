@@ -31,6 +31,7 @@ import sys
 import const
 
 from socket import gethostbyname
+from bisect import bisect_right
 
 # Does anybody read this stuff? There's a PEP somewhere that says I should do this.
 __author__     = 'Cortney T. Buffington, N0MJS'
@@ -52,20 +53,68 @@ def process_acls(_config):
 
     # System level ACLs
     for system in _config['SYSTEMS']:
-        # Registration ACLs (which make no sense for peer systems)
-        if _config['SYSTEMS'][system]['MODE'] == 'MASTER':
+        # Registration ACLs (which make no sense for peer systems). A PROXY's is copied to each
+        # MASTER made from it.
+        if _config['SYSTEMS'][system]['MODE'] == 'MASTER' or _config['SYSTEMS'][system]['MODE'] == 'PROXY':
             _config['SYSTEMS'][system]['REG_ACL'] = acl_build(_config['SYSTEMS'][system]['REG_ACL'], const.PEER_MAX)
 
         # Subscriber and TGID ACLs (valid for all system types)
         for acl in ['SUB_ACL', 'TG1_ACL', 'TG2_ACL']:
             _config['SYSTEMS'][system][acl] = acl_build(_config['SYSTEMS'][system][acl], const.ID_MAX)
 
+# Number of IDs each ACL remembers the verdict for before the cache is flushed
+ACL_CACHE_SIZE = 4096
+
+# A compiled ACL. It is still the (action, ranges) tuple everything else expects, but
+# the ranges are sorted and merged so check() can find an ID with a bisect instead of
+# scanning the list, and recent verdicts are cached for the IDs that are heard often.
+class ACL(tuple):
+    def __new__(cls, _action, _ranges):
+        _merged = []
+        for _start, _end in sorted(_ranges):
+            # A backwards range never matched anything, don't let it swallow others
+            if _start > _end:
+                continue
+            if _merged and _start <= _merged[-1][1] + 1:
+                if _end > _merged[-1][1]:
+                    _merged[-1] = (_merged[-1][0], _end)
+            else:
+                _merged.append((_start, _end))
+
+        self = tuple.__new__(cls, (_action, _merged))
+        self._starts = [_range[0] for _range in _merged]
+        self._ends = [_range[1] for _range in _merged]
+        self._cache = {}
+        return self
+
+    # Pickle (reports to the monitor) and copy as a plain tuple
+    def __reduce__(self):
+        return (tuple, (tuple(self),))
+
+    # Returns the action (True|False) if the integer ID matches, the opposite if not
+    def check(self, _id):
+        try:
+            return self._cache[_id]
+        except KeyError:
+            pass
+
+        _i = bisect_right(self._starts, _id) - 1
+        if _i >= 0 and _id <= self._ends[_i]:
+            _verdict = self[0]
+        else:
+            _verdict = not self[0]
+
+        if len(self._cache) >= ACL_CACHE_SIZE:
+            self._cache.clear()
+        self._cache[_id] = _verdict
+        return _verdict
+
 # Create an access control list that is programatically useable from human readable:
 # ORIGINAL:  'DENY:1-5,3120101,3120124'
-# PROCESSED: (False, set([(1, 5), (3120124, 3120124), (3120101, 3120101)]))
+# PROCESSED: ACL(False, [(1, 5), (3120101, 3120101), (3120124, 3120124)])
 def acl_build(_acl, _max):
     if not _acl:
-        return(True, set((const.ID_MIN, _max)))
+        return ACL(True, [(const.ID_MIN, _max)])
 
     acl = [] #set()
     if type(_acl) == tuple:
@@ -96,7 +145,7 @@ def acl_build(_acl, _max):
             else:
                  sys.exit('ACL CREATION ERROR, VALUE OUT OF RANGE ({} - {}) IN SINGLE ID ENTRY: {}'.format(const.ID_MIN, _max, entry))
 
-    return (action, acl)
+    return ACL(action, acl)
 
 def build_config(_config_file):
     config = configparser.ConfigParser()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+#
+###############################################################################
+#   Copyright (C) 2020-2021 Eric, KF7EEL, <kf7eel@qsl.net>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+Data message reassembly in data_gateway.py with SENDERS radios sending at
+once. Each sends one message of 1 to MAX_BLOCKS blocks, encoded into MMDVM
+packets the way data_gateway sends SMS (dmr_encode, mmdvm_encapsulate). The
+packets of all the senders are shuffled together, each sender's still in
+order, and put through bptc_decode and the assembly engine the way
+data_received does. Every message must come out intact, and nothing may be
+left assembling. Packets decoded and reassembled per second are reported.
+
+    python3 data_assembly_bench.py -n 1000
+'''
+
+import sys
+import random
+import argparse
+from time import time, perf_counter
+
+from bitarray.util import ba2int as ba2num
+
+import data_gateway
+from data_gateway import bptc_decode, assembly_start, assembly_add, dmr_encode, mmdvm_encapsulate, DATA_ASSEMBLY, DATA_BLOCK_BYTES
+
+__author__     = 'Eric Craw, KF7EEL'
+__copyright__  = 'Copyright (c) 2020-2021, Eric Craw, KF7EEL'
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Eric Craw, KF7EEL'
+__email__      = 'kf7eel@qsl.net'
+
+# Most blocks in one message, after the header
+MAX_BLOCKS = 20
+# Destination of every message
+DATA_ID = 9099
+
+
+# The MMDVM packets for one message from _src: a data header saying how many blocks
+# follow (bits 65 - 71), then the message 12 bytes to a block
+def message_packets(_src, _message):
+    _blocks = [_message[_n:_n + DATA_BLOCK_BYTES] for _n in range(0, len(_message), DATA_BLOCK_BYTES)]
+    _header = bytes(8) + bytes([len(_blocks)]) + bytes(3)
+    _packets = []
+    for _seq, _burst in enumerate(dmr_encode([_header] + _blocks, 0)):
+        _packets.append(mmdvm_encapsulate('{:06x}'.format(DATA_ID), '{:06x}'.format(_src), '{:08x}'.format(_src), _seq, 1, 1, 7 if _seq else 6, _src, _burst))
+    return _packets
+
+
+# What data_received does with a packet, returns a finished message or None
+def receive(_data, _now):
+    _dtype_vseq = _data[15] & 0xF
+    _key = (_data[5:8], _data[8:11], 1 if _data[15] & 0x80 else 0, _data[16:20])
+    _block = bptc_decode(_data)
+    if _dtype_vseq == 6:
+        assembly_start(_key, ba2num(_block[65:72]), _now)
+    elif _dtype_vseq == 7:
+        return _key[0], assembly_add(_key, _block.tobytes(), _now)
+    return None, None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--senders', action='store', dest='SENDERS', type=int, default=1000, help='Radios sending at the same time.')
+    cli_args = parser.parse_args()
+
+    if cli_args.SENDERS > data_gateway.DATA_ASSEMBLY_MAX:
+        sys.exit('At most {} messages are assembled at once'.format(data_gateway.DATA_ASSEMBLY_MAX))
+
+    random.seed(1)
+    sent = {}
+    queues = []
+    for src in range(3120000, 3120000 + cli_args.SENDERS):
+        sent[src.to_bytes(3, 'big')] = bytes(random.getrandbits(8) for _n in range(DATA_BLOCK_BYTES * random.randint(1, MAX_BLOCKS)))
+        queues.append(message_packets(src, sent[src.to_bytes(3, 'big')]))
+
+    # Pick a random sender for every packet, so each sender's packets stay in order
+    packets = []
+    order = [_n for _n, _queue in enumerate(queues) for _packet in _queue]
+    random.shuffle(order)
+    for n in order:
+        packets.append(queues[n].pop(0))
+
+    received = {}
+    now = time()
+    start = perf_counter()
+    for data in packets:
+        src, message = receive(data, now)
+        if message != None:
+            received[src] = message
+    took = perf_counter() - start
+
+    wrong = [src for src in sent if received.get(src) != sent[src]]
+    print('{} senders, {} packets interleaved: {:.0f} packets/sec'.format(len(sent), len(packets), len(packets) / took))
+    print('{} messages intact, {} missing or corrupt, {} left assembling'.format(len(sent) - len(wrong), len(wrong), len(DATA_ASSEMBLY)))
+    if wrong or DATA_ASSEMBLY:
+        sys.exit('Interleaved messages were not reassembled intact')
@@ -88,6 +88,9 @@ except:
 #Modules for APRS settings
 import ast
 from pathlib import Path
+from user_settings import UserSettings
+from data_scheduler import DataScheduler, PRIORITY_NORMAL
+from data_que import que_send
 # Used for APRS
 import threading
 # Used for SMS encoding
@@ -260,23 +263,39 @@ def send_ss(CONFIG, callsign, message, dmr_id):
         except requests.ConnectionError:
             logger.error('Config server unreachable')
 
+# Send the web service the units added, heard again or expired since the last time. The whole
+# table goes the first time, or after a failed send, so the web service can't drift from UNIT_MAP.
 def send_unit_table(CONFIG, _data):
+    global UNIT_SENT
+    _full = UNIT_SENT == None
+    _sent = UNIT_SENT or {}
+    _update = [[int_id(_unit), str(_data[_unit][0]), _data[_unit][1]] for _unit in _data if _sent.get(_unit) != _data[_unit]]
+    _remove = [int_id(_unit) for _unit in _sent if _unit not in _data]
+    if not _full and not _update and not _remove:
+        return
     user_man_url = CONFIG['WEB_SERVICE']['URL']
     shared_secret = str(sha256(CONFIG['WEB_SERVICE']['SHARED_SECRET'].encode()).hexdigest())
     sms_data = {
     'unit_table': CONFIG['WEB_SERVICE']['THIS_SERVER_NAME'],
     'secret':shared_secret,
-    'data': str(_data),
+    'full': _full,
+    'update': _update,
+    'remove': _remove
 
     }
     json_object = json.dumps(sms_data, indent = 4)
     
     try:
         req = requests.post(user_man_url, data=json_object, headers={'Content-Type': 'application/json'})
+        if req.ok:
+            UNIT_SENT = dict(_data)
+        else:
+            UNIT_SENT = None
 ##        resp = json.loads(req.text)
 ##        print(resp)
 ##        return resp['rules']
     except requests.ConnectionError:
+        UNIT_SENT = None
         logger.error('Config server unreachable')
 
 def send_sms_que_req(CONFIG):
@@ -362,6 +381,8 @@ def download_config(CONFIG_FILE, cli_file):
                 corrected_config['SYSTEMS'][i]['TG1_ACL'] = data_gateway_config.acl_build(iterate_config[i]['TG1_ACL'], 4294967295)
                 corrected_config['SYSTEMS'][i]['TG2_ACL'] = data_gateway_config.acl_build(iterate_config[i]['TG2_ACL'], 4294967295)
                 corrected_config['SYSTEMS'][i]['PASSPHRASE'] = bytes(iterate_config[i]['PASSPHRASE'], 'utf-8')
+                if iterate_config[i]['MODE'] == 'MASTER' or iterate_config[i]['MODE'] == 'PROXY':
+                    corrected_config['SYSTEMS'][i]['REG_ACL'] = data_gateway_config.acl_build(iterate_config[i]['REG_ACL'], 4294967295)
                 if iterate_config[i]['MODE'] == 'OPENBRIDGE':
 ##                    corrected_config['SYSTEMS'][i]['NETWORK_ID'] = int(iterate_config[i]['NETWORK_ID']).to_bytes(4, 'big')
                     corrected_config['SYSTEMS'][i]['NETWORK_ID'] = int(iterate_config[i]['NETWORK_ID']).to_bytes(4, 'big')
@@ -482,10 +503,10 @@ def download_config(CONFIG_FILE, cli_file):
 # Headers for GPS by model of radio:
 # AT-D878 - Compressed UDP
 # MD-380 - Unified Data Transport
-hdr_type = ''
-btf = -1
 ssid = ''
 UNIT_MAP = {}
+# UNIT_MAP as last sent to the web service, None to send all of it next time
+UNIT_SENT = None
 PACKET_MATCH = {}
 
 # From dmr_utils3, modified to decode entire packet. Works for 1/2 rate coded data. 
@@ -505,20 +526,99 @@ def decode_full(_data):
     return binlc
    
 
-n_packet_assembly = 0
-
-packet_assembly = ''
-
-final_packet = ''
-
-#Convert DMR packet to binary from MMDVM packet and remove Slot Type and EMB Sync stuff to allow for BPTC 196,96 decoding
+# Data messages being reassembled, one per sender so interleaved transmissions from
+# different radios don't corrupt each other.
+# format: (rf_src, dst_id, slot, stream_id): {'BTF': blocks still to follow, 'BUF': bytearray, 'LEN': bytes used, 'TIME': last block}
+DATA_ASSEMBLY = {}
+# MD-380 UDT headers waiting for the location block, same key. format: key: time
+UDT_HEADERS = {}
+# Seconds without a block before a partial message is dropped
+DATA_ASSEMBLY_TIMEOUT = 10
+# Most messages assembled at once, and most blocks in one message (blocks to follow is 7 bits)
+DATA_ASSEMBLY_MAX = 2048
+DATA_ASSEMBLY_BLOCKS = 127
+# A 1/2 rate block decodes to 96 bits
+DATA_BLOCK_BYTES = 12
+
+# Drop assemblies (and UDT headers) that have not seen a block in DATA_ASSEMBLY_TIMEOUT
+def assembly_prune(_now):
+    for _table, _stamp in ((DATA_ASSEMBLY, lambda _entry: _entry['TIME']), (UDT_HEADERS, lambda _entry: _entry)):
+        for _key in [_key for _key, _entry in _table.items() if _now - _stamp(_entry) > DATA_ASSEMBLY_TIMEOUT]:
+            logger.debug('Dropping incomplete data from DMR ID: %s', int_id(_key[0]))
+            del _table[_key]
+
+# Start assembling a message from a data header, the buffer is allocated once for the whole message
+def assembly_start(_key, _btf, _now):
+    if _btf < 1 or _btf > DATA_ASSEMBLY_BLOCKS:
+        DATA_ASSEMBLY.pop(_key, None)
+        return
+    if _key not in DATA_ASSEMBLY and len(DATA_ASSEMBLY) >= DATA_ASSEMBLY_MAX:
+        assembly_prune(_now)
+        # Still full, make room by dropping the longest waiting
+        if len(DATA_ASSEMBLY) >= DATA_ASSEMBLY_MAX:
+            _oldest = min(DATA_ASSEMBLY, key = lambda _k: DATA_ASSEMBLY[_k]['TIME'])
+            logger.info('Data assembly full, dropping incomplete data from DMR ID: %s', int_id(_oldest[0]))
+            del DATA_ASSEMBLY[_oldest]
+    DATA_ASSEMBLY[_key] = {'BTF': _btf, 'BUF': bytearray(_btf * DATA_BLOCK_BYTES), 'LEN': 0, 'TIME': _now}
+
+# Add a decoded block. Returns the whole message once the last block is in, otherwise None.
+# Blocks that arrive without a header, or after a timeout, are ignored.
+def assembly_add(_key, _block, _now):
+    _entry = DATA_ASSEMBLY.get(_key)
+    if _entry == None:
+        return None
+    if _now - _entry['TIME'] > DATA_ASSEMBLY_TIMEOUT:
+        del DATA_ASSEMBLY[_key]
+        return None
+    _end = _entry['LEN'] + DATA_BLOCK_BYTES
+    _entry['BUF'][_entry['LEN']:_end] = _block
+    _entry['LEN'] = _end
+    _entry['BTF'] -= 1
+    _entry['TIME'] = _now
+    if _entry['BTF'] > 0:
+        return None
+    del DATA_ASSEMBLY[_key]
+    return bytes(_entry['BUF'])
+
+# decode_full() works a bit at a time and is slow, so it is only used to build a lookup table.
+# The DMR payload of a burst is 33 bytes, with the Slot Type and EMB Sync (bits 98 - 165) between
+# the two halves of the BPTC 196,96 data. For each payload byte that carries data, and every value
+# it can have, the table holds the bits that byte adds to the 96 bit result, format: [(byte, [256 ints]), ...]
+def mk_bptc_table():
+    _positions = {}
+    for _in in range(196):
+        _bits = bitarray(196, endian='big')
+        _bits.setall(0)
+        _bits[_in] = 1
+        _out = decode_full(_bits)
+        # Parity bits aren't in the result
+        if _out.any():
+            # Position in the payload, before Slot Type and EMB Sync were removed
+            _positions[_in if _in < 98 else _in + 68] = _out.index(1)
+    _table = []
+    for _byte in range(33):
+        _values = [0] * 256
+        for _value in range(256):
+            for _bit in range(8):
+                if _value & (0x80 >> _bit) and _byte * 8 + _bit in _positions:
+                    _values[_value] |= 1 << (95 - _positions[_byte * 8 + _bit])
+        if any(_values):
+            _table.append((_byte, _values))
+    return _table
+
+BPTC_TABLE = mk_bptc_table()
+
+# BPTC 196,96 decode of the data in an MMDVM packet, using BPTC_TABLE. Returns a 96 bit bitarray.
 def bptc_decode(_data):
-        binary_packet = bitarray(decode.to_bits(_data[20:]))
-        del binary_packet[98:166]
-        return decode_full(binary_packet)
-# Placeholder for future header id
-def header_ID(_data):
-    hex_hdr = str(ahex(bptc_decode(_data)))
+    _bits = 0
+    for _byte, _values in BPTC_TABLE:
+        _bits |= _values[_data[20 + _byte]]
+    _block = bitarray(endian='big')
+    _block.frombytes(_bits.to_bytes(12, 'big'))
+    return _block
+# Placeholder for future header id, takes a burst decoded with bptc_decode()
+def header_ID(_block):
+    hex_hdr = str(ahex(_block))
     return hex_hdr[2:6]
     # Work in progress, used to determine data format
 ##    pass
@@ -578,54 +678,44 @@ def user_setting_write(dmr_id, setting, value, call_type):
         if CONFIG['WEB_SERVICE']['REMOTE_CONFIG_ENABLED'] == True:
             send_sms_cmd(CONFIG, dmr_id, 'APRS-' + setting + '=' + str(value))
         if CONFIG['WEB_SERVICE']['REMOTE_CONFIG_ENABLED'] == False:
-   # Open file and load as dict for modification
+   # Load as dict for modification
             logger.info(setting.upper())
-            with open(user_settings_file, 'r') as f:
-    ##            if f.read() == '{}':
-    ##                user_dict = {}
-                user_dict = ast.literal_eval(f.read())
-                logger.info('Current settings: ' + str(user_dict))
-                if dmr_id not in user_dict:
-                    user_dict[dmr_id] = [{'call': str(get_alias((dmr_id), subscriber_ids))}, {'ssid': ''}, {'icon': ''}, {'comment': ''}, {'pin': ''}, {'APRS': False}]
-                if setting.upper() == 'ICON':
-                    user_dict[dmr_id][2]['icon'] = value
-                if setting.upper() == 'SSID':
-                    user_dict[dmr_id][1]['ssid'] = value  
-                if setting.upper() == 'COM':
-                    user_comment = user_dict[dmr_id][3]['comment'] = value[0:35]
-                if setting.upper() == 'APRS ON':
-                    user_dict[dmr_id][5] = {'APRS': True}
-                    if call_type == 'unit':
-                        send_sms(False, dmr_id, 9, 9, 'unit', 'APRS MSG TX/RX Enabled')
-                    if call_type == 'vcsbk':
-                        send_sms(False, 9, 9, 9, 'group', 'APRS MSG TX/RX Enabled')
-                if setting.upper() == 'APRS OFF':
-                    user_dict[dmr_id][5] = {'APRS': False}
-                    if call_type == 'unit':
-                        send_sms(False, dmr_id, 9, 9, 'unit', 'APRS MSG TX/RX Disabled')
-                    if call_type == 'vcsbk':
-                        send_sms(False, 9, 9, 9, 'group', 'APRS MSG TX/RX Disabled')
-                if setting.upper() == 'PIN':
-                    #try:
-                        #if user_dict[dmr_id]:
-                    user_dict[dmr_id][4]['pin'] = value
-                    if call_type == 'unit':
-                        send_sms(False, dmr_id, 9, 9, 'unit',  'You can now use your pin on the dashboard.')
-                    if call_type == 'vcsbk':
-                        send_sms(False, 9, 9, 9, 'group',  'You can now use your pin on the dashboard.')
-                        #if not user_dict[dmr_id]:
-                        #    user_dict[dmr_id] = [{'call': str(get_alias((dmr_id), subscriber_ids))}, {'ssid': ''}, {'icon': ''}, {'comment': ''}, {'pin': pin}]
-                    #except:
-                    #    user_dict[dmr_id].append({'pin': value})
-                f.close()
-                logger.info('Loaded user settings. Write changes.')
-        # Write modified dict to file
-            with open(user_settings_file, 'w') as user_dict_file:
-                user_dict_file.write(str(user_dict))
-                user_dict_file.close()
-                logger.info('User setting saved')
-                f.close()
-                packet_assembly = ''
+            user_dict = USER_SETTINGS.all()
+            logger.info('Current settings: ' + str(user_dict))
+            if dmr_id not in user_dict:
+                user_dict[dmr_id] = [{'call': str(get_alias((dmr_id), subscriber_ids))}, {'ssid': ''}, {'icon': ''}, {'comment': ''}, {'pin': ''}, {'APRS': False}]
+            if setting.upper() == 'ICON':
+                user_dict[dmr_id][2]['icon'] = value
+            if setting.upper() == 'SSID':
+                user_dict[dmr_id][1]['ssid'] = value  
+            if setting.upper() == 'COM':
+                user_comment = user_dict[dmr_id][3]['comment'] = value[0:35]
+            if setting.upper() == 'APRS ON':
+                user_dict[dmr_id][5] = {'APRS': True}
+                if call_type == 'unit':
+                    send_sms(False, dmr_id, 9, 9, 'unit', 'APRS MSG TX/RX Enabled')
+                if call_type == 'vcsbk':
+                    send_sms(False, 9, 9, 9, 'group', 'APRS MSG TX/RX Enabled')
+            if setting.upper() == 'APRS OFF':
+                user_dict[dmr_id][5] = {'APRS': False}
+                if call_type == 'unit':
+                    send_sms(False, dmr_id, 9, 9, 'unit', 'APRS MSG TX/RX Disabled')
+                if call_type == 'vcsbk':
+                    send_sms(False, 9, 9, 9, 'group', 'APRS MSG TX/RX Disabled')
+            if setting.upper() == 'PIN':
+                #try:
+                    #if user_dict[dmr_id]:
+                user_dict[dmr_id][4]['pin'] = value
+                if call_type == 'unit':
+                    send_sms(False, dmr_id, 9, 9, 'unit',  'You can now use your pin on the dashboard.')
+                if call_type == 'vcsbk':
+                    send_sms(False, 9, 9, 9, 'group',  'You can now use your pin on the dashboard.')
+                    #if not user_dict[dmr_id]:
+                    #    user_dict[dmr_id] = [{'call': str(get_alias((dmr_id), subscriber_ids))}, {'ssid': ''}, {'icon': ''}, {'comment': ''}, {'pin': pin}]
+                #except:
+                #    user_dict[dmr_id].append({'pin': value})
+        # Write modified dict to file, done shortly after by USER_SETTINGS
+            USER_SETTINGS.changed()
             
 # Process SMS, do something bases on message
 
@@ -707,7 +797,7 @@ def process_sms(_rf_src, sms, call_type, system_name):
         logger.info('Latitude: ' + str(aprs_lat))
         logger.info('Longitude: ' + str(aprs_lon))
         # 14FRS2013 simplified and moved settings retrieval
-        user_settings = ast.literal_eval(os.popen('cat ' + user_settings_file).read())	
+        user_settings = USER_SETTINGS.all()	
         if int_id(_rf_src) not in user_settings:	
             ssid = str(user_ssid)	
             icon_table = '/'	
@@ -752,7 +842,7 @@ def process_sms(_rf_src, sms, call_type, system_name):
         aprs_msg = s.join(parse_sms[1:])#re.sub('^@|.* A-|','',sms)
         logger.info(aprs_msg)
         logger.info('APRS message to ' + aprs_dest.upper() + '. Message: ' + aprs_msg)
-        user_settings = ast.literal_eval(os.popen('cat ' + user_settings_file).read())
+        user_settings = USER_SETTINGS.all()
         if int_id(_rf_src) in user_settings and user_settings[int_id(_rf_src)][1]['ssid'] != '':
             ssid = user_settings[int_id(_rf_src)][1]['ssid']
         else:
@@ -918,25 +1008,40 @@ def block_sequence(input_string):
             n = n + 1
     return block_seq
 
+# bptc.encode_19696 works a bit at a time and is slow, so it is only used to build a lookup table.
+# The Hamming parity is an XOR of data bits, so a block encodes (and interleaves) to the XOR of what
+# each of its bytes encodes to on its own. format: [[256 ints of 196 bits] for each of the 12 bytes]
+def mk_bptc_encode_table():
+    _bits = []
+    for _bit in range(96):
+        _block = (1 << (95 - _bit)).to_bytes(12, 'big')
+        # 196 bits come back as 25 bytes, the last 4 bits are padding
+        _bits.append(int.from_bytes(bptc.interleave_19696(bptc.encode_19696(_block)).tobytes(), 'big') >> 4)
+    _table = []
+    for _byte in range(12):
+        _values = [0] * 256
+        for _value in range(1, 256):
+            # This value without its lowest bit is already done, add that bit
+            _low = _value & -_value
+            _values[_value] = _values[_value ^ _low] ^ _bits[_byte * 8 + 8 - _low.bit_length()]
+        _table.append(_values)
+    return _table
+
+BPTC_ENCODE_TABLE = mk_bptc_encode_table()
+
+# Slot Type and sync between the two halves of the BPTC data in every data burst we send
+# Mobile Station data sync D5D7F77FD757 (TS1 would be F7FDD5DDFD55, TS2 D7557F5FF7F5)
+BURST_MIDDLE = int('0111011100' + '110101011101011111110111011111111101011101010111' + '1101110001', 2) << 98
+
 # Takes list of DMR packets, 12 bytes, then encodes them
 def dmr_encode(packet_list, _slot):
     send_seq = []
     for i in packet_list:
-        stitched_pkt = bptc.interleave_19696(bptc.encode_19696(i))
-        l_slot = bitarray('0111011100')
-        r_slot = bitarray('1101110001')
-        #Mobile Station
-       # D5D7F77FD757
-        sync_data = bitarray('110101011101011111110111011111111101011101010111')
-##        if _slot == 0:
-##            # TS1 - F7FDD5DDFD55
-##            sync_data = bitarray('111101111111110111010101110111011111110101010101')
-##        if _slot == 1:
-##            #TS2 - D7557F5FF7F5
-##            sync_data = bitarray('110101110101010101111111010111111111011111110101')
-##            
-        # Data sync? 110101011101011111110111011111111101011101010111 - D5D7F77FD757
-        new_pkt = ahex(stitched_pkt[:98] + l_slot + sync_data + r_slot + stitched_pkt[98:])
+        stitched_pkt = 0
+        for _byte, _value in enumerate(i):
+            stitched_pkt ^= BPTC_ENCODE_TABLE[_byte][_value]
+        # First 98 bits, Slot Type and sync, last 98 bits
+        new_pkt = ahex((stitched_pkt >> 98 << 166 | BURST_MIDDLE | stitched_pkt & ((1 << 98) - 1)).to_bytes(33, 'big'))
         send_seq.append(new_pkt)
     return send_seq
 
@@ -988,8 +1093,7 @@ def create_sms_seq(dst_id, src_id, peer_id, _slot, _call_type, dmr_string):
 
             
     if CONFIG['WEB_SERVICE']['REMOTE_CONFIG_ENABLED'] == False:  
-        with open('/tmp/.hblink_data_que_' + str(CONFIG['DATA_CONFIG']['APRS_LOGIN_CALL']).upper() + '/' + str(random.randint(1000, 9999)) + '.mmdvm_seq', "w") as packet_write_file:
-            packet_write_file.write(str(mmdvm_send_seq))
+        que_send('/tmp/.hblink_data_que_' + str(CONFIG['DATA_CONFIG']['APRS_LOGIN_CALL']).upper() + '/', mmdvm_send_seq)
             
     return mmdvm_send_seq
 ##    return the_mmdvm_pkt
@@ -1056,9 +1160,9 @@ def gen_header(to_id, from_id, call_type):
         seq_header = '824A' + to_id + from_id + '9550'
     return seq_header
 
-def send_sms(csbk, to_id, from_id, peer_id, call_type, msg, snd_slot = 1):
+# Sequences are queued on DATA_SCHEDULER, which paces them out through the reactor
+def send_sms(csbk, to_id, from_id, peer_id, call_type, msg, snd_slot = 1, priority = PRIORITY_NORMAL):
     global use_csbk
-    sleep(1)
     use_csbk = csbk
     to_id = str(hex(to_id))[2:].zfill(6)
     from_id = str(hex(from_id))[2:].zfill(6)
@@ -1095,13 +1199,11 @@ def send_sms(csbk, to_id, from_id, peer_id, call_type, msg, snd_slot = 1):
         if CONFIG['SYSTEMS'][UNIT_MAP[bytes.fromhex(to_id)][0]]['MODE'] == 'OPENBRIDGE' and CONFIG['SYSTEMS'][UNIT_MAP[bytes.fromhex(to_id)][0]]['BOTH_SLOTS'] == False  and CONFIG['SYSTEMS'][UNIT_MAP[bytes.fromhex(to_id)][0]]['ENABLED'] == True:
                 slot = 0
                 snd_seq_lst = create_sms_seq(to_id, from_id, peer_id, int(slot), call_type, create_crc16(gen_header(to_id, from_id, call_type)) + create_crc32(format_sms(str(msg), to_id, from_id)))
-                for d in snd_seq_lst:
-                    systems[UNIT_MAP[bytes.fromhex(to_id)][0]].send_system(d)
+                DATA_SCHEDULER.queue(UNIT_MAP[bytes.fromhex(to_id)][0], slot, snd_seq_lst, systems[UNIT_MAP[bytes.fromhex(to_id)][0]].send_system, priority)
                 logger.info('Sending on TS: ' + str(slot))
         elif CONFIG['SYSTEMS'][UNIT_MAP[bytes.fromhex(to_id)][0]]['MODE'] == 'OPENBRIDGE' and CONFIG['SYSTEMS'][UNIT_MAP[bytes.fromhex(to_id)][0]]['BOTH_SLOTS'] == True or CONFIG['SYSTEMS'][UNIT_MAP[bytes.fromhex(to_id)][0]]['MODE'] != 'OPENBRIDGE' and CONFIG['SYSTEMS'][UNIT_MAP[bytes.fromhex(to_id)][0]]['ENABLED'] == True:
                 snd_seq_lst = create_sms_seq(to_id, from_id, peer_id, int(slot), call_type, create_crc16(gen_header(to_id, from_id, call_type)) + create_crc32(format_sms(str(msg), to_id, from_id)))
-                for d in snd_seq_lst:
-                    systems[UNIT_MAP[bytes.fromhex(to_id)][0]].send_system(d)
+                DATA_SCHEDULER.queue(UNIT_MAP[bytes.fromhex(to_id)][0], slot, snd_seq_lst, systems[UNIT_MAP[bytes.fromhex(to_id)][0]].send_system, priority)
                 logger.info('Sending on TS: ' + str(slot))
   # We don't know where the user is
     elif bytes.fromhex(to_id) not in UNIT_MAP:
@@ -1109,55 +1211,67 @@ def send_sms(csbk, to_id, from_id, peer_id, call_type, msg, snd_slot = 1):
             if CONFIG['SYSTEMS'][s]['MODE'] == 'OPENBRIDGE' and CONFIG['SYSTEMS'][s]['BOTH_SLOTS'] == False and CONFIG['SYSTEMS'][s]['ENABLED'] == True:
                 slot = 0
                 snd_seq_lst = create_sms_seq(to_id, from_id, peer_id, int(slot), call_type, create_crc16(gen_header(to_id, from_id, call_type)) + create_crc32(format_sms(str(msg), to_id, from_id)))
-                for d in snd_seq_lst:
-                    systems[s].send_system(d)
+                DATA_SCHEDULER.queue(s, slot, snd_seq_lst, systems[s].send_system, priority)
                 logger.info('User not in map. Sending on TS: ' + str(slot))
             elif CONFIG['SYSTEMS'][s]['MODE'] == 'OPENBRIDGE' and CONFIG['SYSTEMS'][s]['BOTH_SLOTS'] == True and CONFIG['SYSTEMS'][s]['ENABLED'] == True or CONFIG['SYSTEMS'][s]['MODE'] != 'OPENBRIDGE' and CONFIG['SYSTEMS'][s]['ENABLED'] == True:
                 snd_seq_lst = create_sms_seq(to_id, from_id, peer_id, int(slot), call_type, create_crc16(gen_header(to_id, from_id, call_type)) + create_crc32(format_sms(str(msg), to_id, from_id)))
-                for d in snd_seq_lst:
-                    systems[s].send_system(d)
+                DATA_SCHEDULER.queue(s, slot, snd_seq_lst, systems[s].send_system, priority)
                 logger.info('User not in map. Sending on TS: ' + str(slot))
 
+# Users that can receive APRS-IS messages, rebuilt when the user settings change.
+# format: (callsign, ssid): [dmr_id, ...]
+APRS_INDEX = {'VERSION': None, 'USERS': {}}
+
+def aprs_index():
+    user_settings = USER_SETTINGS.all()
+    _version = USER_SETTINGS.version
+    if _version != APRS_INDEX['VERSION']:
+        _users = {}
+        # Runs in the APRS-IS thread, the settings can change while we work
+        for sms_id in list(user_settings):
+            try:
+                if user_settings[sms_id][5]['APRS'] != True:
+                    continue
+                ssid = user_settings[sms_id][1]['ssid']
+                if ssid == '':
+                    ssid = user_ssid
+                _users.setdefault((user_settings[sms_id][0]['call'].upper(), str(ssid)), []).append(sms_id)
+            except (KeyError, IndexError, TypeError, AttributeError):
+                logger.debug('Incomplete APRS settings for DMR ID: %s', sms_id)
+        APRS_INDEX['USERS'] = _users
+        APRS_INDEX['VERSION'] = _version
+    return APRS_INDEX['USERS']
+
 def aprs_process(packet):
-    print(aprslib.parse(packet))
     try:
-        if 'addresse' in aprslib.parse(packet):
-            #print(aprslib.parse(packet))
-            recipient = re.sub('-.*','', aprslib.parse(packet)['addresse'])
-            recipient_ssid = re.sub('.*-','', aprslib.parse(packet)['addresse']) 
+        aprs_packet = aprslib.parse(packet)
+    except Exception as e:
+        logger.debug(e)
+        return
+    try:
+        if 'addresse' in aprs_packet:
+            recipient = re.sub('-.*','', aprs_packet['addresse']).upper()
+            recipient_ssid = re.sub('.*-','', aprs_packet['addresse'])
             if recipient == '':
                 pass
             else:
-                user_settings = ast.literal_eval(os.popen('cat ' + user_settings_file).read())
-                for i in user_settings.items():
-                    sms_id = i[0]
-                    print(sms_id)
-                    ssid = i[1][1]['ssid']
-                    if i[1][1]['ssid'] == '':
-                        ssid = user_ssid
-                    if recipient in i[1][0]['call'] and i[1][5]['APRS'] == True and recipient_ssid in ssid:
-                        logger.info(aprslib.parse(packet)['from'])
-                        mailbox_write(re.sub('-.*','', aprslib.parse(packet)['addresse']), aprslib.parse(packet)['from'], time(), 'From APRS-IS: ' + aprslib.parse(packet)['message_text'], aprslib.parse(packet)['from'])
-                        send_sms(False, sms_id, 9, 9, 'unit', str('APRS / ' + str(aprslib.parse(packet)['from']) + ': ' + aprslib.parse(packet)['message_text']))
-##                        print(UNIT_MAP[bytes_3(sms_id)][1])
-##                        print(type(UNIT_MAP[bytes_3(sms_id)][1]))
-##                        print(float(datetime.datetime.utcnow().strftime('%s')) - UNIT_MAP[bytes_3(sms_id)][1])
-##
-##                        if float(datetime.datetime.utcnow().strftime('%s')) - UNIT_MAP[bytes_3(sms_id)][1] < 60:
-                        try:
-                            if 'msgNo' in aprslib.parse(packet):
-                                #sleep(1)
-##                                print(UNIT_MAP)
-                                # Write function to check UNIT_MAP and see if X amount of time has passed, if time passed, no ACK. This will prevent multiple gateways from
-                                # ACKing. time of 24hrs?
-                                if bytes_3(sms_id) in UNIT_MAP:
-                                    logger.info(str(aprslib.parse(packet)['addresse']) + '>APHBL3,TCPIP*:' + ':' + str(aprslib.parse(packet)['from'].ljust(9)) +':ack' + str(aprslib.parse(packet)['msgNo']))
-                                    aprs_send(str(aprslib.parse(packet)['addresse']) + '>APHBL3,TCPIP*:' + ':' + str(aprslib.parse(packet)['from'].ljust(9)) +':ack' + str(aprslib.parse(packet)['msgNo']))
-                                    logger.info('Send ACK')
-                                else:
-                                    logger.info('Station not seen in 24 hours, not acknowledging')
-                        except Exception as e:
-                            logger.info(e)
+                for sms_id in aprs_index().get((recipient, recipient_ssid), []):
+                    logger.info(aprs_packet['from'])
+                    mailbox_write(recipient, aprs_packet['from'], time(), 'From APRS-IS: ' + aprs_packet['message_text'], aprs_packet['from'])
+                    send_sms(False, sms_id, 9, 9, 'unit', str('APRS / ' + str(aprs_packet['from']) + ': ' + aprs_packet['message_text']))
+                    try:
+                        if 'msgNo' in aprs_packet:
+                            # Write function to check UNIT_MAP and see if X amount of time has passed, if time passed, no ACK. This will prevent multiple gateways from
+                            # ACKing. time of 24hrs?
+                            if bytes_3(sms_id) in UNIT_MAP:
+                                aprs_ack = str(aprs_packet['addresse']) + '>APHBL3,TCPIP*:' + ':' + str(aprs_packet['from'].ljust(9)) +':ack' + str(aprs_packet['msgNo'])
+                                logger.info(aprs_ack)
+                                aprs_send(aprs_ack)
+                                logger.info('Send ACK')
+                            else:
+                                logger.info('Station not seen in 24 hours, not acknowledging')
+                    except Exception as e:
+                        logger.info(e)
     except Exception as e:
         logger.info(e)
 
@@ -1165,7 +1279,6 @@ def aprs_process(packet):
 def aprs_rx(aprs_rx_login, aprs_passcode, aprs_server, aprs_port, aprs_filter, user_ssid):
     global AIS
     AIS = aprslib.IS(aprs_rx_login, passwd=int(aprs_passcode), host=aprs_server, port=int(aprs_port))
-    user_settings = ast.literal_eval(os.popen('cat ' + user_settings_file).read())
     AIS.set_filter(aprs_filter)#parser.get('DATA_CONFIG', 'APRS_FILTER'))
     try:
         if 'N0CALL' in aprs_callsign:
@@ -1195,15 +1308,16 @@ def aprs_beacon_send():
 ##### DMR data function ####
 def data_received(self, _peer_id, _rf_src, _dst_id, _seq, _slot, _call_type, _frame_type, _dtype_vseq, _stream_id, _data, mirror = False):
     # Capture data headers
-    global n_packet_assembly, hdr_type
     #logger.info(_dtype_vseq)
     #logger.info(_call_type)
     #logger.info(_frame_type)
     print(int_id(_stream_id))
     print((_seq))
     logger.info(strftime('%H:%M:%S - %m/%d/%y'))
+    # Decode the burst once, everything below works from this
+    _block = bptc_decode(_data)
     #logger.info('Special debug for developement:')
-    logger.info(ahex(bptc_decode(_data)))
+    logger.info(ahex(_block))
     #logger.info(_rf_src)
     #logger.info((ba2num(bptc_decode(_data)[8:12])))
 ################################################################3###### CHNGED #########
@@ -1218,124 +1332,104 @@ def data_received(self, _peer_id, _rf_src, _dst_id, _seq, _slot, _call_type, _fr
     # If 5 is at position 3, then this should be a UDT header for MD-380 type radios.
     # Coordinates are usually in the very next block after the header, we will discard the rest.
     #logger.info(ahex(bptc_decode(_data)[0:10]))
-    if _call_type == call_type and header_ID(_data)[3] == '5' and ba2num(bptc_decode(_data)[69:72]) == 0 and ba2num(bptc_decode(_data)[8:12]) == 0 or (_call_type == 'vcsbk' and header_ID(_data)[3] == '5' and ba2num(bptc_decode(_data)[69:72]) == 0 and ba2num(bptc_decode(_data)[8:12]) == 0):
-        global udt_block
+    _key = (_rf_src, _dst_id, _slot, _stream_id)
+    _now = time()
+    if _call_type == call_type and header_ID(_block)[3] == '5' and ba2num(_block[69:72]) == 0 and ba2num(_block[8:12]) == 0 or (_call_type == 'vcsbk' and header_ID(_block)[3] == '5' and ba2num(_block[69:72]) == 0 and ba2num(_block[8:12]) == 0):
         logger.info('MD-380 type UDT header detected. Very next packet should be location.')
-        hdr_type = '380'
-    if _dtype_vseq == 6 and hdr_type == '380' or _dtype_vseq == 'group' and hdr_type == '380':
-        udt_block = 1
-    if _dtype_vseq == 7 and hdr_type == '380':
-        udt_block = udt_block - 1
-        if udt_block == 0:
-            logger.info('MD-380 type packet. This should contain the GPS location.')
-            logger.info('Packet: ' + str(ahex(bptc_decode(_data))))
-            if ba2num(bptc_decode(_data)[1:2]) == 1:
-                lat_dir = 'N'
-            if ba2num(bptc_decode(_data)[1:2]) == 0:
-                lat_dir = 'S'
-            if ba2num(bptc_decode(_data)[2:3]) == 1:
-                lon_dir = 'E'
-            if ba2num(bptc_decode(_data)[2:3]) == 0:
-                lon_dir = 'W'
-            lat_deg = ba2num(bptc_decode(_data)[11:18])
-            lon_deg = ba2num(bptc_decode(_data)[38:46])
-            lat_min = ba2num(bptc_decode(_data)[18:24])
-            lon_min = ba2num(bptc_decode(_data)[46:52])
-            lat_min_dec = str(ba2num(bptc_decode(_data)[24:38])).zfill(4)
-            lon_min_dec = str(ba2num(bptc_decode(_data)[52:66])).zfill(4)
-            # Old MD-380 coordinate format, keep here until new is confirmed working.
-            #aprs_lat = str(str(lat_deg) + str(lat_min) + '.' + str(lat_min_dec)[0:2]).zfill(7) + lat_dir
-            #aprs_lon = str(str(lon_deg) + str(lon_min) + '.' + str(lon_min_dec)[0:2]).zfill(8) + lon_dir
-            # Fix for MD-380 by G7HIF
-            aprs_lat = str(str(lat_deg) + str(lat_min).zfill(2) + '.' + str(lat_min_dec)[0:2]).zfill(7) + lat_dir
-            aprs_lon = str(str(lon_deg) + str(lon_min).zfill(2) + '.' + str(lon_min_dec)[0:2]).zfill(8) + lon_dir
-
-            # Form APRS packet
-            #logger.info(aprs_loc_packet)
-            logger.info('Lat: ' + str(aprs_lat) + ' Lon: ' + str(aprs_lon))
-            if mirror == False:
-            # 14FRS2013 simplified and moved settings retrieval
-                user_settings = ast.literal_eval(os.popen('cat ' + user_settings_file).read())
-                if int_id(_rf_src) not in user_settings:	
-                    ssid = str(user_ssid)	
+        UDT_HEADERS[_key] = _now
+    if _dtype_vseq == 7 and UDT_HEADERS.pop(_key, None) != None:
+        logger.info('MD-380 type packet. This should contain the GPS location.')
+        logger.info('Packet: ' + str(ahex(_block)))
+        if ba2num(_block[1:2]) == 1:
+            lat_dir = 'N'
+        if ba2num(_block[1:2]) == 0:
+            lat_dir = 'S'
+        if ba2num(_block[2:3]) == 1:
+            lon_dir = 'E'
+        if ba2num(_block[2:3]) == 0:
+            lon_dir = 'W'
+        lat_deg = ba2num(_block[11:18])
+        lon_deg = ba2num(_block[38:46])
+        lat_min = ba2num(_block[18:24])
+        lon_min = ba2num(_block[46:52])
+        lat_min_dec = str(ba2num(_block[24:38])).zfill(4)
+        lon_min_dec = str(ba2num(_block[52:66])).zfill(4)
+        # Old MD-380 coordinate format, keep here until new is confirmed working.
+        #aprs_lat = str(str(lat_deg) + str(lat_min) + '.' + str(lat_min_dec)[0:2]).zfill(7) + lat_dir
+        #aprs_lon = str(str(lon_deg) + str(lon_min) + '.' + str(lon_min_dec)[0:2]).zfill(8) + lon_dir
+        # Fix for MD-380 by G7HIF
+        aprs_lat = str(str(lat_deg) + str(lat_min).zfill(2) + '.' + str(lat_min_dec)[0:2]).zfill(7) + lat_dir
+        aprs_lon = str(str(lon_deg) + str(lon_min).zfill(2) + '.' + str(lon_min_dec)[0:2]).zfill(8) + lon_dir
+
+        # Form APRS packet
+        #logger.info(aprs_loc_packet)
+        logger.info('Lat: ' + str(aprs_lat) + ' Lon: ' + str(aprs_lon))
+        if mirror == False:
+        # 14FRS2013 simplified and moved settings retrieval
+            user_settings = USER_SETTINGS.all()
+            if int_id(_rf_src) not in user_settings:	
+                ssid = str(user_ssid)	
+                icon_table = '/'	
+                icon_icon = '['	
+                comment = aprs_comment + ' DMR ID: ' + str(int_id(_rf_src)) 	
+            else:	
+                if user_settings[int_id(_rf_src)][1]['ssid'] == '':	
+                    ssid = user_ssid	
+                if user_settings[int_id(_rf_src)][3]['comment'] == '':	
+                    comment = aprs_comment + ' DMR ID: ' + str(int_id(_rf_src))	
+                if user_settings[int_id(_rf_src)][2]['icon'] == '':	
                     icon_table = '/'	
                     icon_icon = '['	
-                    comment = aprs_comment + ' DMR ID: ' + str(int_id(_rf_src)) 	
-                else:	
-                    if user_settings[int_id(_rf_src)][1]['ssid'] == '':	
-                        ssid = user_ssid	
-                    if user_settings[int_id(_rf_src)][3]['comment'] == '':	
-                        comment = aprs_comment + ' DMR ID: ' + str(int_id(_rf_src))	
-                    if user_settings[int_id(_rf_src)][2]['icon'] == '':	
-                        icon_table = '/'	
-                        icon_icon = '['	
-                    if user_settings[int_id(_rf_src)][2]['icon'] != '':	
-                        icon_table = user_settings[int_id(_rf_src)][2]['icon'][0]	
-                        icon_icon = user_settings[int_id(_rf_src)][2]['icon'][1]	
-                    if user_settings[int_id(_rf_src)][1]['ssid'] != '':	
-                        ssid = user_settings[int_id(_rf_src)][1]['ssid']	
-                    if user_settings[int_id(_rf_src)][3]['comment'] != '':	
-                        comment = user_settings[int_id(_rf_src)][3]['comment']
-                aprs_loc_packet = str(get_alias(int_id(_rf_src), subscriber_ids)) + '-' + ssid + '>APHBL3,TCPIP*:@' + str(datetime.datetime.utcnow().strftime("%H%M%Sh")) + str(aprs_lat) + icon_table + str(aprs_lon) + icon_icon + '/' + str(comment)
-                logger.info(aprs_loc_packet)
-                logger.info('User comment: ' + comment)
-                logger.info('User SSID: ' + ssid)
-                logger.info('User icon: ' + icon_table + icon_icon)
-                # Attempt to prevent malformed packets from being uploaded.
-                try:
-                    aprslib.parse(aprs_loc_packet)
-                    float(lat_deg) < 91
-                    float(lon_deg) < 121
+                if user_settings[int_id(_rf_src)][2]['icon'] != '':	
+                    icon_table = user_settings[int_id(_rf_src)][2]['icon'][0]	
+                    icon_icon = user_settings[int_id(_rf_src)][2]['icon'][1]	
+                if user_settings[int_id(_rf_src)][1]['ssid'] != '':	
+                    ssid = user_settings[int_id(_rf_src)][1]['ssid']	
+                if user_settings[int_id(_rf_src)][3]['comment'] != '':	
+                    comment = user_settings[int_id(_rf_src)][3]['comment']
+            aprs_loc_packet = str(get_alias(int_id(_rf_src), subscriber_ids)) + '-' + ssid + '>APHBL3,TCPIP*:@' + str(datetime.datetime.utcnow().strftime("%H%M%Sh")) + str(aprs_lat) + icon_table + str(aprs_lon) + icon_icon + '/' + str(comment)
+            logger.info(aprs_loc_packet)
+            logger.info('User comment: ' + comment)
+            logger.info('User SSID: ' + ssid)
+            logger.info('User icon: ' + icon_table + icon_icon)
+            # Attempt to prevent malformed packets from being uploaded.
+            try:
+                aprslib.parse(aprs_loc_packet)
+                float(lat_deg) < 91
+                float(lon_deg) < 121
     ##                if int_id(_dst_id) == data_id:
-                    if int_id(_dst_id) in data_id:
-                        aprs_send(aprs_loc_packet)
-                        dashboard_loc_write(str(get_alias(int_id(_rf_src), subscriber_ids)) + '-' + ssid, aprs_lat, aprs_lon, time(), comment, int_id(_rf_src))
-                    #logger.info('Sent APRS packet')
-                except Exception as error_exception:
-                    logger.info('Error. Failed to send packet. Packet may be malformed.')
-                    logger.info(error_exception)
-                    logger.info(str(traceback.extract_tb(error_exception.__traceback__)))
-                udt_block = 1
-                hdr_type = ''
-        else:
-              pass
+                if int_id(_dst_id) in data_id:
+                    aprs_send(aprs_loc_packet)
+                    dashboard_loc_write(str(get_alias(int_id(_rf_src), subscriber_ids)) + '-' + ssid, aprs_lat, aprs_lon, time(), comment, int_id(_rf_src))
+                #logger.info('Sent APRS packet')
+            except Exception as error_exception:
+                logger.info('Error. Failed to send packet. Packet may be malformed.')
+                logger.info(error_exception)
+                logger.info(str(traceback.extract_tb(error_exception.__traceback__)))
     #NMEA type packets for Anytone like radios.
     #if _call_type == call_type or (_call_type == 'vcsbk' and pckt_seq > 3): #int.from_bytes(_seq, 'big') > 3 ):
     # 14FRS2013 contributed improved header filtering, KF7EEL added conditions to allow both call types at the same time
     if _call_type == call_type or (_call_type == 'vcsbk' and pckt_seq > 3 and call_type != 'unit') or (_call_type == 'group' and pckt_seq > 3 and call_type != 'unit') or (_call_type == 'group' and pckt_seq > 3 and call_type == 'both') or (_call_type == 'vcsbk' and pckt_seq > 3 and call_type == 'both') or (_call_type == 'unit' and pckt_seq > 3 and call_type == 'both'): #int.from_bytes(_seq, 'big') > 3 ):
-        global packet_assembly, btf
         if _dtype_vseq == 6 or _dtype_vseq == 'group':
-            global btf, hdr_start
-            hdr_start = str(header_ID(_data))
             logger.info('Header from ' + str(get_alias(int_id(_rf_src), subscriber_ids)) + '. DMR ID: ' + str(int_id(_rf_src)))
-            logger.info(ahex(bptc_decode(_data)))
-            logger.info('Blocks to follow: ' + str(ba2num(bptc_decode(_data)[65:72])))
-            btf = ba2num(bptc_decode(_data)[65:72])
-            # Try resetting packet_assembly
-            packet_assembly = ''
+            logger.info(ahex(_block))
+            logger.info('Blocks to follow: ' + str(ba2num(_block[65:72])))
+            assembly_start(_key, ba2num(_block[65:72]), _now)
         # Data blocks at 1/2 rate, see https://github.com/g4klx/MMDVM/blob/master/DMRDefines.h for data types. _dtype_seq defined here also
         if _dtype_vseq == 7:
-            btf = btf - 1
-            logger.info('Block #: ' + str(btf))
+            if _key in DATA_ASSEMBLY:
+                logger.info('Block #: ' + str(DATA_ASSEMBLY[_key]['BTF'] - 1))
             #logger.info(_seq)
             logger.info('Data block from ' + str(get_alias(int_id(_rf_src), subscriber_ids)) + '. DMR ID: ' + str(int_id(_rf_src)) + '. Destination: ' + str(int_id(_dst_id)))
-            logger.info(ahex(bptc_decode(_data)))
-            if _seq == 0:
-                n_packet_assembly = 0
-                packet_assembly = ''
-                
-            #if btf < btf + 1:
+            logger.info(ahex(_block))
             # 14FRS2013 removed condition, works great!
-            n_packet_assembly = n_packet_assembly + 1
-            packet_assembly = packet_assembly + str(bptc_decode(_data)) #str((decode_full_lc(b_packet)).strip('bitarray('))
-            # Use block 0 as trigger. $GPRMC must also be in string to indicate NMEA.
+            _message = assembly_add(_key, _block.tobytes(), _now)
+            # Last block is the trigger. $GPRMC must also be in string to indicate NMEA.
             # This triggers the APRS upload
-            if btf == 0:
-                
-                final_packet = str(bitarray(re.sub("\)|\(|bitarray|'", '', packet_assembly)).tobytes().decode('utf-8', 'ignore'))
-                sms_hex = str(ba2hx(bitarray(re.sub("\)|\(|bitarray|'", '', packet_assembly))))
-                sms_hex_string = re.sub("b'|'", '', str(sms_hex))
-                print(sms_hex_string)
+            if _message != None:
+                final_packet = _message.decode('utf-8', 'ignore')
+                sms_hex = _message.hex()
+                print(sms_hex)
                 #NMEA GPS sentence
                 if '$GPRMC' in final_packet or '$GNRMC' in final_packet:
                     logger.info(final_packet + '\n')
@@ -1356,7 +1450,7 @@ def data_received(self, _peer_id, _rf_src, _dst_id, _seq, _slot, _call_type, _fr
                             # Begin APRS format and upload
                             # Disable opening file for reading to reduce "collision" or reading and writing at same time.
                             # 14FRS2013 simplified and moved settings retrieval
-                            user_settings = ast.literal_eval(os.popen('cat ' + user_settings_file).read())
+                            user_settings = USER_SETTINGS.all()
                             print(user_settings)
                             if int_id(_rf_src) not in user_settings:	
                                 ssid = str(user_ssid)	
@@ -1413,7 +1507,7 @@ def data_received(self, _peer_id, _rf_src, _dst_id, _seq, _slot, _call_type, _fr
 ##                                logger.info(type(sms_hex))
 ##                        logger.info('Attempting to find command...')
 ##                                sms = codecs.decode(bytes.fromhex(''.join(sms_hex[:-8].split('00'))), 'utf-8', 'ignore')
-                        sms = codecs.decode(bytes.fromhex(''.join(sms_hex_string[:-8].split('00'))), 'utf-8', 'ignore')
+                        sms = codecs.decode(bytes.fromhex(''.join(sms_hex[:-8].split('00'))), 'utf-8', 'ignore')
                         msg_found = re.sub('.*\n', '', sms)
                         logger.info('\n\n' + 'Received SMS from ' + str(get_alias(int_id(_rf_src), subscriber_ids)) + ', DMR ID: ' + str(int_id(_rf_src)) + ': ' + str(msg_found) + '\n')
                         
@@ -1428,12 +1522,6 @@ def data_received(self, _peer_id, _rf_src, _dst_id, _seq, _slot, _call_type, _fr
                         pass
                         #logger.info(bitarray(re.sub("\)|\(|bitarray|'", '', str(bptc_decode(_data)).tobytes().decode('utf-8', 'ignore'))))
                     #logger.info('\n\n' + 'Received SMS from ' + str(get_alias(int_id(_rf_src), subscriber_ids)) + ', DMR ID: ' + str(int_id(_rf_src)) + ': ' + str(sms) + '\n')
-                # Reset the packet assembly to prevent old data from returning.
-                # 14FRS2013 moved variable reset
-                hdr_start = ''
-                n_packet_assembly = 0	
-                packet_assembly = ''	
-                btf = 0
             #logger.info(_seq)
             #packet_assembly = '' #logger.info(_dtype_vseq)
         #logger.info(ahex(bptc_decode(_data)).decode('utf-8', 'ignore'))
@@ -1454,8 +1542,7 @@ def ten_loop_func():
     logger.info('10 minute loop')
     # Download user APRS settings
     if CONFIG['WEB_SERVICE']['REMOTE_CONFIG_ENABLED'] == True:
-        with open(user_settings_file, 'w') as f:
-                f.write(str(download_aprs_settings(CONFIG)))
+        USER_SETTINGS.replace(download_aprs_settings(CONFIG))
 
 ##    for unit in UNIT_MAP:
     for my_id in data_id:
@@ -1480,6 +1567,9 @@ def rule_timer_loop():
     for unit in remove_list:
         del UNIT_MAP[unit]
 
+    # Drop data messages that stopped part way through
+    assembly_prune(_now)
+
     logger.debug('Removed unit(s) %s from UNIT_MAP', remove_list)
     if CONFIG['WEB_SERVICE']['REMOTE_CONFIG_ENABLED'] == True:
         ping(CONFIG)
@@ -1668,6 +1758,8 @@ if __name__ == '__main__':
             with open(user_settings_file, 'w') as user_dict_file:
                 user_dict_file.write("{1: [{'call': 'N0CALL'}, {'ssid': ''}, {'icon': ''}, {'comment': ''}, {'pin': ''}, {'APRS': False}]}")
                 user_dict_file.close()    
+    USER_SETTINGS = UserSettings(user_settings_file)
+    DATA_SCHEDULER = DataScheduler()
 
     # Start the system logger
     if cli_args.LOG_LEVEL:
@@ -1681,6 +1773,7 @@ if __name__ == '__main__':
     def sig_handler(_signal, _frame):
         logger.info('(GLOBAL) SHUTDOWN: CONFBRIDGE IS TERMINATING WITH SIGNAL %s', str(_signal))
         hblink_handler(_signal, _frame)
+        USER_SETTINGS.flush()
         logger.info('(GLOBAL) SHUTDOWN: ALL SYSTEM HANDLERS EXECUTED - STOPPING REACTOR')
         reactor.stop()
 
@@ -31,6 +31,7 @@ import sys
 import const
 
 from socket import gethostbyname
+from config import ACL
 
 # Does anybody read this stuff? There's a PEP somewhere that says I should do this.
 __author__     = 'Cortney T. Buffington, N0MJS'
@@ -52,8 +53,9 @@ def process_acls(_config):
 
     # System level ACLs
     for system in _config['SYSTEMS']:
-        # Registration ACLs (which make no sense for peer systems)
-        if _config['SYSTEMS'][system]['MODE'] == 'MASTER':
+        # Registration ACLs (which make no sense for peer systems). A PROXY's is copied to each
+        # MASTER made from it.
+        if _config['SYSTEMS'][system]['MODE'] == 'MASTER' or _config['SYSTEMS'][system]['MODE'] == 'PROXY':
             _config['SYSTEMS'][system]['REG_ACL'] = acl_build(_config['SYSTEMS'][system]['REG_ACL'], const.PEER_MAX)
 
         # Subscriber and TGID ACLs (valid for all system types)
@@ -62,10 +64,10 @@ def process_acls(_config):
 
 # Create an access control list that is programatically useable from human readable:
 # ORIGINAL:  'DENY:1-5,3120101,3120124'
-# PROCESSED: (False, set([(1, 5), (3120124, 3120124), (3120101, 3120101)]))
+# PROCESSED: ACL(False, [(1, 5), (3120101, 3120101), (3120124, 3120124)])
 def acl_build(_acl, _max):
     if not _acl:
-        return(True, set((const.ID_MIN, _max)))
+        return ACL(True, [(const.ID_MIN, _max)])
 
     acl = [] #set()
     if type(_acl) == tuple:
@@ -96,7 +98,7 @@ def acl_build(_acl, _max):
             else:
                  sys.exit('ACL CREATION ERROR, VALUE OUT OF RANGE ({} - {}) IN SINGLE ID ENTRY: {}'.format(const.ID_MIN, _max, entry))
 
-    return (action, acl)
+    return ACL(action, acl)
 
 def build_config(_config_file):
     config = configparser.ConfigParser()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+#
+###############################################################################
+#   Copyright (C) 2020-2021 Eric, KF7EEL, <kf7eel@qsl.net>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+Local queue for DMR data sequences passed between processes on the same host,
+e.g. to ipsc_to_mmdvm.py. A queue is named by its spool directory, such as
+/tmp/.hblink_data_que_ipsc/. The reader listens on a Unix datagram socket next
+to it (/tmp/.hblink_data_que_ipsc.sock) and sequences sent there are delivered
+straight away. If nothing is listening, the sequence is left in the spool
+directory as a file, like before, and the reader picks it up when it next
+checks. A sequence is the str() of a list of packets in both cases.
+'''
+
+import os
+import ast
+import socket
+from itertools import count
+
+from twisted.internet.protocol import DatagramProtocol
+from twisted.internet import reactor, task
+
+# The module needs logging, but handlers, etc. are controlled by the parent
+import logging
+logger = logging.getLogger(__name__)
+
+__author__     = 'Eric Craw, KF7EEL'
+__copyright__  = 'Copyright (c) 2020-2021, Eric Craw, KF7EEL'
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Eric Craw, KF7EEL'
+__email__      = 'kf7eel@qsl.net'
+
+# Seconds between checks of the spool directory for sequences left while nothing was listening
+SPOOL_INTERVAL = 1
+# Largest sequence sent over the socket, the reader receives up to this much (Twisted would cut
+# datagrams off at 8192 bytes). Anything bigger always goes through the spool directory.
+QUE_PACKET_SIZE = 65536
+
+_spool_count = count()
+
+
+def que_sock(_que_dir):
+    return _que_dir.rstrip('/') + '.sock'
+
+# Send a sequence to a queue, to the socket if the reader is listening or the spool directory if not
+def que_send(_que_dir, _seq):
+    _message = str(_seq)
+    _data = _message.encode()
+    if len(_data) <= QUE_PACKET_SIZE:
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as _sock:
+                _sock.setblocking(False)
+                _sock.sendto(_data, que_sock(_que_dir))
+            return True
+        except OSError:
+            # Not listening or busy
+            pass
+    try:
+        os.makedirs(_que_dir, exist_ok = True)
+        # Written beside the directory and moved in, so the reader never sees half a file
+        _name = '{}-{}.mmdvm_seq'.format(os.getpid(), next(_spool_count))
+        _tmp = '{}.{}'.format(_que_dir.rstrip('/'), _name)
+        with open(_tmp, 'w') as _f:
+            _f.write(_message)
+        os.rename(_tmp, os.path.join(_que_dir, _name))
+        return True
+    except OSError as e:
+        logger.error('Could not queue data sequence in %s: %s', _que_dir, e)
+        return False
+
+
+class DataQue(DatagramProtocol):
+    def __init__(self, _que_dir, _handler, _interval = SPOOL_INTERVAL):
+        self._que_dir = _que_dir
+        # Called with each sequence (a list of packets) as it arrives
+        self._handler = _handler
+        self._interval = _interval
+        self._spool_task = None
+
+    def start(self):
+        os.makedirs(self._que_dir, exist_ok = True)
+        try:
+            os.remove(que_sock(self._que_dir))
+        except OSError:
+            pass
+        _port = reactor.listenUNIXDatagram(que_sock(self._que_dir), self, maxPacketSize = QUE_PACKET_SIZE, mode = 0o660)
+        self._spool_task = task.LoopingCall(self.read_spool)
+        self._spool_task.start(self._interval)
+        return _port
+
+    def datagramReceived(self, _data, _addr):
+        self.deliver(_data.decode(), 'socket')
+
+    def read_spool(self):
+        try:
+            _entries = list(os.scandir(self._que_dir))
+        except OSError as e:
+            logger.error('Could not read data queue %s: %s', self._que_dir, e)
+            return
+        for _entry in _entries:
+            try:
+                with open(_entry.path, 'r') as _f:
+                    _message = _f.read()
+                os.remove(_entry.path)
+            except OSError as e:
+                logger.error('Could not read %s: %s', _entry.path, e)
+                continue
+            self.deliver(_message, _entry.name)
+
+    def deliver(self, _message, _source):
+        try:
+            _seq = ast.literal_eval(_message)
+        except (ValueError, SyntaxError):
+            logger.error('Bad data sequence from %s, discarded', _source)
+            return
+        try:
+            self._handler(_seq)
+        except Exception as e:
+            logger.error('Error handling data sequence from %s: %s', _source, e)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+#
+###############################################################################
+#   Copyright (C) 2020-2021 Eric, KF7EEL, <kf7eel@qsl.net>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+Throughput of the local data queue (data_que.py). Another process sends
+sequences to a DataQue reader as fast as it can, and the time until the reader
+has them all is measured. Most are short SMS sequences, every LONG_EVERY one is
+LONG_PACKETS packets, well over 8192 bytes. The same is then done with nothing
+listening, so everything is spooled, and the reader is started afterwards to
+drain it. Every sequence must arrive, unchanged.
+
+    python3 data_que_bench.py -n 10000
+'''
+
+import os
+import sys
+import shutil
+import argparse
+import subprocess
+import tempfile
+from time import time
+
+from twisted.internet import reactor
+
+from data_que import DataQue, que_send
+
+__author__     = 'Eric Craw, KF7EEL'
+__copyright__  = 'Copyright (c) 2020-2021, Eric Craw, KF7EEL'
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Eric Craw, KF7EEL'
+__email__      = 'kf7eel@qsl.net'
+
+# Packets in a short sequence and a long one, and how often a long one is sent
+SHORT_PACKETS = 6
+LONG_PACKETS = 100
+LONG_EVERY = 100
+
+
+def sequence(_n):
+    _packets = LONG_PACKETS if _n % LONG_EVERY == 0 else SHORT_PACKETS
+    return [b'DMRD' + _n.to_bytes(4, 'big') + bytes([_p % 256]) * 47 for _p in range(_packets)]
+
+
+def send(_que_dir, _count):
+    for _n in range(_count):
+        if not que_send(_que_dir, sequence(_n)):
+            sys.exit('Could not queue sequence {}'.format(_n))
+
+
+def run(_que_dir, _count, _spool_first):
+    _received = {}
+    _times = {}
+
+    def handler(_seq):
+        _n = int.from_bytes(_seq[0][4:8], 'big')
+        _received[_n] = _seq == sequence(_n)
+        if len(_received) == _count:
+            _times['DONE'] = time()
+            reactor.stop()
+
+    def start_reader():
+        _times['READER'] = time()
+        DataQue(_que_dir, handler, 0.05).start()
+
+    def start_sender():
+        _times['START'] = time()
+        _proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--send', _que_dir, '-n', str(_count)])
+        if _spool_first:
+            # Nothing listening until the sender has finished
+            _proc.wait()
+            _times['SENT'] = time()
+            reactor.callLater(0, start_reader)
+
+    if not _spool_first:
+        start_reader()
+    reactor.callWhenRunning(start_sender)
+    reactor.callLater(120, reactor.stop)
+    reactor.run()
+    _bad = [_n for _n in _received if not _received[_n]]
+    return _received, _bad, _times
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--count', action='store', dest='COUNT', type=int, default=10000, help='Sequences to send.')
+    parser.add_argument('--mode', action='store', dest='MODE', choices=['socket', 'spool'], help='Only run one of the two.')
+    parser.add_argument('--send', action='store', dest='SEND', help=argparse.SUPPRESS)
+    cli_args = parser.parse_args()
+
+    if cli_args.SEND:
+        send(cli_args.SEND, cli_args.COUNT)
+        sys.exit(0)
+
+    # A reactor can only be run once, so each mode has its own process
+    if not cli_args.MODE:
+        failed = False
+        for mode in ['socket', 'spool']:
+            if subprocess.call([sys.executable, os.path.abspath(__file__), '-n', str(cli_args.COUNT), '--mode', mode]):
+                failed = True
+        sys.exit(1 if failed else 0)
+
+    que_dir = tempfile.mkdtemp(prefix = 'hbnet_que_bench_') + '/que/'
+    try:
+        received, bad, times = run(que_dir, cli_args.COUNT, cli_args.MODE == 'spool')
+    finally:
+        shutil.rmtree(os.path.dirname(que_dir.rstrip('/')))
+    long_count = len([n for n in received if n % LONG_EVERY == 0])
+    if cli_args.MODE == 'spool':
+        print('spool:  {} of {} sequences ({} long, {} bytes), written in {:.2f}s, drained in {:.2f}s'.format(len(received), cli_args.COUNT, long_count, len(str(sequence(0))), times['SENT'] - times['START'], times.get('DONE', time()) - times['READER']))
+    else:
+        print('socket: {} of {} sequences ({} long, {} bytes), delivered in {:.2f}s'.format(len(received), cli_args.COUNT, long_count, len(str(sequence(0))), times.get('DONE', time()) - times['START']))
+    if len(received) != cli_args.COUNT or bad:
+        sys.exit('{} sequences missing, {} changed'.format(cli_args.COUNT - len(received), len(bad)))
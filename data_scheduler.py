@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+#
+###############################################################################
+#   Copyright (C) 2020-2021 Eric, KF7EEL, <kf7eel@qsl.net>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+Sends DMR data sequences (SMS, etc.) out at the pace of the air interface
+without ever blocking the reactor. Sequences are queued per system and slot,
+only one sequence is sent on a slot at a time, its bursts go out one every
+60ms and there is a gap before each sequence starts. Higher priority
+sequences jump the queue, and each queue has a maximum depth.
+'''
+
+import heapq
+from itertools import count
+
+from twisted.internet import reactor
+from twisted.python.threadable import isInIOThread
+
+# The module needs logging, but handlers, etc. are controlled by the parent
+import logging
+logger = logging.getLogger(__name__)
+
+__author__     = 'Eric Craw, KF7EEL'
+__copyright__  = 'Copyright (c) 2020-2021, Eric Craw, KF7EEL'
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Eric Craw, KF7EEL'
+__email__      = 'kf7eel@qsl.net'
+
+# Seconds between bursts, one DMR burst per slot every 60ms
+BURST_INTERVAL = 0.06
+# Seconds of quiet on a slot before a sequence starts, this also gives a radio that has just
+# sent us something time to go back to receive before a reply comes
+SEQUENCE_GAP = 1
+# Most sequences waiting on one system and slot
+MAX_QUEUE = 64
+
+# Lower numbers go first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+
+class DataScheduler(object):
+    def __init__(self, _burst_interval = BURST_INTERVAL, _gap = SEQUENCE_GAP, _max_queue = MAX_QUEUE, _reactor = reactor):
+        self._burst_interval = _burst_interval
+        self._gap = _gap
+        self._max_queue = _max_queue
+        self._reactor = _reactor
+        # Waiting sequences, format: (system, slot): [(priority, order, packets, send function), ...] (a heap)
+        self._queues = {}
+        # Slots in use, format: (system, slot): the IDelayedCall for the next burst or the end of the gap
+        self._busy = {}
+        self._order = count()
+
+    # Queue a sequence of packets for a system and slot. _send is called with each packet in
+    # turn. Returns False if the queue was full and the sequence was dropped. Safe to call from
+    # other threads, the work is handed to the reactor.
+    def queue(self, _system, _slot, _packets, _send, _priority = PRIORITY_NORMAL):
+        if not isInIOThread():
+            self._reactor.callFromThread(self.queue, _system, _slot, _packets, _send, _priority)
+            return True
+
+        _key = (_system, _slot)
+        _queue = self._queues.setdefault(_key, [])
+        if len(_queue) >= self._max_queue:
+            logger.warning('Data queue for %s TS%s full, dropping sequence', _system, _slot)
+            return False
+        heapq.heappush(_queue, (_priority, next(self._order), list(_packets), _send))
+        if _key not in self._busy:
+            self._busy[_key] = self._reactor.callLater(self._gap, self._start, _key)
+        return True
+
+    def pending(self, _system, _slot):
+        return len(self._queues.get((_system, _slot), []))
+
+    def _start(self, _key):
+        _queue = self._queues.get(_key)
+        if not _queue:
+            self._busy.pop(_key, None)
+            self._queues.pop(_key, None)
+            return
+        _priority, _order, _packets, _send = heapq.heappop(_queue)
+        self._burst(_key, _packets, 0, _send)
+
+    def _burst(self, _key, _packets, _index, _send):
+        if _index < len(_packets):
+            try:
+                _send(_packets[_index])
+            except Exception as e:
+                logger.error('Error sending data on %s TS%s: %s', _key[0], _key[1], e)
+            self._busy[_key] = self._reactor.callLater(self._burst_interval, self._burst, _key, _packets, _index + 1, _send)
+        else:
+            self._busy[_key] = self._reactor.callLater(self._gap, self._start, _key)
+
+    # Drop everything waiting and stop sending
+    def stop(self):
+        for _call in self._busy.values():
+            if _call.active():
+                _call.cancel()
+        self._busy = {}
+        self._queues = {}
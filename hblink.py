@@ -64,7 +64,10 @@ import libscrc
 import re
 
 # Encryption library
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, MultiFernet
+
+# Non-blocking web service client
+from web_client import get_client, UNREACHABLE
 
 
 # Does anybody read this stuff? There's a PEP somewhere that says I should do this.
@@ -78,16 +81,35 @@ __email__      = 'n0mjs@me.com'
 # Global variables used whether we are a module or __main__
 systems = {}
 
+# Last answer from the web service for each login ID. Used as the fallback when the
+# web service is slow or unreachable, format: login_id: response
+UMS_CACHE = {}
+
+# Cipher objects already built for each ENCRYPTION_KEY, format: key: Fernet|MultiFernet
+CIPHERS = {}
+
+# ENCRYPTION_KEY may hold several comma separated keys while a key is being rotated. The
+# first key encrypts, any of them will decrypt.
+def get_cipher(key):
+    try:
+        return CIPHERS[key]
+    except KeyError:
+        _keys = [_key.strip() for _key in key.split(b',')]
+        if len(_keys) == 1:
+            _cipher = Fernet(_keys[0])
+        else:
+            _cipher = MultiFernet([Fernet(_key) for _key in _keys])
+        CIPHERS[key] = _cipher
+        return _cipher
+
 # Functions that provide a basic symetrical encryption using Fernet
 def encrypt_packet(key, message):
-    f = Fernet(key)
-    token = f.encrypt(message)
+    token = get_cipher(key).encrypt(message)
 
     return token
 
 def decrypt_packet(key, message):
-    f = Fernet(key)
-    token = f.decrypt(message, ttl=1)
+    token = get_cipher(key).decrypt(message, ttl=1)
 
     return token
 
@@ -112,22 +134,18 @@ def config_reports(_config, _factory):
 # Shut ourselves down gracefully by disconnecting from the masters and peers.
 def hblink_handler(_signal, _frame):
     for system in systems:
+        # Systems that never started (owned by another bridge.py worker) have nothing to de-register
+        if not systems[system].transport:
+            continue
         logger.info('(GLOBAL) SHUTDOWN: DE-REGISTER SYSTEM: %s', system)
         systems[system].dereg()
 
 # Check a supplied ID against the ACL provided. Returns action (True|False) based
 # on matching and the action specified.
+# ACLs are compiled by acl_build when the config is loaded, every config path (local
+# file, downloaded config, proxy MASTERs) hands over an ACL, never a string.
 def acl_check(_id, _acl):
-    id = int_id(_id)
-
-    # if acl string, build tuple
-    if type(_acl) == str:
-        _acl = acl_build(_acl, 4294967295)
-    
-    for entry in _acl[1]:
-        if entry[0] <= id <= entry[1]:
-            return _acl[0]
-    return not _acl[0]
+    return _acl.check(int_id(_id))
 
 
 def download_burnlist(_CONFIG):
@@ -290,6 +308,9 @@ class HBSYSTEM(DatagramProtocol):
         # Define shortcuts and generic function names based on the type of system we are
         if self._config['MODE'] == 'MASTER':
             self._peers = self._CONFIG['SYSTEMS'][self._system]['PEERS']
+            self._web_service = get_client(self._CONFIG['WEB_SERVICE']['URL'])
+            # Peers with an RPTL waiting on the web service
+            self._pending_logins = set()
             self.send_system = self.send_peers
             self.maintenance_loop = self.master_maintenance_loop
             self.datagramReceived = self.master_datagramReceived
@@ -309,31 +330,42 @@ class HBSYSTEM(DatagramProtocol):
             self.datagramReceived = self.peer_datagramReceived
             self.dereg = self.peer_dereg
             
+    # Ask the web service if a peer may log in. Returns a deferred that always fires with a
+    # response. Only if the web service can't be reached or doesn't answer in time is the last
+    # known answer for this ID used, or the login allowed if we've never heard about it. An
+    # error status (a wrong shared secret is a 401), a reply that makes no sense, or too many
+    # logins already waiting denies it, the peer sends its RPTL again.
     def check_user_man(self, _id, server_name, peer_ip, _system):
-        #Change this to a config value
-        user_man_url = self._CONFIG['WEB_SERVICE']['URL']
         shared_secret = str(sha256(self._CONFIG['WEB_SERVICE']['SHARED_SECRET'].encode()).hexdigest())
-##        print(int(str(int_id(_id))[:7]))
+        _login_id = int(str(int_id(_id))[:7])
         auth_check = {
         'secret':shared_secret,
-        'login_id':int(str(int_id(_id))[:7]),
+        'login_id':_login_id,
         'login_ip': peer_ip,
         'login_server': server_name,
         'system': _system
         }
-        json_object = json.dumps(auth_check, indent = 4)
-        try:
-            req = requests.post(user_man_url, data=json_object, headers={'Content-Type': 'application/json'})
-            resp = json.loads(req.text)
-            print(resp)
+
+        def _answer(resp):
+            if not isinstance(resp, dict) or 'allow' not in resp:
+                logger.error('(%s) Invalid web service login answer for %s, login denied: %s', self._system, _login_id, resp)
+                return {'allow':False}
+            UMS_CACHE[_login_id] = resp
             return resp
-        except requests.ConnectionError:
-            return {'allow':True}
+
+        def _fallback(failure):
+            if failure.check(*UNREACHABLE):
+                logger.warning('(%s) Web service login check failed for %s, using cached or default decision: %s', self._system, _login_id, failure.getErrorMessage())
+                return UMS_CACHE.get(_login_id, {'allow':True})
+            logger.error('(%s) Web service login check failed for %s, login denied: %s', self._system, _login_id, failure.getErrorMessage())
+            return {'allow':False}
+
+        _d = self._web_service.post(auth_check)
+        _d.addCallbacks(_answer, _fallback)
+        return _d
         
 # Sends login confirmation for log
     def send_login_conf(self, _id, server_name, peer_ip, old_auth):
-        #Change this to a config value
-        user_man_url = self._CONFIG['WEB_SERVICE']['URL']
         shared_secret = str(sha256(self._CONFIG['WEB_SERVICE']['SHARED_SECRET'].encode()).hexdigest())
         #print(int(str(int_id(_id))[:7]))
         auth_conf = {
@@ -344,18 +376,10 @@ class HBSYSTEM(DatagramProtocol):
         'login_confirmed': True,
         'old_auth': old_auth
         }
-##        print(auth_conf)
-        json_object = json.dumps(auth_conf, indent = 4)
-        try:
-            req = requests.post(user_man_url, data=json_object, headers={'Content-Type': 'application/json'})
-        #    resp = json.loads(req.text)
-        #return resp
-        except Exception as e:
-            logger.info(e)
+        self._web_service.post(auth_conf).addErrback(lambda failure: logger.info('(%s) Login confirmation not sent: %s', self._system, failure.getErrorMessage()))
+
 # Sends PEER info for map and other stuff            
     def send_peer_loc(self, _id, call, lat, lon, url, description, loc, soft):
-        #Change this to a config value
-        user_man_url = self._CONFIG['WEB_SERVICE']['URL']
         shared_secret = str(sha256(self._CONFIG['WEB_SERVICE']['SHARED_SECRET'].encode()).hexdigest())
         peer_loc_conf = {
         'secret':shared_secret,
@@ -368,30 +392,20 @@ class HBSYSTEM(DatagramProtocol):
         'loc' : re.sub("b'|'|\s\s+", '', str(loc)),
         'software': re.sub("b'|'|\s\s+", '', str(soft))
         }
-        json_object = json.dumps(peer_loc_conf, indent = 4)
-        print()
-        print()
-        print(json_object)
-        print()
-        print()
-        try:
-            req = requests.post(user_man_url, data=json_object, headers={'Content-Type': 'application/json'})
-        #    resp = json.loads(req.text)
-        #return resp
-        except Exception as e:
-            logger.info(e)
+        self._web_service.post(peer_loc_conf).addErrback(lambda failure: logger.info('(%s) Peer location not sent: %s', self._system, failure.getErrorMessage()))
 
     def calc_passphrase(self, peer_id, _salt_str):
         burn_id = ast.literal_eval(os.popen('cat ' + self._CONFIG['WEB_SERVICE']['BURN_FILE']).read())
         peer_id_trimmed = int(str(int_id(peer_id))[:7])
         try:
-##            print(self.ums_response)
-            if self.ums_response['mode'] == 'legacy':
+            # The web service answer for this peer's login, kept by rptl_auth()
+            ums_response = self._peers[peer_id]['UMS_RESPONSE']
+            if ums_response['mode'] == 'legacy':
                 _calc_hash = bhex(sha256(_salt_str+self._config['PASSPHRASE']).hexdigest())
                 calc_passphrase = self._config['PASSPHRASE']
-            if self.ums_response['mode'] == 'override':
-                _calc_hash = bhex(sha256(_salt_str+str.encode(self.ums_response['value'])).hexdigest())
-            if self.ums_response['mode'] == 'normal':
+            if ums_response['mode'] == 'override':
+                _calc_hash = bhex(sha256(_salt_str+str.encode(ums_response['value'])).hexdigest())
+            if ums_response['mode'] == 'normal':
                 _new_peer_id = bytes_4(int(str(int_id(peer_id))[:7]))
                 peer_id_trimmed = str(peer_id_trimmed)
                 try:
@@ -529,6 +543,67 @@ class HBSYSTEM(DatagramProtocol):
         self.send_master(RPTCL + self._config['RADIO_ID'])
         logger.info('(%s) De-Registration sent to Master: %s:%s', self._system, self._config['MASTER_SOCKADDR'][0], self._config['MASTER_SOCKADDR'][1])
 
+    # Continues an RPTL login once the web service has answered check_user_man
+    def ums_login(self, _ums_response, _peer_id, _sockaddr):
+        self._pending_logins.discard(_peer_id)
+        #Will allow anyone to attempt authentication, used for a transition period
+##        if acl_check(_peer_id, self._CONFIG['GLOBAL']['REG_ACL']) and _ums_response['allow'] or acl_check(_peer_id, self._CONFIG['GLOBAL']['REG_ACL']) and acl_check(_peer_id, self._config['REG_ACL']):
+        if acl_check(_peer_id, self._CONFIG['GLOBAL']['REG_ACL']) and _ums_response['allow']:
+            user_auth = _ums_response['allow']
+        else:
+            user_auth = False
+        # Peers may have logged in while we were waiting
+        if _peer_id not in self._peers and len(self._peers) >= self._config['MAX_PEERS']:
+            self.transport.write(b''.join([MSTNAK, _peer_id]), _sockaddr)
+            logger.warning('(%s) Registration denied from Radio ID: %s Maximum number of peers exceeded', self._system, int_id(_peer_id))
+            return
+        self.rptl_auth(_peer_id, _sockaddr, user_auth, _ums_response)
+
+    def ums_login_failed(self, _failure, _peer_id):
+        self._pending_logins.discard(_peer_id)
+        logger.error('(%s) Error processing login for Radio ID: %s -- %s', self._system, int_id(_peer_id), _failure.getErrorMessage())
+
+    # Answers an RPTL with a challenge if the peer is allowed to log in, or a NAK if not.
+    # _ums_response is the web service answer for this peer, calc_passphrase() checks the RPTK with it.
+    def rptl_auth(self, _peer_id, _sockaddr, user_auth, _ums_response = None):
+        if user_auth == True:
+        # Build the configuration data strcuture for the peer
+            self._peers.update({_peer_id: {
+                'CONNECTION': 'RPTL-RECEIVED',
+                'CONNECTED': time(),
+                'PINGS_RECEIVED': 0,
+                'LAST_PING': time(),
+                'SOCKADDR': _sockaddr,
+                'IP': _sockaddr[0],
+                'PORT': _sockaddr[1],
+                'SALT': randint(0,0xFFFFFFFF),
+                'RADIO_ID': str(int(ahex(_peer_id), 16)),
+                'CALLSIGN': '',
+                'RX_FREQ': '',
+                'TX_FREQ': '',
+                'TX_POWER': '',
+                'COLORCODE': '',
+                'LATITUDE': '',
+                'LONGITUDE': '',
+                'HEIGHT': '',
+                'LOCATION': '',
+                'DESCRIPTION': '',
+                'SLOTS': '',
+                'URL': '',
+                'SOFTWARE_ID': '',
+                'PACKAGE_ID': '',
+                'UMS_RESPONSE': _ums_response,
+            }})
+            logger.info('(%s) Repeater Logging in with Radio ID: %s, %s:%s', self._system, int_id(_peer_id), _sockaddr[0], _sockaddr[1])
+            _salt_str = bytes_4(self._peers[_peer_id]['SALT'])
+            self.send_peer(_peer_id, b''.join([RPTACK, _salt_str]))
+            self._peers[_peer_id]['CONNECTION'] = 'CHALLENGE_SENT'
+            logger.info('(%s) Sent Challenge Response to %s for login: %s', self._system, int_id(_peer_id), self._peers[_peer_id]['SALT'])
+##                    print(self._peers)
+        else:
+            self.transport.write(b''.join([MSTNAK, _peer_id]), _sockaddr)
+            logger.warning('(%s) Invalid Login from %s Radio ID: %s Denied by Registation ACL', self._system, _sockaddr[0], int_id(_peer_id))
+
     # Aliased in __init__ to datagramReceived if system is a master
     def master_datagramReceived(self, _data, _sockaddr):
         # Keep This Line Commented Unless HEAVILY Debugging!
@@ -608,22 +683,18 @@ class HBSYSTEM(DatagramProtocol):
 
         elif _command == RPTL:    # RPTLogin -- a repeater wants to login
             _peer_id = _data[4:8]
-##            print()
-##            print((self._config['REG_ACL']))
-##            print()
             # Check to see if we've reached the maximum number of allowed peers
             if len(self._peers) < self._config['MAX_PEERS']:
                 # Check for valid Radio ID
-                #print(self.check_user_man(_peer_id))
                 if self._config['USE_USER_MAN'] == True:
-                    self.ums_response = self.check_user_man(_peer_id, self._CONFIG['WEB_SERVICE']['THIS_SERVER_NAME'], _sockaddr[0], self._system)
-##                    print(self.ums_response)
-                    #Will allow anyone to attempt authentication, used for a transition period
-##                    if acl_check(_peer_id, self._CONFIG['GLOBAL']['REG_ACL']) and self.ums_response['allow'] or acl_check(_peer_id, self._CONFIG['GLOBAL']['REG_ACL']) and acl_check(_peer_id, self._config['REG_ACL']):
-                    if acl_check(_peer_id, self._CONFIG['GLOBAL']['REG_ACL']) and self.ums_response['allow']:
-                        user_auth = self.ums_response['allow']
-                    else:
-                        user_auth = False
+                    # Don't wait on the web service here, the login carries on in ums_login when
+                    # it answers. Repeats of the RPTL while we wait are ignored.
+                    if _peer_id not in self._pending_logins:
+                        self._pending_logins.add(_peer_id)
+                        _d = self.check_user_man(_peer_id, self._CONFIG['WEB_SERVICE']['THIS_SERVER_NAME'], _sockaddr[0], self._system)
+                        _d.addCallback(self.ums_login, _peer_id, _sockaddr)
+                        _d.addErrback(self.ums_login_failed, _peer_id)
+                    return
                 elif self._config['USE_USER_MAN'] == False:
                     print('False')
                     b_acl = self._config['REG_ACL']
@@ -639,42 +710,7 @@ class HBSYSTEM(DatagramProtocol):
                         user_auth = False
                         if acl_check(_peer_id, self._CONFIG['GLOBAL']['REG_ACL']) and acl_check(_peer_id, b_acl):#acl_check(_peer_id, b_acl):
                             user_auth = True
-                if user_auth == True:
-                # Build the configuration data strcuture for the peer
-                    self._peers.update({_peer_id: {
-                        'CONNECTION': 'RPTL-RECEIVED',
-                        'CONNECTED': time(),
-                        'PINGS_RECEIVED': 0,
-                        'LAST_PING': time(),
-                        'SOCKADDR': _sockaddr,
-                        'IP': _sockaddr[0],
-                        'PORT': _sockaddr[1],
-                        'SALT': randint(0,0xFFFFFFFF),
-                        'RADIO_ID': str(int(ahex(_peer_id), 16)),
-                        'CALLSIGN': '',
-                        'RX_FREQ': '',
-                        'TX_FREQ': '',
-                        'TX_POWER': '',
-                        'COLORCODE': '',
-                        'LATITUDE': '',
-                        'LONGITUDE': '',
-                        'HEIGHT': '',
-                        'LOCATION': '',
-                        'DESCRIPTION': '',
-                        'SLOTS': '',
-                        'URL': '',
-                        'SOFTWARE_ID': '',
-                        'PACKAGE_ID': '',
-                    }})
-                    logger.info('(%s) Repeater Logging in with Radio ID: %s, %s:%s', self._system, int_id(_peer_id), _sockaddr[0], _sockaddr[1])
-                    _salt_str = bytes_4(self._peers[_peer_id]['SALT'])
-                    self.send_peer(_peer_id, b''.join([RPTACK, _salt_str]))
-                    self._peers[_peer_id]['CONNECTION'] = 'CHALLENGE_SENT'
-                    logger.info('(%s) Sent Challenge Response to %s for login: %s', self._system, int_id(_peer_id), self._peers[_peer_id]['SALT'])
-##                    print(self._peers)
-                else:
-                    self.transport.write(b''.join([MSTNAK, _peer_id]), _sockaddr)
-                    logger.warning('(%s) Invalid Login from %s Radio ID: %s Denied by Registation ACL', self._system, _sockaddr[0], int_id(_peer_id))
+                self.rptl_auth(_peer_id, _sockaddr, user_auth)
             else:
                 self.transport.write(b''.join([MSTNAK, _peer_id]), _sockaddr)
                 logger.warning('(%s) Registration denied from Radio ID: %s Maximum number of peers exceeded', self._system, int_id(_peer_id))
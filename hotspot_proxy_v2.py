@@ -20,7 +20,7 @@ from twisted.internet.protocol import DatagramProtocol
 from twisted.internet import reactor, task
 from time import time
 from dmr_utils3.utils import int_id
-import random
+from collections import deque
 import ipaddress
 import os
 from setproctitle import setproctitle
@@ -34,6 +34,28 @@ __license__    = 'GNU GPLv3'
 __maintainer__ = 'Simon Adlem G7RZU'
 __email__      = 'simon@gb7fr.org.uk'
 
+# HomeBrew Protocol Commands
+DMRD    = b'DMRD'
+DMRA    = b'DMRA'
+MSTCL   = b'MSTCL'
+MSTNAK  = b'MSTNAK'
+MSTPONG = b'MSTPONG'
+MSTN    = b'MSTN'
+MSTP    = b'MSTP'
+MSTC    = b'MSTC'
+RPTL    = b'RPTL'
+RPTPING = b'RPTPING'
+RPTCL   = b'RPTCL'
+RPTACK  = b'RPTACK'
+RPTK    = b'RPTK'
+RPTC    = b'RPTC'
+RPTP    = b'RPTP'
+RPTA    = b'RPTA'
+RPTO    = b'RPTO'
+
+# Seconds a client has to answer after the master sends MSTN or MSTC
+CLOSE_TIMEOUT = 15
+
 def IsIPv4Address(ip):
     try:
         ipaddress.IPv4Address(ip)
@@ -61,9 +83,47 @@ class Proxy(DatagramProtocol):
         self.blackList = blackList
         self.destPortStart = DestportStart
         self.destPortEnd = DestPortEnd
-        self.numPorts = DestPortEnd - DestportStart
-        
-        
+        # Ports not in use, the longest free is handed out first
+        self.freePorts = deque(port for port in connTrack if not connTrack[port])
+        # Timer wheel for reaping quiet clients, format: second: set(peer_ids). A client
+        # only sits in one slot, activity just moves its expiry time, and it is moved on
+        # to a later slot when its slot comes round (see reap_loop)
+        self.wheel = {}
+        self.wheelSecond = int(time())
+
+    def startProtocol(self):
+        self.reapTask = task.LoopingCall(self.reap_loop)
+        self.reapTask.start(1)
+
+    def stopProtocol(self):
+        if self.reapTask.running:
+            self.reapTask.stop()
+
+    # (Re)set when a client will be reaped if we hear nothing more from it
+    def set_timer(self,_peer_id,_timeout):
+        _peer = self.peerTrack[_peer_id]
+        _peer['expires'] = time() + _timeout
+        _slot = int(_peer['expires']) + 1
+        # Only a shorter timeout needs the client moved now
+        if _slot < _peer['slot']:
+            self.wheel.setdefault(_slot, set()).add(_peer_id)
+            _peer['slot'] = _slot
+
+    def reap_loop(self):
+        _now = time()
+        while self.wheelSecond <= int(_now):
+            for _peer_id in self.wheel.pop(self.wheelSecond, ()):
+                _peer = self.peerTrack.get(_peer_id)
+                # Gone, or moved to an earlier slot and already dealt with
+                if not _peer or _peer['slot'] != self.wheelSecond:
+                    continue
+                if _peer['expires'] <= _now:
+                    self.reaper(_peer_id)
+                else:
+                    _peer['slot'] = int(_peer['expires']) + 1
+                    self.wheel.setdefault(_peer['slot'], set()).add(_peer_id)
+            self.wheelSecond += 1
+
     def reaper(self,_peer_id):
         if self.debug:
             print("dead",_peer_id)
@@ -71,31 +131,12 @@ class Proxy(DatagramProtocol):
             print(f"{datetime.now().replace(microsecond=0)} Client: ID:{str(int_id(_peer_id)).rjust(9)} IP:{self.peerTrack[_peer_id]['shost'].rjust(15)} Port:{self.peerTrack[_peer_id]['sport']} Removed.")
         self.transport.write(b'RPTCL'+_peer_id, (self.master,self.peerTrack[_peer_id]['dport']))
         self.connTrack[self.peerTrack[_peer_id]['dport']] = False
+        self.freePorts.append(self.peerTrack[_peer_id]['dport'])
         del self.peerTrack[_peer_id]
         
 
     def datagramReceived(self, data, addr):
         
-        # HomeBrew Protocol Commands
-        DMRD    = b'DMRD'
-        DMRA    = b'DMRA'
-        MSTCL   = b'MSTCL'
-        MSTNAK  = b'MSTNAK'
-        MSTPONG = b'MSTPONG'
-        MSTN    = b'MSTN'
-        MSTP    = b'MSTP'
-        MSTC    = b'MSTC'
-        RPTL    = b'RPTL'
-        RPTPING = b'RPTPING'
-        RPTCL   = b'RPTCL'
-        RPTL    = b'RPTL'
-        RPTACK  = b'RPTACK'
-        RPTK    = b'RPTK'
-        RPTC    = b'RPTC'
-        RPTP    = b'RPTP'
-        RPTA    = b'RPTA'
-        RPTO    = b'RPTO'
-        
         _peer_id = False
         
         host,port = addr
@@ -129,7 +170,7 @@ class Proxy(DatagramProtocol):
                 # Remove the client after send a MSTN or MSTC packet
                 if _command in (MSTN,MSTC):
                     # Give time to the client for a reply to prevent port reassignment 
-                    self.peerTrack[_peer_id]['timer'].reset(15)
+                    self.set_timer(_peer_id,CLOSE_TIMEOUT)
  
             return
             
@@ -162,7 +203,7 @@ class Proxy(DatagramProtocol):
                 self.peerTrack[_peer_id]['sport'] = port
                 self.peerTrack[_peer_id]['shost'] = host
                 self.transport.write(data, (self.master,_dport))
-                self.peerTrack[_peer_id]['timer'].reset(self.timeout)
+                self.set_timer(_peer_id,self.timeout)
                 if self.debug:
                     print(data)
                 return
@@ -170,10 +211,9 @@ class Proxy(DatagramProtocol):
             else:
                 if int_id(_peer_id) in self.blackList:
                     return   
-                # Make a list with the available ports
-                _ports_avail = [port for port in self.connTrack if not self.connTrack[port]]
-                if _ports_avail:
-                    _dport = random.choice(_ports_avail)
+                # Take the next free port
+                if self.freePorts:
+                    _dport = self.freePorts.popleft()
                 else:
                     return
                 self.connTrack[_dport] = _peer_id
@@ -181,7 +221,9 @@ class Proxy(DatagramProtocol):
                 self.peerTrack[_peer_id]['dport'] = _dport
                 self.peerTrack[_peer_id]['sport'] = port
                 self.peerTrack[_peer_id]['shost'] = host
-                self.peerTrack[_peer_id]['timer'] = reactor.callLater(self.timeout,self.reaper,_peer_id)
+                self.peerTrack[_peer_id]['expires'] = nowtime + self.timeout
+                self.peerTrack[_peer_id]['slot'] = int(nowtime + self.timeout) + 1
+                self.wheel.setdefault(self.peerTrack[_peer_id]['slot'], set()).add(_peer_id)
                 self.transport.write(data, (self.master,_dport))
 
                 if self.clientinfo and _peer_id != b'\xff\xff\xff\xff':
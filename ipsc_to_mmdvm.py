@@ -36,6 +36,7 @@ from dmr_utils3.utils import bytes_3, int_id, get_alias
 from dmr_utils3 import decode, bptc, const
 import config
 import log
+from data_que import DataQue
 from const import *
 import re
 from pathlib import Path
@@ -65,27 +66,13 @@ def build_unit(CONFIG):
             UNIT.append(i[0])
     return UNIT
 # Functions
-def data_que_check():
-    l=task.LoopingCall(data_que_send)
-    l.start(1)
-def data_que_send():
-    #logger.info('Check SMS que')
-    try:
-        #logger.info(UNIT_MAP)
-        for packet_file in os.listdir('/tmp/.hblink_data_que_ipsc/'):
-            logger.info('Sending SMS')
-            data_file = ast.literal_eval(os.popen('cat /tmp/.hblink_data_que_ipsc/' + str(packet_file)).read())
-
-            for i in data_file:
-                #print(bytes.fromhex(str(i)))
-                for d in UNIT:
-                    systems[d].send_system(bytes.fromhex(i))
-            os.system('rm /tmp/.hblink_data_que_ipsc/' + packet_file)
-
-            
-
-    except Exception as e:
-        logger.info(e)
+# Called by DataQue with each sequence written to the queue
+def data_que_send(_seq):
+    logger.info('Sending SMS')
+    for i in _seq:
+        #print(bytes.fromhex(str(i)))
+        for d in UNIT:
+            systems[d].send_system(bytes.fromhex(i))
 
 def mmdvm_encapsulate(dst_id, src_id, peer_id, _seq, _slot, _call_type, _dtype_vseq, _stream_id, _dmr_data):
     signature = 'DMRD'
@@ -275,9 +262,8 @@ if __name__ == '__main__':
     def loopingErrHandle(failure):
         logger.error('(GLOBAL) STOPPING REACTOR TO AVOID MEMORY LEAK: Unhandled error in timed loop.\n %s', failure)
         reactor.stop()
-    Path('/tmp/.hblink_data_que_ipsc/').mkdir(parents=True, exist_ok=True)
     UNIT = build_unit(CONFIG)
-    data_que_check()
+    DataQue('/tmp/.hblink_data_que_ipsc/', data_que_send).start()
 
 
     reactor.run()
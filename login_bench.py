@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+#
+###############################################################################
+#   Copyright (C) 2020-2021 Eric, KF7EEL, <kf7eel@qsl.net>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+Checks the HBP login path (hblink.py check_user_man) against a stub web service
+running in another process. One master carries a voice stream between two
+peers, one frame every 60 ms, while a burst of logins waits DELAY seconds for
+the stub to answer. The time each frame takes to be repeated is measured
+before and during the burst, it must not go up.
+
+Other masters point at stubs that never answer, answer 401, answer something
+that isn't JSON, or aren't there at all, and each login must be allowed or
+denied the way check_user_man promises: only a web service that can't be
+reached falls back to the cached answer, or allows the login.
+
+    python3 login_bench.py -l 50 -d 2
+'''
+
+import sys
+import json
+import socket
+import struct
+import logging
+import argparse
+import subprocess
+from time import time, perf_counter
+
+from twisted.internet import reactor
+from twisted.internet.protocol import DatagramProtocol
+from twisted.web import server, resource
+
+import const
+import hblink
+from config import acl_build
+
+__author__     = 'Eric Craw, KF7EEL'
+__copyright__  = 'Copyright (c) 2020-2021, Eric Craw, KF7EEL'
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Eric Craw, KF7EEL'
+__email__      = 'kf7eel@qsl.net'
+
+# Seconds of voice before the logins start, and after the last one is answered
+QUIET = 2
+# Seconds between voice frames
+FRAME = 0.06
+# Most milliseconds a frame may take to be repeated while logins are waiting
+MAX_LATENCY = 50
+
+# Path on the stub, what each login should get (True: RPTACK, False: MSTNAK), and logins to try.
+# 'cached' only has one login, for an ID the web service said no to before.
+SCENARIOS = {
+    'slow':    ('/slow', True),
+    'hang':    ('/hang', True),
+    'cached':  ('/hang', False),
+    'deny401': ('/deny401', False),
+    'garbage': ('/garbage', False),
+    'down':    (None, True),
+}
+
+
+# The stub web service, what it answers depends on the path
+class StubWebService(resource.Resource):
+    isLeaf = True
+
+    def __init__(self, _delay):
+        resource.Resource.__init__(self)
+        self._delay = _delay
+
+    def render_POST(self, request):
+        _mode = request.path.decode()
+        json.loads(request.content.read())
+        if _mode == '/deny401':
+            request.setResponseCode(401)
+            return json.dumps({'message': 'Authentication error'}).encode()
+        if _mode == '/garbage':
+            return b'<html><body>Internal Server Error</body></html>'
+        if _mode == '/slow':
+            reactor.callLater(self._delay, self.answer, request)
+        # /hang never answers
+        return server.NOT_DONE_YET
+
+    def answer(self, _request):
+        _request.write(json.dumps({'allow': True, 'mode': 'normal'}).encode())
+        _request.finish()
+
+
+def stub(_delay):
+    _port = reactor.listenTCP(0, server.Site(StubWebService(_delay)), interface = '127.0.0.1')
+    print(_port.getHost().port)
+    sys.stdout.flush()
+    reactor.run()
+
+
+# A hotspot, counts the answers to its logins and times the voice frames it is sent
+class Hotspot(DatagramProtocol):
+    def __init__(self):
+        self.acks = 0
+        self.naks = 0
+        self.latency = []
+
+    def datagramReceived(self, _data, _sockaddr):
+        if _data[:6] == const.RPTACK:
+            self.acks += 1
+        elif _data[:6] == const.MSTNAK:
+            self.naks += 1
+        elif _data[:4] == const.DMRD:
+            self.latency.append((time(), (perf_counter() - struct.unpack('>d', _data[20:28])[0]) * 1000))
+
+
+def master_config(_url):
+    _config = {
+        'GLOBAL': {'REG_ACL': acl_build('PERMIT:ALL', const.PEER_MAX), 'USE_ACL': False, 'PING_TIME': 5, 'MAX_MISSED': 100},
+        'WEB_SERVICE': {'URL': _url, 'SHARED_SECRET': 'test', 'THIS_SERVER_NAME': 'bench', 'REMOTE_CONFIG_ENABLED': True},
+        'SYSTEMS': {'MASTER-1': {'MODE': 'MASTER', 'PEERS': {}, 'MAX_PEERS': 100000, 'REPEAT': True, 'USE_ACL': False, 'USE_USER_MAN': True}},
+    }
+    return _config
+
+
+def free_port():
+    _sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    _sock.bind(('127.0.0.1', 0))
+    _port = _sock.getsockname()[1]
+    _sock.close()
+    return _port
+
+
+def run(_logins, _delay):
+    _stub = subprocess.Popen([sys.executable, __file__, '--stub', '-d', str(_delay)], stdout = subprocess.PIPE)
+    try:
+        return logins_and_voice(int(_stub.stdout.readline()), _logins)
+    finally:
+        _stub.terminate()
+
+
+def logins_and_voice(_stub_port, _logins):
+    _masters = {}
+    _hotspots = {}
+    _peer_id = 1000000
+    for _name in SCENARIOS:
+        _path, _expect = SCENARIOS[_name]
+        _url = 'http://127.0.0.1:{}{}'.format(_stub_port if _path else free_port(), _path or '/svr')
+        _config = master_config(_url)
+        _masters[_name] = hblink.HBSYSTEM('MASTER-1', _config, None)
+        _masters[_name].port = reactor.listenUDP(0, _masters[_name], interface = '127.0.0.1')
+        _hotspots[_name] = Hotspot()
+        _hotspots[_name].port = reactor.listenUDP(0, _hotspots[_name], interface = '127.0.0.1')
+        # Every login is a different ID, so none of them has a cached answer
+        _ids = []
+        for _n in range(1 if _name == 'cached' else _logins):
+            _peer_id += 1
+            _ids.append(_peer_id.to_bytes(4, 'big'))
+        if _name == 'cached':
+            hblink.UMS_CACHE[_peer_id] = {'allow': False}
+        _hotspots[_name].ids = _ids
+
+    # Two peers on the slow master already logged in, one talking to the other
+    _talker = Hotspot()
+    _talker.port = reactor.listenUDP(0, _talker, interface = '127.0.0.1')
+    _listener = Hotspot()
+    _listener.port = reactor.listenUDP(0, _listener, interface = '127.0.0.1')
+    for _hotspot, _id in [(_talker, b'\x00\x0f\x00\x01'), (_listener, b'\x00\x0f\x00\x02')]:
+        _masters['slow']._peers[_id] = {'CONNECTION': 'YES', 'SOCKADDR': ('127.0.0.1', _hotspot.port.getHost().port), 'LAST_PING': time()}
+    _slow_addr = ('127.0.0.1', _masters['slow'].port.getHost().port)
+    _times = {}
+
+    def voice(_seq):
+        _data = b''.join([const.DMRD, bytes([_seq % 256]), (3120001).to_bytes(3, 'big'), (91).to_bytes(3, 'big'), b'\x00\x0f\x00\x01', b'\x81', b'\x00\x00\x00\x01', struct.pack('>d', perf_counter()), bytes(25)])
+        _talker.transport.write(_data, _slow_addr)
+        if 'DONE' not in _times or time() < _times['DONE'] + QUIET:
+            reactor.callLater(FRAME, voice, _seq + 1)
+        else:
+            reactor.stop()
+
+    def logins():
+        _times['LOGINS'] = time()
+        for _name in SCENARIOS:
+            _addr = ('127.0.0.1', _masters[_name].port.getHost().port)
+            for _id in _hotspots[_name].ids:
+                _hotspots[_name].transport.write(const.RPTL + _id, _addr)
+        check()
+
+    def check():
+        if all(_hotspots[_name].acks + _hotspots[_name].naks == len(_hotspots[_name].ids) for _name in SCENARIOS):
+            _times['DONE'] = time()
+        else:
+            reactor.callLater(0.05, check)
+
+    reactor.callWhenRunning(voice, 0)
+    reactor.callLater(QUIET, logins)
+    reactor.callLater(QUIET + 60, reactor.stop)
+    reactor.run()
+    return _hotspots, _listener.latency, _times
+
+
+def stats(_latency):
+    _latency = sorted(_latency)
+    if not _latency:
+        return 'no frames'
+    return '{} frames, median {:.2f} ms, max {:.2f} ms'.format(len(_latency), _latency[len(_latency) // 2], _latency[-1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-l', '--logins', action='store', dest='LOGINS', type=int, default=50, help='Logins sent to each master, past web_client.WS_MAX_PENDING they are denied.')
+    parser.add_argument('-d', '--delay', action='store', dest='DELAY', type=float, default=2, help='Seconds the slow stub takes to answer.')
+    parser.add_argument('--stub', action='store_true', dest='STUB', help=argparse.SUPPRESS)
+    cli_args = parser.parse_args()
+
+    if cli_args.STUB:
+        stub(cli_args.DELAY)
+        sys.exit(0)
+
+    # Every failed login check is logged, that isn't what's being measured
+    logging.disable(logging.CRITICAL)
+    hotspots, latency, times = run(cli_args.LOGINS, cli_args.DELAY)
+    failed = False
+    for name in SCENARIOS:
+        expect = SCENARIOS[name][1]
+        h = hotspots[name]
+        ok = (h.acks if expect else h.naks) == len(h.ids)
+        failed = failed or not ok
+        print('{:8} {:3} logins, {:3} allowed, {:3} denied  {}'.format(name, len(h.ids), h.acks, h.naks, 'ok' if ok else 'WRONG'))
+    if 'DONE' not in times:
+        sys.exit('Not every login was answered')
+    before = [l for t, l in latency if t < times['LOGINS']]
+    during = [l for t, l in latency if times['LOGINS'] <= t <= times['DONE']]
+    print('voice before logins: {}'.format(stats(before)))
+    print('voice during logins: {} ({:.1f}s)'.format(stats(during), times['DONE'] - times['LOGINS']))
+    if not during or max(during) > MAX_LATENCY:
+        failed = True
+    if failed:
+        sys.exit('Login check failed')
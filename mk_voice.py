@@ -23,6 +23,7 @@ from dmr_utils3 import bptc, golay, qr
 from dmr_utils3.utils import bytes_3, bytes_4
 from dmr_utils3.const import EMB, SLOT_TYPE, BS_VOICE_SYNC, BS_DATA_SYNC, LC_OPT
 from random import randint
+from collections import OrderedDict
 from voice_lib import words
 
 # Precalculated "dmrbits" (DMRD packet byte 15) -- just (slot << 7 | this value) and you're good to go!
@@ -37,13 +38,33 @@ NULL_EMB_LC.frombytes(b'\x00\x00\x00\x00')
 # This is where HBP encodes RSSI, it will need to be null
 TAIL = b'\x00\x00'
     
-# WARNING this funciton uses yeild to return a generator that will pass the next HBP packet for a phrase
-# each time that it is called. Do NOT try to use it like a normal function.
-def pkt_gen(_rf_src, _dst_id, _peer, _slot, _phrase):
+# Encoded phrases (and the pieces they are made from) kept ready to send, the least recently used
+# are dropped first. Packets are stored with sequence number and stream ID zero, they are filled in
+# for each stream by phrase_stream().
+PHRASE_CACHE_SIZE = 256
+PIECE_CACHE_SIZE = 1024
+# Words encoded at start up by warm_phrases(), for announcing talkgroups and link status
+WARM_WORDS = ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9', 'enabled', 'disabled']
 
-    # Calculate all of the static components up-front
-    STREAM_ID = bytes_4(randint(0x00, 0xFFFFFFFF))
-    SDP = _rf_src + _dst_id + _peer
+NULL_STREAM_ID = b'\x00\x00\x00\x00'
+
+# format: (words, rf_src, dst_id, peer, slot): [packet, ...]
+_phrases = OrderedDict()
+# format: ('HEAD' or 'TERM' or word, rf_src, dst_id, peer, slot): [packet, ...]
+_pieces = OrderedDict()
+
+def _lru(_cache, _size, _key, _build):
+    try:
+        _cache.move_to_end(_key)
+        return _cache[_key]
+    except KeyError:
+        _cache[_key] = _value = _build()
+        if len(_cache) > _size:
+            _cache.popitem(last = False)
+        return _value
+
+# Header, terminator and embedded LCs are the same for every stream between the same IDs
+def _lcs(_rf_src, _dst_id):
     LC = LC_OPT + _dst_id + _rf_src
     
     HEAD_LC = bptc.encode_header_lc(LC)
@@ -61,7 +82,58 @@ def pkt_gen(_rf_src, _dst_id, _peer, _slot, _phrase):
     EMBED.append(EMB['BURST_D'][:8] +  EMB_LC[3]  + EMB['BURST_D'][-8:])
     EMBED.append(EMB['BURST_E'][:8] +  EMB_LC[4]  + EMB['BURST_E'][-8:])
     EMBED.append(EMB['BURST_F'][:8] + NULL_EMB_LC + EMB['BURST_F'][-8:])
-    
+    return HEAD_LC, TERM_LC, EMBED
+
+def _head_pkt(_seq, _sdp, _slot, _stream_id, HEAD_LC):
+    return b'DMRD' + bytes([_seq]) + _sdp + bytes([_slot << 7 | HEADBITS]) + _stream_id + (HEAD_LC[0] + SLOT_TYPE['VOICE_LC_HEAD'][:10] + BS_DATA_SYNC + SLOT_TYPE['VOICE_LC_HEAD'][-10:] + HEAD_LC[1]).tobytes() + TAIL
+
+# Bursts A-F rotate through the proper EMBED value, starting again with each word
+def _word_pkt(_seq, _sdp, _slot, _stream_id, EMBED, _word, _burst):
+    return b'DMRD' + bytes([_seq]) + _sdp + bytes([_slot << 7 | BURSTBITS[_burst % 6]]) + _stream_id + (_word[_burst][0] + EMBED[_burst % 6] + _word[_burst][1]).tobytes() + TAIL
+
+def _term_pkt(_seq, _sdp, _slot, _stream_id, TERM_LC):
+    return b'DMRD' + bytes([_seq]) + _sdp + bytes([_slot << 7 | TERMBITS]) + _stream_id + (TERM_LC[0] + SLOT_TYPE['VOICE_LC_TERM'][:10] + BS_DATA_SYNC + SLOT_TYPE['VOICE_LC_TERM'][-10:] + TERM_LC[1]).tobytes() + TAIL
+
+def _piece(_name, _rf_src, _dst_id, _peer, _slot):
+    def build():
+        HEAD_LC, TERM_LC, EMBED = _lru(_pieces, PIECE_CACHE_SIZE, ('LC', _rf_src, _dst_id), lambda: _lcs(_rf_src, _dst_id))
+        SDP = _rf_src + _dst_id + _peer
+        if _name == 'HEAD':
+            return [_head_pkt(0, SDP, _slot, NULL_STREAM_ID, HEAD_LC)] * 3
+        if _name == 'TERM':
+            return [_term_pkt(0, SDP, _slot, NULL_STREAM_ID, TERM_LC)]
+        return [_word_pkt(0, SDP, _slot, NULL_STREAM_ID, EMBED, words[_name], _burst) for _burst in range(len(words[_name]))]
+    return _lru(_pieces, PIECE_CACHE_SIZE, (_name, _rf_src, _dst_id, _peer, _slot), build)
+
+# The packets for a phrase (a list of voice_lib word names), with sequence number and stream ID zero
+def phrase_pkts(_rf_src, _dst_id, _peer, _slot, _words):
+    def build():
+        _pkts = list(_piece('HEAD', _rf_src, _dst_id, _peer, _slot))
+        for _word in _words:
+            _pkts.extend(_piece(_word, _rf_src, _dst_id, _peer, _slot))
+        _pkts.extend(_piece('TERM', _rf_src, _dst_id, _peer, _slot))
+        return _pkts
+    return _lru(_phrases, PHRASE_CACHE_SIZE, (tuple(_words), _rf_src, _dst_id, _peer, _slot), build)
+
+# A phrase ready to send, as a list of DMRD packets. Only the sequence numbers and stream ID are new.
+def phrase_stream(_rf_src, _dst_id, _peer, _slot, _words, _stream_id = None):
+    if _stream_id == None:
+        _stream_id = bytes_4(randint(0x00, 0xFFFFFFFF))
+    return [_pkt[:4] + bytes([_seq % 0x100]) + _pkt[5:16] + _stream_id + _pkt[20:] for _seq, _pkt in enumerate(phrase_pkts(_rf_src, _dst_id, _peer, _slot, _words))]
+
+# Encode the common words ahead of time so the first announcement is as quick as the rest
+def warm_phrases(_rf_src, _dst_id, _peer, _slot, _words = WARM_WORDS):
+    for _word in _words:
+        phrase_pkts(_rf_src, _dst_id, _peer, _slot, [_word])
+
+# WARNING this funciton uses yeild to return a generator that will pass the next HBP packet for a phrase
+# each time that it is called. Do NOT try to use it like a normal function.
+def pkt_gen(_rf_src, _dst_id, _peer, _slot, _phrase):
+
+    # Calculate all of the static components up-front
+    STREAM_ID = bytes_4(randint(0x00, 0xFFFFFFFF))
+    SDP = _rf_src + _dst_id + _peer
+    HEAD_LC, TERM_LC, EMBED = _lcs(_rf_src, _dst_id)
     
     #initialize the HBP calls stream sequence to 0
     SEQ = 0
@@ -70,20 +142,19 @@ def pkt_gen(_rf_src, _dst_id, _peer, _slot, _phrase):
     
     # Send 3 Voice Header Frames
     for i in range(3):
-        pkt = b'DMRD' + bytes([SEQ]) + SDP + bytes([_slot << 7 | HEADBITS]) + STREAM_ID + (HEAD_LC[0] + SLOT_TYPE['VOICE_LC_HEAD'][:10] + BS_DATA_SYNC + SLOT_TYPE['VOICE_LC_HEAD'][-10:] + HEAD_LC[1]).tobytes() + TAIL
+        pkt = _head_pkt(SEQ, SDP, _slot, STREAM_ID, HEAD_LC)
         SEQ = (SEQ + 1) % 0x100
         yield pkt
         
     # Send each burst, six bursts per Superframe rotating through with the proper EMBED value per burst A-F
     for word in _phrase:
         for burst in range(0, len(word)):
-            print(burst)
-            pkt = b'DMRD' + bytes([SEQ]) + SDP + bytes([_slot << 7 | BURSTBITS[burst % 6]]) + STREAM_ID + (word[burst + 0][0] + EMBED[burst % 6] + word[burst + 0][1]).tobytes() + TAIL
+            pkt = _word_pkt(SEQ, SDP, _slot, STREAM_ID, EMBED, word, burst)
             SEQ = (SEQ + 1) % 0x100
             yield pkt
 
     # Send a single Voice Terminator Frame
-    pkt = b'DMRD' + bytes([SEQ]) + SDP + bytes([_slot << 7 | TERMBITS]) + STREAM_ID + (TERM_LC[0] + SLOT_TYPE['VOICE_LC_TERM'][:10] + BS_DATA_SYNC + SLOT_TYPE['VOICE_LC_TERM'][-10:] + TERM_LC[1]).tobytes() + TAIL
+    pkt = _term_pkt(SEQ, SDP, _slot, STREAM_ID, TERM_LC)
     SEQ = (SEQ + 1) % 0x100
     yield pkt
     
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+#
+###############################################################################
+#   Copyright (C) 2020-2021 Eric, KF7EEL, <kf7eel@qsl.net>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+SESSIONS parrot sessions at once through a real playback.py. It is started
+with SESSIONS masters, a hotspot logs in to each, and they all make a call
+of FRAMES frames at the same moment. playback.py records each one and plays
+it back 2 seconds after its terminator, so all the streams play together.
+
+Every hotspot must hear its whole call back. For each stream, the gaps
+between frames and how far each frame is from its place on a 60ms clock
+started by the first one are measured, as is the delay from the terminator
+to the first frame played back. Pings to every master are timed the whole
+time, to show playback.py keeps answering everything else while it plays.
+No frame may be more than a frame (60ms) off its clock.
+
+    python3 parrot_bench.py -n 100
+'''
+
+import os
+import sys
+import signal
+import shutil
+import argparse
+import subprocess
+import tempfile
+from time import time
+
+from twisted.internet import reactor
+
+import const
+from shard_floor_bench import CONFIG, MASTER, PASSPHRASE, LOGIN_WAIT, FRAME, Hotspot, free_port
+
+__author__     = 'Eric Craw, KF7EEL'
+__copyright__  = 'Copyright (c) 2020-2021, Eric Craw, KF7EEL'
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Eric Craw, KF7EEL'
+__email__      = 'kf7eel@qsl.net'
+
+# Frames in each call
+FRAMES = 50
+# Seconds playback.py waits after the terminator before playing back
+PLAYBACK_DELAY = 2
+# Seconds between pings to every master
+PING = 0.5
+
+
+# A hotspot that keeps the time every frame is heard, and times its pings
+class Parrot(Hotspot):
+    def __init__(self, *_args):
+        Hotspot.__init__(self, *_args)
+        self.arrived = []
+        self.pings = []
+        self.ping_sent = None
+
+    def datagramReceived(self, _data, _sockaddr):
+        if _data[:4] == const.DMRD:
+            self.arrived.append(time())
+        elif _data[:7] == const.MSTPONG and self.ping_sent:
+            self.pings.append(time() - self.ping_sent)
+            self.ping_sent = None
+        else:
+            Hotspot.datagramReceived(self, _data, _sockaddr)
+
+    def ping(self):
+        self.ping_sent = time()
+        Hotspot.ping(self)
+
+    # Note when the terminator goes, the stream is played back PLAYBACK_DELAY after it
+    def call(self, _stream, _frames = FRAMES, _n = 0):
+        if _n == _frames - 1:
+            self.terminator = time()
+        Hotspot.call(self, _stream, _frames, _n)
+
+
+def run(_dir, _sessions):
+    _ports = [free_port() for _n in range(_sessions)]
+    with open(_dir + '/hbnet.cfg', 'w') as _f:
+        _f.write(CONFIG.format(dir = _dir) + ''.join(MASTER.format(name = _n, port = _port, passphrase = PASSPHRASE.decode()) for _n, _port in enumerate(_ports)))
+    _playback = subprocess.Popen([sys.executable, os.path.dirname(os.path.abspath(__file__)) + '/playback.py', '-c', _dir + '/hbnet.cfg'], stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+    try:
+        return talk(_ports)
+    finally:
+        _playback.send_signal(signal.SIGTERM)
+        _playback.wait()
+
+
+def talk(_ports):
+    _parrots = []
+    for _n, _port in enumerate(_ports):
+        _parrots.append(Parrot(_n, (3120100 + _n).to_bytes(4, 'big'), ('127.0.0.1', _port)))
+        reactor.listenUDP(0, _parrots[-1], interface = '127.0.0.1')
+    _times = {}
+
+    # Log in, then keep pinging
+    def ping(_stop):
+        for _parrot in _parrots:
+            if _parrot.connected:
+                _parrot.ping()
+            else:
+                _parrot.login()
+        if all(_parrot.connected for _parrot in _parrots):
+            if 'START' not in _times:
+                _times['START'] = time()
+                for _n, _parrot in enumerate(_parrots):
+                    _parrot.call(_n + 1)
+                # All the calls, the wait, and all the playback
+                reactor.callLater(FRAMES * FRAME * 2 + PLAYBACK_DELAY + 2, reactor.stop)
+        elif time() > _stop:
+            print('Not every hotspot could log in')
+            reactor.stop()
+            return
+        reactor.callLater(PING if 'START' in _times else 1, ping, _stop)
+
+    reactor.callWhenRunning(ping, time() + LOGIN_WAIT)
+    reactor.run()
+    return _parrots, _times.get('START')
+
+
+def spread(_ms):
+    _ms = sorted(_ms)
+    return 'median {:6.2f}  99% {:6.2f}  max {:6.2f}'.format(_ms[len(_ms) // 2], _ms[len(_ms) * 99 // 100], _ms[-1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--sessions', action='store', dest='SESSIONS', type=int, default=100, help='Parrot sessions at once.')
+    cli_args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix = 'hbnet_parrot_bench_')
+    try:
+        parrots, start = run(tmp_dir, cli_args.SESSIONS)
+    finally:
+        shutil.rmtree(tmp_dir)
+    if not start:
+        sys.exit('The sessions never started')
+
+    # Each hotspot hears its own call back, with nothing before it
+    short = [parrot.name for parrot in parrots if len(parrot.arrived) != FRAMES]
+    gaps, late, delay = [], [], []
+    for parrot in parrots:
+        if not parrot.arrived:
+            continue
+        gaps += [abs(b - a - FRAME) * 1000 for a, b in zip(parrot.arrived, parrot.arrived[1:])]
+        late += [abs(t - parrot.arrived[0] - n * FRAME) * 1000 for n, t in enumerate(parrot.arrived)]
+        delay.append((parrot.arrived[0] - parrot.terminator - PLAYBACK_DELAY) * 1000)
+    pings = [rtt * 1000 for parrot in parrots for rtt in parrot.pings]
+    print('{} sessions of {} frames, {} heard their whole call back'.format(len(parrots), FRAMES, len(parrots) - len(short)))
+    if gaps:
+        print('frame gap off 60ms (ms):       {}'.format(spread(gaps)))
+        print('frame off its 60ms clock (ms): {}'.format(spread(late)))
+        print('playback start late (ms):      {}'.format(spread(delay)))
+    if pings:
+        print('ping round trip (ms):          {}  ({} pings)'.format(spread(pings), len(pings)))
+    if short:
+        sys.exit('{} sessions did not hear their whole call back'.format(len(short)))
+    if max(late) > FRAME * 1000:
+        sys.exit('Frames were played back more than a frame off their time')
@@ -21,7 +21,7 @@
 # Python modules we need
 import sys
 from bitarray import bitarray
-from time import time, sleep
+from time import time
 from importlib import import_module
 from binascii import b2a_hex as bhex
 
@@ -37,8 +37,9 @@ from dmr_utils3 import decode, bptc, const
 import config
 import log
 from const import *
-from mk_voice import pkt_gen
+from mk_voice import pkt_gen, phrase_stream, warm_phrases
 from voice_lib import words
+from voice_player import VoicePlayer
 
 # Stuff for socket reporting
 import pickle
@@ -80,18 +81,12 @@ class HBP(HBSYSTEM):
             print(int_id(_stream_id), int_id(self.last_stream))
             self.last_stream = _stream_id
             print('start speech')
-            speech = pkt_gen(bytes_3(3120101), bytes_3(2), bytes_4(3120119), 0, [words['all_circuits'],words['all_circuits']])
-    
-            sleep(1)
-            while True:
-                try:
-                    pkt = next(speech)
-                except StopIteration:
-                    break
-                sleep(.058)
-                self.send_system(pkt)
-                print(bhex(pkt))
-            print('end speech')
+            speech = phrase_stream(bytes_3(3120101), bytes_3(2), bytes_4(3120119), 0, ['all_circuits', 'all_circuits'])
+            # Played by the reactor after 1 second, one frame every 60ms
+            voice_player.play((self._system, 0), speech, self.send_system, 1).addCallback(self.speech_done)
+
+    def speech_done(self, _frames):
+        print('end speech')
 
 
 
@@ -143,6 +138,11 @@ if __name__ == '__main__':
     # Create the name-number mapping dictionaries
     peer_ids, subscriber_ids, talkgroup_ids = mk_aliases(CONFIG)
 
+    # Plays speech without holding up the other systems
+    voice_player = VoicePlayer()
+    # Encode the speech now rather than on the first call
+    warm_phrases(bytes_3(3120101), bytes_3(2), bytes_4(3120119), 0, ['all_circuits'])
+
     # INITIALIZE THE REPORTING LOOP
     if CONFIG['REPORTS']['REPORT']:
         report_server = config_reports(CONFIG, bridgeReportFactory)
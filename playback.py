@@ -22,7 +22,7 @@
 # Python modules we need
 import sys
 from bitarray import bitarray
-from time import time, sleep
+from time import time
 from importlib import import_module
 
 # Twisted is pretty important, so I keep it separate
@@ -37,6 +37,7 @@ from dmr_utils3 import decode, bptc, const
 import config
 import log
 import const
+from voice_player import VoicePlayer
 
 # The module needs logging logging, but handlers, etc. are controlled by the parent
 import logging
@@ -129,15 +130,11 @@ class playback(HBSYSTEM):
                 call_duration = pkt_time - self.STATUS['RX_START']
                 self.CALL_DATA.append(_data)
                 logger.info('(%s) *END   RECORDING* STREAM ID: %s', self._system, int_id(_stream_id))
-                sleep(2)
                 logger.info('(%s) *START  PLAYBACK* STREAM ID: %s SUB: %s (%s) REPEATER: %s (%s) TGID %s (%s), TS %s, Duration: %s', \
                                   self._system, int_id(_stream_id), get_alias(_rf_src, subscriber_ids), int_id(_rf_src), get_alias(_peer_id, peer_ids), int_id(_peer_id), get_alias(_dst_id, talkgroup_ids), int_id(_dst_id), _slot, call_duration)
-                for i in self.CALL_DATA:
-                    self.send_system(i)
-                    #print(i)
-                    sleep(0.06)
+                # Played back by the reactor after 2 seconds, one frame every 60ms
+                voice_player.play((self._system, _slot), self.CALL_DATA, self.send_system, 2).addCallback(self.playback_done, _stream_id)
                 self.CALL_DATA = []
-                logger.info('(%s) *END    PLAYBACK* STREAM ID: %s', self._system, int_id(_stream_id))
 
             else:
                 if self.CALL_DATA:
@@ -151,6 +148,9 @@ class playback(HBSYSTEM):
             self.STATUS[_slot]['RX_TIME']      = pkt_time
             self.STATUS[_slot]['RX_STREAM_ID'] = _stream_id
 
+    def playback_done(self, _frames, _stream_id):
+        logger.info('(%s) *END    PLAYBACK* STREAM ID: %s', self._system, int_id(_stream_id))
+
 
 #************************************************
 #      MAIN PROGRAM LOOP STARTS HERE
@@ -213,6 +213,9 @@ if __name__ == '__main__':
         
     # INITIALIZE THE REPORTING LOOP
     report_server = config_reports(CONFIG, reportFactory)    
+
+    # Plays recordings back without holding up the other systems
+    voice_player = VoicePlayer()
     
     # HBlink instance creation
     logger.info('HBlink \'playback.py\' (c) 2017-2019 Cort Buffington, N0MJS & Mike Zingman, N4IRR -- SYSTEM STARTING...')
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+#
+###############################################################################
+#   Copyright (C) 2020-2021 Eric, KF7EEL, <kf7eel@qsl.net>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+Connect churn through the hotspot proxy (hotspot_proxy_v2.py). HOTSPOTS
+hotspots log in through a proxy with exactly that many master ports, over
+loopback. Half of them keep pinging and half go quiet, and the quiet ones must
+be reaped by the timer wheel once TIMEOUT has passed. Then as many new
+hotspots as were reaped log in, and can only get a port if the reaped ones
+were given back. Finally everyone goes quiet and every port must come back.
+
+The logins handled per second are measured for each wave, as is the longest
+pass of the timer wheel (reap_loop).
+
+    python3 proxy_bench.py -n 10000
+'''
+
+import sys
+import argparse
+from time import time, perf_counter
+
+from twisted.internet import reactor
+from twisted.internet.protocol import DatagramProtocol
+
+from hotspot_proxy_v2 import Proxy, RPTL, RPTP
+
+__author__     = 'Eric Craw, KF7EEL'
+__copyright__  = 'Copyright (c) 2020-2021, Eric Craw, KF7EEL'
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Eric Craw, KF7EEL'
+__email__      = 'kf7eel@qsl.net'
+
+# Seconds a hotspot can be quiet before it is reaped
+TIMEOUT = 3
+# Datagrams sent each time round the reactor, more would overflow the proxy's socket buffer
+BURST = 100
+# The proxy sends to the master here, there is nothing listening, it only has to be a
+# different address from the hotspots
+MASTER = '127.0.0.2'
+PORT_START = 30000
+
+
+# Times every pass of the timer wheel
+class TimedProxy(Proxy):
+    def __init__(self, *args):
+        Proxy.__init__(self, *args)
+        self.passes = []
+
+    def reap_loop(self):
+        _before = len(self.peerTrack)
+        _start = perf_counter()
+        Proxy.reap_loop(self)
+        self.passes.append((perf_counter() - _start, _before - len(self.peerTrack)))
+
+
+class Hotspots(DatagramProtocol):
+    def __init__(self, _proxy_addr):
+        self._proxy_addr = _proxy_addr
+
+    # Send a datagram for each ID, BURST at a time, then call _done
+    def send(self, _command, _ids, _done = None, _n = 0):
+        for _id in _ids[_n:_n + BURST]:
+            if _command == RPTP:
+                self.transport.write(RPTP + b'ING' + _id, self._proxy_addr)
+            else:
+                self.transport.write(_command + _id, self._proxy_addr)
+        if _n + BURST < len(_ids):
+            reactor.callLater(0, self.send, _command, _ids, _done, _n + BURST)
+        elif _done:
+            _done()
+
+
+def run(_count):
+    _conn_track = {_port: False for _port in range(PORT_START, PORT_START + _count)}
+    _proxy = TimedProxy(MASTER, 0, _conn_track, [], TIMEOUT, False, False, PORT_START, PORT_START + _count - 1)
+    _port = reactor.listenUDP(0, _proxy, interface = '127.0.0.1')
+    _hotspots = Hotspots(('127.0.0.1', _port.getHost().port))
+    reactor.listenUDP(0, _hotspots, interface = '127.0.0.1')
+
+    _first = [(_n + 1000000).to_bytes(4, 'big') for _n in range(_count)]
+    _pinging = _first[:_count // 2]
+    _quiet = _first[_count // 2:]
+    _second = [(_n + 2000000).to_bytes(4, 'big') for _n in range(len(_quiet))]
+    _results = {'FAILED': []}
+    _times = {}
+
+    def check(_name, _ok):
+        if not _ok:
+            _results['FAILED'].append(_name)
+
+    # Wait until the proxy is tracking _expect clients, then call _next
+    def wait_for(_expect, _next, _stop):
+        if len(_proxy.peerTrack) == _expect:
+            _next()
+        elif time() > _stop:
+            check('{} clients expected, {} tracked'.format(_expect, len(_proxy.peerTrack)), False)
+            reactor.stop()
+        else:
+            reactor.callLater(0.01, wait_for, _expect, _next, _stop)
+
+    def ping():
+        if 'STOP_PINGING' not in _times:
+            _hotspots.send(RPTP, _pinging)
+            reactor.callLater(1, ping)
+
+    def first_wave():
+        _times['FIRST'] = time()
+        _hotspots.send(RPTL, _first)
+        wait_for(_count, first_done, time() + 60)
+
+    def first_done():
+        _results['FIRST'] = _count / (time() - _times['FIRST'])
+        check('first wave has a port each', len(set(_conn_track.values())) == _count)
+        ping()
+        # The quiet half is reaped TIMEOUT after it last spoke
+        reactor.callLater(TIMEOUT + 2, reaped)
+
+    def reaped():
+        check('quiet hotspots reaped', not any(_id in _proxy.peerTrack for _id in _quiet))
+        check('pinging hotspots kept', all(_id in _proxy.peerTrack for _id in _pinging))
+        _times['SECOND'] = time()
+        _hotspots.send(RPTL, _second)
+        wait_for(_count, second_done, time() + 60)
+
+    def second_done():
+        _results['SECOND'] = len(_second) / (time() - _times['SECOND'])
+        check('second wave got the reaped ports', len(set(_conn_track.values())) == _count and all(_id in _proxy.peerTrack for _id in _second))
+        _times['STOP_PINGING'] = time()
+        reactor.callLater(TIMEOUT + 2, all_reaped)
+
+    def all_reaped():
+        check('everyone reaped', not _proxy.peerTrack and len(_proxy.freePorts) == _count and not any(_conn_track.values()))
+        reactor.stop()
+
+    reactor.callWhenRunning(first_wave)
+    reactor.run()
+    return _results, _proxy.passes
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--hotspots', action='store', dest='HOTSPOTS', type=int, default=10000, help='Hotspots, and master ports on the proxy.')
+    cli_args = parser.parse_args()
+
+    results, passes = run(cli_args.HOTSPOTS)
+    if 'FIRST' in results:
+        print('first wave:  {} logins, {:.0f} logins/sec'.format(cli_args.HOTSPOTS, results['FIRST']))
+    if 'SECOND' in results:
+        print('second wave: {} logins, {:.0f} logins/sec'.format(cli_args.HOTSPOTS - cli_args.HOTSPOTS // 2, results['SECOND']))
+    if passes:
+        longest = max(passes)
+        print('timer wheel: {} passes, longest {:.2f} ms reaping {} hotspots'.format(len(passes), longest[0] * 1000, longest[1]))
+    else:
+        results['FAILED'].append('the timer wheel never ran')
+    for failure in results['FAILED']:
+        print('WRONG: {}'.format(failure))
+    if results['FAILED'] or 'SECOND' not in results:
+        sys.exit('Proxy churn check failed')
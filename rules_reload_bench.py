@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+#
+###############################################################################
+#   Copyright (C) 2020-2021 Eric, KF7EEL, <kf7eel@qsl.net>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+CHANGES changes to the rules file while calls go through a real bridge.py,
+which checks for new rules every INTERVAL seconds. A hotspot logs in to each
+of 11 masters. A, C, E and G keep talking on TS1 TG 1, each bridged to one
+other master (B, D, F, H), so every call has a bridge of its own. Nothing
+else talks, except I, bridged to J by a bridge that is switched off and on.
+
+Each change is written to a new file put in place of the rules file, as an
+editor saving it would, and the next is only written once the log says the
+rules were reloaded, so no two changes share a modification time. A change
+is one of:
+
+    add      a bridge on an unused TG, between any masters, made or replaced
+    decoy    a bridge on TS1 TG 1 that sends to X, with A, C, E or G in it
+             but not ACTIVE
+    remove   one of those bridges taken out
+    pair     a talking bridge changed: a TIMEOUT, the rules' order, or a
+             rule for X that is not ACTIVE added or taken out
+    switch   I's bridge switched, between calls, on or off (J not ACTIVE,
+             or the bridge taken out)
+
+B, D, F and H must hear every frame of every call to them, J every frame of
+I's calls made while its bridge was on, and no hotspot anything else. Each
+call is from a new talker, so it starts more than STREAM_TO after the last
+one ended, or bridge.py would rightly hold it off. With -w 2 the talking
+masters and the ones they are bridged to are on different workers, which
+each reload the rules for themselves.
+
+    python3 rules_reload_bench.py -n 1000 -i 0.05 -w 2
+'''
+
+import os
+import sys
+import random
+import signal
+import shutil
+import argparse
+import subprocess
+import tempfile
+from time import time
+from functools import partial
+
+from twisted.internet import reactor
+
+from const import STREAM_TO
+from shard_floor_bench import CONFIG, MASTER, PASSPHRASE, LOGIN_WAIT, FRAME, Hotspot, free_port
+
+__author__     = 'Eric Craw, KF7EEL'
+__copyright__  = 'Copyright (c) 2020-2021, Eric Craw, KF7EEL'
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Eric Craw, KF7EEL'
+__email__      = 'kf7eel@qsl.net'
+
+# Talking master: the master it is bridged to
+PAIRS = {'A': 'B', 'C': 'D', 'E': 'F', 'G': 'H'}
+NAMES = 'ABCDEFGHIJX'
+# Frames in each call, and frames I waits between its calls
+FRAMES = 50
+SWITCH_FRAMES = 25
+SWITCH_GAP = 10
+# Bridges the add and decoy changes are made in
+SLOTS = 20
+# Most seconds to wait for a change to be picked up
+RELOAD_WAIT = 5
+
+
+# A hotspot that calls done() once it has sent a call's terminator. Each frame is sent a frame
+# after the last one went, so a call takes longer than FRAMES * FRAME when the CPU is busy.
+class Talker(Hotspot):
+    def __init__(self, *_args):
+        Hotspot.__init__(self, *_args)
+        self.done = None
+
+    def call(self, _stream, _frames = FRAMES, _n = 0):
+        Hotspot.call(self, _stream, _frames, _n)
+        if _n == _frames - 1 and self.done:
+            self.done()
+
+
+def rule(_name, _tgid, _active, _ts = 1, _timeout = 2):
+    return {'SYSTEM': 'MASTER-' + _name, 'TS': _ts, 'TGID': _tgid, 'ACTIVE': _active, 'TIMEOUT': _timeout, 'TO_TYPE': 'NONE', 'ON': [], 'OFF': [], 'RESET': []}
+
+
+def rules_file(_bridges):
+    return 'BRIDGES = {}\nUNIT = []\nFLOOD_TIMEOUT = 1\n'.format(repr(_bridges))
+
+
+# The bridges as they are now, and the next change to them
+class Rules:
+    def __init__(self):
+        self.pairs = {_src: [rule(_src, 1, True), rule(_dst, 1, True)] for _src, _dst in PAIRS.items()}
+        self.slots = {}
+        self.switch = True
+        self.kinds = {}
+
+    def bridges(self):
+        _bridges = {'PAIR-' + _src: self.pairs[_src] for _src in self.pairs}
+        _bridges.update(('SLOT-{}'.format(_k), self.slots[_k]) for _k in self.slots)
+        if self.switch == True:
+            _bridges['SWITCH'] = [rule('I', 1, True), rule('J', 1, True)]
+        elif self.switch == 'inactive':
+            _bridges['SWITCH'] = [rule('I', 1, True), rule('J', 1, False)]
+        return _bridges
+
+    def change(self, _random, _switch):
+        if _switch:
+            _kind = 'switch'
+            self.switch = _random.choice(['inactive', 'removed']) if self.switch == True else True
+        else:
+            _kind = _random.choice(['add', 'decoy', 'remove', 'pair'])
+        _k = _random.randrange(SLOTS)
+        if _kind == 'add':
+            self.slots[_k] = [rule(_name, 100 + _random.randrange(100), _random.random() < 0.5, _random.choice([1, 2]), _random.randint(1, 5)) for _name in _random.sample(NAMES, _random.randint(2, 4))]
+        elif _kind == 'decoy':
+            _src = _random.choice(list(PAIRS))
+            self.slots[_k] = [rule(_src, 1, False), rule('X', 1, True), rule(PAIRS[_src], 1, _random.random() < 0.5)]
+        elif _kind == 'remove':
+            self.slots.pop(_k, None)
+        elif _kind == 'pair':
+            _pair = self.pairs[_random.choice(list(PAIRS))]
+            _what = _random.choice(['timeout', 'order', 'x'])
+            if _what == 'timeout':
+                _rule = _random.choice(_pair)
+                _rule['TIMEOUT'] = 5 - _rule['TIMEOUT']
+            elif _what == 'order':
+                _pair.reverse()
+            elif any(_rule['SYSTEM'] == 'MASTER-X' for _rule in _pair):
+                _pair[:] = [_rule for _rule in _pair if _rule['SYSTEM'] != 'MASTER-X']
+            else:
+                _pair.insert(_random.randrange(len(_pair) + 1), rule('X', 1, False))
+        self.kinds[_kind] = self.kinds.get(_kind, 0) + 1
+
+
+def run(_dir, _args):
+    _ports = {_name: free_port() for _name in NAMES}
+    with open(_dir + '/hbnet.cfg', 'w') as _f:
+        _f.write(CONFIG.format(dir = _dir).replace('LOG_HANDLERS: null', 'LOG_HANDLERS: file') + ''.join(MASTER.format(name = _name, port = _ports[_name], passphrase = PASSPHRASE.decode()) for _name in NAMES))
+    _rules = Rules()
+    with open(_dir + '/rules.py', 'w') as _f:
+        _f.write(rules_file(_rules.bridges()))
+    _bridge = subprocess.Popen([sys.executable, os.path.dirname(os.path.abspath(__file__)) + '/bridge.py', '-c', _dir + '/hbnet.cfg', '-r', _dir + '/rules.py', '-w', str(_args.WORKERS), '-i', str(_args.INTERVAL)], stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+    try:
+        return talk(_dir, _ports, _rules, _args)
+    finally:
+        _bridge.send_signal(signal.SIGTERM)
+        _bridge.wait()
+
+
+def talk(_dir, _ports, _rules, _args):
+    _hotspots = {}
+    for _n, _name in enumerate(NAMES):
+        _hotspots[_name] = Talker(_name, (3120100 + _n).to_bytes(4, 'big'), ('127.0.0.1', _ports[_name]))
+        reactor.listenUDP(0, _hotspots[_name], interface = '127.0.0.1')
+    # Streams each hotspot sent, and for I whether its bridge was on
+    _sent = {_name: [] for _name in NAMES}
+    _switch = {'BUSY': False, 'PENDING': False, 'SWITCHED': True}
+    _state = {'DONE': False, 'CHANGE': 0, 'RELOADS': 0, 'PICKUP': [], 'ERRORS': 0}
+    _random = random.Random(1)
+
+    # Log in, and keep pinging the masters once logged in
+    def ping(_stop):
+        for _hotspot in _hotspots.values():
+            if _hotspot.connected:
+                _hotspot.ping()
+            else:
+                _hotspot.login()
+        if all(_hotspot.connected for _hotspot in _hotspots.values()) and 'LOG' not in _state:
+            _state['LOG'] = open(_dir + '/bridge.log')
+            for _src in PAIRS:
+                call(_src)
+            call_switch()
+            change()
+        elif time() > _stop and 'LOG' not in _state:
+            _state['FAILED'] = 'Not every hotspot could log in'
+            reactor.stop()
+            return
+        reactor.callLater(1, ping, _stop)
+
+    # Calls one after another until the changes are done. Each is from a new talker, so it is
+    # started more than STREAM_TO after the last one ended, or bridge.py holds it off as contention
+    def call(_name):
+        if _state['DONE']:
+            return
+        _stream = (NAMES.index(_name) + 1) * 10000 + len(_sent[_name])
+        _sent[_name].append(_stream)
+        _hotspots[_name].call(_stream, FRAMES)
+
+    # I only calls while no switch of its bridge is waiting to be picked up, and a switch is
+    # only made while I is not calling, so each call is made with its bridge on or off
+    def call_switch():
+        if _state['DONE']:
+            return
+        if _switch['PENDING']:
+            reactor.callLater(0.05, call_switch)
+            return
+        _stream = (NAMES.index('I') + 1) * 10000 + len(_sent['I'])
+        _sent['I'].append((_stream, _rules.switch == True))
+        _switch['BUSY'] = True
+        _switch['SWITCHED'] = False
+        _hotspots['I'].call(_stream, SWITCH_FRAMES)
+
+    def call_done():
+        _switch['BUSY'] = False
+        reactor.callLater(SWITCH_GAP * FRAME, call_switch)
+
+    def change():
+        if _state['CHANGE'] == _args.CHANGES:
+            _state['DONE'] = True
+            reactor.callLater(FRAMES * FRAME + 2, reactor.stop)
+            return
+        _flip = not _switch['BUSY'] and not _switch['SWITCHED']
+        _rules.change(_random, _flip)
+        if _flip:
+            _switch['PENDING'] = True
+            _switch['SWITCHED'] = True
+        with open(_dir + '/rules.new', 'w') as _f:
+            _f.write(rules_file(_rules.bridges()))
+        os.replace(_dir + '/rules.new', _dir + '/rules.py')
+        _state['CHANGE'] += 1
+        wait(time())
+
+    # Every worker logs each reload
+    def wait(_written):
+        for _line in _state['LOG']:
+            if 'Rules reloaded' in _line:
+                _state['RELOADS'] += 1
+            elif 'New rules not used' in _line or 'Could not read changed rules file' in _line:
+                _state['ERRORS'] += 1
+        if _state['RELOADS'] >= _state['CHANGE'] * _args.WORKERS:
+            _state['PICKUP'].append(time() - _written)
+            _switch['PENDING'] = False
+            change()
+        elif time() - _written > RELOAD_WAIT:
+            _state['FAILED'] = 'Change {} was not picked up in {} s'.format(_state['CHANGE'], RELOAD_WAIT)
+            reactor.stop()
+        else:
+            reactor.callLater(0.01, wait, _written)
+
+    for _src in PAIRS:
+        _hotspots[_src].done = partial(reactor.callLater, STREAM_TO + 0.1, call, _src)
+    _hotspots['I'].done = partial(reactor.callLater, STREAM_TO + 0.1, call_done)
+    reactor.callWhenRunning(ping, time() + LOGIN_WAIT)
+    reactor.run()
+    if 'LOG' in _state:
+        _state['LOG'].close()
+    _state['KINDS'] = _rules.kinds
+    return _hotspots, _sent, _state
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--changes', action='store', dest='CHANGES', type=int, default=1000, help='Changes made to the rules file.')
+    parser.add_argument('-i', '--interval', action='store', dest='INTERVAL', type=float, default=0.05, help='Seconds between bridge.py checks for new rules.')
+    parser.add_argument('-w', '--workers', action='store', dest='WORKERS', type=int, default=1, help='Workers bridge.py runs as.')
+    cli_args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix = 'hbnet_rules_reload_bench_')
+    try:
+        hotspots, sent, state = run(tmp_dir, cli_args)
+    finally:
+        shutil.rmtree(tmp_dir)
+    if 'FAILED' in state:
+        sys.exit(state['FAILED'])
+
+    # Streams each hotspot should have heard, all of
+    expect = {name: [] for name in NAMES}
+    for src, dst in PAIRS.items():
+        expect[dst] = [(stream, FRAMES) for stream in sent[src]]
+    expect['J'] = [(stream, SWITCH_FRAMES) for stream, on in sent['I'] if on]
+    lost = 0
+    misrouted = 0
+    for name in NAMES:
+        heard = dict(hotspots[name].heard)
+        for stream, frames in expect[name]:
+            lost += max(frames - len(heard.get(stream, [])), 0)
+            misrouted += max(len(heard.pop(stream, [])) - frames, 0)
+        misrouted += sum(len(frames) for frames in heard.values())
+        if name in PAIRS.values() or name == 'J':
+            print('{}: {} calls, {} frames heard'.format(name, len(expect[name]), sum(len(frames) for frames in hotspots[name].heard.values())))
+
+    pickup = sorted(state['PICKUP'])
+    print('{} changes made while calling ({}), {} reloads logged, {} rules files not used'.format(state['CHANGE'], ', '.join('{} {}'.format(n, kind) for kind, n in sorted(state['KINDS'].items())), state['RELOADS'], state['ERRORS']))
+    if pickup:
+        print('picked up after: median {:.0f} ms, max {:.0f} ms'.format(pickup[len(pickup) // 2] * 1000, pickup[-1] * 1000))
+    print('I called {} times with its bridge on, {} with it off'.format(sum(on for stream, on in sent['I']), sum(not on for stream, on in sent['I'])))
+    print('{} frames lost, {} frames heard where they should not have been'.format(lost, misrouted))
+    if lost or misrouted or state['ERRORS'] or state['CHANGE'] != cli_args.CHANGES:
+        sys.exit('Frames were lost or went the wrong way while the rules changed')
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+#
+###############################################################################
+#   Copyright (C) 2020-2021 Eric, KF7EEL, <kf7eel@qsl.net>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+Runs bridge.py as several worker processes so it can use more than one core.
+The supervisor starts the workers and restarts any that die. Every worker loads
+the same configuration and rules, but only binds the sockets for (owns) its share
+of the systems. Packets routed to a system owned by another worker, and changes
+to routing state, are passed between the workers over Unix datagram sockets.
+'''
+
+import os
+import sys
+import signal
+import pickle
+import subprocess
+from time import sleep, time
+
+from twisted.internet.protocol import DatagramProtocol
+from twisted.internet import reactor
+
+# The module needs logging, but handlers, etc. are controlled by the parent
+import logging
+logger = logging.getLogger(__name__)
+
+__author__     = 'Eric Craw, KF7EEL'
+__copyright__  = 'Copyright (c) 2020-2021, Eric Craw, KF7EEL'
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Eric Craw, KF7EEL'
+__email__      = 'kf7eel@qsl.net'
+
+# Where the worker sockets live, one per worker, named for the supervisor's PID
+SHARD_SOCK = '/tmp/hbnet-{}-{}.sock'
+# Largest message between workers. Anything bigger is split into several (see _pack) and
+# the sockets are opened to receive this much, Twisted would cut datagrams off at 8192 bytes.
+SHARD_PACKET_SIZE = 65536
+# Seconds before trying again when another worker's socket is full, and the most messages
+# kept waiting for it.
+SHARD_RETRY = 0.01
+SHARD_BACKLOG = 1000
+# Voice frames (PACKET, ROUTE) for a worker are sent together, as one message for every
+# SHARD_BATCH of them, once the reactor has handled everything that came in with them. They wait
+# for room like any other message, but one more than SHARD_FRAME_AGE seconds late is no use (the
+# next frame of the call is due) and it is dropped.
+SHARD_FRAMES = ('PACKET', 'ROUTE')
+SHARD_BATCH = 100
+SHARD_FRAME_AGE = 0.06
+
+
+# Start the workers and wait. Each one is this same command line with --worker added.
+# Workers that die are restarted until we are told to stop. Called after the program has
+# changed to its own directory, so a relative script path is just the file name.
+def supervise(_workers):
+    _procs = {}
+    _stopping = []
+    if os.path.isabs(sys.argv[0]):
+        _script = sys.argv[0]
+    else:
+        _script = os.path.basename(sys.argv[0])
+
+    def start_worker(_worker):
+        _procs[_worker] = subprocess.Popen([sys.executable, _script] + sys.argv[1:] + ['--worker', str(_worker)])
+        logger.info('(SHARD) Started worker %s, PID: %s', _worker, _procs[_worker].pid)
+
+    def stop_workers(_signal, _frame):
+        logger.info('(SHARD) SHUTDOWN: Stopping workers with signal %s', _signal)
+        _stopping.append(_signal)
+        for _proc in _procs.values():
+            _proc.send_signal(_signal)
+
+    for _sig in [signal.SIGINT, signal.SIGTERM]:
+        signal.signal(_sig, stop_workers)
+
+    for _worker in range(_workers):
+        start_worker(_worker)
+
+    while _procs:
+        sleep(1)
+        for _worker in list(_procs):
+            if _procs[_worker].poll() is not None:
+                if _stopping:
+                    del _procs[_worker]
+                else:
+                    logger.error('(SHARD) Worker %s exited with code %s, restarting', _worker, _procs[_worker].returncode)
+                    start_worker(_worker)
+
+    for _worker in range(_workers):
+        try:
+            os.remove(SHARD_SOCK.format(os.getpid(), _worker))
+        except OSError:
+            pass
+
+
+# Stands in for the report server in workers other than 0, report events are sent to
+# worker 0 which has the real one
+class ShardReport(object):
+    def __init__(self, _link):
+        self._link = _link
+
+    def send_bridgeEvent(self, _data):
+        self._link.send(0, 'REPORT', _data)
+
+    # Worker 0 already tells the clients about bridge updates
+    def send_clients(self, _message):
+        pass
+
+
+class ShardLink(DatagramProtocol):
+    def __init__(self, _worker, _workers, _handlers):
+        self.worker = _worker
+        self._workers = _workers
+        self._handlers = _handlers
+        # Which worker owns each system, format: system: worker
+        self._owners = {}
+        # Sockets are named for the supervisor, which is our parent
+        self._socks = [SHARD_SOCK.format(os.getppid(), _n) for _n in range(_workers)]
+        # Messages waiting for a worker's socket to have room,
+        # format: worker: [(opcode, data, time queued, voice frames in it), ...]
+        self._backlog = {}
+        # format: worker: IDelayedCall of the next try
+        self._retry = {}
+        # Voice frames not sent yet, format: worker: [(opcode, args), ...]
+        self._frames = {}
+        # Voice frames dropped for each worker, and how many of those have been logged
+        self.dropped = {}
+        self._logged = {}
+
+    # Share the enabled systems out between the workers. Every worker works this out for
+    # itself from the same configuration, so they all agree.
+    def assign(self, _systems):
+        self._owners = {}
+        for _i, _system in enumerate(sorted(_system for _system in _systems if _systems[_system]['ENABLED'])):
+            self._owners[_system] = _i % self._workers
+
+    def listen(self):
+        try:
+            os.remove(self._socks[self.worker])
+        except OSError:
+            pass
+        return reactor.listenUNIXDatagram(self._socks[self.worker], self, maxPacketSize = SHARD_PACKET_SIZE, mode = 0o600)
+
+    def owns(self, _system):
+        return self._owners.get(_system) == self.worker
+
+    def owner(self, _system):
+        return self._owners[_system]
+
+    # Stand-in for send_system on systems owned by other workers
+    def forward(self, _system, _packet):
+        self.send(self._owners[_system], 'PACKET', _system, _packet)
+
+    # Pickle a message. If it is too big for one datagram and its last argument is a list
+    # (rules, units), the list is split over as many messages as it takes.
+    def _pack(self, _opcode, _args):
+        _data = pickle.dumps((_opcode, _args), protocol = pickle.HIGHEST_PROTOCOL)
+        if len(_data) <= SHARD_PACKET_SIZE:
+            return [_data]
+        if _args and isinstance(_args[-1], list) and len(_args[-1]) > 1:
+            _half = len(_args[-1]) // 2
+            return self._pack(_opcode, _args[:-1] + (_args[-1][:_half],)) + self._pack(_opcode, _args[:-1] + (_args[-1][_half:],))
+        logger.error('(SHARD) %s message of %s bytes is too big to send to the other workers', _opcode, len(_data))
+        return []
+
+    # True if sent, None if the other worker's socket is full, False if it can't be sent
+    def _sendto(self, _worker, _opcode, _data):
+        try:
+            # Twisted drops the datagram and returns None if the socket is full
+            if self.transport.write(_data, self._socks[_worker]) == None:
+                return None
+            return True
+        except Exception as e:
+            # Most likely the other worker is (re)starting, there is nothing to queue for
+            logger.debug('(SHARD) Could not send %s to worker %s: %s', _opcode, _worker, e)
+            return False
+
+    def _write(self, _worker, _opcode, _messages, _frames = 0):
+        _backlog = self._backlog.setdefault(_worker, [])
+        _now = time()
+        _backlog.extend((_opcode, _data, _now, _frames) for _data in _messages)
+        if len(_backlog) > SHARD_BACKLOG:
+            logger.error('(SHARD) Worker %s is not keeping up, dropped %s messages to it', _worker, len(_backlog) - SHARD_BACKLOG)
+            self._drop(_worker, _backlog[:-SHARD_BACKLOG])
+            del _backlog[:-SHARD_BACKLOG]
+        self._flush(_worker)
+
+    def _drop(self, _worker, _messages):
+        self.dropped[_worker] = self.dropped.get(_worker, 0) + sum(_message[3] for _message in _messages)
+
+    # Send what is waiting for a worker, in order, until its socket is full. Voice frames that
+    # have waited too long are dropped instead.
+    def _flush(self, _worker):
+        _backlog = self._backlog.get(_worker, [])
+        _now = time()
+        while _backlog:
+            _opcode, _data, _queued, _frames = _backlog[0]
+            if _frames and _now - _queued > SHARD_FRAME_AGE:
+                self._drop(_worker, _backlog[:1])
+            else:
+                _sent = self._sendto(_worker, _opcode, _data)
+                if _sent == False:
+                    self._drop(_worker, _backlog)
+                    break
+                if _sent == None:
+                    if _worker not in self._retry:
+                        self._retry[_worker] = reactor.callLater(SHARD_RETRY, self._retry_flush, _worker)
+                    return
+            _backlog.pop(0)
+        self._backlog.pop(_worker, None)
+
+    def _retry_flush(self, _worker):
+        del self._retry[_worker]
+        self._flush(_worker)
+
+    # Voice frames wait for the reactor to finish what it is doing, see SHARD_FRAMES
+    def send(self, _worker, _opcode, *_args):
+        if _opcode in SHARD_FRAMES:
+            if _worker not in self._frames:
+                self._frames[_worker] = []
+                reactor.callLater(0, self._send_frames, _worker)
+            self._frames[_worker].append((_opcode, _args))
+        else:
+            self._write(_worker, _opcode, self._pack(_opcode, _args))
+
+    # True if messages are waiting for the worker's socket to have room
+    def busy(self, _worker):
+        return _worker in self._backlog
+
+    def _send_frames(self, _worker):
+        _frames = self._frames.pop(_worker)
+        for _i in range(0, len(_frames), SHARD_BATCH):
+            _batch = _frames[_i:_i + SHARD_BATCH]
+            self._write(_worker, 'FRAMES', self._pack('FRAMES', (_batch,)), len(_batch))
+
+    # Log the voice frames dropped since the last time, bridge.py calls this once a second
+    def log_dropped(self):
+        for _worker in self.dropped:
+            if self.dropped[_worker] != self._logged.get(_worker, 0):
+                logger.warning('(SHARD) Worker %s is not keeping up, dropped %s voice frames to it (%s in all)', _worker, self.dropped[_worker] - self._logged.get(_worker, 0), self.dropped[_worker])
+                self._logged[_worker] = self.dropped[_worker]
+
+    def broadcast(self, _opcode, *_args):
+        _messages = self._pack(_opcode, _args)
+        for _worker in range(self._workers):
+            if _worker != self.worker:
+                self._write(_worker, _opcode, _messages)
+
+    def datagramReceived(self, _data, _addr):
+        try:
+            _opcode, _args = pickle.loads(_data)
+        except Exception as e:
+            logger.error('(SHARD) Bad message of %s bytes from another worker: %s', len(_data), e)
+            return
+        if _opcode == 'FRAMES':
+            _messages = _args[0]
+        else:
+            _messages = [(_opcode, _args)]
+        for _opcode, _args in _messages:
+            if _opcode in self._handlers:
+                self._handlers[_opcode](*_args)
+            else:
+                logger.error('(SHARD) Unknown message from another worker: %s', _opcode)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+#
+###############################################################################
+#   Copyright (C) 2020-2021 Eric, KF7EEL, <kf7eel@qsl.net>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+Checks and benchmarks the links between bridge.py workers (shard.py). For 1 to
+N workers, every worker forwards DMRD sized packets to the next one as fast as
+it can, and the packets each worker receives per second are added up, with the
+ones dropped for being too late. Worker 0 also sends a rule set and a UNIT_MAP
+far too big for one datagram, like a busy master would, and every other worker
+must get all of it. With 1 worker the packets go to itself, so that line is
+only the cost of the link.
+
+This measures the link, not routing: every worker is doing nothing but sending
+and receiving. More workers only add up to more packets when there are as many
+cores, on fewer they take turns and the total is what one core can do, less
+the cost of switching between them.
+
+Linux lets only net.unix.max_dgram_qlen (usually 10) datagrams wait on a
+worker's socket, raising it helps a busy server.
+
+    python3 shard_bench.py -w 4 -s 5
+'''
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+from time import time
+
+from twisted.internet import reactor
+
+from shard import ShardLink, SHARD_SOCK
+
+__author__     = 'Eric Craw, KF7EEL'
+__copyright__  = 'Copyright (c) 2020-2021, Eric Craw, KF7EEL'
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Eric Craw, KF7EEL'
+__email__      = 'kf7eel@qsl.net'
+
+# Packets sent each time round the reactor, like a busy worker passing on frames from many calls
+BURST = 100
+# Seconds to wait when the next worker is behind
+BACKOFF = 0.001
+# Rules and units sent by worker 0, the same shape as bridge.py sends them
+RULES = 5000
+UNITS = 5000
+
+
+def worker(_worker, _workers, _seconds):
+    _stats = {'PACKETS': 0, 'RULES': 0, 'UNITS': 0}
+    _packet = b'DMRD' + bytes(51)
+
+    def packet_received(_system, _data):
+        _stats['PACKETS'] += 1
+
+    def rules_received(_rules):
+        _stats['RULES'] += len(_rules)
+
+    def units_received(_units):
+        _stats['UNITS'] += len(_units)
+
+    _link = ShardLink(_worker, _workers, {'PACKET': packet_received, 'RULES': rules_received, 'UNITS': units_received})
+    _link.listen()
+    _target = (_worker + 1) % _workers
+
+    def burst(_stop):
+        _delay = 0
+        if _link.busy(_target):
+            # The next worker is behind, give it a chance to catch up
+            _delay = BACKOFF
+        else:
+            for _n in range(BURST):
+                _link.send(_target, 'PACKET', 'MASTER-{}'.format(_n % 20), _packet)
+        if time() < _stop:
+            reactor.callLater(_delay, burst, _stop)
+
+    def start():
+        if _worker == 0:
+            _link.broadcast('RULES', [('TG{}'.format(_n), 'MASTER-{}'.format(_n % 20), 2, (_n).to_bytes(3, 'big'), True, time()) for _n in range(RULES)])
+            _link.broadcast('UNITS', [((_n).to_bytes(3, 'big'), 'MASTER-{}'.format(_n % 20), time()) for _n in range(UNITS)])
+        _stats['PACKETS'] = 0
+        burst(time() + _seconds)
+
+    def finish():
+        _stats['DROPPED'] = sum(_link.dropped.values())
+        print(json.dumps(_stats))
+        sys.stdout.flush()
+        reactor.stop()
+
+    # Give every worker time to open its socket first
+    reactor.callLater(1, start)
+    reactor.callLater(_seconds + 2, finish)
+    reactor.run()
+
+
+def run(_workers, _seconds):
+    _procs = [subprocess.Popen([sys.executable, os.path.abspath(__file__), '--worker', str(_n), '-w', str(_workers), '-s', str(_seconds)], stdout = subprocess.PIPE) for _n in range(_workers)]
+    _stats = [json.loads(_proc.communicate()[0]) for _proc in _procs]
+    for _n in range(_workers):
+        try:
+            os.remove(SHARD_SOCK.format(os.getpid(), _n))
+        except OSError:
+            pass
+    return _stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-w', '--workers', action='store', dest='WORKERS', type=int, default=4, help='Most workers to try.')
+    parser.add_argument('-s', '--seconds', action='store', dest='SECONDS', type=int, default=5, help='Seconds to send packets for with each number of workers.')
+    parser.add_argument('--worker', action='store', dest='WORKER', type=int, help=argparse.SUPPRESS)
+    cli_args = parser.parse_args()
+
+    if cli_args.WORKER != None:
+        worker(cli_args.WORKER, cli_args.WORKERS, cli_args.SECONDS)
+        sys.exit(0)
+
+    failed = False
+    print('workers  packets/sec  dropped  rules  units')
+    for n in range(1, cli_args.WORKERS + 1):
+        stats = run(n, cli_args.SECONDS)
+        pps = sum(s['PACKETS'] for s in stats) / cli_args.SECONDS
+        # Every worker but 0 must have all of worker 0's rules and units
+        for s in stats[1:]:
+            if s['RULES'] != RULES or s['UNITS'] != UNITS:
+                failed = True
+        print('{:7}  {:11.0f}  {:7}  {}  {}'.format(n, pps, sum(s['DROPPED'] for s in stats), ' '.join(str(s['RULES']) for s in stats[1:]) or '-', ' '.join(str(s['UNITS']) for s in stats[1:]) or '-'))
+    if failed:
+        sys.exit('Not every worker got all of the rules and units')
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+#
+###############################################################################
+#   Copyright (C) 2020-2021 Eric, KF7EEL, <kf7eel@qsl.net>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+Checks that bridge.py -w 2 gives a target's slot to one call at a time. Three
+masters are bridged on TS1 TG 1: MASTER-A and MASTER-T belong to worker 0,
+MASTER-B to worker 1. A hotspot logs in to each, then:
+
+    a-first   A starts a call, B starts another while it is going
+    b-first   the same, B first
+    rx        T's hotspot is talking, A and B both start calls
+
+T's hotspot must only hear the first call, and nothing at all in the last one.
+B's frames for T are decided by worker 0, which has T's slot state. The time
+each frame takes to get to T is measured too, from A (one worker) and from B
+(passed between workers). With -w 1 everything is in one process, to compare.
+
+    python3 shard_floor_bench.py -w 2
+'''
+
+import os
+import sys
+import signal
+import shutil
+import socket
+import struct
+import argparse
+import subprocess
+import tempfile
+from time import time
+from hashlib import sha256
+
+from twisted.internet import reactor
+from twisted.internet.protocol import DatagramProtocol
+
+import const
+
+__author__     = 'Eric Craw, KF7EEL'
+__copyright__  = 'Copyright (c) 2020-2021, Eric Craw, KF7EEL'
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Eric Craw, KF7EEL'
+__email__      = 'kf7eel@qsl.net'
+
+PASSPHRASE = b'passw0rd'
+# Seconds between voice frames, and frames in a call
+FRAME = 0.06
+FRAMES = 30
+# The second call starts this many frames into the first
+OVERLAP = 5
+# Seconds between scenarios, longer than the group hangtime in the configuration
+GAP = 2
+# Most seconds to wait for bridge.py to start and the hotspots to log in
+LOGIN_WAIT = 30
+
+CONFIG = '''
+[GLOBAL]
+PATH: ./
+PING_TIME: 5
+MAX_MISSED: 10
+USE_ACL: False
+REG_ACL: PERMIT:ALL
+SUB_ACL: DENY:1
+TGID_TS1_ACL: PERMIT:ALL
+TGID_TS2_ACL: PERMIT:ALL
+[REPORTS]
+REPORT: False
+REPORT_INTERVAL: 60
+REPORT_PORT: 4321
+REPORT_CLIENTS: 127.0.0.1
+[LOGGER]
+LOG_FILE: {dir}/bridge.log
+LOG_HANDLERS: null
+LOG_LEVEL: INFO
+LOG_NAME: HBNet
+[ALIASES]
+TRY_DOWNLOAD: False
+PATH: {dir}/
+PEER_FILE: peer_ids.json
+SUBSCRIBER_FILE: subscriber_ids.json
+TGID_FILE: talkgroup_ids.json
+PEER_URL: https://www.radioid.net/static/rptrs.json
+SUBSCRIBER_URL: https://www.radioid.net/static/users.json
+STALE_DAYS: 7
+[WEB_SERVICE]
+THIS_SERVER_NAME: bench
+REMOTE_CONFIG_ENABLED: False
+URL: http://127.0.0.1:1/svr
+APPEND_INT: 1
+EXTRA_INT_1: 5
+EXTRA_INT_2: 8
+EXTRA_1: TeSt
+EXTRA_2: DmR4
+SHARED_SECRET: test
+SHORTEN_PASSPHRASE: False
+SHORTEN_SAMPLE: 4
+SHORTEN_LENGTH: 4
+BURN_FILE: {dir}/burn_ids.txt
+BURN_INT: 5
+'''
+
+MASTER = '''
+[MASTER-{name}]
+MODE: MASTER
+ENABLED: True
+USE_USER_MAN: False
+REPEAT: True
+MAX_PEERS: 10
+EXPORT_AMBE: False
+IP: 127.0.0.1
+PORT: {port}
+PASSPHRASE: {passphrase}
+GROUP_HANGTIME: 1
+USE_ACL: False
+REG_ACL: PERMIT:ALL
+SUB_ACL: DENY:1
+TGID_TS1_ACL: PERMIT:ALL
+TGID_TS2_ACL: PERMIT:ALL
+OTHER_OPTIONS:
+'''
+
+RULES = '''
+BRIDGES = {
+    'TG1': [
+''' + ''.join("        {{'SYSTEM': 'MASTER-{}', 'TS': 1, 'TGID': 1, 'ACTIVE': True, 'TIMEOUT': 2, 'TO_TYPE': 'NONE', 'ON': [], 'OFF': [], 'RESET': []}},\n".format(_name) for _name in 'ABT') + '''    ]
+}
+UNIT = []
+FLOOD_TIMEOUT = 1
+'''
+
+# Stream IDs of each call, by scenario
+SCENARIOS = {
+    'a-first': (('A', 1), ('B', 2)),
+    'b-first': (('B', 3), ('A', 4)),
+    'rx':      (('T', 5), ('A', 6), ('B', 7)),
+}
+
+
+# A hotspot logged in to one of the masters, times the frames it hears by stream
+class Hotspot(DatagramProtocol):
+    def __init__(self, _name, _peer_id, _master):
+        self.name = _name
+        self.peer_id = _peer_id
+        self.master = _master
+        self.connected = False
+        self.heard = {}
+
+    # Start logging in, again if the master wasn't listening yet
+    def login(self):
+        self.state = 'RPTL'
+        self.transport.write(const.RPTL + self.peer_id, self.master)
+
+    def datagramReceived(self, _data, _sockaddr):
+        if _data[:6] == const.RPTACK and not self.connected:
+            if self.state == 'RPTL':
+                self.state = 'RPTK'
+                self.transport.write(const.RPTK + self.peer_id + bytes.fromhex(sha256(_data[6:10] + PASSPHRASE).hexdigest()), self.master)
+            elif self.state == 'RPTK':
+                self.state = 'RPTC'
+                self.transport.write(const.RPTC + self.peer_id + b'BENCH'.ljust(294, b' '), self.master)
+            else:
+                self.connected = True
+        elif _data[:4] == const.DMRD:
+            _stream = int.from_bytes(_data[16:20], 'big')
+            # The terminator's LC is re-written over the time it was sent
+            _sent = struct.unpack('>d', _data[20:28])[0] if _data[15] != 0x22 else None
+            self.heard.setdefault(_stream, []).append(_sent and (time() - _sent) * 1000)
+
+    def ping(self):
+        self.transport.write(const.RPTPING + self.peer_id, self.master)
+
+    # One call: bursts A-F over and over, then a terminator
+    def call(self, _stream, _frames = FRAMES, _n = 0):
+        if _n < _frames - 1:
+            _bits = 0x10 if _n % 6 == 0 else _n % 6
+        else:
+            _bits = 0x22
+        # Only the embedded LC (bits 116:148) is re-written in bursts B-E, the time is kept
+        _burst = struct.pack('>d', time()) + bytes(25)
+        _data = b''.join([const.DMRD, bytes([_n % 256]), (3120000 + _stream).to_bytes(3, 'big'), (1).to_bytes(3, 'big'), self.peer_id, bytes([_bits]), _stream.to_bytes(4, 'big'), _burst, b'\x00\x00'])
+        self.transport.write(_data, self.master)
+        if _n < _frames - 1:
+            reactor.callLater(FRAME, self.call, _stream, _frames, _n + 1)
+
+
+def free_port():
+    _sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    _sock.bind(('127.0.0.1', 0))
+    _port = _sock.getsockname()[1]
+    _sock.close()
+    return _port
+
+
+def run(_dir, _workers):
+    _ports = {_name: free_port() for _name in 'ABT'}
+    with open(_dir + '/hbnet.cfg', 'w') as _f:
+        _f.write(CONFIG.format(dir = _dir) + ''.join(MASTER.format(name = _name, port = _ports[_name], passphrase = PASSPHRASE.decode()) for _name in 'ABT'))
+    with open(_dir + '/rules.py', 'w') as _f:
+        _f.write(RULES)
+    _bridge = subprocess.Popen([sys.executable, os.path.dirname(os.path.abspath(__file__)) + '/bridge.py', '-c', _dir + '/hbnet.cfg', '-r', _dir + '/rules.py', '-w', str(_workers)], stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+    try:
+        return talk(_ports)
+    finally:
+        _bridge.send_signal(signal.SIGTERM)
+        _bridge.wait()
+
+
+def talk(_ports):
+    _hotspots = {}
+    for _n, _name in enumerate('ABT'):
+        _hotspots[_name] = Hotspot(_name, (3120100 + _n).to_bytes(4, 'big'), ('127.0.0.1', _ports[_name]))
+        reactor.listenUDP(0, _hotspots[_name], interface = '127.0.0.1')
+
+    # Log in, and keep pinging the masters once logged in
+    def ping(_stop):
+        for _hotspot in _hotspots.values():
+            if _hotspot.connected:
+                _hotspot.ping()
+            else:
+                _hotspot.login()
+        if all(_hotspot.connected for _hotspot in _hotspots.values()) and 'START' not in _times:
+            _times['START'] = time()
+            start()
+        elif time() > _stop:
+            print('Not every hotspot could log in')
+            reactor.stop()
+            return
+        reactor.callLater(1, ping, _stop)
+
+    def start():
+        _at = 0
+        for _scenario in SCENARIOS:
+            for _i, (_name, _stream) in enumerate(SCENARIOS[_scenario]):
+                # The later calls start OVERLAP frames in, and end with the first one
+                _frames = FRAMES - OVERLAP if _i else FRAMES
+                reactor.callLater(_at + (OVERLAP * FRAME if _i else 0), _hotspots[_name].call, _stream, _frames)
+            _at += FRAMES * FRAME + GAP
+        reactor.callLater(_at, reactor.stop)
+
+    _times = {}
+    reactor.callWhenRunning(ping, time() + LOGIN_WAIT)
+    reactor.run()
+    return _hotspots
+
+
+def stats(_latency):
+    _latency = sorted(_l for _l in _latency if _l != None)
+    if not _latency:
+        return 'no frames'
+    return '{} frames, median {:.2f} ms, max {:.2f} ms'.format(len(_latency), _latency[len(_latency) // 2], _latency[-1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-w', '--workers', action='store', dest='WORKERS', type=int, default=2, help='Workers bridge.py runs as.')
+    cli_args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix = 'hbnet_floor_bench_')
+    try:
+        hotspots = run(tmp_dir, cli_args.WORKERS)
+    finally:
+        shutil.rmtree(tmp_dir)
+    heard = hotspots['T'].heard
+    failed = False
+    for scenario in SCENARIOS:
+        calls = SCENARIOS[scenario]
+        # T hears the first call from A or B and nothing else, and nothing while it is talking itself
+        expect = [] if calls[0][0] == 'T' else [calls[0][1]]
+        got = [stream for name, stream in calls if stream in heard]
+        ok = got == expect and all(len(heard[stream]) == FRAMES for stream in got)
+        failed = failed or not ok
+        print('{:8} T heard calls from: {:6}  {}'.format(scenario, ', '.join(name for name, stream in calls if stream in heard) or '-', 'ok' if ok else 'WRONG'))
+    print('A to T: {}'.format(stats(heard.get(1, []))))
+    print('B to T: {}'.format(stats(heard.get(3, []))))
+    if failed:
+        sys.exit('More than one call got the target\'s slot')
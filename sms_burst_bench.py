@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+#
+###############################################################################
+#   Copyright (C) 2020-2021 Eric, KF7EEL, <kf7eel@qsl.net>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+Voice forwarding latency in data_gateway.py while a burst of SMS goes out.
+Another process plays a radio: it sends a voice frame every 60ms to this
+one, which forwards it straight back the way a master repeats a call, and
+it times each frame's round trip. After WARMUP seconds MESSAGES SMS are sent
+at once with data_gateway's send_sms, to users spread over SYSTEMS systems
+and both slots, and DATA_SCHEDULER paces them out. Every SMS packet must
+reach the radio, no voice frame may be lost, and none may take longer than
+a frame (60ms) to come back.
+
+--mode sleep does what send_sms used to do, sleep(1) in the reactor and then
+write the whole sequence, to compare.
+
+    python3 sms_burst_bench.py -m 50
+'''
+
+import os
+import sys
+import json
+import struct
+import argparse
+import subprocess
+from time import time, sleep
+from contextlib import redirect_stdout
+
+from twisted.internet import reactor
+from twisted.internet.protocol import DatagramProtocol
+
+import data_gateway
+import data_scheduler
+from data_scheduler import DataScheduler
+from dmr_utils3.utils import bytes_3
+
+__author__     = 'Eric Craw, KF7EEL'
+__copyright__  = 'Copyright (c) 2020-2021, Eric Craw, KF7EEL'
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Eric Craw, KF7EEL'
+__email__      = 'kf7eel@qsl.net'
+
+# Seconds of voice before the burst, for the latency to compare with
+WARMUP = 2
+# Seconds between voice frames
+FRAME = 0.06
+FIRST_ID = 3120000
+
+
+# The radio: sends voice, times it coming back, counts the SMS packets
+class Radio(DatagramProtocol):
+    def __init__(self, _stats):
+        self._stats = _stats
+
+    def datagramReceived(self, _data, _addr):
+        if _data == b'STOP':
+            print(json.dumps(self._stats))
+            sys.stdout.flush()
+            reactor.stop()
+        elif _data[:4] == b'VOIC':
+            _sent = struct.unpack('>d', _data[4:12])[0]
+            self._stats['VOICE'].append((_sent, time() - _sent))
+        else:
+            self._stats['RECEIVED'] += 1
+
+
+def radio(_gateway_port):
+    _stats = {'VOICE': [], 'RECEIVED': 0, 'SENT': 0}
+    _radio = Radio(_stats)
+    _port = reactor.listenUDP(0, _radio, interface = '127.0.0.1')
+    print(_port.getHost().port)
+    sys.stdout.flush()
+
+    # Keep to a 60ms clock however late each call is
+    def talk(_next):
+        _radio.transport.write(b'VOIC' + struct.pack('>d', time()) + bytes(43), ('127.0.0.1', _gateway_port))
+        _stats['SENT'] += 1
+        _next += FRAME
+        reactor.callLater(max(0, _next - time()), talk, _next)
+
+    reactor.callWhenRunning(talk, time())
+    reactor.run()
+
+
+# What send_sms used to do: wait a second in the reactor, then send the whole sequence
+class SleepScheduler(object):
+    def queue(self, _system, _slot, _packets, _send, _priority = None):
+        sleep(data_scheduler.SEQUENCE_GAP)
+        for _packet in _packets:
+            _send(_packet)
+        return True
+
+
+class Gateway(DatagramProtocol):
+    def __init__(self):
+        self.radio = None
+
+    def datagramReceived(self, _data, _addr):
+        self.transport.write(_data, _addr)
+
+
+class System(object):
+    def __init__(self, _gateway, _stats):
+        self._gateway = _gateway
+        self._stats = _stats
+
+    def send_system(self, _packet):
+        self._gateway.transport.write(_packet, self._gateway.radio)
+        self._stats['DATA'] += 1
+
+
+def gateway(_mode, _messages, _systems):
+    _stats = {'DATA': 0}
+    _gateway = Gateway()
+    _port = reactor.listenUDP(0, _gateway, interface = '127.0.0.1')
+    _radio = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--radio', str(_port.getHost().port)], stdout = subprocess.PIPE)
+    _gateway.radio = ('127.0.0.1', int(_radio.stdout.readline()))
+
+    # Just enough of data_gateway's set up for send_sms
+    _names = ['MASTER-{}'.format(_n) for _n in range(_systems)]
+    data_gateway.CONFIG = {'SYSTEMS': {_name: {'MODE': 'MASTER', 'ENABLED': True} for _name in _names}, 'WEB_SERVICE': {'REMOTE_CONFIG_ENABLED': True}}
+    data_gateway.systems = {_name: System(_gateway, _stats) for _name in _names}
+    data_gateway.UNIT_MAP = {bytes_3(FIRST_ID + _n): (_names[_n % _systems], 0, 0) for _n in range(_messages)}
+    data_gateway.DATA_SCHEDULER = SleepScheduler() if _mode == 'sleep' else DataScheduler()
+    _times = {}
+
+    def burst():
+        _times['BURST'] = time()
+        # send_sms prints debugging output
+        with open(os.devnull, 'w') as _null, redirect_stdout(_null):
+            for _n in range(_messages):
+                data_gateway.send_sms(False, FIRST_ID + _n, 9, 9, 'unit', 'Test message number {} of the burst'.format(_n), (_n // _systems) % 2)
+        _times['QUEUED'] = time()
+        wait_sent()
+
+    def wait_sent():
+        if data_gateway.DATA_SCHEDULER.__class__ == SleepScheduler or not data_gateway.DATA_SCHEDULER._busy:
+            _times['DONE'] = time()
+            reactor.callLater(1, stop)
+        else:
+            reactor.callLater(0.1, wait_sent)
+
+    def stop():
+        _gateway.transport.write(b'STOP', _gateway.radio)
+        reactor.callLater(0.1, reactor.stop)
+
+    reactor.callLater(WARMUP, burst)
+    reactor.run()
+    _stats.update(json.loads(_radio.communicate()[0]))
+    _stats.update(_times)
+    return _stats
+
+
+def latency(_frames):
+    _ms = sorted(_l * 1000 for _sent, _l in _frames)
+    if not _ms:
+        return 'no frames'
+    return '{:4} frames  median {:6.2f} ms  99% {:7.2f} ms  max {:7.2f} ms'.format(len(_ms), _ms[len(_ms) // 2], _ms[len(_ms) * 99 // 100], _ms[-1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', '--messages', action='store', dest='MESSAGES', type=int, default=50, help='SMS in the burst.')
+    parser.add_argument('-s', '--systems', action='store', dest='SYSTEMS', type=int, default=5, help='Systems the users are spread over.')
+    parser.add_argument('--mode', action='store', dest='MODE', choices=['scheduler', 'sleep'], default='scheduler', help='How SMS are paced.')
+    parser.add_argument('--radio', action='store', dest='RADIO', type=int, help=argparse.SUPPRESS)
+    cli_args = parser.parse_args()
+
+    if cli_args.RADIO:
+        radio(cli_args.RADIO)
+        sys.exit(0)
+
+    stats = gateway(cli_args.MODE, cli_args.MESSAGES, cli_args.SYSTEMS)
+    before = [frame for frame in stats['VOICE'] if frame[0] < stats['BURST']]
+    during = [frame for frame in stats['VOICE'] if stats['BURST'] <= frame[0] <= stats['DONE']]
+    print('{} SMS ({} packets) queued in {:.0f} ms, sent in {:.1f} s, {} packets received'.format(cli_args.MESSAGES, stats['DATA'], (stats['QUEUED'] - stats['BURST']) * 1000, stats['DONE'] - stats['BURST'], stats['RECEIVED']))
+    print('voice before the burst: {}'.format(latency(before)))
+    print('voice during the burst: {}'.format(latency(during)))
+    lost = stats['SENT'] - len(stats['VOICE'])
+    print('voice frames lost: {}'.format(lost))
+    if stats['RECEIVED'] != stats['DATA'] or lost or max(frame[1] for frame in during) > FRAME:
+        sys.exit('Voice was held up by the SMS burst')
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+#
+###############################################################################
+#   Copyright (C) 2020-2021 Eric, KF7EEL, <kf7eel@qsl.net>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+User APRS settings for data_gateway.py, kept in memory and indexed by DMR ID.
+The settings file is only read again when its modification time changes, so
+it can still be edited by hand or replaced from the web service. Changes are
+written back a short time later, several changes at once, to a temporary file
+that then replaces the settings file so it is never seen half written.
+'''
+
+import os
+import ast
+from time import time
+
+from twisted.internet import reactor
+
+# The module needs logging, but handlers, etc. are controlled by the parent
+import logging
+logger = logging.getLogger(__name__)
+
+__author__     = 'Eric Craw, KF7EEL'
+__copyright__  = 'Copyright (c) 2020-2021, Eric Craw, KF7EEL'
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Eric Craw, KF7EEL'
+__email__      = 'kf7eel@qsl.net'
+
+# Seconds to wait after a change before writing the file, changes made meanwhile go with it
+WRITE_DELAY = 2
+# Least number of seconds between checks of the file for changes made by something else
+CHECK_INTERVAL = 1
+
+
+class UserSettings(object):
+    def __init__(self, _file, _write_delay = WRITE_DELAY, _reactor = reactor):
+        self._file = _file
+        self._write_delay = _write_delay
+        self._reactor = _reactor
+        self._write_call = None
+        self._mtime = None
+        self._checked = 0
+        # format: dmr_id: [{'call': }, {'ssid': }, {'icon': }, {'comment': }, {'pin': }, {'APRS': }]
+        self._settings = {}
+        # Goes up every time the settings change, for anything that keeps its own index of them
+        self.version = 0
+
+    # Read the file again if something else changed it. Changes of our own that haven't been
+    # written yet win over the file.
+    def load(self, _force = False):
+        _now = time()
+        if not _force and (_now - self._checked < CHECK_INTERVAL or self._write_call != None):
+            return
+        self._checked = _now
+        try:
+            _mtime = os.stat(self._file).st_mtime
+        except OSError:
+            return
+        if _mtime == self._mtime:
+            return
+        try:
+            with open(self._file, 'r') as _f:
+                _settings = ast.literal_eval(_f.read())
+        except (OSError, ValueError, SyntaxError) as e:
+            logger.error('Could not load user settings from %s: %s', self._file, e)
+            return
+        self._settings = _settings
+        self._mtime = _mtime
+        self.version += 1
+        logger.info('Loaded user settings for %s users', len(self._settings))
+
+    # All of the settings, format as above. Anything changed in here must be followed by changed().
+    def all(self):
+        self.load()
+        return self._settings
+
+    def get(self, _dmr_id, _default = None):
+        return self.all().get(_dmr_id, _default)
+
+    def __contains__(self, _dmr_id):
+        return _dmr_id in self.all()
+
+    # Replace all of the settings, as downloaded from the web service
+    def replace(self, _settings):
+        self._settings = _settings
+        self.changed()
+
+    # Note a change, the file is written WRITE_DELAY later along with anything else changed meanwhile
+    def changed(self):
+        self.version += 1
+        if self._write_call == None:
+            self._write_call = self._reactor.callLater(self._write_delay, self.write)
+
+    # Write any changes still waiting, used at shut down
+    def flush(self):
+        if self._write_call != None:
+            self.write()
+
+    def write(self):
+        if self._write_call != None and self._write_call.active():
+            self._write_call.cancel()
+        self._write_call = None
+        _tmp = self._file + '.tmp'
+        try:
+            with open(_tmp, 'w') as _f:
+                _f.write(str(self._settings))
+                _f.flush()
+                os.fsync(_f.fileno())
+            os.replace(_tmp, self._file)
+            self._mtime = os.stat(self._file).st_mtime
+            logger.info('User settings saved')
+        except OSError as e:
+            logger.error('Could not save user settings to %s: %s', self._file, e)
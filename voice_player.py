@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+#
+###############################################################################
+#   Copyright (C) 2020-2021 Eric, KF7EEL, <kf7eel@qsl.net>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+Plays recorded or generated voice streams (parrot, voice prompts) out of a
+system one frame every 60ms, without blocking the reactor. Any number of
+streams can play at once. Each frame is timed from the start of its stream
+rather than from the frame before it, so timer lateness doesn't add up over a
+long stream. Streams with the same key (usually system and slot) take turns.
+'''
+
+from twisted.internet import reactor, defer
+
+# The module needs logging, but handlers, etc. are controlled by the parent
+import logging
+logger = logging.getLogger(__name__)
+
+__author__     = 'Eric Craw, KF7EEL'
+__copyright__  = 'Copyright (c) 2020-2021, Eric Craw, KF7EEL'
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Eric Craw, KF7EEL'
+__email__      = 'kf7eel@qsl.net'
+
+# Seconds between voice frames
+FRAME_INTERVAL = 0.06
+
+
+class VoicePlayer(object):
+    def __init__(self, _interval = FRAME_INTERVAL, _reactor = reactor):
+        self._interval = _interval
+        self._reactor = _reactor
+        # Streams playing, format: key: {'FRAMES': iterator, 'SEND': function, 'START': time, 'FRAME': number, 'CALL': IDelayedCall, 'DONE': Deferred}
+        self._playing = {}
+        # Streams waiting for their key to be free, format: key: [(frames, send function, delay, Deferred), ...]
+        self._waiting = {}
+        # Timing of every frame sent, lateness is how far after its time a frame went out
+        self.stats = {'FRAMES': 0, 'LATE_TOTAL': 0.0, 'LATE_MAX': 0.0}
+
+    # Play _frames (a list or a generator, like mk_voice.pkt_gen) with _send, starting after _delay
+    # seconds. Returns a deferred that fires with the number of frames sent once the stream ends.
+    def play(self, _key, _frames, _send, _delay = 0):
+        _done = defer.Deferred()
+        if _key in self._playing:
+            self._waiting.setdefault(_key, []).append((_frames, _send, _delay, _done))
+        else:
+            self._start(_key, _frames, _send, _delay, _done)
+        return _done
+
+    def playing(self, _key):
+        return _key in self._playing
+
+    # Stop a stream, and any waiting behind it
+    def stop(self, _key):
+        for _frames, _send, _delay, _done in self._waiting.pop(_key, []):
+            _done.callback(0)
+        _stream = self._playing.pop(_key, None)
+        if _stream:
+            if _stream['CALL'].active():
+                _stream['CALL'].cancel()
+            _stream['DONE'].callback(_stream['FRAME'])
+
+    def stop_all(self):
+        for _key in list(self._playing):
+            self.stop(_key)
+
+    # Average and worst frame lateness in seconds
+    def jitter(self):
+        if not self.stats['FRAMES']:
+            return 0.0, 0.0
+        return self.stats['LATE_TOTAL'] / self.stats['FRAMES'], self.stats['LATE_MAX']
+
+    def _start(self, _key, _frames, _send, _delay, _done):
+        _start = self._reactor.seconds() + _delay
+        self._playing[_key] = {
+            'FRAMES': iter(_frames),
+            'SEND': _send,
+            'START': _start,
+            'FRAME': 0,
+            'CALL': self._reactor.callLater(_delay, self._frame, _key),
+            'DONE': _done
+            }
+
+    def _frame(self, _key):
+        _stream = self._playing[_key]
+        _due = _stream['START'] + _stream['FRAME'] * self._interval
+        _now = self._reactor.seconds()
+        try:
+            _pkt = next(_stream['FRAMES'])
+        except StopIteration:
+            self._finished(_key)
+            return
+        try:
+            _stream['SEND'](_pkt)
+        except Exception as e:
+            logger.error('Error playing frame on %s: %s', _key, e)
+
+        _late = max(0.0, _now - _due)
+        self.stats['FRAMES'] += 1
+        self.stats['LATE_TOTAL'] += _late
+        if _late > self.stats['LATE_MAX']:
+            self.stats['LATE_MAX'] = _late
+
+        _stream['FRAME'] += 1
+        _next = _stream['START'] + _stream['FRAME'] * self._interval
+        _stream['CALL'] = self._reactor.callLater(max(0, _next - _now), self._frame, _key)
+
+    def _finished(self, _key):
+        _stream = self._playing.pop(_key)
+        if self._waiting.get(_key):
+            self._start(_key, *self._waiting[_key].pop(0))
+            if not self._waiting[_key]:
+                del self._waiting[_key]
+        _stream['DONE'].callback(_stream['FRAME'])
@@ -21,19 +21,24 @@
 Flask based application that is the web server for HBNet. Controls user authentication, DMR server config, etc.
 '''
 
-from flask import Flask, render_template_string, request, make_response, jsonify, render_template, Markup, flash, redirect, url_for, current_app, Response, send_from_directory
+from flask import Flask, render_template_string, request, make_response, jsonify, render_template, Markup, flash, redirect, url_for, current_app, Response, send_from_directory, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.pool import QueuePool
 from flask_user import login_required, UserManager, UserMixin, user_registered, roles_required
 from werkzeug.security import check_password_hash
 from flask_login import current_user, login_user, logout_user
 from wtforms import StringField, SubmitField
 import requests
-import base64, hashlib
+import base64, hashlib, hmac
 from dmr_utils3.utils import int_id, bytes_4
 from config import *
 import ast
 import json
+import csv, io
 import datetime, time
+from urllib.parse import urlencode
 from flask_babelex import Babel
 import libscrc
 import random
@@ -54,6 +59,23 @@ import os, ast
 from cryptography.fernet import Fernet
 
 peer_locations = {}
+# Server secrets for /svr, format: {'SECRETS': [secret, ...] or None until read, 'VERSION': config version when read}
+secret_cache = {'SECRETS': None, 'VERSION': None}
+# Parsed User.aprs for aprs_settings, format: {User.aprs string: settings dict}
+aprs_cache = {}
+# Map points for /map, format: {'VERSION': newest id and row count of GPS and peer rows, 'FEATURES': GeoJSON features,
+# 'PEERS': peer keys, 'TIME': newest point time, 'SHELL': the map page without points}
+map_cache = {'VERSION': None, 'FEATURES': [], 'PEERS': [], 'TIME': 0, 'SHELL': None}
+# Seconds between the map page checking for new points
+map_refresh_time = 30
+# Last time the logs were trimmed, and the least number of seconds between trims
+trim_time = {'LAST': 0}
+trim_interval = 300
+# Rows on each page of the authentication log
+auth_log_per_page = 200
+# Config and rules sent to each server, built again only when the config version changes, format:
+# (kind, server): {'VERSION': config version, 'ETAG': hash of DATA, 'DATA': , 'PREVIOUS': (ETAG, DATA) of the one before}
+config_snapshots = {}
 hbnet_version = 'HWS 0.0.1-pre_pre_alpha'
 
 # Query radioid.net for list of IDs
@@ -121,6 +143,10 @@ class ConfigClass(object):
     # Flask-SQLAlchemy settings
     SQLALCHEMY_DATABASE_URI = db_location    # File-based SQL database
     SQLALCHEMY_TRACK_MODIFICATIONS = False    # Avoids SQLAlchemy warning
+    # Keep SQLite connections open between requests. Otherwise every request opens a new one,
+    # and SQLite reads the whole schema again before the first query on it.
+    if db_location.startswith('sqlite'):
+        SQLALCHEMY_ENGINE_OPTIONS = {'poolclass': QueuePool, 'pool_size': 10, 'connect_args': {'check_same_thread': False}}
 
     # Flask-User settings
     USER_APP_NAME = title      # Shown in and email templates and page footers
@@ -146,6 +172,17 @@ def hbnet_web_service():
     # Initialize Flask-SQLAlchemy
     db = SQLAlchemy(app)
 
+    # In WAL mode SQLite readers carry on while another web service process writes, and with
+    # synchronous=NORMAL a commit doesn't wait for the disk
+    def sqlite_connect(dbapi_connection, connection_record):
+        c = dbapi_connection.cursor()
+        c.execute('PRAGMA journal_mode=WAL')
+        c.execute('PRAGMA synchronous=NORMAL')
+        c.close()
+
+    if db_location.startswith('sqlite'):
+        event.listen(db.engine, 'connect', sqlite_connect)
+
     # Define the User data-model.
     # NB: Make sure to add flask_user UserMixin !!!
     class User(db.Model, UserMixin):
@@ -192,16 +229,48 @@ def hbnet_web_service():
 ##        id = db.Column(db.Integer(), primary_key=True)
         dmr_id = db.Column(db.Integer(), unique=True, primary_key=True)
         version = db.Column(db.Integer(), primary_key=True)
+    # One row for each DMR ID in User.dmr_ids, so a radio ID is found by index rather than
+    # searching every user's dmr_ids. Kept in step by sync_dmr_ids().
+    class UserDmrId(db.Model):
+        __tablename__ = 'user_dmr_ids'
+        dmr_id = db.Column(db.Integer(), primary_key=True)
+        user_id = db.Column(db.Integer(), db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    # Last time each server was heard from, and how often, written by server_ping()
+    class ServerPing(db.Model):
+        __tablename__ = 'server_ping'
+        server = db.Column(db.String(100), primary_key=True)
+        last_ping = db.Column(db.Float(), nullable=False, server_default='0')
+        pings = db.Column(db.Integer(), nullable=False, server_default='0')
+        config_pulls = db.Column(db.Integer(), nullable=False, server_default='0')
+    # Each server's UNIT table, which system a unit was last heard on and when
+    class UnitTable(db.Model):
+        __tablename__ = 'unit_table'
+        server = db.Column(db.String(100), primary_key=True)
+        dmr_id = db.Column(db.Integer(), primary_key=True)
+        system_name = db.Column(db.String(100), nullable=False, server_default='')
+        last_seen = db.Column(db.Float(), nullable=False, server_default='0')
+    # One row, goes up whenever a table that servers get their config or rules from changes
+    class ConfigVersion(db.Model):
+        __tablename__ = 'config_version'
+        id = db.Column(db.Integer(), primary_key=True)
+        version = db.Column(db.Integer(), nullable=False, server_default='0')
     class AuthLog(db.Model):
         __tablename__ = 'auth_log'
         id = db.Column(db.Integer(), primary_key=True)
         login_dmr_id = db.Column(db.Integer())
-        login_time = db.Column(db.DateTime())
+        login_time = db.Column(db.DateTime(), index=True)
         peer_ip = db.Column(db.String(100), nullable=False, server_default='')
         server_name = db.Column(db.String(100))
         login_auth_method = db.Column(db.String(100), nullable=False, server_default='')
         portal_username = db.Column(db.String(100), nullable=False, server_default='')
         login_type = db.Column(db.String(100), nullable=False, server_default='')
+        # For each of the filters on /auth_log, newest first
+        __table_args__ = (
+            db.Index('ix_auth_log_dmr_id_time', 'login_dmr_id', 'login_time'),
+            db.Index('ix_auth_log_server_time', 'server_name', 'login_time'),
+            db.Index('ix_auth_log_ip_time', 'peer_ip', 'login_time'),
+            db.Index('ix_auth_log_user_time', 'portal_username', 'login_time'),
+            )
     class mmdvmPeer(db.Model):
         __tablename__ = 'MMDVM_peers'
         id = db.Column(db.Integer(), primary_key=True)
@@ -417,7 +486,7 @@ def hbnet_web_service():
         comment = db.Column(db.String(150), nullable=False, server_default='')
         lat = db.Column(db.String(100), nullable=False, server_default='')
         lon = db.Column(db.String(100), nullable=False, server_default='')
-        time = db.Column(db.DateTime())
+        time = db.Column(db.DateTime(), index=True)
         server = db.Column(db.String(100), nullable=False, server_default='')
         system_name = db.Column(db.String(100), nullable=False, server_default='')
         dmr_id = db.Column(db.Integer(), primary_key=False)
@@ -427,7 +496,7 @@ def hbnet_web_service():
         id = db.Column(db.Integer(), primary_key=True)
         callsign = db.Column(db.String(100), nullable=False, server_default='')
         bulletin = db.Column(db.String(150), nullable=False, server_default='')
-        time = db.Column(db.DateTime())
+        time = db.Column(db.DateTime(), index=True)
         server = db.Column(db.String(100), nullable=False, server_default='')
         system_name = db.Column(db.String(100), nullable=False, server_default='')
         dmr_id = db.Column(db.Integer(), primary_key=False)
@@ -438,7 +507,7 @@ def hbnet_web_service():
         snd_callsign = db.Column(db.String(100), nullable=False, server_default='')
         rcv_callsign = db.Column(db.String(100), nullable=False, server_default='')
         message = db.Column(db.String(100), nullable=False, server_default='')
-        time = db.Column(db.DateTime())
+        time = db.Column(db.DateTime(), index=True)
         server = db.Column(db.String(100), nullable=False, server_default='')
         system_name = db.Column(db.String(100), nullable=False, server_default='')
         snd_id = db.Column(db.Integer(), primary_key=False)
@@ -612,6 +681,21 @@ def hbnet_web_service():
 
     # Create all database tables
     db.create_all()
+    # create_all() only makes indexes along with new tables, make any added since for tables
+    # that were already there
+    for t in [GPS_LocLog, SMSLog, BulletinBoard, AuthLog]:
+        for i in t.__table__.indexes:
+            try:
+                i.create(bind=db.engine, checkfirst=True)
+            except Exception as e:
+                print(e)
+    if not ConfigVersion.query.get(1):
+        try:
+            db.session.add(ConfigVersion(id=1, version=0))
+            db.session.commit()
+        except IntegrityError:
+            # Another web service process got there first
+            db.session.rollback()
 
 
     if not User.query.filter(User.username == 'admin').first():
@@ -660,13 +744,6 @@ def hbnet_web_service():
             time = datetime.datetime.utcnow()
             )
         db.session.add(home_entry_add)
-        ping_list_initial = Misc(
-            field_1 = 'ping_list',
-            field_2 = '{}',
-            
-            time = datetime.datetime.utcnow()
-            )
-        db.session.add(ping_list_initial)
         unregistered_aprs_list_initial = Misc(
             field_1 = 'unregistered_aprs',
             field_2 = '{}',
@@ -683,6 +760,59 @@ def hbnet_web_service():
         db.session.add(script_links_initial)
         db.session.commit()
 
+    # Rewrite the UserDmrId rows of a user from user.dmr_ids, call before committing any change
+    # to dmr_ids. An ID another user already has stays with them, as the old search of dmr_ids
+    # found the first user listing it. Returns the IDs that were refused.
+    def sync_dmr_ids(user):
+        try:
+            id_dict = ast.literal_eval(user.dmr_ids)
+        except:
+            id_dict = {}
+        new_ids = set()
+        for i in id_dict:
+            try:
+                new_ids.add(int(i))
+            except:
+                pass
+        db.session.flush()
+        old_ids = set(r.dmr_id for r in UserDmrId.query.filter_by(user_id=user.id).all())
+        refused = set()
+        if old_ids - new_ids:
+            UserDmrId.query.filter(UserDmrId.dmr_id.in_(old_ids - new_ids)).delete(synchronize_session=False)
+        if new_ids - old_ids:
+            for r in UserDmrId.query.filter(UserDmrId.dmr_id.in_(new_ids - old_ids)).all():
+                print('DMR ID ' + str(r.dmr_id) + ' belongs to user ID ' + str(r.user_id) + ', not given to ' + str(user.username))
+                refused.add(r.dmr_id)
+            for i in new_ids - old_ids - refused:
+                db.session.add(UserDmrId(dmr_id=i, user_id=user.id))
+        return refused
+
+    def dmr_id_user(dmr_id):
+        return User.query.join(UserDmrId, UserDmrId.user_id == User.id).filter(UserDmrId.dmr_id == int(dmr_id)).first()
+
+    # Fill user_dmr_ids from the users table, when upgrading from before it existed. Where two
+    # users list the same ID, the first keeps it, as the old search of dmr_ids found.
+    if not UserDmrId.query.first():
+        taken = {}
+        for u in db.session.query(User.id, User.dmr_ids).order_by(User.id).all():
+            try:
+                id_dict = ast.literal_eval(u.dmr_ids)
+            except:
+                continue
+            for i in id_dict:
+                try:
+                    i = int(i)
+                except:
+                    continue
+                if i not in taken:
+                    taken[i] = {'dmr_id': i, 'user_id': u.id}
+        try:
+            db.session.bulk_insert_mappings(UserDmrId, list(taken.values()))
+            db.session.commit()
+        except IntegrityError:
+            # Another web service process got there first
+            db.session.rollback()
+
     # Query radioid.net for list of DMR IDs, then add to DB
     @user_registered.connect_via(app)
     def _after_user_registered_hook(sender, user, **extra):
@@ -691,6 +821,7 @@ def hbnet_web_service():
         radioid_data = ast.literal_eval(get_ids(user.username))
 ##        edit_user.notes = ''
         edit_user.dmr_ids = str(radioid_data[0])
+        sync_dmr_ids(edit_user)
         edit_user.first_name = str(radioid_data[1])
         edit_user.last_name = str(radioid_data[2])
         edit_user.city = str(radioid_data[3])
@@ -726,7 +857,10 @@ def hbnet_web_service():
     def gen_passphrase(dmr_id):
         _new_peer_id = bytes_4(int(str(dmr_id)[:7]))
         trimmed_id = int(str(dmr_id)[:7])
-        b_list = get_burnlist()
+        burn = BurnList.query.filter_by(dmr_id=trimmed_id).first()
+        b_list = {}
+        if burn:
+            b_list[burn.dmr_id] = burn.version
         # print(b_list)
         burned = False
         for ui in b_list.items():
@@ -758,6 +892,7 @@ def hbnet_web_service():
             elif i[0] not in db_id_dict:
                 new_id_dict[i[0]] = 0
         edit_user.dmr_ids = str(new_id_dict)
+        sync_dmr_ids(edit_user)
         edit_user.first_name = str(ast.literal_eval(get_ids(callsign))[1])
         edit_user.last_name = str(ast.literal_eval(get_ids(callsign))[2])
         edit_user.city = str(ast.literal_eval(get_ids(callsign))[3])
@@ -977,33 +1112,38 @@ def hbnet_web_service():
             content = 'No peer found.'
         return render_template('single_map_peer.html', markup_content = Markup(content))
 
-    @app.route('/map')
-##    @login_required
-    def map_page():
-        dev_loc = GPS_LocLog.query.order_by(GPS_LocLog.time.desc()).limit(300).all()
-        dev_list = []
-        f_map = folium.Map(location=center_map, zoom_start=map_zoom)
-        peer_l = PeerLoc.query.all()
-##        print(peer_l)
+    # Newest GPS position of each callsign (from the last 300) and every peer, as GeoJSON
+    # features. Only rebuilt when a position or peer has been added or removed since. The
+    # row counts catch trimming, which removes old rows and leaves the newest id as it was.
+    def map_points():
+        gps_v = db.session.query(db.func.max(GPS_LocLog.id), db.func.count(GPS_LocLog.id)).first()
+        peer_v = db.session.query(db.func.max(PeerLoc.id), db.func.count(PeerLoc.id)).first()
+        version = (tuple(gps_v), tuple(peer_v))
+        if map_cache['VERSION'] == version:
+            return map_cache
+        features = []
+        peers = []
         if mode == 'FULL' or mode == 'DASH_ONLY':
-            for i in dev_loc:
+            dev_list = []
+            for i in GPS_LocLog.query.order_by(GPS_LocLog.time.desc()).limit(300).all():
                 if i.callsign in dev_list:
-                    pass
-                elif i.callsign not in dev_list:
-                    dev_list.append(i.callsign)
-                    lat = i.lat
-                    lon = i.lon
+                    continue
+                dev_list.append(i.callsign)
+                try:
+                    lat = aprs_to_latlon(float(re.sub('[A-Za-z]','', i.lat)))
                     if 'S' in i.lat:
-                        lat = aprs_to_latlon(float(re.sub('[A-Za-z]','', i.lat)))
                         lat = -lat
-                    if 'S' not in i.lat:
-                        lat = aprs_to_latlon(float(re.sub('[A-Za-z]','', i.lat)))
+                    lon = aprs_to_latlon(float(re.sub('[A-Za-z]','', i.lon)))
                     if 'W' in i.lon:
-                        lon = aprs_to_latlon(float(re.sub('[A-Za-z]','', i.lon)))
                         lon = -lon
-                    if 'W' not in i.lon:
-                        lon = aprs_to_latlon(float(re.sub('[A-Za-z]','', i.lon)))
-                    folium.Marker([lat, lon], popup="""<i>
+                except:
+                    continue
+                features.append({'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [lon, lat]}, 'properties': {
+                    'key': 'gps_' + str(i.callsign),
+                    'color': 'blue',
+                    'time': (i.time - datetime.datetime(1970, 1, 1)).total_seconds(),
+                    'tooltip': '<strong>' + i.callsign + '</strong>',
+                    'popup': """<i>
                         <table style="width: 150px;">
                         <tbody>
                         <tr>
@@ -1021,31 +1161,21 @@ def hbnet_web_service():
                         </tbody>
                         </table>
                         </i>
-                        """, icon=folium.Icon(color="blue", icon="record"), tooltip='<strong>' + i.callsign + '</strong>').add_to(f_map)
-        if mode == 'FULL' or mode == 'DMR_ONLY':            
-            for l in peer_l:
-    ##            print(time.time() - l.time().total_seconds() > 3600 )
-    ##            print(datetime.datetime.now() - timedelta(days = 2))
-    ##            if datetime.datetime.now() - timedelta(days = 2) > timedelta(days = 2):
-    ##                print('greater')
-    ##            folium.Marker([float(l[1][1]), float(l[1][2])], popup='''
-    ##<div class="panel panel-default">
-    ##  <div class="panel-heading" style="text-align: center;"><h4>''' + l[1][0] + '''</h4></div>
-    ##  <div class="panel-body">
-    ##  ''' + l[1][5] + '''
-    ##  <hr />
-    ##  ''' + l[1][1] + ''', ''' + l[1][2] + '''
-    ##  <hr />
-    ##  ''' + l[1][3] + '''
-    ##  <hr />
-    ##  ''' + l[1][4] + '''
-    ##  <hr />
-    ##  ''' + l[1][6] + '''
-    ##    </div>
-    ##</div>
-    ##         ''', icon=folium.Icon(color="red", icon="record"), tooltip='<strong>' + l[1][0] + '</strong>').add_to(f_map)
-
-                folium.Marker([float(l.lat), float(l.lon)], popup='''
+                        """}})
+        if mode == 'FULL' or mode == 'DMR_ONLY':
+            for l in PeerLoc.query.all():
+                try:
+                    lat = float(l.lat)
+                    lon = float(l.lon)
+                except:
+                    continue
+                peers.append('peer_' + str(l.dmr_id))
+                features.append({'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [lon, lat]}, 'properties': {
+                    'key': 'peer_' + str(l.dmr_id),
+                    'color': 'red',
+                    'time': (l.time - datetime.datetime(1970, 1, 1)).total_seconds(),
+                    'tooltip': '<strong>' + l.callsign + '</strong>',
+                    'popup': '''
     <table style="width: 100px; height: 100px;">
     <tbody>
     <tr>
@@ -1067,9 +1197,59 @@ def hbnet_web_service():
     </tbody>
     </table>
 
-    ''', icon=folium.Icon(color="red", icon="record"), tooltip='<strong>' + l.callsign + '</strong>').add_to(f_map)
-        content = f_map._repr_html_()
-       
+    '''}})
+        map_cache['FEATURES'] = features
+        map_cache['PEERS'] = peers
+        map_cache['TIME'] = max([f['properties']['time'] for f in features] + [0])
+        map_cache['VERSION'] = version
+        return map_cache
+
+    # Map points as GeoJSON, ?since=<time> for only those newer than a time given by an earlier
+    # answer. 'peers' lists every peer on the map, so the page can drop peers that have gone.
+    @app.route('/map/points')
+    def map_points_page():
+        points = map_points()
+        since = request.args.get('since', 0, type=float)
+        if since:
+            features = [f for f in points['FEATURES'] if f['properties']['time'] > since]
+        else:
+            features = points['FEATURES']
+        return jsonify(type='FeatureCollection', features=features, peers=points['PEERS'], time=max(points['TIME'], since))
+
+    @app.route('/map')
+##    @login_required
+    def map_page():
+        # The map itself never changes, the page fetches the points from /map/points
+        if not map_cache['SHELL']:
+            f_map = folium.Map(location=center_map, zoom_start=map_zoom)
+            f_map.get_root().script.add_child(folium.Element('''
+var map_markers = {};
+var map_since = 0;
+function map_marker(f) {
+    var p = f.properties;
+    if (map_markers[p.key]) {
+        ''' + f_map.get_name() + '''.removeLayer(map_markers[p.key]);
+    }
+    map_markers[p.key] = L.marker([f.geometry.coordinates[1], f.geometry.coordinates[0]], {icon: L.AwesomeMarkers.icon({icon: 'record', markerColor: p.color, prefix: 'glyphicon', iconColor: 'white'})}).bindPopup(p.popup).bindTooltip(p.tooltip).addTo(''' + f_map.get_name() + ''');
+}
+function map_update() {
+    fetch("''' + url + '''/map/points?since=" + map_since).then(function (r) { return r.json(); }).then(function (d) {
+        d.features.forEach(map_marker);
+        for (var key in map_markers) {
+            if (key.indexOf('peer_') == 0 && d.peers.indexOf(key) == -1) {
+                ''' + f_map.get_name() + '''.removeLayer(map_markers[key]);
+                delete map_markers[key];
+            }
+        }
+        map_since = d.time;
+    });
+}
+// After the map itself has been set up, further down the page
+document.addEventListener('DOMContentLoaded', map_update);
+setInterval(map_update, ''' + str(int(map_refresh_time * 1000)) + ''');
+'''))
+            map_cache['SHELL'] = f_map._repr_html_()
+        content = map_cache['SHELL']
         return render_template('map.html', markup_content = Markup(content))
     
     @app.route('/help')
@@ -1127,8 +1307,7 @@ def hbnet_web_service():
     @login_required
     def gen():
         #print(str(gen_passphrase(3153591))) #(int(i[0])))
-        pl = Misc.query.filter_by(field_1='ping_list').first()
-        ping_list = ast.literal_eval(pl.field_2)
+        ping_list = get_server_pings()
         sl = ServerList.query.all()
         script_l = Misc.query.filter_by(field_1='script_links').first()
         script_links = ast.literal_eval(script_l.field_2)
@@ -1424,6 +1603,8 @@ def hbnet_web_service():
                 content = content + '''<p style="text-align: center;">Changed password for user: <strong>''' + str(user) + '''</strong></p>\n'''
             if request.form.get('dmr_ids') != edit_user.dmr_ids:
                 edit_user.dmr_ids = request.form.get('dmr_ids')
+                for i in sorted(sync_dmr_ids(edit_user)):
+                    content = content + '''<p style="text-align: center;">DMR ID <strong>''' + str(i) + '''</strong> belongs to another user, not given to: <strong>''' + str(user) + '''</strong></p>\n'''
                 dmr_auth_dict = ast.literal_eval(request.form.get('dmr_ids'))
                 for id_user in dmr_auth_dict:
                     if isinstance(dmr_auth_dict[id_user], int) == True and dmr_auth_dict[id_user] != 0:
@@ -1454,6 +1635,7 @@ def hbnet_web_service():
             #edit_user = User.query.filter(User.username == request.args.get('callsign')).first()
         elif request.method == 'GET' and request.args.get('callsign') and request.args.get('delete_user') == 'true':
             delete_user = User.query.filter(User.username == request.args.get('callsign')).first()
+            UserDmrId.query.filter_by(user_id=delete_user.id).delete()
             db.session.delete(delete_user)
             db.session.commit()
             content = '''<p style="text-align: center;">Deleted user: <strong>''' + str(delete_user.username) + '''</strong></p>\n'''
@@ -1716,7 +1898,7 @@ def hbnet_web_service():
         #print(type(script_links[dmr_id]))
         script_l = Misc.query.filter_by(field_1='script_links').first()
         script_links = ast.literal_eval(script_l.field_2)
-        u = User.query.filter(User.dmr_ids.contains(request.args.get('dmr_id'))).first()
+        u = dmr_id_user(dmr_id)
 
         pub_list = []
         
@@ -1724,14 +1906,15 @@ def hbnet_web_service():
         
         #print(u.dmr_ids)
 
-        if authorized_peer(dmr_id)[1] == 0:
+        peer_auth = authorized_peer(dmr_id)
+        if peer_auth[1] == 0:
             passphrase = gen_passphrase(dmr_id)
-        elif authorized_peer(dmr_id)[1] != 0 and isinstance(authorized_peer(dmr_id)[1], int) == True:
+        elif peer_auth[1] != 0 and isinstance(peer_auth[1], int) == True:
             passphrase = gen_passphrase(dmr_id)
-        elif authorized_peer(dmr_id)[1] == '':
+        elif peer_auth[1] == '':
             passphrase = legacy_passphrase
-        elif authorized_peer(dmr_id)[1] != '' or authorized_peer(dmr_id)[1] != 0:
-            passphrase = authorized_peer(dmr_id)[1]
+        elif peer_auth[1] != '' or peer_auth[1] != 0:
+            passphrase = peer_auth[1]
         #try:
         if dmr_id in script_links and number == float(script_links[dmr_id]):
             script_links.pop(dmr_id)
@@ -1770,7 +1953,7 @@ def hbnet_web_service():
 
     def authorized_peer(peer_id):
         try:
-            u = User.query.filter(User.dmr_ids.contains(str(peer_id))).first()
+            u = dmr_id_user(peer_id)
             login_passphrase = ast.literal_eval(u.dmr_ids)
             return [u.is_active, login_passphrase[peer_id], str(u.username)]
         except:
@@ -1798,12 +1981,12 @@ def hbnet_web_service():
         elif request.args.get('portal_username') and not request.args.get('flush_user_db') and not request.args.get('flush_dmr_id_db') or request.args.get('dmr_id') and not request.args.get('flush_user_db') and not request.args.get('flush_dmr_id_db'):
             if request.args.get('portal_username'):
 ##                s_filter = portal_username=request.args.get('portal_username')
-                a = AuthLog.query.filter_by(portal_username=str(request.args.get('portal_username')).strip('"')).order_by(AuthLog.login_time.desc()).all()
+                a, next_page = authlog_page(authlog_query(request.args), authlog_before(request.args))
                 g_arg = str(request.args.get('portal_username')).strip('"')
                 f_link = '''    <p style="text-align: center;"><strong><a href="auth_log?flush_user_db=true&portal_username=''' + request.args.get('portal_username') + '''"><button type="button" class="btn btn-danger">Flush auth log for: ''' + request.args.get('portal_username') + '''</button></a></strong></p>'''
             elif request.args.get('dmr_id'):
 ##                s_filter = login_dmr_id=request.args.get('dmr_id')
-                a = AuthLog.query.filter_by(login_dmr_id=request.args.get('dmr_id')).order_by(AuthLog.login_time.desc()).all()
+                a, next_page = authlog_page(authlog_query(request.args), authlog_before(request.args))
                 g_arg = request.args.get('dmr_id')
                 f_link = '''<p style="text-align: center;"><strong><a href="auth_log?flush_dmr_id_db=true&dmr_id=''' + request.args.get('dmr_id') + '''"><button type="button" class="btn btn-danger">Flush auth log for: ''' + request.args.get('dmr_id') + '''</button></a></strong></p>'''
 ##            print(s_filter)
@@ -1889,10 +2072,10 @@ def hbnet_web_service():
     <td style="text-align: center;"><span style="color: #000000; background-color: #FF2400;">&nbsp;<strong>''' + str(i.login_type) + '''</span></strong>&nbsp;</td> 
     </tr>
 '''
-            content = content + '</tbody></table>'
+            content = content + '</tbody></table>' + authlog_links(next_page)
             
         elif request.args.get('mmdvm_server') and not request.args.get('flush_db_mmdvm'):
-            a = AuthLog.query.filter_by(server_name=request.args.get('mmdvm_server')).order_by(AuthLog.login_time.desc()).all()
+            a, next_page = authlog_page(authlog_query(request.args), authlog_before(request.args))
             content = '''
     <p>&nbsp;</p>
     <p style="text-align: center;"><strong><a href="auth_log?flush_db_mmdvm=true&mmdvm_server=''' + request.args.get('mmdvm_server') + '''"><button type="button" class="btn btn-danger">Flush authentication log for server: ''' + request.args.get('mmdvm_server') + '''</button></a></strong></p>
@@ -1971,10 +2154,10 @@ def hbnet_web_service():
     <td style="text-align: center;"><span style="color: #000000; background-color: #FF2400;">&nbsp;<strong>''' + str(i.login_type) + '''</span></strong>&nbsp;</td> 
     </tr>
 '''
-            content = content + '</tbody></table>'
+            content = content + '</tbody></table>' + authlog_links(next_page)
 
         elif request.args.get('peer_ip') and not request.args.get('flush_db_ip'):
-            a = AuthLog.query.filter_by(peer_ip=request.args.get('peer_ip')).order_by(AuthLog.login_time.desc()).all()
+            a, next_page = authlog_page(authlog_query(request.args), authlog_before(request.args))
             content = '''
     <p>&nbsp;</p>
     <p style="text-align: center;"><strong><a href="auth_log?flush_db_ip=true&peer_ip=''' + request.args.get('peer_ip') + '''"><button type="button" class="btn btn-danger">Flush authentication log for IP: ''' + request.args.get('peer_ip') + '''</button></a></strong></p>
@@ -2053,12 +2236,14 @@ def hbnet_web_service():
     <td style="text-align: center;"><span style="color: #000000; background-color: #FF2400;">&nbsp;<strong>''' + str(i.login_type) + '''</span></strong>&nbsp;</td> 
     </tr>
 '''
-            content = content + '</tbody></table>'
+            content = content + '</tbody></table>' + authlog_links(next_page)
             
         else:
             #a = AuthLog.query.all()
 ##            a = AuthLog.query.order_by(AuthLog.login_time.desc()).limit(300).all()
-            a = AuthLog.query.order_by(AuthLog.login_time.desc()).all()
+            # Newest entry for each DMR ID
+            latest = db.session.query(db.func.max(AuthLog.id)).group_by(AuthLog.login_dmr_id)
+            a, next_page = authlog_page(authlog_query(request.args).filter(AuthLog.id.in_(latest)), authlog_before(request.args))
             recent_list = []
 ##            r = AuthLog.query.order_by(AuthLog.login_dmr_id.desc()).all()
             content = '''
@@ -2143,10 +2328,46 @@ def hbnet_web_service():
     </tr>
 '''
                
-            content = content + '</tbody></table>'
+            content = content + '</tbody></table>' + authlog_links(next_page)
         return render_template('flask_user_layout.html', markup_content = Markup(content))
 
     
+    # The authentication log, filtered as on /auth_log, as CSV or JSON (?format=json). Sent a page at
+    # a time as it is read, so the whole log is never held in memory.
+    @app.route('/auth_log/export')
+    @login_required
+    @roles_required('Admin')
+    def auth_log_export():
+        args = request.args.to_dict()
+        fields = ['id', 'login_dmr_id', 'portal_username', 'peer_ip', 'login_auth_method', 'server_name', 'login_time', 'login_type']
+        # A page of rows at a time, each page is sent as one piece
+        def pages():
+            before = None
+            while True:
+                a, before = authlog_page(authlog_query(args), before, 1000)
+                yield [[i.id, i.login_dmr_id, i.portal_username, i.peer_ip, i.login_auth_method, i.server_name, str(i.login_time), i.login_type] for i in a]
+                if not before:
+                    break
+        def export_csv():
+            page = io.StringIO()
+            writer = csv.writer(page)
+            writer.writerow(fields)
+            for p in pages():
+                writer.writerows(p)
+                yield page.getvalue()
+                page.seek(0)
+                page.truncate(0)
+        def export_json():
+            sep = '['
+            for p in pages():
+                if p:
+                    yield sep + ',\n'.join(json.dumps(dict(zip(fields, r))) for r in p)
+                    sep = ',\n'
+            yield ']' if sep == ',\n' else '[]'
+        if request.args.get('format') == 'json':
+            return Response(stream_with_context(export_json()), mimetype='application/json', headers={'Content-Disposition': 'attachment; filename=auth_log.json'})
+        return Response(stream_with_context(export_csv()), mimetype='text/csv', headers={'Content-Disposition': 'attachment; filename=auth_log.csv'})
+
     @app.route('/news') #, methods=['POST', 'GET'])
 ##    @login_required
     def view_news():
@@ -3384,13 +3605,18 @@ Name: <strong>''' + p.name + '''</strong>&nbsp; -&nbsp; Port: <strong>''' + str(
         return burn_dict
 
     def get_aprs_settings():
-        ul = User.query.all()
+        ul = db.session.query(User.aprs).all()
         unreg_l = Misc.query.filter_by(field_1='unregistered_aprs').first()
         ur_l = ast.literal_eval(unreg_l.field_2)
         #print(b)
         aprs_dict = {}
+        # Only parse the settings of users whose aprs has changed since the last call, and keep
+        # only the current strings so the cache doesn't grow
+        parsed = {}
         for i in ul:
-            usr_settings = ast.literal_eval(i.aprs)
+            if i.aprs not in parsed:
+                parsed[i.aprs] = aprs_cache[i.aprs] if i.aprs in aprs_cache else ast.literal_eval(i.aprs)
+            usr_settings = parsed[i.aprs]
             for s in usr_settings.items():
 ##                print(s[1])
 ##                if s[1] == 'default':
@@ -3400,6 +3626,8 @@ Name: <strong>''' + p.name + '''</strong>&nbsp; -&nbsp; Port: <strong>''' + str(
         for s in ur_l.items():
 ##            print(s)
             aprs_dict[s[0]] = s[1]
+        aprs_cache.clear()
+        aprs_cache.update(parsed)
         return aprs_dict
         
     def add_burnlist(_dmr_id, _version):
@@ -3604,7 +3832,7 @@ Name: <strong>''' + p.name + '''</strong>&nbsp; -&nbsp; Port: <strong>''' + str(
             )
         # Only add to mailbox if user exists
         try:
-            usr_nm = User.query.filter(User.dmr_ids.ilike('%' + str(_rcv_id) + '%')).first()
+            usr_nm = dmr_id_user(_rcv_id)
             add_sms_mail = MailBox(
                 snd_callsign = _snd_call,
                 rcv_callsign = str(usr_nm.username).upper(),
@@ -3641,33 +3869,27 @@ Name: <strong>''' + p.name + '''</strong>&nbsp; -&nbsp; Port: <strong>''' + str(
         db.session.commit()
         
         
+    # Each is one DELETE using the time index, rather than loading the table and checking every row
     def trim_bb():
-        trim_bb = BulletinBoard.query.all()
-
-        for i in trim_bb:
-            elap_time = int(datetime.datetime.utcnow().strftime('%s')) - int(i.time.strftime('%s'))
-            # Remove entries more than 1 month old
-            if elap_time > 2678400:
-                db.session.delete(i)
+        # Remove entries more than 1 month old
+        BulletinBoard.query.filter(BulletinBoard.time < datetime.datetime.utcnow() - timedelta(seconds=2678400)).delete(synchronize_session=False)
         
     def trim_sms_log():
-        trim_sms = SMSLog.query.all()
-
-        for i in trim_sms:
-            elap_time = int(datetime.datetime.utcnow().strftime('%s')) - int(i.time.strftime('%s'))
-            # Remove entries more than 1 month old
-            if elap_time > 2678400:
-                db.session.delete(i)
+        # Remove entries more than 1 month old
+        SMSLog.query.filter(SMSLog.time < datetime.datetime.utcnow() - timedelta(seconds=2678400)).delete(synchronize_session=False)
                 
     def trim_dash_loc():
-        trim_dash = GPS_LocLog.query.all()
-##        db.session.delete(delete_b)
-##        db.session.commit()
-        for i in trim_dash:
-            elap_time = int(datetime.datetime.utcnow().strftime('%s')) - int(i.time.strftime('%s'))
-            # Remove entries more than 2 weeks old
-            if elap_time > 1209600:
-                db.session.delete(i)
+        # Remove entries more than 2 weeks old
+        GPS_LocLog.query.filter(GPS_LocLog.time < datetime.datetime.utcnow() - timedelta(seconds=1209600)).delete(synchronize_session=False)
+
+    # Run the trims at most once every trim_interval seconds, from whichever request comes along
+    def trim_logs():
+        if time.time() - trim_time['LAST'] < trim_interval:
+            return
+        trim_time['LAST'] = time.time()
+        trim_dash_loc()
+        trim_sms_log()
+        trim_bb()
         db.session.commit()
         
     def update_burnlist(_dmr_id, _version):
@@ -3724,35 +3946,126 @@ Name: <strong>''' + p.name + '''</strong>&nbsp; -&nbsp; Port: <strong>''' + str(
         m.boo_2 = _boo_2
         db.session.commit()
         
+    # Note a ping or config download from a server. The counters are added to by the database,
+    # so servers pinging at the same time don't lose each other's updates.
+    def server_ping(_server, _config = False):
+        now = time.time()
+        if _config:
+            values = {'last_ping': now, 'config_pulls': ServerPing.config_pulls + 1}
+        else:
+            values = {'last_ping': now, 'pings': ServerPing.pings + 1}
+        if ServerPing.query.filter_by(server=_server).update(values, synchronize_session=False) == 0:
+            try:
+                db.session.add(ServerPing(server=_server, last_ping=now, pings=int(not _config), config_pulls=int(_config)))
+                db.session.commit()
+                return
+            except IntegrityError:
+                # Another request added it first
+                db.session.rollback()
+                ServerPing.query.filter_by(server=_server).update(values, synchronize_session=False)
+        db.session.commit()
+
+    # Apply a UNIT table upload from a server. _update is a list of [dmr_id, system, last seen] for
+    # units added or heard again, _remove a list of expired dmr_ids. A full upload replaces the lot.
+    def unit_table_update(_server, _update, _remove, _full):
+        if _full:
+            UnitTable.query.filter_by(server=_server).delete()
+            # Left by servers from before the unit_table table
+            Misc.query.filter_by(field_1='unit_table_' + _server).delete()
+        elif _remove:
+            UnitTable.query.filter(UnitTable.server == _server).filter(UnitTable.dmr_id.in_(_remove)).delete(synchronize_session=False)
+        units = {}
+        for i in _update:
+            units[int(i[0])] = i
+        existing = {}
+        if not _full:
+            unit_ids = list(units)
+            # A chunk at a time, to stay under the database's limit on query parameters
+            for c in range(0, len(unit_ids), 500):
+                for u in UnitTable.query.filter(UnitTable.server == _server).filter(UnitTable.dmr_id.in_(unit_ids[c:c + 500])).all():
+                    existing[u.dmr_id] = u
+        for i in units.values():
+            if int(i[0]) in existing:
+                existing[int(i[0])].system_name = str(i[1])
+                existing[int(i[0])].last_seen = float(i[2])
+            else:
+                db.session.add(UnitTable(server=_server, dmr_id=int(i[0]), system_name=str(i[1]), last_seen=float(i[2])))
+        db.session.commit()
+
+    # format: {server: last ping time}
+    def get_server_pings():
+        ping_dict = {}
+        for i in db.session.query(ServerPing.server, ServerPing.last_ping).all():
+            ping_dict[i.server] = i.last_ping
+        return ping_dict
+
     def delete_misc_field_1(_field_1):
         delete_f1 = Misc.query.filter_by(field_1=_field_1).first()
         db.session.delete(delete_f1)
         db.session.commit()
         
+    # AuthLog rows matching the filters in _args: dmr_id, portal_username, mmdvm_server, peer_ip
+    # and login_type (Attempt, Confirmed or Failed)
+    def authlog_query(_args):
+        a = AuthLog.query
+        if _args.get('dmr_id'):
+            a = a.filter(AuthLog.login_dmr_id == _args.get('dmr_id'))
+        if _args.get('portal_username'):
+            a = a.filter(AuthLog.portal_username == str(_args.get('portal_username')).strip('"'))
+        if _args.get('mmdvm_server'):
+            a = a.filter(AuthLog.server_name == _args.get('mmdvm_server'))
+        if _args.get('peer_ip'):
+            a = a.filter(AuthLog.peer_ip == _args.get('peer_ip'))
+        if _args.get('login_type'):
+            a = a.filter(AuthLog.login_type == _args.get('login_type'))
+        return a
+
+    # Where the page asked for starts, the (login_time, id) of the last row on the page before
+    def authlog_before(_args):
+        try:
+            return (datetime.datetime.fromisoformat(_args.get('before_time')), int(_args.get('before_id')))
+        except:
+            return None
+
+    # A page of a query, newest first, starting after the row _before. Found through the index
+    # rather than with an offset, so later pages cost no more than the first. Returns the rows
+    # and where the next page starts, None if this is the last page.
+    def authlog_page(_query, _before = None, _per_page = auth_log_per_page):
+        if _before:
+            # Written with the <= on its own so the database can range scan the index
+            _query = _query.filter(AuthLog.login_time <= _before[0]).filter(or_(AuthLog.login_time < _before[0], AuthLog.id < _before[1]))
+        a = _query.order_by(AuthLog.login_time.desc(), AuthLog.id.desc()).limit(_per_page + 1).all()
+        if len(a) > _per_page:
+            return a[:_per_page], (a[_per_page - 1].login_time, a[_per_page - 1].id)
+        return a, None
+
+    # Buttons for the next page, and for exporting the log with the page's filters
+    def authlog_links(_next):
+        args = request.args.to_dict()
+        args.pop('before_time', None)
+        args.pop('before_id', None)
+        links = '''<p style="text-align: center;">'''
+        if _next:
+            links = links + '''<a href="auth_log?''' + urlencode(dict(args, before_time=str(_next[0]), before_id=str(_next[1]))) + '''"><button type="button" class="btn btn-primary">Older</button></a>&nbsp;'''
+        links = links + '''<a href="auth_log/export?''' + urlencode(dict(args, format='csv')) + '''"><button type="button" class="btn btn-success">Export CSV</button></a>&nbsp;<a href="auth_log/export?''' + urlencode(dict(args, format='json')) + '''"><button type="button" class="btn btn-success">Export JSON</button></a></p>'''
+        return links
+
     def authlog_flush():
         AuthLog.query.delete()
         db.session.commit()
         
     def authlog_flush_user(_user):
-        flush_e = AuthLog.query.filter_by(portal_username=_user).all()
-        for i in flush_e:
-            db.session.delete(i)
+        AuthLog.query.filter_by(portal_username=_user).delete()
         db.session.commit()
 
     def authlog_flush_dmr_id(_dmr_id):
-        flush_e = AuthLog.query.filter_by(login_dmr_id=_dmr_id).all()
-        for i in flush_e:
-            db.session.delete(i)
+        AuthLog.query.filter_by(login_dmr_id=_dmr_id).delete()
         db.session.commit()
     def authlog_flush_mmdvm_server(_mmdvm_serv):
-        flush_e = AuthLog.query.filter_by(server_name=_mmdvm_serv).all()
-        for i in flush_e:
-            db.session.delete(i)
+        AuthLog.query.filter_by(server_name=_mmdvm_serv).delete()
         db.session.commit()
     def authlog_flush_ip(_ip):
-        flush_e = AuthLog.query.filter_by(peer_ip=_ip).all()
-        for i in flush_e:
-            db.session.delete(i)
+        AuthLog.query.filter_by(peer_ip=_ip).delete()
         db.session.commit()
 ##    def peer_delete(_mode, _id):
 ##        if _mode == 'xlx':
@@ -3798,6 +4111,8 @@ Name: <strong>''' + p.name + '''</strong>&nbsp; -&nbsp; Port: <strong>''' + str(
             db.session.delete(d)
         for d in xp:
             db.session.delete(d)
+        ServerPing.query.filter_by(server=_name).delete()
+        UnitTable.query.filter_by(server=_name).delete()
         db.session.delete(s)
         
         db.session.commit()
@@ -3812,12 +4127,40 @@ Name: <strong>''' + p.name + '''</strong>&nbsp; -&nbsp; Port: <strong>''' + str(
         db.session.delete(p)
         db.session.commit()
 
+    # Done in the same transaction as the change, so every web service process sees both together
+    def bump_config_version(mapper, connection, target):
+        t = ConfigVersion.__table__
+        connection.execute(t.update().where(t.c.id == 1).values(version=t.c.version + 1))
+
+    for t in [ServerList, MasterList, ProxyList, OBP, mmdvmPeer, xlxPeer, BridgeRules, BridgeList]:
+        for e in ['after_insert', 'after_update', 'after_delete']:
+            event.listen(t, e, bump_config_version)
+
+    def config_version():
+        return db.session.query(ConfigVersion.version).filter_by(id=1).scalar()
+
+    # Read again whenever the config version has moved, which every ServerList change does in
+    # the same transaction, so no web service process keeps using an old secret
     def shared_secrets():
-        s = ServerList.query.all() #filter_by(name=_name).first()
-        r_list = []
-        for i in s:
-            r_list.append(str(i.secret))
-        return r_list
+        version = config_version()
+        if secret_cache['SECRETS'] == None or version == None or secret_cache['VERSION'] != version:
+            s = db.session.query(ServerList.secret).all() #filter_by(name=_name).first()
+            r_list = []
+            for i in s:
+                r_list.append(str(i.secret).encode())
+            secret_cache['SECRETS'] = r_list
+            secret_cache['VERSION'] = version
+        return secret_cache['SECRETS']
+
+    # Compare against every secret, in constant time, so the time taken doesn't give away
+    # how much of a secret was right
+    def valid_secret(_secret):
+        _secret = str(_secret).encode()
+        found = False
+        for i in shared_secrets():
+            if hmac.compare_digest(_secret, i):
+                found = True
+        return found
 
     def bridge_add(_name, _desc, _public, _tg):
         add_bridge = BridgeList(
@@ -3895,9 +4238,14 @@ Name: <strong>''' + p.name + '''</strong>&nbsp; -&nbsp; Port: <strong>''' + str(
             else:
                 if i.enable_unit == True:
                     UNIT.append(i.name)
+        proxies = {}
+        for i in all_p:
+            proxies[i.name] = i
         temp_dict = {}
+        bridge_rules = {}
         # populate dict with needed bridges
         for r in rules:
+            bridge_rules.setdefault(r.bridge_name, []).append(r)
 ##            print(r.bridge_name)
 ##            b = BridgeRules.query.filter_by(server=_name).filter_by(server=_name).all()
 ##            for d in temp_dict.items():
@@ -3909,8 +4257,7 @@ Name: <strong>''' + p.name + '''</strong>&nbsp; -&nbsp; Port: <strong>''' + str(
 ##        print(temp_dict)
         BRIDGES = temp_dict.copy()
         for r in temp_dict.items():
-            b = BridgeRules.query.filter_by(bridge_name=r[0]).filter_by(server=_name).all()
-            for s in b:
+            for s in bridge_rules[r[0]]:
                 try:
                     if s.system_name == disabled[s.system_name]:
                         pass
@@ -3920,7 +4267,7 @@ Name: <strong>''' + p.name + '''</strong>&nbsp; -&nbsp; Port: <strong>''' + str(
                     else:
                         timeout = int(s.timeout)
                     if s.proxy == True:
-                        p = ProxyList.query.filter_by(server=_name).filter_by(name=s.system_name).first()
+                        p = proxies[s.system_name]
 ##                        print(p.external_port)
                         n_systems = p.internal_stop_port - p.internal_start_port
                         n_count = 0
@@ -4082,6 +4429,55 @@ Name: <strong>''' + p.name + '''</strong>&nbsp; -&nbsp; Port: <strong>''' + str(
         # print(master_config_list)
         return master_config_list
 
+    # A server's config or rules, made again only after config_version() moves. The ETag only
+    # changes if what the server would get is different.
+    def config_snapshot(_kind, _server):
+        version = config_version()
+        snap = config_snapshots.get((_kind, _server))
+        if snap and version != None and snap['VERSION'] == version:
+            return snap
+        if _kind == 'rules':
+            unit, bridges = generate_rules(_server)
+            data = {'UNIT': unit, 'BRIDGES': bridges}
+        else:
+            data = {'config': server_get(_server), 'peers': get_peer_configs(_server), 'masters': masters_get(_server)}
+        # Kept as the server will see it, tuples become lists
+        data = json.loads(json.dumps(data))
+        etag = hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+        if snap and snap['ETAG'] == etag:
+            snap['VERSION'] = version
+            return snap
+        config_snapshots[(_kind, _server)] = {'VERSION': version, 'ETAG': etag, 'DATA': data, 'PREVIOUS': (snap['ETAG'], snap['DATA']) if snap else None}
+        return config_snapshots[(_kind, _server)]
+
+    # Changes from _old to _new. Sections that are dicts (systems, bridges) are compared key by
+    # key, anything else is sent whole if it changed.
+    def snapshot_diff(_old, _new):
+        changed = {}
+        removed = {}
+        for s in _new:
+            if isinstance(_new[s], dict) and isinstance(_old.get(s), dict):
+                c = {k: v for k, v in _new[s].items() if _old[s].get(k) != v}
+                r = [k for k in _old[s] if k not in _new[s]]
+                if c:
+                    changed[s] = c
+                if r:
+                    removed[s] = r
+            elif _old.get(s) != _new[s]:
+                changed[s] = _new[s]
+        return {'CHANGED': changed, 'REMOVED': removed}
+
+    # Nothing if the server already has _etag, only the changes if it has the one before, or all of it
+    def snapshot_response(_kind, _server, _etag):
+        snap = config_snapshot(_kind, _server)
+        if _etag == snap['ETAG']:
+            return jsonify(not_modified=True, etag=snap['ETAG'])
+        if _etag and snap['PREVIOUS'] and _etag == snap['PREVIOUS'][0]:
+            return jsonify(diff=snapshot_diff(snap['PREVIOUS'][1], snap['DATA']), etag=snap['ETAG'])
+        if _kind == 'rules':
+            return jsonify(rules=[snap['DATA']['UNIT'], snap['DATA']['BRIDGES']], etag=snap['ETAG'])
+        return jsonify(etag=snap['ETAG'], **snap['DATA'])
+
     def add_system_rule(_bridge_name, _system_name, _ts, _tg, _active, _timeout, _to_type, _on, _off, _reset, _server):
         proxy = ProxyList.query.filter_by(server=_server).filter_by(name=_system_name).first()
         is_proxy = False
@@ -5079,8 +5475,7 @@ Name: <strong>''' + p.name + '''</strong>&nbsp; -&nbsp; Port: <strong>''' + str(
 '''
         else:
             all_s = ServerList.query.all()
-            pl = Misc.query.filter_by(field_1='ping_list').first()
-            ping_list = ast.literal_eval(pl.field_2)
+            ping_list = get_server_pings()
             p_list = '''
 <h3 style="text-align: center;">View/Edit Servers</h3>
 
@@ -6661,6 +7056,7 @@ Name: <strong>''' + p.name + '''</strong>&nbsp; -&nbsp; Port: <strong>''' + str(
                 
                 db.session.add(user)
                 u = User.query.filter_by(username=request.form.get('username')).first()
+                sync_dmr_ids(u)
                 user_role = UserRoles(
                     user_id=u.id,
                     role_id=2,
@@ -7046,10 +7442,8 @@ Name: <strong>''' + p.name + '''</strong>&nbsp; -&nbsp; Port: <strong>''' + str(
     @roles_required('Admin')
     @app.route('/unit/<server>')
     def get_unit_table(server):
-        unit_table = Misc.query.filter_by(field_1='unit_table_' + server).first()
         svr = ServerList.query.filter_by(name=server).first()
-        table_dict = ast.literal_eval(unit_table.field_2)
-        print(table_dict)
+        units = db.session.query(UnitTable, User.username).outerjoin(UserDmrId, UserDmrId.dmr_id == UnitTable.dmr_id).outerjoin(User, User.id == UserDmrId.user_id).filter(UnitTable.server == server).order_by(UnitTable.last_seen.desc()).all()
         content = '''
 <h3 style="text-align: center;">UNIT Call Routing Table for ''' + server + '''</h3>
 <p>&nbsp;</p>
@@ -7065,22 +7459,23 @@ Name: <strong>''' + p.name + '''</strong>&nbsp; -&nbsp; Port: <strong>''' + str(
   <tbody>
 
 '''
+        # Joined once at the end, adding to content row by row copies it every time
+        rows = []
 ##        try:
-        for i in table_dict.items():
-            try:
-                usr_nm = User.query.filter(User.dmr_ids.ilike('%' + str(int_id(i[0])) + '%')).first()
-                usr_lnk = '''<a href="/edit_user?callsign=''' + str(usr_nm.username) + '''"><button type="button" class="btn btn-success">''' + str(usr_nm.username) + '''</button></a>'''
-            except:
+        for i, username in units:
+            if username:
+                usr_lnk = '''<a href="/edit_user?callsign=''' + str(username) + '''"><button type="button" class="btn btn-success">''' + str(username) + '''</button></a>'''
+            else:
                 usr_lnk = ''
-            content = content + '''
+            rows.append('''
 <tr>
-  <td><p><a href="https://www.radioid.net/database/view?id=''' + str(int_id(i[0])) + '''" target="_blank" rel="noopener"><button type="button" class="btn btn-warning">''' + str(int_id(i[0])) + '''</button></a><br /><br />''' + usr_lnk + '''</td>
-  <td>''' + str((i[1][0])) + '''</td>
-  <td>''' + str((timedelta(seconds=svr.unit_time) + datetime.datetime.fromtimestamp(i[1][1])).strftime(time_format)) + '''</td>
+  <td><p><a href="https://www.radioid.net/database/view?id=''' + str(i.dmr_id) + '''" target="_blank" rel="noopener"><button type="button" class="btn btn-warning">''' + str(i.dmr_id) + '''</button></a><br /><br />''' + usr_lnk + '''</td>
+  <td>''' + str(i.system_name) + '''</td>
+  <td>''' + str((timedelta(seconds=svr.unit_time) + datetime.datetime.fromtimestamp(i.last_seen)).strftime(time_format)) + '''</td>
 </tr>
-'''
+''')
 
-        content = content + '</tbody></table>'
+        content = content + ''.join(rows) + '</tbody></table>'
 ####        except:
 ####            content = '<h4><p style="text-align: center;">No UNIT table or other.</p></h4>'
         return render_template('flask_user_layout.html', markup_content = Markup(content))
@@ -7224,42 +7619,40 @@ Name: <strong>''' + p.name + '''</strong>&nbsp; -&nbsp; Port: <strong>''' + str(
     def svr_endpoint():
         hblink_req = request.json
         print((hblink_req))
-        if hblink_req['secret'] in shared_secrets():
+        if valid_secret(hblink_req['secret']):
             try:
                 if hblink_req['ping']:
-                    pl = Misc.query.filter_by(field_1='ping_list').first()
-                    ping_list = ast.literal_eval(pl.field_2)
-                    ping_list[hblink_req['ping']] = time.time()
-                    misc_edit_field_1('ping_list', str(ping_list), '', '', 0, 0, 0, 0, True, True)
+                    server_ping(hblink_req['ping'])
                     response = ''
             except:
                 pass
             if 'login_id' in hblink_req and 'login_confirmed' not in hblink_req:
                 if type(hblink_req['login_id']) == int:
-                    if authorized_peer(hblink_req['login_id'])[0]:
+                    peer_auth = authorized_peer(hblink_req['login_id'])
+                    if peer_auth[0]:
 ##                        print(active_tgs)
-                        if isinstance(authorized_peer(hblink_req['login_id'])[1], int) == True:
-                            authlog_add(hblink_req['login_id'], hblink_req['login_ip'], hblink_req['login_server'], authorized_peer(hblink_req['login_id'])[2], gen_passphrase(hblink_req['login_id']), 'Attempt')
+                        if isinstance(peer_auth[1], int) == True:
+                            authlog_add(hblink_req['login_id'], hblink_req['login_ip'], hblink_req['login_server'], peer_auth[2], gen_passphrase(hblink_req['login_id']), 'Attempt')
 ##                            active_tgs[hblink_req['login_server']][hblink_req['system']] = [{'1':[]}, {'2':[]}, {'SYSTEM': ''}, {'peer_id':hblink_req['login_id']}]
                             response = jsonify(
                                     allow=True,
                                     mode='normal',
                                     )
-                        elif authorized_peer(hblink_req['login_id'])[1] == '':
-                            authlog_add(hblink_req['login_id'], hblink_req['login_ip'], hblink_req['login_server'], authorized_peer(hblink_req['login_id'])[2], 'Config Passphrase: ' + legacy_passphrase, 'Attempt')
+                        elif peer_auth[1] == '':
+                            authlog_add(hblink_req['login_id'], hblink_req['login_ip'], hblink_req['login_server'], peer_auth[2], 'Config Passphrase: ' + legacy_passphrase, 'Attempt')
 ##                            active_tgs[hblink_req['login_server']][hblink_req['system']] = [{'1':[]}, {'2':[]}, {'SYSTEM': ''}, {'peer_id':hblink_req['login_id']}]
                             response = jsonify(
                                     allow=True,
                                     mode='legacy',
                                     )
-                        elif authorized_peer(hblink_req['login_id'])[1] != '' or isinstance(authorized_peer(hblink_req['login_id'])[1], int) == False:
-                            authlog_add(hblink_req['login_id'], hblink_req['login_ip'], hblink_req['login_server'], authorized_peer(hblink_req['login_id'])[2], authorized_peer(hblink_req['login_id'])[1], 'Attempt')
+                        elif peer_auth[1] != '' or isinstance(peer_auth[1], int) == False:
+                            authlog_add(hblink_req['login_id'], hblink_req['login_ip'], hblink_req['login_server'], peer_auth[2], peer_auth[1], 'Attempt')
 ##                            active_tgs[hblink_req['login_server']][hblink_req['system']] = [{'1':[]}, {'2':[]}, {'SYSTEM': ''}, {'peer_id':hblink_req['login_id']}]
                             # print(authorized_peer(hblink_req['login_id']))
                             response = jsonify(
                                     allow=True,
                                     mode='override',
-                                    value=authorized_peer(hblink_req['login_id'])[1]
+                                    value=peer_auth[1]
                                         )
 ##                        try:
 ##                            active_tgs[hblink_req['login_server']][hblink_req['system']] = [{'1':[]}, {'2':[]}, {'SYSTEM': ''}, {'peer_id':hblink_req['login_id']}]
@@ -7267,7 +7660,7 @@ Name: <strong>''' + p.name + '''</strong>&nbsp; -&nbsp; Port: <strong>''' + str(
 ##                        except:
 ##                            active_tgs[hblink_req['login_server']] = {}
 ##                            pass
-                    elif authorized_peer(hblink_req['login_id'])[0] == False:
+                    elif peer_auth[0] == False:
 ##                        print('log fail')
                         authlog_add(hblink_req['login_id'], hblink_req['login_ip'], hblink_req['login_server'], 'Not Registered', '-', 'Failed')
                         response = jsonify(
@@ -7295,10 +7688,11 @@ Name: <strong>''' + p.name + '''</strong>&nbsp; -&nbsp; Port: <strong>''' + str(
                             response = make_response(msg, 401)
                             
             elif 'login_id' in hblink_req and 'login_confirmed' in hblink_req:
+                peer_auth = authorized_peer(hblink_req['login_id'])
                 if hblink_req['old_auth'] == True:
-                    authlog_add(hblink_req['login_id'], hblink_req['login_ip'], hblink_req['login_server'], authorized_peer(hblink_req['login_id'])[2], 'CONFIG, NO UMS', 'Confirmed')
+                    authlog_add(hblink_req['login_id'], hblink_req['login_ip'], hblink_req['login_server'], peer_auth[2], 'CONFIG, NO UMS', 'Confirmed')
                 else:
-                    authlog_add(hblink_req['login_id'], hblink_req['login_ip'], hblink_req['login_server'], authorized_peer(hblink_req['login_id'])[2], 'USER MANAGER', 'Confirmed')
+                    authlog_add(hblink_req['login_id'], hblink_req['login_ip'], hblink_req['login_server'], peer_auth[2], 'USER MANAGER', 'Confirmed')
                 response = jsonify(
                                 logged=True
                                     )
@@ -7326,15 +7720,15 @@ Name: <strong>''' + p.name + '''</strong>&nbsp; -&nbsp; Port: <strong>''' + str(
                 if 'lat' in hblink_req:
                     # Assuming this is a GPS loc
                     dash_loc_add(hblink_req['call'], hblink_req['lat'], hblink_req['lon'], hblink_req['comment'], hblink_req['dmr_id'], hblink_req['dashboard'])
-                    trim_dash_loc()
+                    trim_logs()
                     response = 'yes'
             elif 'log_sms' in hblink_req:
                     sms_log_add(hblink_req['snd_call'], hblink_req['rcv_call'], hblink_req['message'], hblink_req['snd_id'], hblink_req['rcv_id'], hblink_req['log_sms'], hblink_req['system_name'])
-                    trim_sms_log()
+                    trim_logs()
                     response = 'rcvd'
             elif 'bb_send' in hblink_req:
                     bb_add(hblink_req['callsign'], hblink_req['bulletin'], hblink_req['dmr_id'], hblink_req['bb_send'], hblink_req['system_name'])
-                    trim_bb()
+                    trim_logs()
                     response = 'rcvd'
             elif 'mb_add' in hblink_req:
                     mailbox_add(hblink_req['src_callsign'], hblink_req['dst_callsign'], hblink_req['message'], hblink_req['src_dmr_id'], hblink_req['dst_dmr_id'], hblink_req['mb_add'], hblink_req['system_name'])
@@ -7346,12 +7740,12 @@ Name: <strong>''' + p.name + '''</strong>&nbsp; -&nbsp; Port: <strong>''' + str(
                     response = 'rcvd'
             elif 'unit_table' in hblink_req:
 ##                    del_unit_table(hblink_req['unit_table'])
-                try:
-                    delete_misc_field_1('unit_table_' + hblink_req['unit_table'])
-                    misc_add('unit_table_' + hblink_req['unit_table'], str(hblink_req['data']), '', '', 0, 0, 0, 0, False, False)
-                except:
-                    print('entry error')
-                    misc_add('unit_table_' + hblink_req['unit_table'], str(hblink_req['data']), '', '', 0, 0, 0, 0, False, False)
+                if 'data' in hblink_req:
+                    # Whole table as str(UNIT_MAP), from servers not yet sending changes only
+                    table_dict = ast.literal_eval(hblink_req['data'])
+                    unit_table_update(hblink_req['unit_table'], [[int_id(u), table_dict[u][0], table_dict[u][1]] for u in table_dict], [], True)
+                else:
+                    unit_table_update(hblink_req['unit_table'], hblink_req['update'], hblink_req['remove'], hblink_req['full'])
 ##                    unit_table_add(hblink_req['data'])
                 response = 'rcvd'
 
@@ -7360,24 +7754,13 @@ Name: <strong>''' + p.name + '''</strong>&nbsp; -&nbsp; Port: <strong>''' + str(
                 if hblink_req['get_config']: 
 ##                    active_tgs[hblink_req['get_config']] = {}
 
-                    pl = Misc.query.filter_by(field_1='ping_list').first()
-                    ping_list = ast.literal_eval(pl.field_2)
-        
-                    ping_list[hblink_req['get_config']] = time.time()
-                    
-                    misc_edit_field_1('ping_list', str(ping_list), '', '', 0, 0, 0, 0, True, True)
+                    server_ping(hblink_req['get_config'], True)
 ##                    print(active_tgs)
     ##                try:
 ##                    print(get_peer_configs(hblink_req['get_config']))
 
 ##                    print(masters_get(hblink_req['get_config']))
-                    response = jsonify(
-                            config=server_get(hblink_req['get_config']),
-                            peers=get_peer_configs(hblink_req['get_config']),
-                            masters=masters_get(hblink_req['get_config']),
-    ##                        OBP=get_OBP(hblink_req['get_config'])
-
-                            )
+                    response = snapshot_response('config', hblink_req['get_config'], hblink_req.get('etag'))
     ##                except:
     ##                    message = jsonify(message='Config error')
     ##                    response = make_response(message, 401)
@@ -7471,9 +7854,7 @@ Name: <strong>''' + p.name + '''</strong>&nbsp; -&nbsp; Port: <strong>''' + str(
                 if hblink_req['get_rules']: # == 'burn_list':
                     
     ##                try:
-                    response = jsonify(
-                            rules=generate_rules(hblink_req['get_rules']),
-                            )
+                    response = snapshot_response('rules', hblink_req['get_rules'], hblink_req.get('etag'))
 
         else:
             message = jsonify(message='Authentication error')
@@ -7481,6 +7862,9 @@ Name: <strong>''' + p.name + '''</strong>&nbsp; -&nbsp; Port: <strong>''' + str(
         return response
 
 
+    # Close the connections used while starting, uWSGI forks its processes after this and
+    # they must each open their own
+    db.engine.dispose()
 
     return app
 
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+#
+###############################################################################
+#   Copyright (C) 2020-2021 Eric, KF7EEL, <kf7eel@qsl.net>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+Memory used exporting ROWS authentication log rows from /auth_log/export, in
+a new SQLite DB. Needs config.py, as app.py does, the DB in it is not
+touched. Ten rows share each login time, so pages must be split on the id.
+
+Each format is exported by its own process, which reads the stream as it
+comes and keeps only the last row. Every row must come out once, newest
+first by (login_time, id). The memory the process uses, checked after every
+piece of the export, may not grow by more than CEILING MB over what it was
+after starting the web service, however big the export.
+
+    python3 auth_export_bench.py -r 5000000
+'''
+
+import os
+import sys
+import csv
+import json
+import shutil
+import inspect
+import resource
+import argparse
+import datetime
+import tempfile
+import subprocess
+from time import perf_counter
+from contextlib import redirect_stdout
+
+from sqlalchemy import text
+
+import config
+
+__author__     = 'Eric Craw, KF7EEL'
+__copyright__  = 'Copyright (c) 2020-2021, Eric Craw, KF7EEL'
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Eric Craw, KF7EEL'
+__email__      = 'kf7eel@qsl.net'
+
+# Rows written at a time while filling
+CHUNK = 100000
+
+
+def fill(_db, _rows):
+    _start = datetime.datetime(2021, 1, 1)
+    for _c in range(0, _rows, CHUNK):
+        _auth = []
+        for _n in range(_c, min(_c + CHUNK, _rows)):
+            _auth.append({'dmr_id': 3120000 + _n % 5000, 'time': (_start + datetime.timedelta(seconds = _n // 10)).strftime('%Y-%m-%d %H:%M:%S.%f'), 'ip': '10.0.{}.{}'.format(_n % 250, _n % 200), 'server': 'SERVER-{}'.format(_n % 5), 'user': 'KB{:04d}'.format(_n % 5000), 'type': ['Attempt', 'Confirmed', 'Failed'][_n % 3]})
+        with _db.engine.begin() as _conn:
+            _conn.execute(text('INSERT INTO auth_log (login_dmr_id, login_time, peer_ip, server_name, portal_username, login_auth_method, login_type) VALUES (:dmr_id, :time, :ip, :server, :user, \'USER MANAGER\', :type)'), _auth)
+
+
+# Memory in use now, the peak since starting would be the web service starting up
+def rss_mb():
+    with open('/proc/self/statm') as _f:
+        return int(_f.read().split()[1]) * resource.getpagesize() / 1024 / 1024
+
+
+# Export in this process, as an admin would download it, and check each row as it comes
+def export(_db_location, _format):
+    config.db_location = _db_location
+    from app import hbnet_web_service
+    with open(os.devnull, 'w') as _null, redirect_stdout(_null):
+        _app = hbnet_web_service()
+    _view = inspect.unwrap(_app.view_functions['auth_log_export'])
+    _before = rss_mb()
+    _stats = {'ROWS': 0, 'BYTES': 0, 'WRONG': 0, 'PEAK_MB': _before}
+    _last = [None]
+
+    def check(_key):
+        if _last[0] != None and not _key < _last[0]:
+            _stats['WRONG'] += 1
+        _last[0] = _key
+        _stats['ROWS'] += 1
+
+    _start = perf_counter()
+    with _app.test_request_context('/auth_log/export?format=' + _format):
+        _header = None
+        for _chunk in _view().response:
+            _stats['BYTES'] += len(_chunk)
+            _stats['PEAK_MB'] = max(_stats['PEAK_MB'], rss_mb())
+            if _format == 'json':
+                # Each piece is a page of objects, one per line
+                for _line in _chunk.strip('[],\n').split(',\n'):
+                    if _line:
+                        _row = json.loads(_line)
+                        check((_row['login_time'], _row['id']))
+            else:
+                for _row in csv.reader(_chunk.splitlines()):
+                    if not _header:
+                        _header = _row
+                        continue
+                    check((_row[6], int(_row[0])))
+    _stats['TIME'] = perf_counter() - _start
+    _stats['START_MB'] = _before
+    print(json.dumps(_stats))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--rows', action='store', dest='ROWS', type=int, default=5000000, help='Rows in the authentication log.')
+    parser.add_argument('-m', '--ceiling', action='store', dest='CEILING', type=int, default=50, help='MB the export may add to the memory in use.')
+    parser.add_argument('--export', action='store', dest='EXPORT', help=argparse.SUPPRESS)
+    parser.add_argument('--format', action='store', dest='FORMAT', default='csv', help=argparse.SUPPRESS)
+    cli_args = parser.parse_args()
+
+    if cli_args.EXPORT:
+        export(cli_args.EXPORT, cli_args.FORMAT)
+        sys.exit(0)
+
+    tmp_dir = tempfile.mkdtemp(prefix = 'hbnet_auth_export_bench_')
+    db_location = 'sqlite:///' + tmp_dir + '/hbnet.sqlite'
+    config.db_location = db_location
+    from app import hbnet_web_service
+
+    failed = []
+    try:
+        with open(os.devnull, 'w') as null, redirect_stdout(null):
+            app = hbnet_web_service()
+        start = perf_counter()
+        fill(app.extensions['sqlalchemy'].db, cli_args.ROWS)
+        print('{} rows written in {:.0f} s'.format(cli_args.ROWS, perf_counter() - start))
+
+        for export_format in ['csv', 'json']:
+            stats = json.loads(subprocess.run([sys.executable, os.path.abspath(__file__), '--export', db_location, '--format', export_format], stdout = subprocess.PIPE, check = True).stdout)
+            grew = stats['PEAK_MB'] - stats['START_MB']
+            print('{:4}: {} rows, {:.0f} MB in {:.0f} s ({:.0f} rows/sec), memory at most {:.0f} MB, {:.1f} MB over the {:.0f} MB after starting, {} out of order'.format(export_format, stats['ROWS'], stats['BYTES'] / 1024 / 1024, stats['TIME'], stats['ROWS'] / stats['TIME'], stats['PEAK_MB'], grew, stats['START_MB'], stats['WRONG']))
+            if stats['ROWS'] != cli_args.ROWS or stats['WRONG']:
+                failed.append('The {} export did not have every row once, newest first'.format(export_format))
+            if grew > cli_args.CEILING:
+                failed.append('The {} export used {:.0f} MB more than the {} MB allowed'.format(export_format, grew, cli_args.CEILING))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    if failed:
+        sys.exit('\n'.join(failed))
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+#
+###############################################################################
+#   Copyright (C) 2020-2021 Eric, KF7EEL, <kf7eel@qsl.net>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+DMR ID lookups in the web service with USERS users, 2 DMR IDs each, in a new
+SQLite DB. Needs config.py, as app.py does, the DB in it is not touched.
+
+The users are written straight into the users table, as they would be from
+before user_dmr_ids existed, so starting the web service fills user_dmr_ids.
+The last user also lists the first user's ID, which must stay with the first.
+Then, through the test client:
+
+  /svr login_id     for LOOKUPS random IDs, each must get the right answer
+  /svr burn_list, /svr aprs_settings, /unit/<server> with a tenth of the IDs
+
+and the owner of a random ID is found with the LIKE search over dmr_ids that
+user_dmr_ids replaced, and with the user_dmr_ids join, to compare. Last, the
+admin edit form gives a user an ID another user has. It must be refused, and
+the form must say so.
+
+The first aprs_settings parses every user's settings, after that only those
+that have changed are.
+
+    python3 dmr_id_bench.py -u 100000
+'''
+
+import os
+import sys
+import random
+import shutil
+import inspect
+import argparse
+import tempfile
+from time import perf_counter
+from contextlib import redirect_stdout
+
+from sqlalchemy import text
+
+import config
+
+__author__     = 'Eric Craw, KF7EEL'
+__copyright__  = 'Copyright (c) 2020-2021, Eric Craw, KF7EEL'
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Eric Craw, KF7EEL'
+__email__      = 'kf7eel@qsl.net'
+
+FIRST_ID = 3100000
+SECRET = 'bench_secret'
+SERVER = 'BENCH'
+
+
+def user_ids(_n):
+    return FIRST_ID + _n * 2, FIRST_ID + _n * 2 + 1
+
+
+# _users users with 2 IDs each, one with a passphrase and one burned, as dmr_ids was written
+# before user_dmr_ids. The last user also lists the first user's first ID.
+def add_users(_db, _users):
+    _rows = []
+    for _n in range(_users):
+        _a, _b = user_ids(_n)
+        _dmr_ids = {_a: '', _b: 1}
+        if _n == _users - 1:
+            _dmr_ids[user_ids(0)[0]] = ''
+        _rows.append({'username': 'KB{:06d}'.format(_n), 'dmr_ids': str(_dmr_ids), 'aprs': str({_a: [{'call': 'KB{:06d}'.format(_n)}, {'ssid': ''}, {'icon': ''}, {'comment': ''}, {'pin': ''}, {'APRS': False}]})})
+    with _db.engine.begin() as _conn:
+        _conn.execute(text('INSERT INTO users (username, dmr_ids, aprs) VALUES (:username, :dmr_ids, :aprs)'), _rows)
+        _conn.execute(text('INSERT INTO burn_list (dmr_id, version) VALUES (:dmr_id, 1)'), [{'dmr_id': user_ids(_n)[1]} for _n in range(0, _users, 100)])
+        _conn.execute(text('INSERT INTO unit_table (server, dmr_id, system_name, last_seen) VALUES (:server, :dmr_id, :system, :seen)'), [{'server': SERVER, 'dmr_id': user_ids(_n)[0], 'system': 'MASTER-1', 'seen': _n} for _n in range(0, _users, 10)])
+        _conn.execute(text("INSERT INTO server_list (name, secret) VALUES (:name, :secret)"), {'name': SERVER, 'secret': SECRET})
+        _conn.execute(text('DELETE FROM user_dmr_ids'))
+
+
+# Seconds per call of _fn, over _args
+def per_call(_fn, _args):
+    _start = perf_counter()
+    for _arg in _args:
+        _fn(_arg)
+    return (perf_counter() - _start) / len(_args)
+
+
+def svr(_client, _req):
+    _req['secret'] = SECRET
+    return _client.post('/svr', json = _req)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-u', '--users', action='store', dest='USERS', type=int, default=100000, help='Users, with 2 DMR IDs each.')
+    parser.add_argument('-n', '--lookups', action='store', dest='LOOKUPS', type=int, default=1000, help='Random IDs to look up.')
+    cli_args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix = 'hbnet_dmr_id_bench_')
+    config.db_location = 'sqlite:///' + tmp_dir + '/hbnet.sqlite'
+    from app import hbnet_web_service
+
+    failed = []
+    try:
+        # app.py and the /svr handler print as they go
+        with open(os.devnull, 'w') as null, redirect_stdout(null):
+            app = hbnet_web_service()
+            db = app.extensions['sqlalchemy'].db
+            add_users(db, cli_args.USERS)
+            db.session.remove()
+            start = perf_counter()
+            app = hbnet_web_service()
+            start_time = perf_counter() - start
+        db = app.extensions['sqlalchemy'].db
+        client = app.test_client()
+
+        with app.app_context():
+            rows = db.session.execute(text('SELECT count(*) FROM user_dmr_ids')).scalar()
+            owner = db.session.execute(text('SELECT user_id FROM user_dmr_ids WHERE dmr_id = :i'), {'i': user_ids(0)[0]}).scalar()
+            first_user = db.session.execute(text("SELECT id FROM users WHERE username = 'KB000000'")).scalar()
+        print('{} users, web service started and filled user_dmr_ids ({} rows) in {:.2f} s'.format(cli_args.USERS, rows, start_time))
+        if rows != cli_args.USERS * 2 or owner != first_user:
+            failed.append('user_dmr_ids was not filled with every ID, each with the first user listing it')
+
+        # Half the lookups for registered IDs, half for IDs no one has
+        random.seed(1)
+        lookups = []
+        for n in range(cli_args.LOOKUPS):
+            if n % 2:
+                lookups.append(random.randrange(cli_args.USERS * 2, cli_args.USERS * 4) + FIRST_ID)
+            else:
+                lookups.append(random.randrange(cli_args.USERS * 2) + FIRST_ID)
+        wrong = []
+
+        def login(_id):
+            _reply = svr(client, {'login_id': _id, 'login_ip': '127.0.0.1', 'login_server': SERVER}).get_json()
+            _registered = _id < FIRST_ID + cli_args.USERS * 2
+            if _reply['allow'] != _registered or _registered and _reply['mode'] != ('legacy' if _id % 2 == 0 else 'normal'):
+                wrong.append(_id)
+
+        with open(os.devnull, 'w') as null, redirect_stdout(null):
+            login_time = per_call(login, lookups)
+            burn_time = per_call(lambda _n: svr(client, {'burn_list': True}).get_json(), range(10))
+            aprs_first = per_call(lambda _n: svr(client, {'aprs_settings': True}).get_json(), range(1))
+            aprs_time = per_call(lambda _n: svr(client, {'aprs_settings': True}).get_json(), range(10))
+            unit_time = per_call(lambda _n: client.get('/unit/' + SERVER), range(10))
+        print('/svr login_id:       {:8.0f} requests/sec, {} answered wrongly'.format(1 / login_time, len(wrong)))
+        print('/svr burn_list:      {:8.1f} ms'.format(burn_time * 1000))
+        print('/svr aprs_settings:  {:8.1f} ms, the first {:.1f} ms'.format(aprs_time * 1000, aprs_first * 1000))
+        print('/unit/<server>:      {:8.1f} ms'.format(unit_time * 1000))
+        if wrong:
+            failed.append('/svr login_id answered wrongly for {} IDs'.format(len(wrong)))
+
+        # The search user_dmr_ids replaced, for a sample as it is slow
+        with app.app_context():
+            like_time = per_call(lambda _id: db.session.execute(text("SELECT id FROM users WHERE dmr_ids LIKE :i LIMIT 1"), {'i': '%' + str(_id) + '%'}).first(), lookups[:50])
+            join_time = per_call(lambda _id: db.session.execute(text('SELECT users.id FROM users JOIN user_dmr_ids ON user_dmr_ids.user_id = users.id WHERE user_dmr_ids.dmr_id = :i LIMIT 1'), {'i': _id}).first(), lookups)
+        print('owner by LIKE on dmr_ids:      {:9.1f} us'.format(like_time * 1000000))
+        print('owner by user_dmr_ids join:    {:9.1f} us, {:.0f}x'.format(join_time * 1000000, like_time / join_time))
+
+        # The admin edit form gives the second user the first user's ID as well as their own
+        edit_user = inspect.unwrap(app.view_functions['admin_page'])
+        second = 'KB000001'
+        with app.app_context():
+            u = db.session.execute(text('SELECT username, email, aprs, notes, dmr_ids FROM users WHERE username = :u'), {'u': second}).first()
+        taken = user_ids(0)[0]
+        form = {'user_status': 'True', 'username': u.username, 'email': u.email, 'aprs': u.aprs, 'notes': u.notes, 'password': '', 'dmr_ids': u.dmr_ids[:-1] + ', ' + str(taken) + ": ''}"}
+        with open(os.devnull, 'w') as null, redirect_stdout(null), app.test_request_context('/edit_user?callsign=' + second, method = 'POST', data = form):
+            page = str(edit_user())
+        with app.app_context():
+            owner = db.session.execute(text('SELECT user_id FROM user_dmr_ids WHERE dmr_id = :i'), {'i': taken}).scalar()
+        refused = owner == first_user and 'DMR ID <strong>{}</strong> belongs to another user'.format(taken) in page
+        print('giving {} to {} from the admin edit form: {}'.format(taken, second, 'refused' if refused else 'MOVED'))
+        if not refused:
+            failed.append('The edit form moved a DMR ID another user has')
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    if failed:
+        sys.exit('\n'.join(failed))
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+#
+###############################################################################
+#   Copyright (C) 2020-2021 Eric, KF7EEL, <kf7eel@qsl.net>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+Insert latency of GPS positions and SMS log entries as gps_locations and
+sms_log grow to ROWS rows each, in a new SQLite DB. Needs config.py, as
+app.py does, the DB in it is not touched.
+
+The tables are filled 10 times bigger at each step, from 1,000 rows, with
+one row in a hundred past its retention time. At each size INSERTS
+positions and INSERTS SMS are sent to /svr through the test client, as
+data_gateway sends them, and each request is timed. trim_logs is kept from
+running while they are. Then it is let run once, it is timed, and every
+row past its retention time must be gone.
+
+The median insert at the biggest size may not be more than twice what it
+was at the smallest, and each trim must be an indexed DELETE.
+
+    python3 log_insert_bench.py -r 1000000
+'''
+
+import os
+import sys
+import shutil
+import argparse
+import datetime
+import tempfile
+from time import time, perf_counter
+from contextlib import redirect_stdout
+
+from sqlalchemy import text
+
+import config
+
+__author__     = 'Eric Craw, KF7EEL'
+__copyright__  = 'Copyright (c) 2020-2021, Eric Craw, KF7EEL'
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Eric Craw, KF7EEL'
+__email__      = 'kf7eel@qsl.net'
+
+SECRET = 'bench_secret'
+SERVER = 'BENCH'
+# Old enough for both GPS positions (2 weeks) and SMS (1 month) to be trimmed
+EXPIRED = datetime.timedelta(days = 40)
+# Rows written at a time while filling
+CHUNK = 50000
+
+
+def db_time(_time):
+    return _time.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+# Add _count rows to each table, one in a hundred past retention
+def fill(_db, _count):
+    _now = datetime.datetime.utcnow()
+    for _c in range(0, _count, CHUNK):
+        _gps, _sms = [], []
+        for _n in range(_c, min(_c + CHUNK, _count)):
+            _time = db_time(_now - EXPIRED if _n % 100 == 99 else _now - datetime.timedelta(seconds = _n % 86400))
+            _gps.append({'callsign': 'KB{:04d}'.format(_n % 1000), 'lat': '4530.00N', 'lon': '12130.00W', 'time': _time, 'comment': 'Filler'})
+            _sms.append({'snd': 'KB{:04d}'.format(_n % 1000), 'rcv': 'KB{:04d}'.format((_n + 1) % 1000), 'time': _time, 'message': 'Filler message'})
+        with _db.engine.begin() as _conn:
+            _conn.execute(text('INSERT INTO gps_locations (callsign, lat, lon, time, comment) VALUES (:callsign, :lat, :lon, :time, :comment)'), _gps)
+            _conn.execute(text('INSERT INTO sms_log (snd_callsign, rcv_callsign, time, message) VALUES (:snd, :rcv, :time, :message)'), _sms)
+
+
+def spread(_ms):
+    _ms = sorted(_ms)
+    return 'median {:6.2f}  99% {:6.2f}  max {:6.2f}'.format(_ms[len(_ms) // 2], _ms[len(_ms) * 99 // 100], _ms[-1])
+
+
+def timed(_client, _req):
+    _start = perf_counter()
+    _client.post('/svr', json = dict(_req, secret = SECRET))
+    return (perf_counter() - _start) * 1000
+
+
+def gps_req(_n):
+    return {'dashboard': SERVER, 'call': 'KB{:04d}-9'.format(_n % 1000), 'lat': '4530.00N', 'lon': '12130.00W', 'comment': 'Moving', 'dmr_id': 3120000 + _n}
+
+
+def sms_req(_n):
+    return {'log_sms': SERVER, 'snd_call': 'KB{:04d}'.format(_n % 1000), 'rcv_call': 'KB0000', 'message': 'Message {}'.format(_n), 'snd_id': 3120000 + _n, 'rcv_id': 3129999, 'system_name': 'MASTER-1'}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--rows', action='store', dest='ROWS', type=int, default=1000000, help='Rows each table grows to.')
+    parser.add_argument('-n', '--inserts', action='store', dest='INSERTS', type=int, default=200, help='Inserts timed at each size.')
+    cli_args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix = 'hbnet_log_insert_bench_')
+    config.db_location = 'sqlite:///' + tmp_dir + '/hbnet.sqlite'
+    from app import hbnet_web_service, trim_time
+
+    failed = []
+    medians = []
+    try:
+        # app.py and the /svr handler print as they go
+        with open(os.devnull, 'w') as null, redirect_stdout(null):
+            app = hbnet_web_service()
+        db = app.extensions['sqlalchemy'].db
+        client = app.test_client()
+        with db.engine.begin() as conn:
+            conn.execute(text('INSERT INTO server_list (name, secret) VALUES (:name, :secret)'), {'name': SERVER, 'secret': SECRET})
+            for table in ['gps_locations', 'sms_log']:
+                plan = ' '.join(str(row[-1]) for row in conn.execute(text('EXPLAIN QUERY PLAN DELETE FROM ' + table + ' WHERE time < :cutoff'), {'cutoff': db_time(datetime.datetime.utcnow())}))
+                print('{} trim: {}'.format(table, plan))
+                if 'INDEX' not in plan:
+                    failed.append('Trimming {} is not an indexed DELETE'.format(table))
+
+        size = 1000
+        rows = 0
+        while size <= cli_args.ROWS:
+            start = perf_counter()
+            fill(db, size - rows)
+            rows = size
+            fill_time = perf_counter() - start
+
+            trim_time['LAST'] = time()
+            with open(os.devnull, 'w') as null, redirect_stdout(null):
+                gps = [timed(client, gps_req(n)) for n in range(cli_args.INSERTS)]
+                sms = [timed(client, sms_req(n)) for n in range(cli_args.INSERTS)]
+                trim_time['LAST'] = 0
+                trim = timed(client, gps_req(0))
+            with db.engine.connect() as conn:
+                left = sum(conn.execute(text('SELECT count(*) FROM ' + table + ' WHERE time < :cutoff'), {'cutoff': db_time(datetime.datetime.utcnow() - datetime.timedelta(days = 35))}).scalar() for table in ['gps_locations', 'sms_log'])
+                rows = conn.execute(text('SELECT count(*) FROM gps_locations')).scalar()
+            medians.append((sorted(gps)[len(gps) // 2], sorted(sms)[len(sms) // 2]))
+            print('{:8} rows (filled in {:5.1f} s)  GPS insert ms: {}'.format(size, fill_time, spread(gps)))
+            print('{:8}                        SMS insert ms: {}'.format('', spread(sms)))
+            print('{:8}                        trim run with an insert: {:.1f} ms, {} expired rows left'.format('', trim, left))
+            if left:
+                failed.append('{} expired rows were left at {} rows'.format(left, size))
+            size *= 10
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    if medians and (medians[-1][0] > medians[0][0] * 2 or medians[-1][1] > medians[0][1] * 2):
+        failed.append('Insert latency grew with the table')
+    if failed:
+        sys.exit('\n'.join(failed))
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+#
+###############################################################################
+#   Copyright (C) 2020-2021 Eric, KF7EEL, <kf7eel@qsl.net>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+Map requests per second with POSITIONS GPS positions from CALLSIGNS callsigns
+and PEERS peers in a new SQLite DB. Needs config.py, as app.py does, the DB
+in it is not touched. Through the test client:
+
+  /map                       the page, the same for every view
+  /map/points                every point on the map
+  /map/points?since=<time>   what the page polls, with nothing new
+
+and, to compare, a folium map with the same markers built for every view,
+as /map used to be.
+
+Then the points must follow the DB. A position sent to /svr, as
+data_gateway does, must be the only point in the next since= poll. When
+the rows of a callsign on the map are deleted, as trimming does, the newest
+id is left as it was, and that callsign must go from /map/points.
+
+    python3 map_bench.py -p 10000
+'''
+
+import os
+import sys
+import random
+import shutil
+import argparse
+import datetime
+import tempfile
+from time import perf_counter
+from contextlib import redirect_stdout
+
+import folium
+from sqlalchemy import text
+
+import config
+
+__author__     = 'Eric Craw, KF7EEL'
+__copyright__  = 'Copyright (c) 2020-2021, Eric Craw, KF7EEL'
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Eric Craw, KF7EEL'
+__email__      = 'kf7eel@qsl.net'
+
+SECRET = 'bench_secret'
+SERVER = 'BENCH'
+# Requests timed for each kind
+REQUESTS = 200
+
+
+def callsign(_n):
+    return 'KB{:04d}'.format(_n)
+
+
+# APRS style position, as data_gateway stores them
+def aprs_lat(_lat):
+    return '{:02d}{:05.2f}{}'.format(int(abs(_lat)), abs(_lat) % 1 * 60, 'N' if _lat >= 0 else 'S')
+
+
+def aprs_lon(_lon):
+    return '{:03d}{:05.2f}{}'.format(int(abs(_lon)), abs(_lon) % 1 * 60, 'E' if _lon >= 0 else 'W')
+
+
+# _positions positions over the last 13 days, and _peers peers
+def add_points(_db, _positions, _callsigns, _peers):
+    _now = datetime.datetime.utcnow()
+    _gps = []
+    for _n in range(_positions):
+        _gps.append({'callsign': callsign(random.randrange(_callsigns)), 'lat': aprs_lat(random.uniform(30, 50)), 'lon': aprs_lon(random.uniform(-125, -70)), 'time': str(_now - datetime.timedelta(seconds = (_positions - _n) * 13 * 86400 / _positions)), 'comment': 'Position {}'.format(_n)})
+    _peer = []
+    for _n in range(_peers):
+        _peer.append({'callsign': callsign(_n), 'lat': str(random.uniform(30, 50)), 'lon': str(random.uniform(-125, -70)), 'time': str(_now), 'dmr_id': 3120000 + _n, 'loc': 'Somewhere {}'.format(_n)})
+    with _db.engine.begin() as _conn:
+        _conn.execute(text('INSERT INTO gps_locations (callsign, lat, lon, time, comment) VALUES (:callsign, :lat, :lon, :time, :comment)'), _gps)
+        _conn.execute(text('INSERT INTO peer_locations (callsign, lat, lon, time, dmr_id, loc) VALUES (:callsign, :lat, :lon, :time, :dmr_id, :loc)'), _peer)
+        _conn.execute(text('INSERT INTO server_list (name, secret) VALUES (:name, :secret)'), {'name': SERVER, 'secret': SECRET})
+
+
+# What /map used to do for every view, for the same points
+def folium_page(_features):
+    _map = folium.Map(location = config.center_map, zoom_start = config.map_zoom)
+    for _f in _features:
+        _p = _f['properties']
+        folium.Marker([_f['geometry']['coordinates'][1], _f['geometry']['coordinates'][0]], popup = _p['popup'], icon = folium.Icon(color = _p['color'], icon = 'record'), tooltip = _p['tooltip']).add_to(_map)
+    return _map._repr_html_()
+
+
+# Requests a second for _fn
+def per_sec(_fn, _requests = REQUESTS):
+    _start = perf_counter()
+    for _n in range(_requests):
+        _fn()
+    return _requests / (perf_counter() - _start)
+
+
+def keys(_reply):
+    return set(_f['properties']['key'] for _f in _reply['features'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-p', '--positions', action='store', dest='POSITIONS', type=int, default=10000, help='GPS positions stored.')
+    parser.add_argument('-c', '--callsigns', action='store', dest='CALLSIGNS', type=int, default=800, help='Callsigns the positions are from.')
+    parser.add_argument('-n', '--peers', action='store', dest='PEERS', type=int, default=200, help='Peers on the map.')
+    cli_args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix = 'hbnet_map_bench_')
+    config.db_location = 'sqlite:///' + tmp_dir + '/hbnet.sqlite'
+    from app import hbnet_web_service
+
+    failed = []
+    try:
+        random.seed(1)
+        # app.py and the /svr handler print as they go
+        with open(os.devnull, 'w') as null, redirect_stdout(null):
+            app = hbnet_web_service()
+            db = app.extensions['sqlalchemy'].db
+            add_points(db, cli_args.POSITIONS, cli_args.CALLSIGNS, cli_args.PEERS)
+        client = app.test_client()
+
+        start = perf_counter()
+        points = client.get('/map/points').get_json()
+        build_time = perf_counter() - start
+        page = client.get('/map').data
+        print('{} positions from {} callsigns and {} peers: {} points on the map, built in {:.1f} ms'.format(cli_args.POSITIONS, cli_args.CALLSIGNS, cli_args.PEERS, len(points['features']), build_time * 1000))
+        print('/map:                      {:8.0f} requests/sec'.format(per_sec(lambda: client.get('/map').data)))
+        print('/map/points:               {:8.0f} requests/sec'.format(per_sec(lambda: client.get('/map/points').data)))
+        print('/map/points?since=<time>:  {:8.0f} requests/sec'.format(per_sec(lambda: client.get('/map/points?since=' + str(points['time'])).data)))
+        print('folium map for every view: {:8.1f} requests/sec'.format(per_sec(lambda: folium_page(points['features']), 10)))
+
+        # A new position from data_gateway is all the next poll gets
+        req = {'secret': SECRET, 'dashboard': SERVER, 'call': 'KB9999-9', 'lat': '4530.00N', 'lon': '12130.00W', 'comment': 'New', 'dmr_id': 3129999}
+        with open(os.devnull, 'w') as null, redirect_stdout(null):
+            client.post('/svr', json = req)
+        new = client.get('/map/points?since=' + str(points['time'])).get_json()
+        if keys(new) != {'gps_KB9999-9'}:
+            failed.append('The poll after a new position got {}'.format(sorted(keys(new))))
+
+        # Delete the rows of a callsign on the map, other than the newest row
+        with app.app_context():
+            newest = db.session.execute(text('SELECT callsign FROM gps_locations ORDER BY id DESC LIMIT 1')).scalar()
+            gone = next('gps_' + c for c in sorted(k[4:] for k in keys(points) if k.startswith('gps_')) if c != newest)
+            db.session.execute(text('DELETE FROM gps_locations WHERE callsign = :c'), {'c': gone[4:]})
+            db.session.commit()
+        trimmed = client.get('/map/points').get_json()
+        if gone in keys(trimmed) or 'gps_KB9999-9' not in keys(trimmed):
+            failed.append('{} stayed on the map after its rows were deleted'.format(gone[4:]))
+        print('new position in the next poll, deleted callsign gone from the map: {}'.format('yes' if not failed else 'NO'))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    if failed:
+        sys.exit('\n'.join(failed))
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+#
+###############################################################################
+#   Copyright (C) 2020-2021 Eric, KF7EEL, <kf7eel@qsl.net>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+/svr pings at RATE a second for SECONDS seconds, over HTTP, against a new
+SQLite DB. Needs config.py, as app.py does, the DB in it is not touched.
+
+WORKERS web service processes share the DB, as uWSGI runs them, each with
+threaded HTTP. Another process plays SERVERS hblink servers: it sends each
+ping at its place on a clock, over CONNECTIONS kept open connections, and
+times it from when it should have gone, so falling behind shows up as
+latency. One ping in a hundred has a wrong secret and must get 401.
+
+Every other ping must get 200 and be counted in server_ping for its server.
+Then one server's secret is changed in the DB, as the server list page does,
+and every worker must refuse the old secret and take the new one. If fewer
+than RATE pings a second are answered it fails, the workers and the pinging
+process each need a core of their own for 1,000.
+
+    python3 svr_load_bench.py -r 1000 -s 10
+'''
+
+import os
+import sys
+import json
+import signal
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from time import time, sleep
+from contextlib import redirect_stdout
+
+from sqlalchemy import create_engine, text
+
+import config
+
+__author__     = 'Eric Craw, KF7EEL'
+__copyright__  = 'Copyright (c) 2020-2021, Eric Craw, KF7EEL'
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Eric Craw, KF7EEL'
+__email__      = 'kf7eel@qsl.net'
+
+def server_name(_n):
+    return 'SERVER-{}'.format(_n)
+
+
+def secret(_n):
+    return 'secret_{}'.format(_n)
+
+
+def worker(_db_location):
+    config.db_location = _db_location
+    from app import hbnet_web_service
+    from werkzeug.serving import make_server, WSGIRequestHandler
+
+    # Keep connections open, as a proxy in front of uWSGI would
+    WSGIRequestHandler.protocol_version = 'HTTP/1.1'
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    with open(os.devnull, 'w') as _null, redirect_stdout(_null):
+        _app = hbnet_web_service()
+        _server = make_server('127.0.0.1', 0, _app, threaded = True)
+    print(_server.server_port)
+    sys.stdout.flush()
+    signal.signal(signal.SIGTERM, lambda *_args: threading.Thread(target = _server.shutdown).start())
+    with open(os.devnull, 'w') as _null, redirect_stdout(_null):
+        _server.serve_forever()
+
+
+def post(_conn, _req):
+    _body = json.dumps(_req)
+    _conn.request('POST', '/svr', _body, {'Content-Type': 'application/json'})
+    _resp = _conn.getresponse()
+    _resp.read()
+    return _resp.status
+
+
+# Ping _n goes at _start + _n / _rate, from server _n % _servers, the ones from
+# connection _c on the worker it is connected to
+def client(_ports, _rate, _seconds, _servers, _connections):
+    _total = int(_rate * _seconds)
+    _results = [None] * _total
+    _start = time() + 0.5
+
+    def send(_c):
+        _conn = http.client.HTTPConnection('127.0.0.1', _ports[_c % len(_ports)])
+        for _n in range(_c, _total, _connections):
+            _due = _start + _n / _rate
+            if _due > time():
+                sleep(_due - time())
+            _server = _n % _servers
+            _bad = _n % 100 == 99
+            try:
+                _status = post(_conn, {'secret': 'wrong' if _bad else secret(_server), 'ping': server_name(_server)})
+            except Exception:
+                _status = 0
+                _conn.close()
+                _conn = http.client.HTTPConnection('127.0.0.1', _ports[_c % len(_ports)])
+            _results[_n] = (_server, _bad, _status, time() - _due, time() - _start)
+        _conn.close()
+
+    _threads = [threading.Thread(target = send, args = (_c,)) for _c in range(_connections)]
+    for _thread in _threads:
+        _thread.start()
+    for _thread in _threads:
+        _thread.join()
+    print(json.dumps(_results))
+
+
+def spread(_ms):
+    _ms = sorted(_ms)
+    return 'median {:7.1f}  99% {:7.1f}  max {:7.1f}'.format(_ms[len(_ms) // 2], _ms[len(_ms) * 99 // 100], _ms[-1])
+
+
+def run(_dir, _args):
+    _db_location = 'sqlite:///' + _dir + '/hbnet.sqlite'
+    config.db_location = _db_location
+    from app import hbnet_web_service
+    with open(os.devnull, 'w') as _null, redirect_stdout(_null):
+        hbnet_web_service()
+    _engine = create_engine(_db_location)
+    with _engine.begin() as _conn:
+        _conn.execute(text('INSERT INTO server_list (name, secret) VALUES (:name, :secret)'), [{'name': server_name(_n), 'secret': secret(_n)} for _n in range(_args.SERVERS)])
+
+    _here = os.path.abspath(__file__)
+    _workers = [subprocess.Popen([sys.executable, _here, '--worker', _db_location], stdout = subprocess.PIPE) for _n in range(_args.WORKERS)]
+    try:
+        _ports = [int(_worker.stdout.readline()) for _worker in _workers]
+        _client = subprocess.Popen([sys.executable, _here, '--client', ','.join(str(_port) for _port in _ports), '-r', str(_args.RATE), '-s', str(_args.SECONDS), '-n', str(_args.SERVERS), '-c', str(_args.CONNECTIONS)], stdout = subprocess.PIPE)
+        _results = json.loads(_client.communicate()[0])
+
+        # Change a secret as the server list page does, in the same transaction as the config version
+        with _engine.begin() as _conn:
+            _conn.execute(text('UPDATE server_list SET secret = :secret WHERE name = :name'), {'secret': 'changed', 'name': server_name(0)})
+            _conn.execute(text('UPDATE config_version SET version = version + 1 WHERE id = 1'))
+        _rotated = []
+        for _port in _ports:
+            _conn = http.client.HTTPConnection('127.0.0.1', _port)
+            _rotated.append((post(_conn, {'secret': secret(0), 'ping': server_name(0)}), post(_conn, {'secret': 'changed', 'ping': server_name(0)})))
+            _conn.close()
+    finally:
+        for _worker in _workers:
+            _worker.send_signal(signal.SIGTERM)
+        for _worker in _workers:
+            _worker.wait()
+
+    with _engine.connect() as _conn:
+        _counted = dict(_conn.execute(text('SELECT server, pings FROM server_ping')).fetchall())
+    return _results, _rotated, _counted
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--rate', action='store', dest='RATE', type=int, default=1000, help='Pings a second.')
+    parser.add_argument('-s', '--seconds', action='store', dest='SECONDS', type=int, default=10, help='Seconds to keep pinging.')
+    parser.add_argument('-w', '--workers', action='store', dest='WORKERS', type=int, default=4, help='Web service processes.')
+    parser.add_argument('-n', '--servers', action='store', dest='SERVERS', type=int, default=50, help='hblink servers pinging.')
+    parser.add_argument('-c', '--connections', action='store', dest='CONNECTIONS', type=int, default=16, help='Connections the pings are sent over.')
+    parser.add_argument('--worker', action='store', dest='WORKER', help=argparse.SUPPRESS)
+    parser.add_argument('--client', action='store', dest='CLIENT', help=argparse.SUPPRESS)
+    cli_args = parser.parse_args()
+
+    if cli_args.WORKER:
+        worker(cli_args.WORKER)
+        sys.exit(0)
+    if cli_args.CLIENT:
+        client([int(port) for port in cli_args.CLIENT.split(',')], cli_args.RATE, cli_args.SECONDS, cli_args.SERVERS, cli_args.CONNECTIONS)
+        sys.exit(0)
+
+    tmp_dir = tempfile.mkdtemp(prefix = 'hbnet_svr_load_bench_')
+    try:
+        results, rotated, counted = run(tmp_dir, cli_args)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    good = [r for r in results if not r[1]]
+    failed = [r for r in good if r[2] != 200]
+    let_in = [r for r in results if r[1] and r[2] != 401]
+    sent = {}
+    for r in good:
+        if r[2] == 200:
+            sent[server_name(r[0])] = sent.get(server_name(r[0]), 0) + 1
+    # The rotation check pinged server 0 once more on every worker
+    sent[server_name(0)] = sent.get(server_name(0), 0) + len(rotated)
+    took = max(r[4] for r in results)
+    print('{} pings from {} servers to {} workers, offered at {}/sec: {:.0f} answered/sec'.format(len(results), cli_args.SERVERS, cli_args.WORKERS, cli_args.RATE, len(results) / took))
+    print('latency from when each ping was due (ms): {}'.format(spread([r[3] * 1000 for r in results])))
+    print('{} refused or failed, {} with a wrong secret let in, server_ping {} the pings answered'.format(len(failed), len(let_in), 'matches' if counted == sent else 'DOES NOT match'))
+    print('after the secret change, old secret refused and new one taken by {} of {} workers'.format(sum(r == (401, 200) for r in rotated), len(rotated)))
+    if failed or let_in or counted != sent or any(r != (401, 200) for r in rotated):
+        sys.exit('/svr answered or counted pings wrongly')
+    if len(results) / took < cli_args.RATE * 0.95:
+        sys.exit('/svr could not keep up with {} pings/sec'.format(cli_args.RATE))
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+#
+###############################################################################
+#   Copyright (C) 2020-2021 Eric, KF7EEL, <kf7eel@qsl.net>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+Non-blocking client for the web service /svr endpoint. Anything that talks to
+the web service from inside the reactor should use this rather than requests,
+a slow web service must never stall voice traffic. Requests go out over a
+persistent connection pool, each call has a timeout, and the number of calls
+in flight is capped so a dead web service can't pile up connections.
+'''
+
+import json
+from io import BytesIO
+
+from twisted.internet import reactor, defer, error
+from twisted.web.client import Agent, HTTPConnectionPool, FileBodyProducer, readBody, ResponseNeverReceived, RequestTransmissionFailed
+from twisted.web.http_headers import Headers
+
+# The module needs logging, but handlers, etc. are controlled by the parent
+import logging
+logger = logging.getLogger(__name__)
+
+__author__     = 'Eric Craw, KF7EEL'
+__copyright__  = 'Copyright (c) 2020-2021, Eric Craw, KF7EEL'
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Eric Craw, KF7EEL'
+__email__      = 'kf7eel@qsl.net'
+
+# Seconds before a call is abandoned
+WS_TIMEOUT = 5
+# Maximum number of calls waiting on the web service at once
+WS_MAX_PENDING = 64
+# Persistent connections kept open to the web service
+WS_POOL_SIZE = 4
+
+
+# Raised (as a failure) when too many calls are already waiting on the web service
+class WebServiceBusy(Exception):
+    pass
+
+# Raised (as a failure) when the web service answers with anything but 200 OK, a wrong shared secret is a 401
+class WebServiceError(Exception):
+    def __init__(self, _code, _body):
+        Exception.__init__(self, 'HTTP {}: {}'.format(_code, _body[:200]))
+        self.code = _code
+
+# Failures that mean the web service couldn't be reached or didn't answer in time, rather than
+# answering no. Check with failure.check(*UNREACHABLE).
+UNREACHABLE = (defer.TimeoutError, error.ConnectError, error.TimeoutError, ResponseNeverReceived, RequestTransmissionFailed)
+
+
+class WebServiceClient(object):
+    def __init__(self, _url, _timeout = WS_TIMEOUT, _max_pending = WS_MAX_PENDING, _pool_size = WS_POOL_SIZE, _reactor = reactor):
+        self._url = _url.encode()
+        self._timeout = _timeout
+        self._max_pending = _max_pending
+        self._reactor = _reactor
+        self._pool = HTTPConnectionPool(_reactor, persistent = True)
+        self._pool.maxPersistentPerHost = _pool_size
+        self._agent = Agent(_reactor, pool = self._pool)
+        self.pending = 0
+
+    # POST a dictionary as JSON. Returns a deferred that fires with the decoded JSON reply
+    # (None if the reply was empty or not JSON), or errbacks on timeout, connection failure,
+    # an HTTP error status (WebServiceError) or when the in-flight limit has been reached.
+    def post(self, _data, _timeout = None):
+        if self.pending >= self._max_pending:
+            return defer.fail(WebServiceBusy('{} calls already waiting on the web service'.format(self.pending)))
+
+        self.pending += 1
+        _d = self._agent.request(b'POST', self._url, Headers({b'Content-Type': [b'application/json']}), FileBodyProducer(BytesIO(json.dumps(_data).encode())))
+        _d.addCallback(self._read)
+        _d.addCallback(self._decode)
+        _d.addTimeout(_timeout or self._timeout, self._reactor)
+        _d.addBoth(self._done)
+        return _d
+
+    def _read(self, _response):
+        _d = readBody(_response)
+        if _response.code != 200:
+            _d.addCallback(self._error, _response.code)
+        return _d
+
+    def _error(self, _body, _code):
+        raise WebServiceError(_code, _body)
+
+    def _decode(self, _body):
+        try:
+            return json.loads(_body)
+        except ValueError:
+            return None
+
+    def _done(self, _result):
+        self.pending -= 1
+        return _result
+
+    def close(self):
+        return self._pool.closeCachedConnections()
+
+
+# One client (and connection pool) per web service URL, shared by every system in the process
+_clients = {}
+
+def get_client(_url):
+    if _url not in _clients:
+        _clients[_url] = WebServiceClient(_url)
+    return _clients[_url]